@@ -12,6 +12,8 @@ from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
 from config import DEFAULT_DB_CONFIG
+from db_utils import bulk_write_columns
+from snapshot_utils import refresh_snapshot_after_write
 
 
 def get_table_name_from_dir():
@@ -103,51 +105,28 @@ def update_reason_for_goods_ids(table_name, goods_ids, target_date, db_config):
         return 0
     
     conn = pymysql.connect(**db_config)
-    updated_count = 0
     try:
         cursor = conn.cursor()
         
-        for goods_id in goods_ids:
-            date_to_update = target_date
-            
-            check_query = f"""
-            SELECT COUNT(*) 
-            FROM `{table_name}` 
-            WHERE goods_id = %s AND date_label = %s
-            """
-            cursor.execute(check_query, (goods_id, target_date))
-            exists = cursor.fetchone()[0] > 0
-            
-            if not exists:
-                nearest_query = f"""
-                SELECT date_label 
-                FROM `{table_name}` 
-                WHERE goods_id = %s AND date_label <= %s
-                ORDER BY date_label DESC 
-                LIMIT 1
-                """
-                cursor.execute(nearest_query, (goods_id, target_date))
-                result = cursor.fetchone()
-                if result:
-                    date_to_update = result[0]
-                    if isinstance(date_to_update, datetime):
-                        date_to_update = date_to_update.strftime('%Y-%m-%d')
-                    elif hasattr(date_to_update, 'strftime'):
-                        date_to_update = date_to_update.strftime('%Y-%m-%d')
-                    else:
-                        date_to_update = str(date_to_update)
-                else:
-                    continue
-            
-            update_query = f"""
-            UPDATE `{table_name}`
-            SET Reason = 'Secondary_traffic_restricted'
-            WHERE goods_id = %s AND date_label = %s
-            """
-            cursor.execute(update_query, (goods_id, date_to_update))
-            updated_count += cursor.rowcount
+        # 每个goods_id在目标日期（含）之前最近的date_label：目标日期存在时即为目标日期
+        goods_id_list = sorted(goods_ids)
+        placeholders = ','.join(['%s'] * len(goods_id_list))
+        nearest_query = f"""
+        SELECT goods_id, MAX(date_label)
+        FROM `{table_name}`
+        WHERE goods_id IN ({placeholders}) AND date_label <= %s
+        GROUP BY goods_id
+        """
+        cursor.execute(nearest_query, goods_id_list + [target_date])
+        rows = [(goods_id, date_label, 'Reason', 'Secondary_traffic_restricted') for goods_id, date_label in cursor.fetchall()]
+        
+        _, updated_count = bulk_write_columns(cursor, table_name, rows, report_matched=False)
         
         conn.commit()
+        if rows:
+            # 记录Reason写入并刷新快照，使动态管理缓存、快照和历史镜像不再使用旧的Reason
+            refresh_snapshot_after_write(cursor, table_name, sorted({row[0] for row in rows}),
+                                         dates=sorted({row[1] for row in rows}), columns=['Reason'])
         return updated_count
     finally:
         cursor.close()
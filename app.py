@@ -9,7 +9,7 @@ from config import (
     load_config, save_config, get_current_table, set_current_table,
     update_db_config, get_db_config
 )
-from db_utils import get_available_tables, get_db_connection
+from db_utils import get_available_tables, db_cursor, close_all_pools
 from function1_quick_search import quick_search
 from function2_dynamic_management import dynamic_management
 from function3_optimization import optimization_effect
@@ -32,6 +32,9 @@ from function7_batch_operations import (
     batch_auto_update_reason, batch_save_indicator_data,
     get_batch_config
 )
+from job_manager import (
+    register_job_type, submit_job, get_job, list_jobs, get_job_logs, cancel_job
+)
 from datetime import datetime
 
 app = Flask(__name__)
@@ -63,6 +66,8 @@ def api_config():
         product_db = data.get('product_db')
 
         if update_db_config(traffic_db, sales_db, pallet_db, product_db):
+            # 数据库配置变更后释放旧配置对应的连接池
+            close_all_pools()
             return jsonify({
                 'success': True,
                 'message': '配置已保存'
@@ -108,11 +113,8 @@ def api_tables():
     """获取可用表列表"""
     try:
         traffic_config, _, _, _ = get_db_config()
-        conn = get_db_connection(traffic_config)
-        cursor = conn.cursor()
-        tables = get_available_tables(cursor)
-        cursor.close()
-        conn.close()
+        with db_cursor(traffic_config) as cursor:
+            tables = get_available_tables(cursor)
         
         return jsonify({
             'success': True,
@@ -147,7 +149,7 @@ def api_function1():
             'error': 'goods_id必须是数字'
         }), 400
     
-    result = quick_search(goods_id)
+    result = quick_search(goods_id, chart_mode=data.get('chart_mode', 'image'))
     return jsonify(result)
 
 
@@ -181,34 +183,43 @@ def api_function2():
             else:
                 filter_mode['max'] = None
     
-    result = dynamic_management(target_date, use_cache=use_cache, half_image_mode=half_image_mode, filter_mode=filter_mode)
+    chart_mode = data.get('chart_mode', 'image')  # 'image'=服务器PNG, 'series'=返回序列数据由浏览器绘图
+    lazy_images = bool(data.get('lazy_images', False))  # True=只返回分页信息，图片按页通过 image_page 接口获取
+    result = dynamic_management(target_date, use_cache=use_cache, half_image_mode=half_image_mode, filter_mode=filter_mode,
+                                chart_mode=chart_mode, lazy_images=lazy_images)
+    return jsonify(result)
+
+
+@app.route('/api/function2/dynamic_management/image_page', methods=['POST'])
+def api_function2_image_page():
+    """功能2：按需渲染某个类别的一页图片"""
+    data = request.json or {}
+    token = data.get('token')
+    if not token:
+        return jsonify({
+            'success': False,
+            'data': None,
+            'error': '缺少分页令牌'
+        }), 400
+
+    from function2_dynamic_management import render_dynamic_management_image_page
+    result = render_dynamic_management_image_page(token, data.get('goods_ids'), chart_mode=data.get('chart_mode', 'image'))
     return jsonify(result)
 
 
 @app.route('/api/function2/refresh_status', methods=['POST'])
 def api_function2_refresh():
-    """功能2：刷新status数据"""
+    """功能2：刷新status数据（后台任务，返回任务ID）"""
     try:
-        from config import get_current_table
-        from function2_dynamic_management import refresh_status_data
-        
         table_name = get_current_table()
-        sales_table_name = f"{table_name}_Sales"
-        
-        success, message, updated_count, missing_dates_info = refresh_status_data(table_name, sales_table_name)
-        
-        return jsonify({
-            'success': success,
-            'message': message,
-            'updated_count': updated_count,
-            'missing_dates_info': missing_dates_info
-        })
+        job = submit_job('function2_refresh_status', {'table_name': table_name})
+        return _job_submitted_response(job)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({
             'success': False,
-            'message': f'刷新失败: {str(e)}',
+            'message': f'提交刷新任务失败: {str(e)}',
             'updated_count': 0,
             'missing_dates_info': []
         }), 500
@@ -301,7 +312,7 @@ def api_function3():
             'error': 'field_name必须是Video或Price'
         }), 400
     
-    result = optimization_effect(field_name)
+    result = optimization_effect(field_name, chart_mode=data.get('chart_mode', 'image'))
     return jsonify(result)
 
 
@@ -406,19 +417,17 @@ def api_function4_dates():
 
 @app.route('/api/function4/auto_update_reason', methods=['POST'])
 def api_function4_auto_update_reason():
-    """功能4：自动更新Reason（只能更新昨天的数据）"""
+    """功能4：自动更新Reason（只能更新昨天的数据；后台任务，返回任务ID）"""
     try:
-        result = auto_update_reason()
-        if result.get('success'):
-            return jsonify(result)
-        else:
-            return jsonify(result), 400
+        table_name = get_current_table()
+        job = submit_job('function4_auto_update_reason', {'table_name': table_name})
+        return _job_submitted_response(job)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({
             'success': False,
-            'error': f'自动更新Reason失败: {str(e)}'
+            'error': f'提交自动更新Reason任务失败: {str(e)}'
         }), 500
 
 
@@ -708,10 +717,10 @@ def api_function7_single_save_indicator():
 
 @app.route('/api/function7/batch_refresh', methods=['POST'])
 def api_function7_batch_refresh():
-    """功能7：批量刷新Status数据"""
+    """功能7：批量刷新Status数据（后台任务，返回任务ID）"""
     try:
-        result = batch_refresh_status()
-        return jsonify(result)
+        job = submit_job('function7_batch_refresh', {'selected_tables': _get_batch_selected_tables()})
+        return _job_submitted_response(job)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -723,10 +732,10 @@ def api_function7_batch_refresh():
 
 @app.route('/api/function7/batch_quick_refresh', methods=['POST'])
 def api_function7_batch_quick_refresh():
-    """功能7：批量快速刷新Status数据"""
+    """功能7：批量快速刷新Status数据（后台任务，返回任务ID）"""
     try:
-        result = batch_quick_refresh_status()
-        return jsonify(result)
+        job = submit_job('function7_batch_quick_refresh', {'selected_tables': _get_batch_selected_tables()})
+        return _job_submitted_response(job)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -738,10 +747,10 @@ def api_function7_batch_quick_refresh():
 
 @app.route('/api/function7/batch_auto_reason', methods=['POST'])
 def api_function7_batch_auto_reason():
-    """功能7：批量自动更新Reason"""
+    """功能7：批量自动更新Reason（后台任务，返回任务ID）"""
     try:
-        result = batch_auto_update_reason()
-        return jsonify(result)
+        job = submit_job('function7_batch_auto_reason', {'selected_tables': _get_batch_selected_tables()})
+        return _job_submitted_response(job)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -753,12 +762,15 @@ def api_function7_batch_auto_reason():
 
 @app.route('/api/function7/batch_save_indicator', methods=['POST'])
 def api_function7_batch_save_indicator():
-    """功能7：批量保存指标数据"""
+    """功能7：批量保存指标数据（后台任务，返回任务ID）"""
     try:
-        data = request.get_json() or {}
+        data = request.get_json(silent=True) or {}
         target_date = data.get('target_date')
-        result = batch_save_indicator_data(target_date=target_date)
-        return jsonify(result)
+        job = submit_job('function7_batch_save_indicator', {
+            'selected_tables': _get_batch_selected_tables(),
+            'target_date': target_date
+        })
+        return _job_submitted_response(job)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -768,6 +780,141 @@ def api_function7_batch_save_indicator():
         }), 500
 
 
+# ===== 后台任务 =====
+
+def _get_batch_selected_tables():
+    """
+    提交时确定要处理的国家表，任务执行期间修改配置不影响已提交的任务
+    请求体中带 selected_tables 时使用请求中的表，否则使用配置中的已选表
+    """
+    data = request.get_json(silent=True) or {}
+    selected_tables = data.get('selected_tables')
+    if selected_tables is None:
+        selected_tables = load_batch_countries_config().get('selected_tables', [])
+    return [str(table_name).strip() for table_name in selected_tables if str(table_name).strip()]
+
+
+def _job_submitted_response(job):
+    return jsonify({
+        'success': True,
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'message': '任务已提交，正在后台执行'
+    }), 202
+
+
+def _job_refresh_status(ctx, table_name):
+    from function2_dynamic_management import refresh_status_data
+
+    ctx.set_progress(0, f'正在刷新 {table_name}')
+    success, message, updated_count, missing_dates_info = refresh_status_data(table_name, f"{table_name}_Sales")
+    return {
+        'success': success,
+        'message': message,
+        'updated_count': updated_count,
+        'missing_dates_info': missing_dates_info
+    }
+
+
+def _job_auto_update_reason(ctx, table_name):
+    ctx.set_progress(0, f'正在自动更新 {table_name} 的Reason')
+    return auto_update_reason(table_name)
+
+
+def _job_refresh_history_cache(ctx, table_name, months=None):
+    from history_cache import refresh_history_cache
+
+    ctx.set_progress(0, f'正在刷新 {table_name} 的历史镜像')
+    success = refresh_history_cache(table_name, f"{table_name}_Sales", months=months)
+    return {
+        'success': success,
+        'message': '历史镜像已刷新' if success else '历史镜像刷新失败（读取将回退到直接查询MySQL）'
+    }
+
+
+def _make_batch_job(batch_func):
+    """把功能7的批量函数包装为任务：每完成一个国家更新进度，取消请求后不再启动剩余国家"""
+    def handler(ctx, **params):
+        def on_progress(done, total, table_name):
+            progress = done * 100.0 / total if total else 100
+            ctx.set_progress(progress, f'已完成 {table_name}（{done}/{total}）')
+
+        return batch_func(progress_callback=on_progress, cancel_check=ctx.is_cancelled, **params)
+    return handler
+
+
+register_job_type('function2_refresh_status', _job_refresh_status)
+register_job_type('function4_auto_update_reason', _job_auto_update_reason)
+register_job_type('history_cache_refresh', _job_refresh_history_cache)
+register_job_type('function7_batch_refresh', _make_batch_job(batch_refresh_status))
+register_job_type('function7_batch_quick_refresh', _make_batch_job(batch_quick_refresh_status))
+register_job_type('function7_batch_auto_reason', _make_batch_job(batch_auto_update_reason))
+register_job_type('function7_batch_save_indicator', _make_batch_job(batch_save_indicator_data))
+
+
+@app.route('/api/history_cache/refresh', methods=['POST'])
+def api_history_cache_refresh():
+    """
+    强制刷新当前表的本地历史镜像（后台任务，返回任务ID）
+    请求体可带 months（['YYYY-MM', ...]）只刷新这些月份，不带时全量重建
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        months = data.get('months')
+        if months is not None:
+            months = [str(month).strip()[:7] for month in months if str(month).strip()]
+        job = submit_job('history_cache_refresh', {'table_name': get_current_table(), 'months': months})
+        return _job_submitted_response(job)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': f'提交历史镜像刷新任务失败: {str(e)}'
+        }), 500
+
+
+@app.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    """任务列表（按创建时间倒序，不含结果）"""
+    limit = request.args.get('limit', 50, type=int)
+    status = request.args.get('status') or None
+    return jsonify({
+        'success': True,
+        'data': list_jobs(limit=limit, status=status)
+    })
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    """任务状态、进度与结果（result 为原同步接口返回的内容）"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return jsonify({'success': True, 'data': job})
+
+
+@app.route('/api/jobs/<job_id>/logs', methods=['GET'])
+def api_job_logs(job_id):
+    """任务日志，after 为上次拉取到的最后一条日志id"""
+    if get_job(job_id) is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    after_id = request.args.get('after', 0, type=int)
+    return jsonify({
+        'success': True,
+        'data': get_job_logs(job_id, after_id=after_id)
+    })
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_job_cancel(job_id):
+    """取消任务"""
+    success, message = cancel_job(job_id)
+    if success:
+        return jsonify({'success': True, 'message': message})
+    return jsonify({'success': False, 'error': message}), 400
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
 
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+累计Buyers过滤条件基准测试：旧的相关子查询 vs build_cumulative_buyers_condition（按goods_id聚合一次）
+在合成的流量表/销售表上执行 get_dynamic_goods_data 的选品查询，比较两种写法的耗时并检查结果一致
+
+用法：
+    python benchmarks/bench_cumulative_buyers.py                     # SQLite内存库，50k商品
+    python benchmarks/bench_cumulative_buyers.py --index             # 销售表加 (goods_id, date_label) 索引
+    python benchmarks/bench_cumulative_buyers.py --backend mysql     # 使用 app_config.json 中的流量库连接
+MySQL 模式在 Vida_Traffic / Vida_Sales 中创建 Bench_ROA1 / Bench_ROA1_Sales 表，结束后删除
+"""
+
+import os
+import sys
+import time
+import argparse
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_utils import build_cumulative_buyers_condition
+
+
+BENCH_TABLE = 'Bench_ROA1'
+BENCH_SALES_TABLE = 'Bench_ROA1_Sales'
+
+# (min, max) 组合，覆盖 IN 与 NOT IN（0在范围内）两种形式
+FILTER_CASES = [(2, None), (3, 10), (0, 5), (0, None), (-1, 0)]
+
+
+def legacy_cumulative_buyers_condition(sales_table_name, target_date, min_val, max_val=None):
+    """优化前 build_filter_condition 生成的相关子查询条件（每个候选商品执行一到两次 SUM）"""
+    cumulative_sql = (f"(SELECT COALESCE(SUM(s3.Buyers), 0) FROM `Vida_Sales`.`{sales_table_name}` s3 "
+                      f"WHERE s3.goods_id = t2.goods_id AND s3.date_label <= %s AND s3.Buyers IS NOT NULL)")
+    if max_val is not None:
+        return f"{cumulative_sql} >= %s AND {cumulative_sql} <= %s", [target_date, min_val, target_date, max_val]
+    return f"{cumulative_sql} >= %s", [target_date, min_val]
+
+
+def build_goods_query(filter_condition):
+    """与 get_dynamic_goods_data 中选品查询的形状一致"""
+    return f"""
+    SELECT DISTINCT t2.goods_id
+    FROM `Vida_Traffic`.`{BENCH_TABLE}` t2
+    WHERE t2.date_label = %s
+      AND t2.Status = %s
+      AND EXISTS (
+          SELECT 1
+          FROM `Vida_Sales`.`{BENCH_SALES_TABLE}` s2
+          WHERE s2.goods_id = t2.goods_id
+      )
+      AND {filter_condition}
+    """
+
+
+def generate_data(goods_count, days, seed):
+    """返回 (流量行, 销售行, 最后日期)；约60%的商品有销售记录"""
+    rng = np.random.default_rng(seed)
+    start = datetime(2025, 1, 1)
+    dates = [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    goods_ids = np.arange(600000000000, 600000000000 + goods_count)
+
+    traffic_rows = []
+    sales_rows = []
+    for day_index, date_label in enumerate(dates):
+        impressions = rng.integers(0, 5000, size=goods_count)
+        statuses = rng.integers(1, 3, size=goods_count)
+        has_sales = rng.random(goods_count) < 0.6
+        buyers = rng.integers(0, 4, size=goods_count)
+        for goods_id, impression, status in zip(goods_ids.tolist(), impressions.tolist(), statuses.tolist()):
+            traffic_rows.append((goods_id, date_label, impression, status))
+        for goods_id, buyer_count in zip(goods_ids[has_sales].tolist(), buyers[has_sales].tolist()):
+            sales_rows.append((goods_id, date_label, buyer_count))
+    return traffic_rows, sales_rows, dates[-1]
+
+
+class SQLiteBackend:
+    """内存库，Vida_Traffic / Vida_Sales 作为两个附加库，SQL中的 %s 转换为 ?"""
+
+    name = 'sqlite'
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute("ATTACH DATABASE ':memory:' AS Vida_Traffic")
+        self.conn.execute("ATTACH DATABASE ':memory:' AS Vida_Sales")
+
+    def setup(self, traffic_rows, sales_rows, with_index):
+        self.conn.execute(f"CREATE TABLE Vida_Traffic.{BENCH_TABLE} "
+                          f"(goods_id INTEGER, date_label TEXT, `Product impressions` INTEGER, Status INTEGER)")
+        self.conn.execute(f"CREATE TABLE Vida_Sales.{BENCH_SALES_TABLE} (goods_id INTEGER, date_label TEXT, Buyers INTEGER)")
+        self.conn.executemany(f"INSERT INTO Vida_Traffic.{BENCH_TABLE} VALUES (?, ?, ?, ?)", traffic_rows)
+        self.conn.executemany(f"INSERT INTO Vida_Sales.{BENCH_SALES_TABLE} VALUES (?, ?, ?)", sales_rows)
+        self.conn.execute(f"CREATE INDEX Vida_Traffic.idx_bench_date ON {BENCH_TABLE} (date_label, Status)")
+        if with_index:
+            self.conn.execute(f"CREATE INDEX Vida_Sales.idx_bench_goods_date ON {BENCH_SALES_TABLE} (goods_id, date_label)")
+        self.conn.commit()
+
+    def query(self, sql, params):
+        return {row[0] for row in self.conn.execute(sql.replace('%s', '?'), params).fetchall()}
+
+    def teardown(self):
+        self.conn.close()
+
+
+class MySQLBackend:
+    """使用 app_config.json 中的流量库连接（需要对 Vida_Traffic / Vida_Sales 有建表权限）"""
+
+    name = 'mysql'
+
+    def __init__(self):
+        from config import get_db_config
+        from db_utils import get_db_connection
+        traffic_config, _, _, _ = get_db_config()
+        self.conn = get_db_connection(traffic_config)
+        self.cursor = self.conn.cursor()
+
+    def setup(self, traffic_rows, sales_rows, with_index):
+        self.teardown_tables()
+        self.cursor.execute(f"""
+        CREATE TABLE `Vida_Traffic`.`{BENCH_TABLE}` (
+            goods_id BIGINT, date_label DATE, `Product impressions` INT, Status INT,
+            INDEX idx_bench_date (date_label, Status)
+        )""")
+        sales_index = ", INDEX idx_bench_goods_date (goods_id, date_label)" if with_index else ""
+        self.cursor.execute(f"""
+        CREATE TABLE `Vida_Sales`.`{BENCH_SALES_TABLE}` (
+            goods_id BIGINT, date_label DATE, Buyers INT{sales_index}
+        )""")
+        for start in range(0, len(traffic_rows), 5000):
+            self.cursor.executemany(f"INSERT INTO `Vida_Traffic`.`{BENCH_TABLE}` VALUES (%s, %s, %s, %s)",
+                                    traffic_rows[start:start + 5000])
+        for start in range(0, len(sales_rows), 5000):
+            self.cursor.executemany(f"INSERT INTO `Vida_Sales`.`{BENCH_SALES_TABLE}` VALUES (%s, %s, %s)",
+                                    sales_rows[start:start + 5000])
+        self.conn.commit()
+
+    def query(self, sql, params):
+        self.cursor.execute(sql, params)
+        return {row[0] for row in self.cursor.fetchall()}
+
+    def teardown_tables(self):
+        self.cursor.execute(f"DROP TABLE IF EXISTS `Vida_Traffic`.`{BENCH_TABLE}`")
+        self.cursor.execute(f"DROP TABLE IF EXISTS `Vida_Sales`.`{BENCH_SALES_TABLE}`")
+
+    def teardown(self):
+        try:
+            self.teardown_tables()
+            self.conn.commit()
+        finally:
+            self.cursor.close()
+            self.conn.close()
+
+
+def time_query(backend, sql, params, repeat):
+    """返回 (最短耗时秒数, 结果集合)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = backend.query(sql, params)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='累计Buyers过滤条件基准测试')
+    parser.add_argument('--backend', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('--goods', type=int, default=50000, help='商品数')
+    parser.add_argument('--days', type=int, default=10, help='天数')
+    parser.add_argument('--repeat', type=int, default=3, help='每种写法重复次数（取最短耗时）')
+    parser.add_argument('--index', action='store_true', help='销售表加 (goods_id, date_label) 索引')
+    parser.add_argument('--skip-legacy', action='store_true', help='不运行旧写法（无索引时旧写法可能需要数分钟）')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"生成数据: {args.goods} 个商品 × {args.days} 天 ...")
+    traffic_rows, sales_rows, target_date = generate_data(args.goods, args.days, args.seed)
+    print(f"流量表 {len(traffic_rows)} 行，销售表 {len(sales_rows)} 行，目标日期 {target_date}")
+
+    backend = SQLiteBackend() if args.backend == 'sqlite' else MySQLBackend()
+    try:
+        started = time.perf_counter()
+        backend.setup(traffic_rows, sales_rows, args.index)
+        print(f"[{backend.name}] 建表与写入耗时 {time.perf_counter() - started:.2f}s，"
+              f"销售表索引: {'有' if args.index else '无'}\n")
+
+        print(f"{'min':>5} {'max':>5} {'商品数':>8} {'旧写法(s)':>10} {'新写法(s)':>10} {'结果一致':>8}")
+        for min_val, max_val in FILTER_CASES:
+            new_condition, new_params = build_cumulative_buyers_condition(
+                BENCH_SALES_TABLE, 't2.goods_id', target_date, min_val, max_val
+            )
+            new_time, new_result = time_query(backend, build_goods_query(new_condition),
+                                              [target_date, 2] + new_params, args.repeat)
+
+            legacy_time_text = '-'
+            same_text = '-'
+            if not args.skip_legacy:
+                legacy_condition, legacy_params = legacy_cumulative_buyers_condition(
+                    BENCH_SALES_TABLE, target_date, min_val, max_val
+                )
+                legacy_time, legacy_result = time_query(backend, build_goods_query(legacy_condition),
+                                                        [target_date, 2] + legacy_params, args.repeat)
+                legacy_time_text = f"{legacy_time:.3f}"
+                same_text = '是' if legacy_result == new_result else '否'
+
+            max_text = '-' if max_val is None else str(max_val)
+            print(f"{min_val:>5} {max_text:>5} {len(new_result):>8} {legacy_time_text:>10} {new_time:>10.3f} {same_text:>8}")
+    finally:
+        backend.teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+结果缓存文件格式模块（Cache_Dynamic / Cache_Indicator）
+文件结构：
+    MAGIC(8字节) + 头部长度(u32) + 头部JSON + 各分段数据
+    头部JSON: {'schema': 版本号, 'sections': {分段名: [偏移, 长度], ...}}
+    每个顶层键为一个分段，分段单独 zlib 压缩，读取时可以只解压需要的分段（如只读 statistics）
+分段内容为紧凑JSON + int64数组：
+    - 字段完全相同的字典列表（如 goods_info）按列存储
+    - 纯数字的goods_id列表（整数或数字字符串）存为int64数组，JSON中只保留引用，读取时还原为原类型
+写入先写临时文件再替换，读取时版本号不一致或文件损坏返回 None，由调用方重新计算
+"""
+
+import os
+import re
+import json
+import zlib
+import struct
+import threading
+import numpy as np
+
+
+CACHE_MAGIC = b'TEMUCCH\x00'
+CACHE_SCHEMA_VERSION = 1
+
+# 分段压缩级别（6 为 zlib 默认，压缩率与速度的折中）
+CACHE_COMPRESS_LEVEL = 6
+
+_HEADER_LEN = struct.Struct('<I')
+_SECTION_JSON_LEN = struct.Struct('<I')
+_DIGITS_RE = re.compile(r'[1-9][0-9]{0,17}\Z')
+
+
+def _is_id_list(values):
+    """非空且全部为整数，或全部为不以0开头的纯数字字符串（可无损转换为int64）"""
+    if len(values) == 0:
+        return None
+    if all(isinstance(value, (int, np.integer)) and not isinstance(value, bool) and 0 <= value < 2 ** 63
+           for value in values):
+        return 'i'
+    if all(type(value) is str and _DIGITS_RE.match(value) for value in values):
+        return 's'
+    return None
+
+
+def _encode(obj, ids):
+    if isinstance(obj, dict):
+        return {key: _encode(value, ids) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        values = list(obj)
+        id_kind = _is_id_list(values)
+        if id_kind is not None:
+            start = len(ids)
+            ids.extend(int(value) for value in values)
+            return {'$ids': [start, len(values), id_kind]}
+        if len(values) > 1 and all(isinstance(value, dict) for value in values):
+            keys = list(values[0].keys())
+            if all(list(value.keys()) == keys for value in values):
+                return {'$records': {
+                    'keys': keys,
+                    'columns': [_encode([value[key] for value in values], ids) for key in keys]
+                }}
+        return [_encode(value, ids) for value in values]
+    return obj
+
+
+def _decode(obj, id_array):
+    if isinstance(obj, dict):
+        if '$ids' in obj and len(obj) == 1:
+            start, count, id_kind = obj['$ids']
+            values = id_array[start:start + count].tolist()
+            return values if id_kind == 'i' else [str(value) for value in values]
+        if '$records' in obj and len(obj) == 1:
+            keys = obj['$records']['keys']
+            columns = [_decode(column, id_array) for column in obj['$records']['columns']]
+            return [dict(zip(keys, row)) for row in zip(*columns)]
+        return {key: _decode(value, id_array) for key, value in obj.items()}
+    if isinstance(obj, list):
+        if not any(isinstance(value, (dict, list)) for value in obj):
+            return obj
+        return [_decode(value, id_array) for value in obj]
+    return obj
+
+
+def _encode_section(value):
+    ids = []
+    encoded = json.dumps(_encode(value, ids), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    id_bytes = np.asarray(ids, dtype='<i8').tobytes() if ids else b''
+    raw = _SECTION_JSON_LEN.pack(len(encoded)) + encoded + id_bytes
+    return zlib.compress(raw, CACHE_COMPRESS_LEVEL)
+
+
+def _decode_section(blob):
+    raw = zlib.decompress(blob)
+    (json_len,) = _SECTION_JSON_LEN.unpack_from(raw)
+    offset = _SECTION_JSON_LEN.size
+    encoded = json.loads(raw[offset:offset + json_len].decode('utf-8'))
+    id_array = np.frombuffer(raw, dtype='<i8', offset=offset + json_len)
+    return _decode(encoded, id_array)
+
+
+def save_cache_file(path, data):
+    """把字典按分段格式原子写入 path（每个顶层键为一个分段）"""
+    blobs = [(name, _encode_section(value)) for name, value in data.items()]
+
+    sections = {}
+    offset = 0
+    for name, blob in blobs:
+        sections[name] = [offset, len(blob)]
+        offset += len(blob)
+    header = json.dumps({'schema': CACHE_SCHEMA_VERSION, 'sections': sections},
+                        ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(CACHE_MAGIC)
+            f.write(_HEADER_LEN.pack(len(header)))
+            f.write(header)
+            for _, blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_cache_file(path, sections=None):
+    """
+    读取缓存文件
+    sections: 只读取这些分段（如 ['statistics']），None 表示全部
+    返回: 字典；文件不存在、版本不一致或损坏时返回 None
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            (header_len,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+            if header.get('schema') != CACHE_SCHEMA_VERSION:
+                return None
+
+            data_start = len(CACHE_MAGIC) + _HEADER_LEN.size + header_len
+            result = {}
+            for name, (offset, length) in header['sections'].items():
+                if sections is not None and name not in sections:
+                    continue
+                f.seek(data_start + offset)
+                result[name] = _decode_section(f.read(length))
+            return result
+    except Exception as e:
+        print(f"读取缓存文件失败 {path}: {e}")
+        return None
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+渲染图表缓存模块
+把已渲染的PNG按内容寻址保存在 Cache_Charts/<前2位>/<键>.png，数据未变化的商品图不再重新渲染
+缓存键由 图表样式 + 商品的 (goods_id, 最后日期, 行数, 数据哈希) 计算，因此数据一变键就变，不需要主动失效
+（批量商品图按单个商品缓存小图，再拼接为每行一张图）
+总大小超过上限（配置项 chart_cache_max_mb，0 表示关闭缓存）时按最近使用时间淘汰（命中时更新文件mtime）
+"""
+
+import os
+import time
+import base64
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import matplotlib
+
+
+CHART_CACHE_DIR = 'Cache_Charts'
+
+# 修改绘图样式时递增，使旧图全部失效
+CHART_CACHE_VERSION = 1
+
+# 默认大小上限（MB）
+CHART_CACHE_MAX_MB = 512
+
+# 超过上限时淘汰到上限的该比例，避免每次写入都触发扫描
+CHART_CACHE_EVICT_RATIO = 0.9
+
+_cache_lock = threading.Lock()
+_cache_size = None
+
+
+def get_chart_cache_max_bytes():
+    from config import get_config_section
+    try:
+        max_mb = float(get_config_section('chart_cache_max_mb', CHART_CACHE_MAX_MB))
+    except (TypeError, ValueError):
+        max_mb = CHART_CACHE_MAX_MB
+    return max(int(max_mb * 1024 * 1024), 0)
+
+
+def _hash_value(hasher, value):
+    if isinstance(value, np.ndarray):
+        hasher.update(str(value.dtype).encode('utf-8'))
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        hasher.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+    else:
+        hasher.update(repr(value).encode('utf-8'))
+    hasher.update(b'\x00')
+
+
+def goods_fingerprint(goods_id, dates, *arrays):
+    """
+    单个商品序列的指纹：(goods_id, 最后日期, 行数, 数据哈希)
+    dates: 已排序的日期数组；arrays: 绘图用到的其他数组
+    """
+    hasher = hashlib.sha1()
+    _hash_value(hasher, np.asarray(dates))
+    for values in arrays:
+        _hash_value(hasher, values)
+    last_date = str(dates[-1])[:10] if len(dates) > 0 else None
+    return (str(goods_id), last_date, len(dates), hasher.hexdigest())
+
+
+def chart_cache_key(style, *parts):
+    """
+    style: 图表样式（函数名 + 影响外观的参数）
+    parts: 商品指纹或其他决定图片内容的数据（数组/DataFrame/普通值）
+    """
+    hasher = hashlib.sha1()
+    _hash_value(hasher, (CHART_CACHE_VERSION, matplotlib.__version__, style))
+    for part in parts:
+        _hash_value(hasher, part)
+    return hasher.hexdigest()
+
+
+def _chart_path(key):
+    return os.path.join(CHART_CACHE_DIR, key[:2], f"{key}.png")
+
+
+def _scan_cache_files():
+    """返回 [(mtime, size, path), ...]"""
+    files = []
+    if not os.path.isdir(CHART_CACHE_DIR):
+        return files
+    for sub_entry in os.scandir(CHART_CACHE_DIR):
+        if not sub_entry.is_dir():
+            continue
+        for entry in os.scandir(sub_entry.path):
+            if entry.name.endswith('.png'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    return files
+
+
+def _get_cache_size():
+    global _cache_size
+    if _cache_size is None:
+        _cache_size = sum(size for _, size, _ in _scan_cache_files())
+    return _cache_size
+
+
+def _evict(max_bytes):
+    """按最近使用时间从旧到新删除，直到总大小降到上限的 CHART_CACHE_EVICT_RATIO"""
+    global _cache_size
+    files = sorted(_scan_cache_files())
+    total = sum(size for _, size, _ in files)
+    target = max_bytes * CHART_CACHE_EVICT_RATIO
+    for _, size, path in files:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    _cache_size = total
+
+
+def get_cached_chart(key):
+    """命中时返回base64图片并更新最近使用时间，否则返回 None"""
+    if get_chart_cache_max_bytes() <= 0:
+        return None
+    path = _chart_path(key)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    try:
+        now = time.time()
+        os.utime(path, (now, now))
+    except OSError:
+        pass
+    return base64.b64encode(data).decode('utf-8')
+
+
+def put_cached_chart(key, img_base64):
+    """保存base64图片（原子写入），超过大小上限时淘汰最久未使用的图片"""
+    global _cache_size
+    max_bytes = get_chart_cache_max_bytes()
+    if max_bytes <= 0 or not img_base64:
+        return
+    path = _chart_path(key)
+    try:
+        data = base64.b64decode(img_base64)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        existed = os.path.exists(path)
+        os.replace(tmp_path, path)
+        with _cache_lock:
+            # 计数未初始化时 _get_cache_size() 会重新扫描（已包含刚写入的文件），只在已初始化时累加
+            if not existed and _cache_size is not None:
+                _cache_size += len(data)
+            if _get_cache_size() > max_bytes:
+                _evict(max_bytes)
+    except Exception as e:
+        print(f"写入图表缓存失败: {e}")
+
+
+def get_or_render_chart(key, render_func):
+    """先查缓存，未命中时调用 render_func() 渲染并写入缓存"""
+    img_base64 = get_cached_chart(key)
+    if img_base64 is not None:
+        return img_base64
+    img_base64 = render_func()
+    if img_base64:
+        put_cached_chart(key, img_base64)
+    return img_base64
+
+
+def clear_chart_cache():
+    """删除全部缓存图片"""
+    global _cache_size
+    with _cache_lock:
+        for _, _, path in _scan_cache_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        _cache_size = 0
@@ -3,8 +3,11 @@
 配置管理模块
 """
 
+import copy
 import json
 import os
+import threading
+import time
 
 # 默认配置
 DEFAULT_DB_CONFIG = {
@@ -47,9 +50,29 @@ DEFAULT_PRODUCT_DB_CONFIG = {
 
 CONFIG_FILE = 'app_config.json'
 
+# 配置文件检查间隔（秒）：间隔内直接使用内存快照，超过间隔才 stat 一次文件看 mtime 是否变化
+CONFIG_CHECK_INTERVAL = 1.0
 
-def load_config():
-    """加载配置文件"""
+# 内存中的配置快照（只读，对外返回副本）
+_config_cache = {
+    'config': None,
+    'signature': None,   # (mtime_ns, size)，文件不存在时为 None
+    'checked_at': 0.0
+}
+_config_lock = threading.Lock()
+
+
+def _get_config_file_signature():
+    """获取配置文件的 (mtime_ns, size)，文件不存在返回 None"""
+    try:
+        stat = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _read_config_file():
+    """从磁盘读取并解析配置文件"""
     if os.path.exists(CONFIG_FILE):
         try:
             with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
@@ -62,17 +85,59 @@ def load_config():
         return get_default_config()
 
 
+def _get_config_snapshot():
+    """
+    获取配置快照（调用方不得修改返回值）
+    文件 mtime/大小未变化时不再重复读取和解析 JSON
+    """
+    now = time.monotonic()
+    cache = _config_cache
+    if cache['config'] is not None and now - cache['checked_at'] < CONFIG_CHECK_INTERVAL:
+        return cache['config']
+
+    with _config_lock:
+        signature = _get_config_file_signature()
+        if cache['config'] is None or signature != cache['signature']:
+            cache['config'] = _read_config_file()
+            cache['signature'] = signature
+        cache['checked_at'] = now
+        return cache['config']
+
+
+def invalidate_config_cache():
+    """清除配置快照，下次访问时重新读取配置文件"""
+    with _config_lock:
+        _config_cache['config'] = None
+        _config_cache['signature'] = None
+        _config_cache['checked_at'] = 0.0
+
+
+def load_config():
+    """加载配置文件（返回副本，可自由修改后交给 save_config 保存）"""
+    return copy.deepcopy(_get_config_snapshot())
+
+
 def save_config(config):
-    """保存配置文件"""
+    """保存配置文件（同时更新内存快照）"""
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        with _config_lock:
+            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+                json.dump(config, f, ensure_ascii=False, indent=2)
+            _config_cache['config'] = copy.deepcopy(config)
+            _config_cache['signature'] = _get_config_file_signature()
+            _config_cache['checked_at'] = time.monotonic()
         return True
     except Exception as e:
         print(f"保存配置文件失败: {e}")
         return False
 
 
+def get_config_section(key, default=None):
+    """获取配置中的某一项（返回副本）"""
+    value = _get_config_snapshot().get(key, default)
+    return copy.deepcopy(value)
+
+
 def get_default_config():
     """获取默认配置"""
     return {
@@ -84,19 +149,37 @@ def get_default_config():
     }
 
 
+def get_traffic_db_config():
+    """获取流量数据库配置"""
+    return dict(_get_config_snapshot().get('traffic_db', DEFAULT_DB_CONFIG))
+
+
+def get_sales_db_config():
+    """获取销售数据库配置"""
+    return dict(_get_config_snapshot().get('sales_db', DEFAULT_SALES_DB_CONFIG))
+
+
+def get_pallet_db_config():
+    """获取货盘数据库配置"""
+    return dict(_get_config_snapshot().get('pallet_db', DEFAULT_PALLET_DB_CONFIG))
+
+
+def get_product_db_config():
+    """获取平台商品表数据库配置"""
+    return dict(_get_config_snapshot().get('product_db', DEFAULT_PRODUCT_DB_CONFIG))
+
+
 def get_db_config():
     """获取数据库配置"""
-    config = load_config()
-    return (config.get('traffic_db', DEFAULT_DB_CONFIG),
-            config.get('sales_db', DEFAULT_SALES_DB_CONFIG),
-            config.get('pallet_db', DEFAULT_PALLET_DB_CONFIG),
-            config.get('product_db', DEFAULT_PRODUCT_DB_CONFIG))
+    return (get_traffic_db_config(),
+            get_sales_db_config(),
+            get_pallet_db_config(),
+            get_product_db_config())
 
 
 def get_current_table():
     """获取当前选择的表"""
-    config = load_config()
-    return config.get('current_table', 'ROA1_NL')
+    return _get_config_snapshot().get('current_table', 'ROA1_NL')
 
 
 def set_current_table(table_name):
@@ -122,8 +205,7 @@ def update_db_config(traffic_db, sales_db, pallet_db=None, product_db=None):
 
 def load_auto_reason_config():
     """加载自动更新Reason的配置（限流数据目录）"""
-    config = load_config()
-    return config.get('auto_reason_config', {
+    return get_config_section('auto_reason_config', {
         'traffic_restricted_data_dir': ''
     })
 
@@ -3,15 +3,484 @@
 数据库工具模块
 """
 
+import time
+import threading
+from contextlib import contextmanager
 import pymysql
+import pymysql.cursors
+from pymysql.constants import FIELD_TYPE
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from config import get_db_config
 
 
+# 连接池参数：每个数据库配置最多同时打开的连接数、空闲连接最长保留时间（秒）、
+# 空闲超过多久后取出时先做一次 ping 健康检查（秒）、连接池已满时的最长等待时间（秒）
+POOL_MAX_SIZE = 10
+POOL_IDLE_TIMEOUT = 300
+POOL_PING_INTERVAL = 30
+POOL_WAIT_TIMEOUT = 30
+
+
+class ConnectionPool:
+    """
+    单个数据库配置对应的连接池（线程安全）
+    - 最多同时打开 max_size 个连接，超过时等待其他调用归还
+    - 空闲超过 idle_timeout 的连接会被关闭回收
+    - 空闲超过 ping_interval 的连接在取出前先 ping，失效则丢弃重建
+    """
+
+    def __init__(self, config, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 ping_interval=POOL_PING_INTERVAL, wait_timeout=POOL_WAIT_TIMEOUT):
+        self.config = dict(config)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.wait_timeout = wait_timeout
+        self._idle = []  # [(raw_conn, 归还时间)]，末尾为最近归还
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def _evict_idle(self, now):
+        """关闭空闲过久的连接（调用方需持有锁）"""
+        expired = [item for item in self._idle if now - item[1] > self.idle_timeout]
+        if expired:
+            self._idle = [item for item in self._idle if now - item[1] <= self.idle_timeout]
+            for raw_conn, _ in expired:
+                _close_quietly(raw_conn)
+
+    def acquire(self):
+        """从池中取出一个可用连接，返回 PooledConnection"""
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._evict_idle(now)
+                if self._idle:
+                    raw_conn, released_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    raw_conn, released_at = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise pymysql.err.OperationalError(
+                        2006, f"数据库连接池已满（{self.max_size}），等待 {self.wait_timeout} 秒超时")
+                self._cond.wait(remaining)
+
+        # 建连与健康检查在锁外进行，避免阻塞其他线程
+        try:
+            if raw_conn is not None and not self._is_healthy(raw_conn, released_at):
+                _close_quietly(raw_conn)
+                raw_conn = None
+            if raw_conn is None:
+                raw_conn = pymysql.connect(**self.config)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw_conn)
+
+    def _is_healthy(self, raw_conn, released_at):
+        """检查空闲连接是否仍然可用"""
+        if not raw_conn.open:
+            return False
+        if time.monotonic() - released_at < self.ping_interval:
+            return True
+        try:
+            raw_conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def release(self, raw_conn, discard=False):
+        """归还连接；discard=True 或连接已失效时直接关闭"""
+        if not discard and raw_conn.open:
+            try:
+                # 结束未提交的事务，保证下一个使用者看到最新数据（与原先 close() 丢弃未提交修改的行为一致）
+                raw_conn.rollback()
+            except Exception:
+                discard = True
+        else:
+            discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or len(self._idle) >= self.max_size:
+                _close_quietly(raw_conn)
+            else:
+                self._idle.append((raw_conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        """关闭所有空闲连接（正在使用的连接归还后照常入池）"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for raw_conn, _ in idle:
+            _close_quietly(raw_conn)
+
+
+class PooledConnection:
+    """
+    连接池中取出的连接
+    接口与 pymysql 连接一致；close() 归还到连接池而不是真正断开，
+    也可以用作上下文管理器：with get_db_connection(config) as conn: ...
+    """
+
+    def __init__(self, pool, raw_conn):
+        self._pool = pool
+        self._conn = raw_conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise pymysql.err.InterfaceError(0, "连接已归还到连接池")
+        return getattr(conn, name)
+
+    def close(self):
+        """归还连接（可重复调用）"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __del__(self):
+        # 兜底：调用方异常退出未 close() 时，回收时关闭连接并释放池中的名额
+        conn = self.__dict__.get('_conn')
+        if conn is not None:
+            self._conn = None
+            try:
+                self._pool.release(conn, discard=True)
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _close_quietly(raw_conn):
+    try:
+        raw_conn.close()
+    except Exception:
+        pass
+
+
+def _pool_key(config):
+    return tuple(sorted((k, str(v)) for k, v in config.items()))
+
+
+def get_connection_pool(config):
+    """获取（或创建）指定数据库配置对应的进程级连接池"""
+    key = _pool_key(config)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(config)
+                _pools[key] = pool
+    return pool
+
+
+def close_all_pools():
+    """关闭所有连接池中的空闲连接（数据库配置修改后调用）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
+
+
 def get_db_connection(config):
-    """获取数据库连接"""
-    return pymysql.connect(**config)
+    """从连接池获取数据库连接（close() 即归还，可用 with 语句自动归还）"""
+    return get_connection_pool(config).acquire()
+
+
+@contextmanager
+def db_cursor(config):
+    """
+    上下文管理器：从连接池取连接并打开游标，结束时关闭游标并归还连接
+    用法：with db_cursor(traffic_config) as cursor: ...
+    写操作需要调用 cursor.connection.commit()
+    """
+    conn = get_db_connection(config)
+    try:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+
+
+# 批量写入时每条多行 INSERT 包含的记录数
+BULK_WRITE_CHUNK_SIZE = 1000
+
+
+def bulk_write_columns(cursor, table_name, rows, report_matched=True, chunk_size=BULK_WRITE_CHUNK_SIZE):
+    """
+    按 (goods_id, date_label) 批量写入 Status/Reason/Video/Price 等列
+    rows: [(goods_id, date_label, column, value), ...]，可以混合多列
+    先把数据写入临时表（executemany 会合并为多行 INSERT），每列再用一条 UPDATE ... JOIN 回写；
+    同一 (goods_id, date_label, 列) 出现多次时以最后一条为准，与逐条 UPDATE 的结果一致
+    不提交事务，由调用方 commit
+    report_matched: 为False时不检查每条记录是否匹配（matched 返回 None），省去一次JOIN查询
+    返回: (matched, updated_count)
+        matched: 与 rows 一一对应的 bool 列表，表示目标表中是否存在该 (goods_id, date_label) 的记录，
+            用于逐条报告"未找到记录"（值未变化的记录也算匹配）
+        updated_count: 实际变更的行数
+    """
+    if not rows:
+        return ([] if report_matched else None), 0
+    
+    columns = list(dict.fromkeys(row[2] for row in rows))
+    last_index = {}
+    for row_no, (goods_id, date_label, column, _) in enumerate(rows):
+        last_index[(str(goods_id), format_date_label(date_label), column)] = row_no
+    is_last = [False] * len(rows)
+    for row_no in last_index.values():
+        is_last[row_no] = True
+    
+    tmp_table = 'tmp_bulk_write'
+    column_list = ', '.join(f"`{column}`" for column in columns)
+    # 临时表列类型与目标表保持一致，避免 JOIN 和赋值时发生隐式类型转换
+    # 只用一条 CREATE TEMPORARY TABLE 建表：对临时表执行 ALTER TABLE 会隐式提交调用方的事务
+    cursor.execute(f"SHOW COLUMNS FROM `{table_name}`")
+    column_types = {row[0]: row[1] for row in cursor.fetchall()}
+    missing = [column for column in ['goods_id', 'date_label'] + columns if column not in column_types]
+    if missing:
+        raise ValueError(f"表 {table_name} 缺少列: {', '.join(missing)}")
+    value_columns = ''.join(f"`{column}` {column_types[column]} NULL,\n      " for column in columns)
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{tmp_table}`")
+    cursor.execute(f"""
+    CREATE TEMPORARY TABLE `{tmp_table}` (
+      `row_no` INT NOT NULL PRIMARY KEY,
+      `goods_id` {column_types['goods_id']} NULL,
+      `date_label` {column_types['date_label']} NULL,
+      `column_name` VARCHAR(64) NOT NULL,
+      `is_last` TINYINT NOT NULL,
+      {value_columns}INDEX idx_goods_date (goods_id, date_label)
+    )
+    """)
+    
+    try:
+        insert_sql = f"""
+        INSERT INTO `{tmp_table}` (row_no, goods_id, date_label, column_name, is_last, {column_list})
+        VALUES (%s, %s, %s, %s, %s, {', '.join(['%s'] * len(columns))})
+        """
+        staged = []
+        for row_no, (goods_id, date_label, column, value) in enumerate(rows):
+            values = [value if column == target else None for target in columns]
+            staged.append((row_no, goods_id, date_label, column, int(is_last[row_no]), *values))
+        for start in range(0, len(staged), chunk_size):
+            cursor.executemany(insert_sql, staged[start:start + chunk_size])
+        
+        updated_count = 0
+        for column in columns:
+            cursor.execute(f"""
+            UPDATE `{table_name}` t
+            JOIN `{tmp_table}` u
+              ON t.goods_id = u.goods_id
+              AND t.date_label = u.date_label
+            SET t.`{column}` = u.`{column}`
+            WHERE u.column_name = %s AND u.is_last = 1
+            """, (column,))
+            updated_count += cursor.rowcount
+        
+        matched = None
+        if report_matched:
+            matched = [False] * len(rows)
+            cursor.execute(f"""
+            SELECT u.row_no
+            FROM `{tmp_table}` u
+            WHERE EXISTS (
+                SELECT 1 FROM `{table_name}` t
+                WHERE t.goods_id = u.goods_id AND t.date_label = u.date_label
+            )
+            """)
+            for (row_no,) in cursor.fetchall():
+                matched[row_no] = True
+        return matched, updated_count
+    finally:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS `{tmp_table}`")
+
+
+def bulk_update_column(cursor, table_name, column, rows, chunk_size=BULK_WRITE_CHUNK_SIZE):
+    """
+    按 (goods_id, date_label) 批量更新某一列（bulk_write_columns 的单列形式）
+    rows: [(goods_id, date_label, value), ...]
+    不提交事务，由调用方 commit
+    返回: 实际变更的行数
+    """
+    _, updated_count = bulk_write_columns(
+        cursor, table_name, [(goods_id, date_label, column, value) for goods_id, date_label, value in rows],
+        report_matched=False, chunk_size=chunk_size
+    )
+    return updated_count
+
+
+# 流式读取（服务端游标）时每次 fetchmany 的行数，可在 app_config.json 中用 stream_chunk_size 覆盖
+STREAM_CHUNK_SIZE = 5000
+
+_INTEGER_FIELD_TYPES = {
+    FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.INT24, FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR
+}
+_FLOAT_FIELD_TYPES = {FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE, FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL}
+_DATE_FIELD_TYPES = {FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE, FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP}
+
+# ROA1_xx 流量表 / ROA1_xx_Sales 销售表常用列的目标类型，构建DataFrame时一次转换到位
+# 整数列含NULL时退化为同宽度的浮点类型（int32 → float32）；未列出的列按数据库字段类型推断
+# 只在数据库字段本身是日期/数值类型时生效，字符串存储的列仍由 clean_history_frame 解析
+HISTORY_COLUMN_DTYPES = {
+    'date_label': 'datetime64',
+    'Product impressions': np.int32,
+    'Product clicks': np.int32,
+    'impressions': np.int32,
+    'clicks': np.int32,
+    'Buyers': np.float32,
+    'buyers': np.float32,
+}
+
+_NULLABLE_FLOAT_DTYPES = {np.dtype(np.int32): np.float32, np.dtype(np.int64): np.float64}
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+_NAT_DAYS = np.iinfo(np.int64).min
+
+
+def get_stream_chunk_size():
+    from config import get_config_section
+    try:
+        chunk_size = int(get_config_section('stream_chunk_size', STREAM_CHUNK_SIZE))
+    except (TypeError, ValueError):
+        chunk_size = STREAM_CHUNK_SIZE
+    return max(chunk_size, 1)
+
+
+def _chunk_to_array(values, field_type, target_dtype=None):
+    """
+    把一块的某一列转换为NumPy数组
+    target_dtype: HISTORY_COLUMN_DTYPES 中的目标类型；为 None 时按字段类型推断：
+        整数列无NULL时为int64、有NULL时为float64（与pandas推断一致），浮点/DECIMAL列为float64，其他为object
+    """
+    if target_dtype == 'datetime64':
+        if field_type in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE):
+            try:
+                # date 对象按序数换算为距1970-01-01的天数，比逐个解析快一个数量级
+                days = np.array([_NAT_DAYS if v is None else v.toordinal() - _EPOCH_ORDINAL for v in values], dtype=np.int64)
+                return days.view('datetime64[D]')
+            except AttributeError:
+                # 非法日期（如 0000-00-00）会以字符串返回，按 pandas 规则解析为 NaT
+                pass
+        return pd.to_datetime(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype='datetime64[ns]')
+    if target_dtype is None:
+        if field_type in _INTEGER_FIELD_TYPES:
+            target_dtype = np.int64
+        elif field_type in _FLOAT_FIELD_TYPES:
+            target_dtype = np.float64
+        else:
+            return np.array(values, dtype=object)
+    
+    target_dtype = np.dtype(target_dtype)
+    if target_dtype.kind in 'iu':
+        if None not in values:
+            return np.array(values, dtype=target_dtype)
+        target_dtype = np.dtype(_NULLABLE_FLOAT_DTYPES.get(target_dtype, np.float64))
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=target_dtype)
+
+
+def _concat_chunks(chunks):
+    """拼接同一列的各块；部分块含NULL（浮点）时整列统一为该浮点类型"""
+    if not chunks:
+        return np.array([], dtype=object)
+    float_dtypes = [chunk.dtype for chunk in chunks if chunk.dtype.kind == 'f']
+    if float_dtypes and len(float_dtypes) < len(chunks):
+        return np.concatenate([chunk.astype(float_dtypes[0]) for chunk in chunks])
+    return np.concatenate(chunks)
+
+
+def fetch_dataframe_streaming(conn, query, params=None, chunk_size=None, dtypes=None):
+    """
+    用服务端游标（SSCursor）分块读取查询结果，逐块转换为按列的NumPy数组后再拼成DataFrame
+    不会一次性把全部结果物化为Python元组，适合完整历史等大结果集
+    列类型在构建时一次确定（结果转DataFrame的统一入口）：
+        dtypes 中列出的列按指定类型（默认 HISTORY_COLUMN_DTYPES：date_label → datetime64，曝光/点击 → int32，Buyers → float32）
+        其他列按 cursor.description 的字段类型转为 int64/float64（DECIMAL 转为 float64），非数值列保持 object
+    chunk_size: 每次 fetchmany 的行数，默认取 get_stream_chunk_size()
+    """
+    chunk_size = chunk_size or get_stream_chunk_size()
+    if dtypes is None:
+        dtypes = HISTORY_COLUMN_DTYPES
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute(query, params)
+        columns = [desc[0] for desc in cursor.description]
+        field_types = [desc[1] for desc in cursor.description]
+        target_dtypes = []
+        for column, field_type in zip(columns, field_types):
+            target_dtype = dtypes.get(column)
+            if target_dtype == 'datetime64' and field_type not in _DATE_FIELD_TYPES:
+                target_dtype = None
+            elif target_dtype is not None and target_dtype != 'datetime64':
+                if field_type in _FLOAT_FIELD_TYPES and np.dtype(target_dtype).kind in 'iu':
+                    # 小数字段不截断为整数
+                    target_dtype = _NULLABLE_FLOAT_DTYPES.get(np.dtype(target_dtype), np.float64)
+                elif field_type not in _INTEGER_FIELD_TYPES and field_type not in _FLOAT_FIELD_TYPES:
+                    target_dtype = None
+            target_dtypes.append(target_dtype)
+        column_chunks = [[] for _ in columns]
+        
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for i, values in enumerate(zip(*rows)):
+                column_chunks[i].append(_chunk_to_array(values, field_types[i], target_dtypes[i]))
+            del rows
+        
+        data = {}
+        for i, column in enumerate(columns):
+            array = _concat_chunks(column_chunks[i])
+            if target_dtypes[i] == 'datetime64':
+                array = array.astype('datetime64[ns]')
+            data[column] = array
+            column_chunks[i] = None
+        
+        return pd.DataFrame(data, columns=columns)
+    finally:
+        cursor.close()
+
+
+def clean_history_frame(df, numeric_columns=('Product impressions', 'Product clicks', 'Buyers')):
+    """
+    历史数据的统一清洗：由 date_label 生成 date 列并丢弃日期无效的行，数值列的NULL补0
+    由 fetch_dataframe_streaming 按类型构建的列不再重复 to_datetime/to_numeric，只做 fillna
+    """
+    if 'date_label' in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df["date_label"]):
+            df["date"] = df["date_label"]
+        else:
+            df["date"] = pd.to_datetime(df["date_label"], dayfirst=True, errors="coerce")
+        df = df.dropna(subset=["date"])
+    
+    for column in numeric_columns:
+        if column in df.columns:
+            if pd.api.types.is_numeric_dtype(df[column]):
+                df[column] = df[column].fillna(0)
+            else:
+                df[column] = pd.to_numeric(df[column], errors="coerce").fillna(0)
+    
+    return df
 
 
 def get_available_tables(cursor):
@@ -27,20 +496,45 @@ def get_yesterday_date():
     return yesterday.strftime('%Y-%m-%d')
 
 
+def format_date_label(value):
+    """把数据库返回的 date_label（date/datetime/字符串）统一转换为 'YYYY-MM-DD' 字符串"""
+    if value is None:
+        return None
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+def get_history_from_cache(table_name, sales_table_name, goods_ids=None, start_date=None, end_date=None):
+    """
+    从本地历史镜像（history_cache）读取 t.* + Buyers，结果与 LEFT JOIN 查询相同，按 goods_id, date_label 排序
+    start_date/end_date 包含边界
+    返回: DataFrame；镜像不可用时返回 None，调用方回退到MySQL查询
+    """
+    from history_cache import read_history_cache
+    return read_history_cache(table_name, sales_table_name, goods_ids, start_date, end_date)
+
+
 def get_goods_data(table_name, sales_table_name, goods_id):
     """
     获取指定goods_id的曝光和动销数据
     返回: DataFrame包含日期、曝光量、动销数据、点击数据
     """
-    traffic_config, sales_config, _, _ = get_db_config()
+    history = get_history_from_cache(table_name, sales_table_name, [goods_id])
+    if history is not None:
+        df = pd.DataFrame({
+            'date_label': history['date_label'],
+            'impressions': history['Product impressions'],
+            'clicks': history['Product clicks'],
+            'buyers': history['Buyers'].where(history['Buyers'].notna(), 0)
+        }) if len(history) > 0 else pd.DataFrame(columns=['date_label', 'impressions', 'clicks', 'buyers'])
+        return _clean_goods_data(df)
+    
+    traffic_config, _, _, _ = get_db_config()
     
     conn = get_db_connection(traffic_config)
-    conn_sales = get_db_connection(sales_config)
     
     try:
-        cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
-        
         query = f"""
         SELECT 
           t.date_label,
@@ -54,25 +548,67 @@ def get_goods_data(table_name, sales_table_name, goods_id):
         WHERE t.goods_id = %s
         ORDER BY t.date_label;
         """
-        cursor.execute(query, (goods_id,))
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
+        df = fetch_dataframe_streaming(conn, query, (goods_id,))
         
-        # 转换日期格式
-        if len(df) > 0:
-            df['date_label'] = pd.to_datetime(df['date_label'])
-            # 确保数值列为数值类型
-            df['impressions'] = pd.to_numeric(df['impressions'], errors='coerce').fillna(0)
-            df['clicks'] = pd.to_numeric(df['clicks'], errors='coerce').fillna(0)
-            df['buyers'] = pd.to_numeric(df['buyers'], errors='coerce').fillna(0)
-        
-        return df
+        return _clean_goods_data(df)
     finally:
-        cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
+
+
+def _clean_goods_data(df):
+    """
+    get_goods_data 的数据清洗
+    镜像与 fetch_dataframe_streaming 返回的列已是 datetime64/数值类型，只补0；字符串存储的列才解析
+    """
+    if len(df) > 0:
+        if not pd.api.types.is_datetime64_any_dtype(df['date_label']):
+            df['date_label'] = pd.to_datetime(df['date_label'])
+        for column in ('impressions', 'clicks', 'buyers'):
+            if pd.api.types.is_numeric_dtype(df[column]):
+                df[column] = df[column].fillna(0)
+            else:
+                df[column] = pd.to_numeric(df[column], errors='coerce').fillna(0)
+    
+    return df
+
+
+def build_cumulative_buyers_condition(sales_table_name, goods_column, target_date, min_val, max_val=None, inclusive=True):
+    """
+    构建"累计Buyers在[min_val, max_val]范围内"的SQL条件
+    累计Buyers为该商品在 target_date 及之前（inclusive=False 时为之前）的 Buyers 总和，没有销售记录视为0
+    销售表只按 goods_id 聚合一次（非相关子查询），不再对每个候选商品各做一次 SUM
+    goods_column: 外层查询中的goods_id列，如 't2.goods_id'
+    返回: (condition_sql, condition_params)
+    """
+    date_operator = "<=" if inclusive else "<"
+    zero_in_range = min_val <= 0 and (max_val is None or max_val >= 0)
+    
+    if zero_in_range:
+        # 没有销售记录（累计为0）的商品也满足条件，改为排除累计值超出范围的商品
+        having_parts = ["COALESCE(SUM(Buyers), 0) < %s"]
+        having_params = [min_val]
+        if max_val is not None:
+            having_parts.append("COALESCE(SUM(Buyers), 0) > %s")
+            having_params.append(max_val)
+        having_sql = " OR ".join(having_parts)
+        operator = "NOT IN"
+    else:
+        having_parts = ["COALESCE(SUM(Buyers), 0) >= %s"]
+        having_params = [min_val]
+        if max_val is not None:
+            having_parts.append("COALESCE(SUM(Buyers), 0) <= %s")
+            having_params.append(max_val)
+        having_sql = " AND ".join(having_parts)
+        operator = "IN"
+    
+    condition_sql = f"""{goods_column} {operator} (
+        SELECT goods_id
+        FROM `Vida_Sales`.`{sales_table_name}`
+        WHERE date_label {date_operator} %s AND goods_id IS NOT NULL
+        GROUP BY goods_id
+        HAVING {having_sql}
+    )"""
+    return condition_sql, [target_date] + having_params
 
 
 def build_filter_condition(filter_mode, sales_table_name, target_date):
@@ -87,16 +623,7 @@ def build_filter_condition(filter_mode, sales_table_name, target_date):
     min_val = filter_mode.get('min', 0)
     max_val = filter_mode.get('max')
     
-    if max_val is not None:
-        # 有上限和下限
-        condition_sql = f"(SELECT COALESCE(SUM(s3.Buyers), 0) FROM `Vida_Sales`.`{sales_table_name}` s3 WHERE s3.goods_id = t2.goods_id AND s3.date_label <= %s AND s3.Buyers IS NOT NULL) >= %s AND (SELECT COALESCE(SUM(s3.Buyers), 0) FROM `Vida_Sales`.`{sales_table_name}` s3 WHERE s3.goods_id = t2.goods_id AND s3.date_label <= %s AND s3.Buyers IS NOT NULL) <= %s"
-        condition_params = [target_date, min_val, target_date, max_val]
-    else:
-        # 只有下限
-        condition_sql = f"(SELECT COALESCE(SUM(s3.Buyers), 0) FROM `Vida_Sales`.`{sales_table_name}` s3 WHERE s3.goods_id = t2.goods_id AND s3.date_label <= %s AND s3.Buyers IS NOT NULL) >= %s"
-        condition_params = [target_date, min_val]
-    
-    return condition_sql, condition_params
+    return build_cumulative_buyers_condition(sales_table_name, 't2.goods_id', target_date, min_val, max_val)
 
 
 def get_dynamic_goods_data(table_name, sales_table_name, status, target_date=None, filter_mode=None):
@@ -108,67 +635,59 @@ def get_dynamic_goods_data(table_name, sales_table_name, status, target_date=Non
     if target_date is None:
         target_date = get_yesterday_date()
     
-    traffic_config, sales_config, _, _ = get_db_config()
+    traffic_config, _, _, _ = get_db_config()
     
     conn = get_db_connection(traffic_config)
-    conn_sales = get_db_connection(sales_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
         
         # 构建过滤条件
         filter_condition, filter_params = build_filter_condition(filter_mode, sales_table_name, target_date)
         
-        # 构建查询
-        query = f"""
-        SELECT 
-          t.*,
-          s.Buyers
-        FROM `Vida_Traffic`.`{table_name}` t
-        LEFT JOIN `Vida_Sales`.`{sales_table_name}` s
-          ON t.goods_id = s.goods_id
-          AND t.date_label = s.date_label
-        WHERE t.goods_id IN (
-            SELECT DISTINCT t2.goods_id
-            FROM `Vida_Traffic`.`{table_name}` t2
-            WHERE t2.date_label = %s
-              AND t2.Status = %s
-              AND EXISTS (
-                  SELECT 1
-                  FROM `Vida_Sales`.`{sales_table_name}` s2
-                  WHERE s2.goods_id = t2.goods_id
-              )
-              AND {filter_condition}
-        )
-        ORDER BY t.goods_id, t.date_label;
+        # 先找出符合条件的商品
+        query_goods = f"""
+        SELECT DISTINCT t2.goods_id
+        FROM `Vida_Traffic`.`{table_name}` t2
+        WHERE t2.date_label = %s
+          AND t2.Status = %s
+          AND EXISTS (
+              SELECT 1
+              FROM `Vida_Sales`.`{sales_table_name}` s2
+              WHERE s2.goods_id = t2.goods_id
+          )
+          AND {filter_condition}
         """
-        cursor.execute(query, [target_date, status] + filter_params)
+        cursor.execute(query_goods, [target_date, status] + filter_params)
+        goods_ids = [row[0] for row in cursor.fetchall()]
         
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
+        # 再取这些商品的全部历史（优先读本地镜像）
+        df = get_history_from_cache(table_name, sales_table_name, goods_ids)
+        if df is None:
+            if len(goods_ids) == 0:
+                df = pd.DataFrame()
+            else:
+                placeholders = ','.join(['%s'] * len(goods_ids))
+                query = f"""
+                SELECT 
+                  t.*,
+                  s.Buyers
+                FROM `Vida_Traffic`.`{table_name}` t
+                LEFT JOIN `Vida_Sales`.`{sales_table_name}` s
+                  ON t.goods_id = s.goods_id
+                  AND t.date_label = s.date_label
+                WHERE t.goods_id IN ({placeholders})
+                ORDER BY t.goods_id, t.date_label;
+                """
+                df = fetch_dataframe_streaming(conn, query, goods_ids)
         
         # 数据清洗
-        if 'date_label' in df.columns:
-            df["date"] = pd.to_datetime(df["date_label"], dayfirst=True, errors="coerce")
-            df = df.dropna(subset=["date"])
-        
-        if "Product impressions" in df.columns:
-            df["Product impressions"] = pd.to_numeric(df["Product impressions"], errors="coerce").fillna(0)
-        
-        if "Product clicks" in df.columns:
-            df["Product clicks"] = pd.to_numeric(df["Product clicks"], errors="coerce").fillna(0)
-        
-        if "Buyers" in df.columns:
-            df["Buyers"] = pd.to_numeric(df["Buyers"], errors="coerce").fillna(0)
+        df = clean_history_frame(df)
         
         return df
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
 
 
 def get_optimization_data(table_name, sales_table_name, field_name, target_date=None):
@@ -179,52 +698,42 @@ def get_optimization_data(table_name, sales_table_name, field_name, target_date=
     if target_date is None:
         target_date = get_yesterday_date()
     
-    traffic_config, sales_config, _, _ = get_db_config()
+    traffic_config, _, _, _ = get_db_config()
     
     conn = get_db_connection(traffic_config)
-    conn_sales = get_db_connection(sales_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
-        
-        query = f"""
-        SELECT 
-          t.*,
-          s.Buyers
-        FROM `Vida_Traffic`.`{table_name}` t
-        LEFT JOIN `Vida_Sales`.`{sales_table_name}` s
-          ON t.goods_id = s.goods_id
-          AND t.date_label = s.date_label
-        WHERE t.goods_id IN (
-            SELECT DISTINCT t2.goods_id
-            FROM `Vida_Traffic`.`{table_name}` t2
-            WHERE t2.`{field_name}` = 1
-        )
-        ORDER BY t.goods_id, t.date_label;
-        """
-        cursor.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
         
-        # 数据清洗
-        if 'date_label' in df.columns:
-            df["date"] = pd.to_datetime(df["date_label"], dayfirst=True, errors="coerce")
-            df = df.dropna(subset=["date"])
+        cursor.execute(f"SELECT DISTINCT goods_id FROM `Vida_Traffic`.`{table_name}` WHERE `{field_name}` = 1")
+        goods_ids = [row[0] for row in cursor.fetchall()]
         
-        if "Product impressions" in df.columns:
-            df["Product impressions"] = pd.to_numeric(df["Product impressions"], errors="coerce").fillna(0)
+        df = get_history_from_cache(table_name, sales_table_name, goods_ids)
+        if df is None:
+            query = f"""
+            SELECT 
+              t.*,
+              s.Buyers
+            FROM `Vida_Traffic`.`{table_name}` t
+            LEFT JOIN `Vida_Sales`.`{sales_table_name}` s
+              ON t.goods_id = s.goods_id
+              AND t.date_label = s.date_label
+            WHERE t.goods_id IN (
+                SELECT DISTINCT t2.goods_id
+                FROM `Vida_Traffic`.`{table_name}` t2
+                WHERE t2.`{field_name}` = 1
+            )
+            ORDER BY t.goods_id, t.date_label;
+            """
+            df = fetch_dataframe_streaming(conn, query)
         
-        if "Buyers" in df.columns:
-            df["Buyers"] = pd.to_numeric(df["Buyers"], errors="coerce").fillna(0)
+        # 数据清洗
+        df = clean_history_frame(df, numeric_columns=('Product impressions', 'Buyers'))
         
         return df
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
 
 
 def get_filtered_data(table_name, filters, sort_field=None, sort_order='asc', on_shelf_filter_mode=False):
@@ -240,42 +749,27 @@ def get_filtered_data(table_name, filters, sort_field=None, sort_order='asc', on
     conn = get_db_connection(traffic_config)
     
     try:
-        cursor = conn.cursor()
-        
         # 如果启用上架时间筛选模式
         if on_shelf_filter_mode and (filters.get('date_from') or filters.get('date_to')):
-            # 先找到所有goods_id的上架日期（第一次出现的date_label）
-            query_first_date = f"""
-            SELECT goods_id, MIN(date_label) as first_date
-            FROM `Vida_Traffic`.`{table_name}`
-            GROUP BY goods_id
-            """
-            cursor.execute(query_first_date)
-            first_dates = cursor.fetchall()
-            
-            # 筛选出上架日期在时间范围内的goods_id
-            valid_goods_ids = []
+            # 上架日期（第一次出现的date_label）取自商品快照，在快照表上按范围筛选
+            from snapshot_utils import get_goods_snapshot
             date_from = filters.get('date_from')
             date_to = filters.get('date_to')
             
-            for goods_id, first_date in first_dates:
-                # 处理日期类型（可能是字符串或date对象）
-                if isinstance(first_date, str):
-                    first_date_str = first_date
-                elif hasattr(first_date, 'strftime'):
-                    first_date_str = first_date.strftime('%Y-%m-%d')
-                else:
-                    first_date_str = str(first_date)
-                
-                # 检查是否在时间范围内
-                in_range = True
-                if date_from and first_date_str < date_from:
-                    in_range = False
-                if date_to and first_date_str > date_to:
-                    in_range = False
-                
-                if in_range:
-                    valid_goods_ids.append(goods_id)
+            snapshot_conditions = ["first_traffic_date IS NOT NULL"]
+            snapshot_params = []
+            if date_from:
+                snapshot_conditions.append("first_traffic_date >= %s")
+                snapshot_params.append(date_from)
+            if date_to:
+                snapshot_conditions.append("first_traffic_date <= %s")
+                snapshot_params.append(date_to)
+            
+            snapshot = get_goods_snapshot(
+                table_name, f"{table_name}_Sales", columns=['goods_id'],
+                where=' AND '.join(snapshot_conditions), params=snapshot_params
+            )
+            valid_goods_ids = snapshot['goods_id'].tolist()
             
             if len(valid_goods_ids) == 0:
                 # 没有符合条件的goods_id，返回空DataFrame
@@ -289,8 +783,8 @@ def get_filtered_data(table_name, filters, sort_field=None, sort_order='asc', on
             params = valid_goods_ids.copy()
             
             # 上架时间筛选模式：只筛选上架日期在范围内的goods_id，然后获取这些goods_id从其上架日期到最新时间的所有数据
+            # （上架日期即该商品的最早日期，商品的全部记录都满足，不需要再按日期过滤）
             where_conditions.append(f"t.goods_id IN ({placeholders})")
-            where_conditions.append(f"t.date_label >= (SELECT MIN(date_label) FROM `Vida_Traffic`.`{table_name}` t2 WHERE t2.goods_id = t.goods_id)")
             
             # 应用其他筛选条件（曝光量、点击量、CTR等）
             if filters.get('impressions_min'):
@@ -379,24 +873,18 @@ def get_filtered_data(table_name, filters, sort_field=None, sort_order='asc', on
         
         query = query + f" {order_clause} LIMIT 10000;"
         
-        cursor.execute(query, params)
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
+        df = fetch_dataframe_streaming(conn, query, params)
         
         return df
     finally:
-        cursor.close()
         conn.close()
 
 
 def check_date_exists(table_name, goods_id, date_label):
     """检查指定goods_id和date_label是否存在"""
     traffic_config, _, _, _ = get_db_config()
-    conn = get_db_connection(traffic_config)
     
-    try:
-        cursor = conn.cursor()
+    with db_cursor(traffic_config) as cursor:
         query = f"""
         SELECT COUNT(*) 
         FROM `{table_name}` 
@@ -405,78 +893,73 @@ def check_date_exists(table_name, goods_id, date_label):
         cursor.execute(query, (goods_id, date_label))
         result = cursor.fetchone()
         return result[0] > 0 if result else False
-    finally:
-        cursor.close()
-        conn.close()
+
+
+def _refresh_goods_snapshot_after_write(cursor, table_name, goods_id, date_label, column):
+    """单条写入后刷新该商品的快照（snapshot_utils 依赖本模块，故在函数内导入）"""
+    from snapshot_utils import refresh_snapshot_after_write
+    refresh_snapshot_after_write(cursor, table_name, [goods_id], dates=[date_label], columns=[column])
 
 
 def update_reason(table_name, goods_id, date_label, reason):
     """更新Reason字段"""
     traffic_config, _, _, _ = get_db_config()
-    conn = get_db_connection(traffic_config)
     
-    try:
-        cursor = conn.cursor()
+    with db_cursor(traffic_config) as cursor:
         query = f"""
         UPDATE `{table_name}` 
         SET Reason = %s 
         WHERE goods_id = %s AND date_label = %s
         """
         cursor.execute(query, (reason, goods_id, date_label))
-        conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        cursor.close()
-        conn.close()
+        updated = cursor.rowcount > 0
+        cursor.connection.commit()
+        if updated:
+            _refresh_goods_snapshot_after_write(cursor, table_name, goods_id, date_label, 'Reason')
+        return updated
 
 
 def update_video(table_name, goods_id, date_label):
     """更新Video字段为1"""
     traffic_config, _, _, _ = get_db_config()
-    conn = get_db_connection(traffic_config)
     
-    try:
-        cursor = conn.cursor()
+    with db_cursor(traffic_config) as cursor:
         query = f"""
         UPDATE `{table_name}` 
         SET Video = 1 
         WHERE goods_id = %s AND date_label = %s
         """
         cursor.execute(query, (goods_id, date_label))
-        conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        cursor.close()
-        conn.close()
+        updated = cursor.rowcount > 0
+        cursor.connection.commit()
+        if updated:
+            _refresh_goods_snapshot_after_write(cursor, table_name, goods_id, date_label, 'Video')
+        return updated
 
 
 def update_price(table_name, goods_id, date_label):
     """更新Price字段为1"""
     traffic_config, _, _, _ = get_db_config()
-    conn = get_db_connection(traffic_config)
     
-    try:
-        cursor = conn.cursor()
+    with db_cursor(traffic_config) as cursor:
         query = f"""
         UPDATE `{table_name}` 
         SET Price = 1 
         WHERE goods_id = %s AND date_label = %s
         """
         cursor.execute(query, (goods_id, date_label))
-        conn.commit()
-        return cursor.rowcount > 0
-    finally:
-        cursor.close()
-        conn.close()
+        updated = cursor.rowcount > 0
+        cursor.connection.commit()
+        if updated:
+            _refresh_goods_snapshot_after_write(cursor, table_name, goods_id, date_label, 'Price')
+        return updated
 
 
 def get_latest_date_label(table_name, goods_id):
     """获取指定goods_id最近的date_label"""
     traffic_config, _, _, _ = get_db_config()
-    conn = get_db_connection(traffic_config)
     
-    try:
-        cursor = conn.cursor()
+    with db_cursor(traffic_config) as cursor:
         query = f"""
         SELECT date_label 
         FROM `{table_name}` 
@@ -487,7 +970,3 @@ def get_latest_date_label(table_name, goods_id):
         cursor.execute(query, (goods_id,))
         result = cursor.fetchone()
         return result[0] if result else None
-    finally:
-        cursor.close()
-        conn.close()
-
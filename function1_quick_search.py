@@ -4,13 +4,18 @@
 """
 
 from db_utils import get_goods_data
-from plot_utils import plot_goods_trend_double_axis, plot_impressions_clicks_scatter
+from plot_utils import (
+    plot_goods_trend_double_axis, plot_impressions_clicks_scatter,
+    build_goods_trend_series, normalize_chart_mode, CHART_MODE_SERIES
+)
 from config import get_current_table
 
 
-def quick_search(goods_id):
+def quick_search(goods_id, chart_mode='image'):
     """
     快速查找功能
+    chart_mode: 'image' 返回服务器渲染的趋势图PNG；'series' 返回趋势图序列数据（trend_series），由浏览器绘制
+        散点图只有一张，两种模式都返回PNG
     返回: {
         'success': bool,
         'data': dict or None,
@@ -31,8 +36,13 @@ def quick_search(goods_id):
                 'error': f'未找到goods_id {goods_id} 的数据'
             }
         
-        # 绘制双轴图
-        img1 = plot_goods_trend_double_axis(goods_id, df)
+        # 绘制双轴图（浏览器端绘图模式只返回序列数据）
+        img1 = None
+        trend_series = None
+        if normalize_chart_mode(chart_mode) == CHART_MODE_SERIES:
+            trend_series = build_goods_trend_series(goods_id, df)
+        else:
+            img1 = plot_goods_trend_double_axis(goods_id, df)
         
         # 绘制散点图
         img2, correlation = plot_impressions_clicks_scatter(goods_id, df)
@@ -53,6 +63,7 @@ def quick_search(goods_id):
             'data': {
                 'goods_id': goods_id,
                 'trend_image': img1,
+                'trend_series': trend_series,
                 'scatter_image': img2,
                 'summary': summary
             },
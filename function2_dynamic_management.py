@@ -6,13 +6,23 @@
     部分上升期和非上升期数据变动不对应
 """
 
-from db_utils import get_dynamic_goods_data, get_yesterday_date
-from plot_utils import plot_goods_batch
+from db_utils import (
+    get_dynamic_goods_data, get_yesterday_date, get_db_connection, db_cursor,
+    bulk_update_column, bulk_write_columns, format_date_label, get_history_from_cache,
+    fetch_dataframe_streaming, clean_history_frame, HISTORY_COLUMN_DTYPES
+)
+from plot_utils import plot_goods_charts
+from snapshot_utils import refresh_snapshot_after_write, get_cache_watermark, compare_cache_watermark
+from cache_store import load_cache_file, save_cache_file
 from config import get_current_table
 import pandas as pd
 import numpy as np
 import os
 import json
+import hmac
+import base64
+import hashlib
+import secrets
 from datetime import datetime, timedelta
 
 
@@ -106,6 +116,91 @@ def analyze_trend(impressions_series):
     return 'rising'
 
 
+# 7点线性拟合斜率的分子权重：sum((x - x_mean) * y)，x = 0..6
+TREND_SLOPE_WEIGHTS = np.arange(7, dtype=float) - 3.0
+
+
+def _trend_status_kernel(values, group_pos, running_max):
+    """
+    趋势判断的向量化内核，逻辑与 analyze_trend 逐条对应
+    values: 已按商品、日期排好序的曝光数组（不含NaN），同一商品的行连续
+    group_pos: 每行在所属商品内的序号（从0开始）
+    running_max: 每行在所属商品内的前缀最大值
+    返回: numpy数组，1=上升期, 2=过了上升期
+    """
+    n = len(values)
+    status = np.ones(n, dtype=np.int8)
+    if n == 0:
+        return status
+    
+    # argmax 取第一个最大值，所以"最大值在最后一天"等价于当天严格大于之前所有值
+    is_new_max = group_pos == 0
+    is_new_max[1:] |= values[1:] > running_max[:-1]
+    
+    positive_max = running_max > 0
+    decline_ratio = np.zeros(n)
+    decline_ratio[positive_max] = (running_max[positive_max] - values[positive_max]) / running_max[positive_max]
+    
+    declined = positive_max & (decline_ratio > 0.3)
+    
+    if n >= 7:
+        # 最近7天斜率的闭式解：slope = sum((x - 3) * y) / 28，只需要分子的符号
+        numerator = np.zeros(n)
+        numerator[6:] = np.correlate(values, TREND_SLOPE_WEIGHTS, mode='valid')
+        scale = np.zeros(n)
+        scale[6:] = np.correlate(np.abs(values), np.ones(7), mode='valid')
+        
+        candidate = (group_pos >= 6) & positive_max & (decline_ratio > 0.2) & ~declined & ~is_new_max
+        slope_negative = numerator < 0
+        # 分子接近0时浮点舍入可能让 np.polyfit 得到相反符号，这些窗口回退到 polyfit 保证结果一致
+        ambiguous = candidate & (np.abs(numerator) <= scale * 1e-9)
+        for i in np.flatnonzero(ambiguous):
+            slope_negative[i] = np.polyfit(np.arange(7), values[i - 6:i + 1], 1)[0] < 0
+        declined |= candidate & slope_negative
+    
+    declined &= ~is_new_max & (group_pos >= 2)
+    status[declined] = 2
+    return status
+
+
+def analyze_trend_prefixes(impressions_series):
+    """
+    一次性计算曝光序列每个前缀的趋势，等价于对 values[:i+1] 逐个调用 analyze_trend
+    返回: numpy数组，1=上升期, 2=过了上升期
+    """
+    values = np.asarray(impressions_series, dtype=float)
+    n = len(values)
+    return _trend_status_kernel(values, np.arange(n), np.maximum.accumulate(values) if n else values)
+
+
+def analyze_trend_grouped(df_history, value_column='Product impressions', group_column='goods_id'):
+    """
+    在多个商品的长表上一次性计算每一行对应前缀的趋势（同一商品内按行顺序，即日期升序）
+    df_history: 包含 group_column、value_column 列，同一商品内已按 date_label 排序
+    返回: 与 df_history 索引对齐的 Series（1=上升期, 2=过了上升期）
+    """
+    if len(df_history) == 0:
+        return pd.Series([], index=df_history.index, dtype=np.int8)
+    
+    codes, _ = pd.factorize(df_history[group_column])
+    # 稳定排序让同一商品的行连续且保持原有顺序
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    values = df_history[value_column].to_numpy(dtype=float)[order]
+    
+    group_start = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]
+    start_index = np.maximum.accumulate(np.where(group_start, np.arange(len(values)), 0))
+    group_pos = np.arange(len(values)) - start_index
+    running_max = pd.Series(values).groupby(sorted_codes).cummax().to_numpy()
+    # cummax 会跳过NaN，而 analyze_trend 中前缀一旦含NaN最大值就是NaN（结果恒为上升期），这里保持一致
+    nan_seen = pd.Series(np.isnan(values)).groupby(sorted_codes).cummax().to_numpy()
+    running_max = np.where(nan_seen, np.nan, running_max)
+    
+    status = np.empty(len(values), dtype=np.int8)
+    status[order] = _trend_status_kernel(values, group_pos, running_max)
+    return pd.Series(status, index=df_history.index)
+
+
 def check_recent_rising_trend(impressions_series, days=7, threshold=0.2):
     """检查近期上升趋势是否明显"""
     if len(impressions_series) < days:
@@ -129,42 +224,36 @@ def check_recent_rising_trend(impressions_series, days=7, threshold=0.2):
     return False
 
 
-def check_all_goods_have_data_on_date(cursor, table_name, sales_table_name, check_date):
+def get_status_coverage_by_date(cursor, table_name, sales_table_name, start_date, end_date):
     """
-    检查指定日期是否所有动销商品都有数据
-    返回: (all_have_data, goods_with_data_count, total_goods_count)
+    一次查询统计日期范围内每天动销商品的Status覆盖情况
+    返回: {date_str: (goods_with_status_count, total_goods_count)}，没有数据的日期不在字典中
     """
-    # 获取目标日期有动销的所有goods_id
-    query_total = f"""
-    SELECT COUNT(DISTINCT t.goods_id) as count
+    query = f"""
+    SELECT 
+      t.date_label,
+      COUNT(DISTINCT CASE WHEN t.Status IS NOT NULL THEN t.goods_id END) AS with_status_count,
+      COUNT(DISTINCT t.goods_id) AS total_count
     FROM `Vida_Traffic`.`{table_name}` t
-    WHERE t.date_label = %s
+    WHERE t.date_label >= %s AND t.date_label <= %s
       AND EXISTS (
           SELECT 1
           FROM `Vida_Sales`.`{sales_table_name}` s
-          WHERE s.goods_id = t.goods_id AND s.date_label = %s
+          WHERE s.goods_id = t.goods_id AND s.date_label = t.date_label
       )
+    GROUP BY t.date_label
     """
-    cursor.execute(query_total, (check_date, check_date))
-    result = cursor.fetchone()
-    total_count = result[0] if result else 0
-    
-    # 获取检查日期有Status数据的goods_id数量
-    query_with_status = f"""
-    SELECT COUNT(DISTINCT t.goods_id) as count
-    FROM `Vida_Traffic`.`{table_name}` t
-    WHERE t.date_label = %s
-      AND t.Status IS NOT NULL
-      AND EXISTS (
-          SELECT 1
-          FROM `Vida_Sales`.`{sales_table_name}` s
-          WHERE s.goods_id = t.goods_id AND s.date_label = %s
-      )
+    cursor.execute(query, (start_date, end_date))
+    return {format_date_label(row[0]): (row[1], row[2]) for row in cursor.fetchall()}
+
+
+def check_all_goods_have_data_on_date(cursor, table_name, sales_table_name, check_date):
     """
-    cursor.execute(query_with_status, (check_date, check_date))
-    result = cursor.fetchone()
-    with_status_count = result[0] if result else 0
-    
+    检查指定日期是否所有动销商品都有数据
+    返回: (all_have_data, goods_with_data_count, total_goods_count)
+    """
+    coverage = get_status_coverage_by_date(cursor, table_name, sales_table_name, check_date, check_date)
+    with_status_count, total_count = coverage.get(check_date, (0, 0))
     return with_status_count == total_count and total_count > 0, with_status_count, total_count
 
 
@@ -175,11 +264,18 @@ def find_latest_date_with_data(cursor, table_name, sales_table_name, start_date,
     """
     start_dt = datetime.strptime(start_date, '%Y-%m-%d')
     
+    # 整个回看范围的覆盖情况只查询一次
+    coverage = get_status_coverage_by_date(
+        cursor, table_name, sales_table_name,
+        (start_dt - timedelta(days=max_days_back)).strftime('%Y-%m-%d'),
+        (start_dt - timedelta(days=1)).strftime('%Y-%m-%d')
+    )
+    
     for days_back in range(1, max_days_back + 1):
         check_date = (start_dt - timedelta(days=days_back)).strftime('%Y-%m-%d')
-        all_have_data, _, _ = check_all_goods_have_data_on_date(cursor, table_name, sales_table_name, check_date)
+        with_status_count, total_count = coverage.get(check_date, (0, 0))
         
-        if all_have_data:
+        if with_status_count == total_count and total_count > 0:
             return check_date, days_back
     
     return None, None
@@ -287,7 +383,7 @@ def import_missing_data_for_date_range(cursor, table_name, sales_table_name, fro
     """
     from datetime import datetime, timedelta
     
-    imported_count = 0
+    status_rows = []
     missing_dates = []
     
     # 将日期字符串转换为datetime对象
@@ -365,58 +461,29 @@ def import_missing_data_for_date_range(cursor, table_name, sales_table_name, fro
         df_history = pd.DataFrame(history_data, columns=['goods_id', 'date_label', 'Product impressions'])
         df_history['Product impressions'] = pd.to_numeric(df_history['Product impressions'], errors='coerce').fillna(0)
         
-        # 对每个商品分析趋势并更新Status
-        updates = []
-        for goods_id in goods_ids:
-            goods_data = df_history[df_history['goods_id'] == goods_id].sort_values('date_label')
-            
-            if len(goods_data) == 0:
-                continue
-            
-            impressions = goods_data['Product impressions'].values
-            
-            # 分析趋势
-            trend = analyze_trend(impressions)
-            status = 1 if trend == 'rising' else 2
-            
-            updates.append({
-                'goods_id': goods_id,
-                'status': status
-            })
-        
-        # 更新Status
-        for update in updates:
-            goods_id = update['goods_id']
-            new_status = update['status']
-            
-            # 检查该商品在该日期是否有记录
-            check_query = f"""
-            SELECT COUNT(*) 
-            FROM `{table_name}`
-            WHERE goods_id = %s AND date_label = %s
-            """
-            cursor.execute(check_query, (goods_id, date_str))
-            exists = cursor.fetchone()[0] > 0
-            
-            if exists:
-                update_sql = f"""
-                UPDATE `{table_name}`
-                SET `Status` = %s
-                WHERE `goods_id` = %s AND `date_label` = %s
-                """
-                cursor.execute(update_sql, (new_status, goods_id, date_str))
-                if cursor.rowcount > 0:
-                    imported_count += 1
+        # 每个商品截至当天的趋势（最后一行即完整历史），各日期的Status收集后统一批量写入
+        df_history['new_status'] = analyze_trend_grouped(df_history)
+        latest = df_history.drop_duplicates('goods_id', keep='last')
+        status_rows.extend(
+            (goods_id, date_str, 'Status', int(status))
+            for goods_id, status in zip(latest['goods_id'].tolist(), latest['new_status'])
+        )
         
         current_date += timedelta(days=1)
     
-    # 提交事务
+    # 一条 UPDATE ... JOIN 写入所有日期的Status，并提交事务
     try:
+        matched, imported_count = bulk_write_columns(cursor, table_name, status_rows)
+        imported_goods_ids = {row[0] for row, found in zip(status_rows, matched) if found}
         cursor.connection.commit()
-    except:
+    except Exception as e:
+        print(f"批量写入Status失败: {e}")
         cursor.connection.rollback()
         return False, "导入数据时发生错误", 0, missing_dates
     
+    if imported_goods_ids:
+        refresh_snapshot_after_write(cursor, table_name, imported_goods_ids, refresh_daily=True, since_date=from_date, columns=['Status'])
+    
     if len(missing_dates) > 0:
         return True, f"成功导入 {imported_count} 条status数据，但以下日期数据库缺失数据: {', '.join(missing_dates)}", imported_count, missing_dates
     else:
@@ -459,21 +526,181 @@ def get_recent_history_status(cursor, table_name, goods_id, target_date):
     return False, None
 
 
+def get_status_map_on_date(cursor, table_name, date_label, goods_ids=None):
+    """
+    获取指定日期有Status数据的商品及其Status
+    goods_ids: 只查询这些商品，None表示全部
+    返回: {goods_id: status}
+    """
+    params = [date_label]
+    goods_condition = ""
+    if goods_ids is not None:
+        if len(goods_ids) == 0:
+            return {}
+        goods_condition = f"AND `goods_id` IN ({','.join(['%s'] * len(goods_ids))})"
+        params += list(goods_ids)
+    
+    query = f"""
+    SELECT `goods_id`, `Status`
+    FROM `{table_name}`
+    WHERE `date_label` = %s AND `Status` IS NOT NULL {goods_condition}
+    """
+    cursor.execute(query, params)
+    status_map = {}
+    for goods_id, status in cursor.fetchall():
+        status_map.setdefault(goods_id, status)
+    return status_map
+
+
+def get_last_known_status_map(cursor, table_name, goods_ids, target_date):
+    """
+    获取每个商品在目标日期之前最近一次的Status（批量版 get_recent_history_status）
+    返回: {goods_id: status}，目标日期之前没有Status的商品不在字典中
+    """
+    if len(goods_ids) == 0:
+        return {}
+    
+    placeholders = ','.join(['%s'] * len(goods_ids))
+    query = f"""
+    SELECT t.`goods_id`, t.`Status`
+    FROM `{table_name}` t
+    JOIN (
+        SELECT `goods_id`, MAX(`date_label`) AS last_date
+        FROM `{table_name}`
+        WHERE `goods_id` IN ({placeholders}) AND `Status` IS NOT NULL AND `date_label` < %s
+        GROUP BY `goods_id`
+    ) m ON m.goods_id = t.goods_id AND m.last_date = t.date_label
+    WHERE t.`Status` IS NOT NULL
+    """
+    cursor.execute(query, list(goods_ids) + [target_date])
+    status_map = {}
+    for goods_id, status in cursor.fetchall():
+        status_map.setdefault(goods_id, status)
+    return status_map
+
+
+def get_first_seen_date_map(cursor, table_name, goods_ids):
+    """
+    获取每个商品在流量表中第一次出现的日期
+    返回: {goods_id: 'YYYY-MM-DD'}
+    """
+    if len(goods_ids) == 0:
+        return {}
+    
+    placeholders = ','.join(['%s'] * len(goods_ids))
+    query = f"""
+    SELECT `goods_id`, MIN(`date_label`)
+    FROM `{table_name}`
+    WHERE `goods_id` IN ({placeholders})
+    GROUP BY `goods_id`
+    """
+    cursor.execute(query, list(goods_ids))
+    return {goods_id: format_date_label(first_date) for goods_id, first_date in cursor.fetchall()}
+
+
+def get_previous_day_status_batch(cursor, table_name, sales_table_name, goods_ids, target_date):
+    """
+    批量版 get_previous_day_status：判断逻辑相同，但前一天Status、历史Status、
+    前一天数据覆盖情况都只查询一次，缺失数据的导入也最多执行一次
+    返回: {goods_id: (has_status, status, special_note)}
+    """
+    target_dt = datetime.strptime(target_date, '%Y-%m-%d')
+    previous_day = (target_dt - timedelta(days=1)).strftime('%Y-%m-%d')
+    
+    previous_status_map = get_status_map_on_date(cursor, table_name, previous_day, goods_ids)
+    missing_goods = [goods_id for goods_id in goods_ids if goods_id not in previous_status_map]
+    
+    results = {goods_id: (True, status, None) for goods_id, status in previous_status_map.items()}
+    if len(missing_goods) == 0:
+        return results
+    
+    # 前一天的数据覆盖情况对所有商品相同，只计算一次
+    last_status_map = get_last_known_status_map(cursor, table_name, missing_goods, target_date)
+    all_have_data, goods_with_data, total_goods = check_all_goods_have_data_on_date(
+        cursor, table_name, sales_table_name, previous_day
+    )
+    others_have_data = all_have_data or (goods_with_data > 0 and goods_with_data >= total_goods - 1)
+    
+    pending_goods = []
+    for goods_id in missing_goods:
+        if goods_id in last_status_map and others_have_data:
+            # 该goods_id之前有status，其他goods_id都有数据（或只有这一个没有），可能是缺货/下架
+            results[goods_id] = (True, 2, 'out_of_stock')
+        elif not all_have_data and goods_with_data == 0:
+            # 所有goods_id前一天都没有数据
+            pending_goods.append(goods_id)
+        else:
+            results[goods_id] = (False, None, None)
+    
+    if len(pending_goods) == 0:
+        return results
+    
+    for goods_id in pending_goods:
+        results[goods_id] = (False, None, None)
+    
+    # 往前找有数据的日期，并尝试把缺失的status数据导入到昨天
+    found_date, days_back = find_latest_date_with_data(
+        cursor, table_name, sales_table_name, previous_day, max_days_back=30
+    )
+    if not found_date:
+        return results
+    
+    yesterday = get_yesterday_date()
+    import_success, import_message, imported_count, missing_dates = import_missing_data_for_date_range(
+        cursor, table_name, sales_table_name, found_date, yesterday
+    )
+    
+    if import_success:
+        # 导入后重新查询前一天的状态和覆盖情况
+        previous_status_map = get_status_map_on_date(cursor, table_name, previous_day, pending_goods)
+        last_status_map = get_last_known_status_map(cursor, table_name, pending_goods, target_date)
+        all_have_data, goods_with_data, total_goods = check_all_goods_have_data_on_date(
+            cursor, table_name, sales_table_name, previous_day
+        )
+        others_have_data = all_have_data or (goods_with_data > 0 and goods_with_data >= total_goods - 1)
+        
+        if len(previous_status_map) > 0:
+            print(f"{previous_day}日期没有导入数据，已从数据库导入")
+        for goods_id in pending_goods:
+            if goods_id in previous_status_map:
+                results[goods_id] = (True, previous_status_map[goods_id], 'data_imported')
+            elif goods_id in last_status_map and others_have_data:
+                results[goods_id] = (True, 2, 'out_of_stock')
+            elif previous_day in missing_dates:
+                # 前一天的数据缺失，无法计算status
+                results[goods_id] = (False, None, 'data_missing')
+        if previous_day in missing_dates:
+            print(f"数据库没有{previous_day}日期的信息，无法计算status，请手动导入数据到数据库")
+    else:
+        # 导入失败，检查found_date之后是否有任何goods_id的数据
+        check_query = f"""
+        SELECT COUNT(DISTINCT goods_id)
+        FROM `{table_name}`
+        WHERE date_label > %s AND date_label <= %s
+        """
+        cursor.execute(check_query, (found_date, previous_day))
+        result = cursor.fetchone()
+        if result and result[0] == 0:
+            # 数据库确实缺少这个日期范围的数据
+            print(f"数据库没有{previous_day}日期的信息，请手动导入数据到数据库")
+            for goods_id in pending_goods:
+                results[goods_id] = (False, None, 'data_missing')
+    
+    return results
+
+
 def get_status_statistics(table_name, sales_table_name, target_date):
     """
     获取状态统计信息（包含变更统计）
     返回统计字典
     """
     from config import get_db_config
-    import pymysql
     
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
+    traffic_config, _, _, _ = get_db_config()
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
         
         # 获取所有动销品goods_id（包括下架缺货的）
         all_sales_goods = get_active_sales_goods_ids(table_name, sales_table_name)
@@ -580,20 +807,8 @@ def get_status_statistics(table_name, sales_table_name, target_date):
         cursor.execute(query_all, (target_date,))
         current_goods = cursor.fetchall()
         
-        # 获取所有在选定日期有Status=1的商品ID（用于验证）
-        query_rising_goods = f"""
-        SELECT DISTINCT t.goods_id
-        FROM `Vida_Traffic`.`{table_name}` t
-        WHERE t.date_label = %s
-          AND t.Status = 1
-          AND EXISTS (
-              SELECT 1
-              FROM `Vida_Sales`.`{sales_table_name}` s
-              WHERE s.goods_id = t.goods_id
-          )
-        """
-        cursor.execute(query_rising_goods, (target_date,))
-        all_rising_goods_ids = set([row[0] for row in cursor.fetchall()])
+        # 所有在选定日期有Status=1的商品ID（用于验证，与实际上升期查询条件相同）
+        all_rising_goods_ids = set(actual_rising_goods)
         
         # 获取current_goods中的Status=1的商品ID
         current_rising_goods_ids = set([row[0] for row in current_goods if row[3] == 1])
@@ -601,31 +816,6 @@ def get_status_statistics(table_name, sales_table_name, target_date):
         # 检查是否有遗漏的Status=1商品（这些商品在变更统计中可能被遗漏）
         missing_rising_goods = all_rising_goods_ids - current_rising_goods_ids
         
-        # 获取历史数据用于分析趋势
-        if len(current_goods) > 0:
-            goods_ids = [row[0] for row in current_goods]
-            placeholders = ','.join(['%s'] * len(goods_ids))
-            query_history = f"""
-            SELECT 
-              t.goods_id,
-              t.date_label,
-              t.`Product impressions`,
-              t.`Status`
-            FROM `Vida_Traffic`.`{table_name}` t
-            WHERE t.goods_id IN ({placeholders})
-            ORDER BY t.goods_id, t.date_label
-            """
-            cursor.execute(query_history, goods_ids)
-            history_data = cursor.fetchall()
-        else:
-            history_data = []
-        
-        # 构建DataFrame
-        df_history = pd.DataFrame(history_data, columns=['goods_id', 'date_label', 'Product impressions', 'Status'])
-        if len(df_history) > 0:
-            df_history['date_label'] = pd.to_datetime(df_history['date_label'])
-            df_history['Product impressions'] = pd.to_numeric(df_history['Product impressions'], errors='coerce').fillna(0)
-        
         # 统计变更类型
         new_rising = 0
         new_declined = 0
@@ -643,55 +833,53 @@ def get_status_statistics(table_name, sales_table_name, target_date):
         # 记录特殊说明
         special_notes = []  # 存储特殊说明信息
         
-        for goods_id, date_label, impressions, status in current_goods:
+        # 需要分类的商品：选定日期有Status的商品 + 遗漏的Status=1商品（按 (goods_id, status, 是否记录特殊说明)）
+        # 遗漏的Status=1商品在选定日期有Status=1，但可能前一天没有Status数据，需要统计到变更类型中以确保数量一致
+        goods_to_classify = [(row[0], row[3], True) for row in current_goods]
+        goods_to_classify += [(goods_id, 1, False) for goods_id in missing_rising_goods]
+        unique_goods_ids = list(dict.fromkeys(goods_id for goods_id, _, _ in goods_to_classify))
+        
+        # 集合查询：前一天状态（含特殊处理）、历史最近Status、首次出现日期
+        previous_day_status_map = get_previous_day_status_batch(
+            cursor, table_name, sales_table_name, unique_goods_ids, target_date
+        )
+        recent_status_map = get_last_known_status_map(cursor, table_name, unique_goods_ids, target_date)
+        first_seen_map = get_first_seen_date_map(cursor, table_name, unique_goods_ids)
+        
+        for goods_id, status, record_notes in goods_to_classify:
             # 获取前一天的状态（包含特殊处理）
-            has_previous_day, previous_status, special_note = get_previous_day_status(
-                cursor, table_name, sales_table_name, goods_id, target_date
-            )
+            has_previous_day, previous_status, special_note = previous_day_status_map.get(goods_id, (False, None, None))
             
             # 处理特殊说明
-            if special_note == 'out_of_stock':
-                previous_day = (datetime.strptime(target_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+            if record_notes and special_note == 'out_of_stock':
                 special_notes.append(f"goods id {goods_id}查询日期的前一日({previous_day})单独没有status数据，可能缺货下架了")
                 # 将前一天状态设为2（缺货/下架）
                 previous_status = 2
                 has_previous_day = True
-            elif special_note == 'data_missing':
-                previous_day = (datetime.strptime(target_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+            elif record_notes and special_note == 'data_missing':
                 special_notes.append(f"数据库没有{previous_day}日期的信息，请手动导入数据到数据库")
             
             # 检查goods_id在选定日期前是否有任何数据（用于判断是否为新增）
-            has_any_data_before = check_goods_has_any_data_before_date(cursor, table_name, goods_id, target_date)
-            
-            # 获取该商品的曝光数据用于判断趋势
-            goods_data = df_history[df_history['goods_id'] == goods_id].sort_values('date_label')
-            impressions_series = goods_data['Product impressions'].values if len(goods_data) > 0 else []
+            first_seen_date = first_seen_map.get(goods_id)
+            has_any_data_before = first_seen_date is not None and first_seen_date < target_date
             
             if status == 1:  # 当前状态为上升期
                 if not has_previous_day:
                     # 前一天没有数据
                     # 检查历史是否有Status数据（不仅仅是Traffic数据）
-                    has_recent_status, recent_status = get_recent_history_status(cursor, table_name, goods_id, target_date)
-                    
-                    if not has_recent_status:
+                    if goods_id not in recent_status_map:
                         # 历史没有Status数据 → 新增上升期
                         new_rising += 1
                         new_rising_goods.append(goods_id)
+                    elif recent_status_map[goods_id] == 2:
+                        # 历史有Status数据，但前一天没有（可能是缺货后恢复），最近历史为2 → 由非上升期重回上升期
+                        back_to_rising += 1
+                        back_to_rising_goods.append(goods_id)
                     else:
-                        # 历史有Status数据，但前一天没有（可能是缺货后恢复）
-                        if recent_status == 2:
-                            # 最近历史为2 → 由非上升期重回上升期
-                            back_to_rising += 1
-                            back_to_rising_goods.append(goods_id)
-                        elif recent_status == 1:
-                            # 最近历史为1，但前一天没有数据（可能是缺货后恢复，之前是上升期）
-                            # 这种情况算作"更新为上升期"（因为之前就是上升期，只是中间缺货了）
-                            updated_to_rising += 1
-                            updated_to_rising_goods.append(goods_id)
-                        else:
-                            # 其他情况，算作"更新为上升期"
-                            updated_to_rising += 1
-                            updated_to_rising_goods.append(goods_id)
+                        # 最近历史为1，但前一天没有数据（可能是缺货后恢复，之前是上升期）
+                        # 这种情况算作"更新为上升期"（因为之前就是上升期，只是中间缺货了）
+                        updated_to_rising += 1
+                        updated_to_rising_goods.append(goods_id)
                 elif previous_status == 1:
                     # 前一天是1，选定日期也是1 → 不记录（保持上升期）
                     pass
@@ -719,72 +907,6 @@ def get_status_statistics(table_name, sales_table_name, target_date):
                     declined_from_rising += 1
                     declined_from_rising_goods.append(goods_id)
         
-        # 处理遗漏的Status=1商品（这些商品在选定日期有Status=1，但可能前一天没有Status数据）
-        # 这些商品应该被统计到变更类型中，以确保统计数量一致
-        if len(missing_rising_goods) > 0:
-            for goods_id in missing_rising_goods:
-                # 获取前一天的状态
-                has_previous_day, previous_status, special_note = get_previous_day_status(
-                    cursor, table_name, sales_table_name, goods_id, target_date
-                )
-                
-                # 检查goods_id在选定日期前是否有任何数据
-                has_any_data_before = check_goods_has_any_data_before_date(cursor, table_name, goods_id, target_date)
-                
-                # 获取该商品的历史数据用于判断趋势
-                query_goods_history = f"""
-                SELECT 
-                  t.goods_id,
-                  t.date_label,
-                  t.`Product impressions`,
-                  t.`Status`
-                FROM `Vida_Traffic`.`{table_name}` t
-                WHERE t.goods_id = %s
-                ORDER BY t.date_label
-                """
-                cursor.execute(query_goods_history, (goods_id,))
-                goods_history = cursor.fetchall()
-                
-                if len(goods_history) > 0:
-                    df_goods = pd.DataFrame(goods_history, columns=['goods_id', 'date_label', 'Product impressions', 'Status'])
-                    df_goods['date_label'] = pd.to_datetime(df_goods['date_label'])
-                    df_goods['Product impressions'] = pd.to_numeric(df_goods['Product impressions'], errors='coerce').fillna(0)
-                    impressions_series = df_goods['Product impressions'].values
-                else:
-                    impressions_series = []
-                
-                # 判断变更类型
-                if not has_previous_day:
-                    # 前一天没有数据
-                    # 检查历史是否有Status数据（不仅仅是Traffic数据）
-                    has_recent_status, recent_status = get_recent_history_status(cursor, table_name, goods_id, target_date)
-                    
-                    if not has_recent_status:
-                        # 历史没有Status数据 → 新增上升期
-                        new_rising += 1
-                        new_rising_goods.append(goods_id)
-                    else:
-                        # 历史有Status数据，但前一天没有（可能是缺货后恢复）
-                        if recent_status == 2:
-                            # 最近历史为2 → 由非上升期重回上升期
-                            back_to_rising += 1
-                            back_to_rising_goods.append(goods_id)
-                        elif recent_status == 1:
-                            # 最近历史为1，但前一天没有数据 → 更新为上升期
-                            updated_to_rising += 1
-                            updated_to_rising_goods.append(goods_id)
-                        else:
-                            # 其他情况，算作"更新为上升期"
-                            updated_to_rising += 1
-                            updated_to_rising_goods.append(goods_id)
-                elif previous_status == 1:
-                    # 前一天是1，选定日期也是1 → 不记录（保持上升期）
-                    pass
-                elif previous_status == 2:
-                    # 前一天是2，选定日期是1 → 由非上升期重回上升期（简化判断，不检查上升趋势）
-                    back_to_rising += 1
-                    back_to_rising_goods.append(goods_id)
-        
         # 计算计算上升期
         # 计算上升期 = 前一天上升期数量 + 新增上升期 + 更新为上升期 + 由非上升期重回上升期 - 由上升期到非上升期
         calculated_rising_count = previous_rising_count + new_rising + updated_to_rising + back_to_rising - declined_from_rising
@@ -830,9 +952,7 @@ def get_status_statistics(table_name, sales_table_name, target_date):
         }
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
 
 
 def parse_reason_category(reason):
@@ -885,76 +1005,106 @@ def count_reason_categories(goods_info_list):
     return counts
 
 
-def get_goods_info_with_status(df, table_name, sales_table_name):
+def _parse_join_date(first_sales_date):
+    """把首次动销日期（datetime/date/字符串）转换为datetime，无法解析时返回None"""
+    if first_sales_date is None or (not isinstance(first_sales_date, str) and pd.isna(first_sales_date)):
+        return None
+    # 处理不同的日期类型
+    if isinstance(first_sales_date, datetime):
+        return first_sales_date
+    if hasattr(first_sales_date, 'strftime'):
+        # 如果是date对象，转换为datetime
+        return datetime.combine(first_sales_date, datetime.min.time())
+    if isinstance(first_sales_date, str):
+        try:
+            return datetime.strptime(first_sales_date, '%Y-%m-%d')
+        except ValueError:
+            return None
+    return None
+
+
+def get_first_sales_date_map(table_name, sales_table_name, goods_ids):
     """
-    获取商品信息，包括加入时间和Reason
-    返回: list of dict
-    加入时间：第一个动销的时间（Vida_Sales表中Buyers > 0的最早日期）
+    批量获取首次动销日期（Vida_Sales表中Buyers > 0的最早日期）
+    优先读取商品快照中维护的 first_sales_date；快照不可用时用一条分组查询
+    返回: {str(goods_id): 首次动销日期}，没有动销记录的商品不在结果中
     """
+    goods_ids = list(goods_ids)
+    if len(goods_ids) == 0:
+        return {}
+
+    try:
+        from snapshot_utils import get_goods_snapshot
+        snapshot = get_goods_snapshot(table_name, sales_table_name, goods_ids, columns=['first_sales_date'])
+        return {
+            str(goods_id): first_sales_date
+            for goods_id, first_sales_date in zip(snapshot['goods_id'], snapshot['first_sales_date'])
+            if first_sales_date is not None and not pd.isna(first_sales_date)
+        }
+    except Exception as e:
+        print(f"读取商品快照的首次动销日期失败，改为直接查询销售表: {e}")
+
     from config import get_db_config
-    import pymysql
-    
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
-    
+
+    _, sales_config, _, _ = get_db_config()
+    conn_sales = get_db_connection(sales_config)
     try:
-        cursor = conn.cursor()
         cursor_sales = conn_sales.cursor()
-        goods_info_list = []
-        
-        # 按照goods_id排序，确保与plot_goods_batch的顺序一致
-        for goods_id, group in df.groupby('goods_id', sort=True):
-            group_sorted = group.sort_values('date')
-            
-            # 获取Reason（取最新的非空Reason）
-            reason = None
-            if 'Reason' in group_sorted.columns:
-                reasons = group_sorted['Reason'].dropna()
-                reasons = reasons[reasons != '']
-                if len(reasons) > 0:
-                    reason = reasons.iloc[-1]
-            
-            # 获取该商品的第一个动销日期（Vida_Sales表中Buyers > 0的最早日期）
-            query_first_sales = f"""
-            SELECT MIN(date_label) as first_sales_date
-            FROM `Vida_Sales`.`{sales_table_name}`
-            WHERE goods_id = %s
-              AND Buyers IS NOT NULL 
-              AND Buyers > 0
-            """
-            cursor_sales.execute(query_first_sales, (goods_id,))
-            result = cursor_sales.fetchone()
-            
-            join_date = None
-            if result and result[0] is not None:
-                first_sales_date = result[0]
-                # 处理不同的日期类型
-                if isinstance(first_sales_date, datetime):
-                    join_date = first_sales_date
-                elif hasattr(first_sales_date, 'strftime'):
-                    # 如果是date对象，转换为datetime
-                    join_date = datetime.combine(first_sales_date, datetime.min.time())
-                elif isinstance(first_sales_date, str):
-                    try:
-                        join_date = datetime.strptime(first_sales_date, '%Y-%m-%d')
-                    except:
-                        join_date = None
-            
-            goods_info_list.append({
-                'goods_id': goods_id,
-                'reason': reason if reason else 'None',
-                'join_date': join_date.strftime('%Y-%m-%d') if join_date else 'N/A'
-            })
-        
-        return goods_info_list
+        placeholders = ','.join(['%s'] * len(goods_ids))
+        query_first_sales = f"""
+        SELECT goods_id, MIN(date_label) as first_sales_date
+        FROM `Vida_Sales`.`{sales_table_name}`
+        WHERE goods_id IN ({placeholders})
+          AND Buyers IS NOT NULL 
+          AND Buyers > 0
+        GROUP BY goods_id
+        """
+        cursor_sales.execute(query_first_sales, [str(goods_id) for goods_id in goods_ids])
+        return {str(row[0]): row[1] for row in cursor_sales.fetchall() if row[1] is not None}
     finally:
-        cursor.close()
         cursor_sales.close()
-        conn.close()
         conn_sales.close()
 
 
+def get_goods_info_with_status(df, table_name, sales_table_name):
+    """
+    获取商品信息，包括加入时间和Reason
+    返回: list of dict
+    加入时间：第一个动销的时间（Vida_Sales表中Buyers > 0的最早日期），所有商品一次批量获取
+    """
+    if len(df) == 0:
+        return []
+
+    # 按照goods_id排序，确保与plot_goods_batch的顺序一致
+    goods_ids = sorted(df['goods_id'].unique().tolist())
+
+    # 获取Reason（每个商品取最新的非空Reason）
+    latest_reason = {}
+    if 'Reason' in df.columns:
+        df_reason = df[['goods_id', 'date', 'Reason']]
+        df_reason = df_reason[df_reason['Reason'].notna() & (df_reason['Reason'] != '')]
+        if len(df_reason) > 0:
+            latest_reason = (
+                df_reason.sort_values(['goods_id', 'date'], kind='stable')
+                .groupby('goods_id', sort=False)['Reason'].last()
+                .to_dict()
+            )
+
+    first_sales_map = get_first_sales_date_map(table_name, sales_table_name, goods_ids)
+
+    goods_info_list = []
+    for goods_id in goods_ids:
+        reason = latest_reason.get(goods_id)
+        join_date = _parse_join_date(first_sales_map.get(str(goods_id)))
+        goods_info_list.append({
+            'goods_id': goods_id,
+            'reason': reason if reason else 'None',
+            'join_date': join_date.strftime('%Y-%m-%d') if join_date else 'N/A'
+        })
+
+    return goods_info_list
+
+
 def save_dynamic_management_history(target_date, stats, rising_info, declined_info, table_name):
     """
     保存动销品管理的历史记录到txt文件
@@ -1096,10 +1246,9 @@ def check_target_date_has_status_data(table_name, target_date):
     返回: (has_data, count)
     """
     from config import get_db_config
-    import pymysql
     
     traffic_config, _, _, _ = get_db_config()
-    conn = pymysql.connect(**traffic_config)
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
@@ -1125,19 +1274,13 @@ def get_active_sales_goods_ids(table_name, sales_table_name, filter_mode=False):
     返回: list of goods_id
     """
     from config import get_db_config
-    import pymysql
     
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
+    _, sales_config, _, _ = get_db_config()
     
-    try:
-        cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
-        
-        # 根据过滤模式决定Buyers的筛选条件
-        buyers_condition = "> 1" if filter_mode else "> 0"
-        
+    # 根据过滤模式决定Buyers的筛选条件
+    buyers_condition = "> 1" if filter_mode else "> 0"
+    
+    with db_cursor(sales_config) as cursor:
         # 获取所有有动销记录的goods_id（Buyers不为空且不为0）
         query = f"""
         SELECT DISTINCT s.goods_id
@@ -1145,15 +1288,8 @@ def get_active_sales_goods_ids(table_name, sales_table_name, filter_mode=False):
         WHERE s.Buyers IS NOT NULL 
           AND s.Buyers {buyers_condition}
         """
-        cursor_sales.execute(query)
-        goods_ids = [row[0] for row in cursor_sales.fetchall()]
-        
-        return goods_ids
-    finally:
-        cursor.close()
-        cursor_sales.close()
-        conn.close()
-        conn_sales.close()
+        cursor.execute(query)
+        return [row[0] for row in cursor.fetchall()]
 
 
 def get_declined_goods_data_with_discontinued(table_name, sales_table_name, target_date, filter_mode=None):
@@ -1163,17 +1299,14 @@ def get_declined_goods_data_with_discontinued(table_name, sales_table_name, targ
     filter_mode: 过滤模式，None=不过滤, 字典格式：{'min': 最小值, 'max': 最大值或None}
     返回: DataFrame
     """
-    from db_utils import build_filter_condition
+    from db_utils import build_filter_condition, build_cumulative_buyers_condition
     from config import get_db_config
-    import pymysql
     
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
+    traffic_config, _, _, _ = get_db_config()
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
         
         # 获取所有动销品goods_id（不使用filter_mode，因为这是获取所有动销品）
         all_sales_goods = get_active_sales_goods_ids(table_name, sales_table_name, filter_mode=False)
@@ -1206,14 +1339,10 @@ def get_declined_goods_data_with_discontinued(table_name, sales_table_name, targ
             discontinued_filter = f"EXISTS (SELECT 1 FROM `Vida_Sales`.`{sales_table_name}` s5 WHERE s5.goods_id = s.goods_id AND s5.date_label < %s AND s5.Buyers IS NOT NULL AND s5.Buyers > 0)"
             discontinued_params = [target_date]
         else:
-            min_val = filter_mode.get('min', 0)
-            max_val = filter_mode.get('max')
-            if max_val is not None:
-                discontinued_filter = f"(SELECT COALESCE(SUM(s5.Buyers), 0) FROM `Vida_Sales`.`{sales_table_name}` s5 WHERE s5.goods_id = s.goods_id AND s5.date_label < %s AND s5.Buyers IS NOT NULL) >= %s AND (SELECT COALESCE(SUM(s5.Buyers), 0) FROM `Vida_Sales`.`{sales_table_name}` s5 WHERE s5.goods_id = s.goods_id AND s5.date_label < %s AND s5.Buyers IS NOT NULL) <= %s"
-                discontinued_params = [target_date, min_val, target_date, max_val]
-            else:
-                discontinued_filter = f"(SELECT COALESCE(SUM(s5.Buyers), 0) FROM `Vida_Sales`.`{sales_table_name}` s5 WHERE s5.goods_id = s.goods_id AND s5.date_label < %s AND s5.Buyers IS NOT NULL) >= %s"
-                discontinued_params = [target_date, min_val]
+            discontinued_filter, discontinued_params = build_cumulative_buyers_condition(
+                sales_table_name, 's.goods_id', target_date,
+                filter_mode.get('min', 0), filter_mode.get('max'), inclusive=False
+            )
         
         query_discontinued = f"""
         SELECT DISTINCT s.goods_id
@@ -1255,31 +1384,124 @@ def get_declined_goods_data_with_discontinued(table_name, sales_table_name, targ
           AND t.date_label <= %s
         ORDER BY t.goods_id, t.date_label;
         """
-        cursor.execute(query, all_declined_goods + [target_date])
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
+        df = get_history_from_cache(table_name, sales_table_name, all_declined_goods, end_date=target_date)
+        if df is None:
+            df = fetch_dataframe_streaming(conn, query, all_declined_goods + [target_date])
         
         # 数据清洗
-        if 'date_label' in df.columns:
-            df["date"] = pd.to_datetime(df["date_label"], dayfirst=True, errors="coerce")
-            df = df.dropna(subset=["date"])
-        
-        if "Product impressions" in df.columns:
-            df["Product impressions"] = pd.to_numeric(df["Product impressions"], errors="coerce").fillna(0)
-        
-        if "Product clicks" in df.columns:
-            df["Product clicks"] = pd.to_numeric(df["Product clicks"], errors="coerce").fillna(0)
-        
-        if "Buyers" in df.columns:
-            df["Buyers"] = pd.to_numeric(df["Buyers"], errors="coerce").fillna(0)
+        df = clean_history_frame(df)
         
         return df
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
+
+
+def get_first_sales_date_subquery(sales_table_name):
+    """每个动销品首次动销日期（Buyers > 0 的最早 date_label）的子查询SQL"""
+    return f"""
+    SELECT s.goods_id, MIN(s.date_label) AS first_sales_date
+    FROM `Vida_Sales`.`{sales_table_name}` s
+    WHERE s.Buyers IS NOT NULL
+      AND s.Buyers > 0
+    GROUP BY s.goods_id
+    """
+
+
+def bulk_recompute_status(cursor, table_name, sales_table_name, end_date, start_date=None):
+    """
+    批量重算Status：一次性拉取所有动销品截至 end_date 的流量历史，
+    在内存中计算每个 (goods_id, date_label) 前缀的趋势，只把与库中不同的Status批量回写
+    只更新首次动销日期（含）到 end_date（含）之间的记录；指定 start_date 时只更新该日期及之后的记录
+    不提交事务，由调用方 commit
+    返回: (更新的行数, Status发生变化的日期列表)
+    """
+    first_sales_sql = get_first_sales_date_subquery(sales_table_name)
+    query_history = f"""
+    SELECT 
+      t.goods_id,
+      t.date_label,
+      t.`Product impressions`,
+      t.`Status`,
+      f.first_sales_date
+    FROM `Vida_Traffic`.`{table_name}` t
+    JOIN ({first_sales_sql}) f ON f.goods_id = t.goods_id
+    WHERE t.date_label <= %s
+    ORDER BY t.goods_id, t.date_label
+    """
+    # 流式读取（服务端游标），不把整段历史物化为Python元组；日期列构建时即为 datetime64，数值列只需补0
+    df_history = fetch_dataframe_streaming(cursor.connection, query_history, (end_date,),
+                                           dtypes={**HISTORY_COLUMN_DTYPES, 'first_sales_date': 'datetime64'})
+    
+    if len(df_history) == 0:
+        return 0, []
+    
+    df_history['Product impressions'] = df_history['Product impressions'].fillna(0)
+    
+    # 每一行的前缀趋势；同一天有多行时以当天最后一行（即截至当天的完整历史）为准
+    df_history['new_status'] = analyze_trend_grouped(df_history)
+    df_history['new_status'] = df_history.groupby(['goods_id', 'date_label'], sort=False)['new_status'].transform('last')
+    
+    mask = df_history['date_label'] >= df_history['first_sales_date']
+    if start_date is not None:
+        mask &= df_history['date_label'] >= pd.Timestamp(start_date)
+    
+    # 只回写Status发生变化的记录
+    current_status = df_history['Status']
+    mask &= current_status.isna() | (current_status != df_history['new_status'])
+    
+    changed = df_history.loc[mask, ['goods_id', 'date_label', 'new_status']].drop_duplicates(['goods_id', 'date_label'])
+    rows = [(goods_id, format_date_label(date_label), int(status))
+            for goods_id, date_label, status in changed.itertuples(index=False)]
+    changed_dates = sorted({date_label for _, date_label, _ in rows})
+    
+    return bulk_update_column(cursor, table_name, 'Status', rows), changed_dates
+
+
+def bulk_update_status_for_date(conn, table_name, sales_table_name, target_date):
+    """
+    批量计算并更新所有动销品在 target_date 当天的Status（只处理当天有流量记录的商品）：
+    一次流式查询拉取这些商品截至 target_date 的曝光历史，向量化计算趋势，
+    取每个商品最后一行（即截至当天的完整历史）的结果，用一条 UPDATE ... JOIN 批量回写
+    不提交事务，由调用方 commit
+    返回: (更新的行数, 参与计算的goods_id列表)
+    """
+    query_history = f"""
+    SELECT 
+      t.goods_id,
+      t.date_label,
+      t.`Product impressions`
+    FROM `Vida_Traffic`.`{table_name}` t
+    JOIN (
+        SELECT DISTINCT goods_id
+        FROM `Vida_Traffic`.`{table_name}`
+        WHERE date_label = %s
+    ) d ON d.goods_id = t.goods_id
+    JOIN (
+        SELECT DISTINCT goods_id
+        FROM `Vida_Sales`.`{sales_table_name}`
+        WHERE Buyers IS NOT NULL AND Buyers > 0
+    ) s ON s.goods_id = t.goods_id
+    WHERE t.date_label <= %s
+    ORDER BY t.goods_id, t.date_label
+    """
+    df_history = fetch_dataframe_streaming(conn, query_history, (target_date, target_date))
+    if len(df_history) == 0:
+        return 0, []
+    
+    df_history['Product impressions'] = df_history['Product impressions'].fillna(0)
+    df_history['new_status'] = analyze_trend_grouped(df_history)
+    
+    latest = df_history.drop_duplicates('goods_id', keep='last')
+    goods_ids = latest['goods_id'].tolist()
+    rows = [(goods_id, target_date, int(status)) for goods_id, status in zip(goods_ids, latest['new_status'])]
+    
+    cursor = conn.cursor()
+    try:
+        updated_count = bulk_update_column(cursor, table_name, 'Status', rows)
+    finally:
+        cursor.close()
+    return updated_count, goods_ids
 
 
 def refresh_status_data(table_name, sales_table_name):
@@ -1289,27 +1511,18 @@ def refresh_status_data(table_name, sales_table_name):
     返回: (success, message, updated_count, missing_dates_info)
     """
     from config import get_db_config
-    import pymysql
     from db_utils import get_yesterday_date
     
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
+    traffic_config, _, _, _ = get_db_config()
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
         
         # 检查并创建必需的列
         create_columns_if_not_exist(cursor, table_name)
         conn.commit()
         
-        # 获取所有动销品goods_id
-        goods_ids = get_active_sales_goods_ids(table_name, sales_table_name)
-        
-        if len(goods_ids) == 0:
-            return False, "没有找到动销品", 0, []
-        
         # 获取昨天日期
         yesterday = get_yesterday_date()
         yesterday_dt = datetime.strptime(yesterday, '%Y-%m-%d')
@@ -1317,134 +1530,66 @@ def refresh_status_data(table_name, sales_table_name):
         missing_dates_info = []
         updated_count = 0
         
-        # 对每个动销品，找到首次动销日期，然后从该日期到昨天，计算并更新所有日期的status
-        placeholders = ','.join(['%s'] * len(goods_ids))
+        first_sales_sql = get_first_sales_date_subquery(sales_table_name)
         
-        # 获取每个goods_id的首次动销日期
-        first_sales_query = f"""
-        SELECT 
-            s.goods_id,
-            MIN(s.date_label) as first_sales_date
-        FROM `Vida_Sales`.`{sales_table_name}` s
-        WHERE s.goods_id IN ({placeholders})
-          AND s.Buyers IS NOT NULL 
-          AND s.Buyers > 0
-        GROUP BY s.goods_id
+        # 检查是否有动销品
+        cursor.execute(f"SELECT COUNT(*) FROM ({first_sales_sql}) f")
+        if cursor.fetchone()[0] == 0:
+            return False, "没有找到动销品", 0, []
+        
+        # 清除所有动销品首次动销日期之前的status数据（先记录受影响的日期，只让这些日期的缓存失效）
+        cursor.execute(f"""
+        SELECT DISTINCT t.`date_label`
+        FROM `{table_name}` t
+        JOIN ({first_sales_sql}) f ON f.goods_id = t.goods_id
+        WHERE t.`date_label` < f.first_sales_date AND t.`Status` IS NOT NULL
+        """)
+        changed_dates = {format_date_label(row[0]) for row in cursor.fetchall()}
+        clear_status_query = f"""
+        UPDATE `{table_name}` t
+        JOIN ({first_sales_sql}) f ON f.goods_id = t.goods_id
+        SET t.`Status` = NULL
+        WHERE t.`date_label` < f.first_sales_date AND t.`Status` IS NOT NULL
         """
-        cursor_sales.execute(first_sales_query, goods_ids)
-        first_sales_data = cursor_sales.fetchall()
-        
-        if len(first_sales_data) == 0:
-            return False, "没有找到动销日期数据", 0, []
-        
-        # 构建goods_id到首次动销日期的映射
-        # 处理日期类型：可能是字符串或datetime.date对象
-        goods_first_sales = {}
-        for row in first_sales_data:
-            goods_id = row[0]
-            first_sales_date = row[1]
-            # 处理不同的日期类型
-            if first_sales_date is None:
-                continue
-            # 如果是datetime对象，转换为字符串
-            if isinstance(first_sales_date, datetime):
-                first_sales_date = first_sales_date.strftime('%Y-%m-%d')
-            # 如果是date对象，转换为字符串
-            elif hasattr(first_sales_date, 'strftime'):
-                try:
-                    first_sales_date = first_sales_date.strftime('%Y-%m-%d')
-                except:
-                    first_sales_date = str(first_sales_date)
-            # 如果不是字符串，转换为字符串
-            elif not isinstance(first_sales_date, str):
-                first_sales_date = str(first_sales_date)
-            goods_first_sales[goods_id] = first_sales_date
-        
-        # 对每个goods_id，清除首次动销日期前的status数据
-        for goods_id, first_sales_date in goods_first_sales.items():
-            # 清除首次动销日期之前的所有status数据
-            clear_status_query = f"""
-            UPDATE `{table_name}`
-            SET `Status` = NULL
-            WHERE `goods_id` = %s AND `date_label` < %s AND `Status` IS NOT NULL
-            """
-            cursor.execute(clear_status_query, (goods_id, first_sales_date))
-            cleared_count = cursor.rowcount
-            if cleared_count > 0:
-                updated_count += cleared_count  # 记录清除的数量（虽然不算更新，但算作操作）
-        
-        # 对每个goods_id，从首次动销日期到昨天，计算并更新status
-        for goods_id, first_sales_date in goods_first_sales.items():
-            # 确保first_sales_date是字符串格式
-            if not isinstance(first_sales_date, str):
-                if hasattr(first_sales_date, 'strftime'):
-                    first_sales_date = first_sales_date.strftime('%Y-%m-%d')
-                else:
-                    first_sales_date = str(first_sales_date)
-            first_sales_dt = datetime.strptime(first_sales_date, '%Y-%m-%d')
-            
-            # 从首次动销日期到昨天，遍历每一天
-            current_date = first_sales_dt
-            while current_date <= yesterday_dt:
-                date_str = current_date.strftime('%Y-%m-%d')
-                
-                # 检查该日期是否有Traffic数据（用于计算status）
-                check_traffic_query = f"""
-                SELECT COUNT(*) 
-                FROM `{table_name}`
-                WHERE goods_id = %s AND date_label = %s
-                """
-                cursor.execute(check_traffic_query, (goods_id, date_str))
-                has_traffic_data = cursor.fetchone()[0] > 0
-                
-                if not has_traffic_data:
-                    # 如果没有Traffic数据，检查是否有动销数据
-                    check_sales_query = f"""
-                    SELECT COUNT(*) 
-                    FROM `{sales_table_name}`
-                    WHERE goods_id = %s AND date_label = %s
-                      AND Buyers IS NOT NULL AND Buyers > 0
-                    """
-                    cursor_sales.execute(check_sales_query, (goods_id, date_str))
-                    has_sales_data = cursor_sales.fetchone()[0] > 0
-                    
-                    if has_sales_data:
-                        # 有动销数据但没有Traffic数据，说明数据库缺失数据
-                        if date_str not in [info.get('date', '') for info in missing_dates_info]:
-                            missing_dates_info.append({
-                                'date': date_str,
-                                'goods_id': goods_id,
-                                'message': f'goods_id {goods_id} 在 {date_str} 有动销数据但缺少Traffic数据，无法计算status'
-                            })
-                    # 没有Traffic数据，无法计算status，跳过
-                    current_date += timedelta(days=1)
-                    continue
-                
-                # 检查该日期是否已经有status数据
-                check_status_query = f"""
-                SELECT Status
-                FROM `{table_name}`
-                WHERE goods_id = %s AND date_label = %s AND Status IS NOT NULL
-                """
-                cursor.execute(check_status_query, (goods_id, date_str))
-                result = cursor.fetchone()
-                
-                # 无论是否已有status，都重新计算并更新（确保status是最新的）
-                # 计算该日期的status
-                try:
-                    success, msg, count = auto_update_status_for_goods(
-                        cursor, table_name, sales_table_name, date_str, [goods_id]
-                    )
-                    if success:
-                        updated_count += count
-                except Exception as e:
-                    # 如果单个商品更新失败，记录错误但继续处理其他商品
-                    print(f"更新goods_id {goods_id} 在 {date_str} 的status失败: {str(e)}")
-                    # 继续处理下一个日期
-                
-                current_date += timedelta(days=1)
+        cursor.execute(clear_status_query)
+        updated_count += cursor.rowcount  # 记录清除的数量（虽然不算更新，但算作操作）
+        
+        # 从首次动销日期到昨天，批量计算并更新status
+        recompute_count, recompute_dates = bulk_recompute_status(cursor, table_name, sales_table_name, yesterday)
+        updated_count += recompute_count
+        changed_dates.update(recompute_dates)
         
         conn.commit()
+        if changed_dates:
+            # 只标记实际变化的日期，历史镜像只重新拉取这些月份，不再整表重建
+            refresh_snapshot_after_write(cursor, table_name, refresh_daily=True, dates=sorted(changed_dates),
+                                         columns=['Status'])
+        
+        # 有动销数据但没有Traffic数据的日期（数据库缺失数据，无法计算status），每个日期记录一个goods_id
+        missing_traffic_query = f"""
+        SELECT s.goods_id, s.date_label
+        FROM `Vida_Sales`.`{sales_table_name}` s
+        WHERE s.Buyers IS NOT NULL AND s.Buyers > 0
+          AND s.date_label <= %s
+          AND NOT EXISTS (
+              SELECT 1
+              FROM `Vida_Traffic`.`{table_name}` t
+              WHERE t.goods_id = s.goods_id AND t.date_label = s.date_label
+          )
+        ORDER BY s.goods_id, s.date_label
+        """
+        cursor.execute(missing_traffic_query, (yesterday,))
+        seen_dates = set()
+        for goods_id, date_label in cursor.fetchall():
+            date_str = format_date_label(date_label)
+            if date_str in seen_dates:
+                continue
+            seen_dates.add(date_str)
+            missing_dates_info.append({
+                'date': date_str,
+                'goods_id': goods_id,
+                'message': f'goods_id {goods_id} 在 {date_str} 有动销数据但缺少Traffic数据，无法计算status'
+            })
         
         # 检查昨天和之前数据库没有数据的日期范围
         # 检查昨天是否有Traffic数据
@@ -1460,16 +1605,15 @@ def refresh_status_data(table_name, sales_table_name):
         # 向前查找，找到第一个有数据的日期
         missing_date_ranges = []
         if yesterday_count == 0:
-            # 昨天没有数据，向前查找
-            found_date = None
-            for days_back in range(1, 90):  # 最多往前查找90天
-                check_date = (yesterday_dt - timedelta(days=days_back)).strftime('%Y-%m-%d')
-                cursor.execute(check_yesterday_query, (check_date,))
-                result = cursor.fetchone()
-                count = result[0] if result else 0
-                if count > 0:
-                    found_date = check_date
-                    break
+            # 昨天没有数据，向前查找（最多往前查找90天）
+            latest_date_query = f"""
+            SELECT MAX(date_label)
+            FROM `{table_name}`
+            WHERE date_label >= %s AND date_label < %s
+            """
+            cursor.execute(latest_date_query, ((yesterday_dt - timedelta(days=89)).strftime('%Y-%m-%d'), yesterday))
+            result = cursor.fetchone()
+            found_date = format_date_label(result[0]) if result and result[0] else None
             
             if found_date:
                 missing_date_ranges.append({
@@ -1519,9 +1663,7 @@ def refresh_status_data(table_name, sales_table_name):
         return False, f"刷新失败: {str(e)}", 0, []
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
 
 
 def quick_refresh_status_data(table_name, sales_table_name):
@@ -1530,16 +1672,13 @@ def quick_refresh_status_data(table_name, sales_table_name):
     返回: (success, message, updated_count, missing_dates_info)
     """
     from config import get_db_config
-    import pymysql
     from db_utils import get_yesterday_date
     
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
+    traffic_config, _, _, _ = get_db_config()
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
         
         # 检查并创建必需的列
         create_columns_if_not_exist(cursor, table_name)
@@ -1548,42 +1687,24 @@ def quick_refresh_status_data(table_name, sales_table_name):
         # 获取昨天日期
         yesterday = get_yesterday_date()
         
-        # 获取所有动销品goods_id（所有历史有动销的商品）
-        all_sales_goods = get_active_sales_goods_ids(table_name, sales_table_name)
+        # 所有历史动销品中昨天有流量记录的商品，一次查询取历史、批量计算并回写
+        updated_count, refreshed_goods = bulk_update_status_for_date(conn, table_name, sales_table_name, yesterday)
         
-        if len(all_sales_goods) == 0:
-            return False, "没有找到动销品", 0, []
+        if len(refreshed_goods) == 0:
+            cursor.execute(f"""
+            SELECT 1
+            FROM `Vida_Sales`.`{sales_table_name}`
+            WHERE Buyers IS NOT NULL AND Buyers > 0
+            LIMIT 1
+            """)
+            if cursor.fetchone() is None:
+                return False, "没有找到动销品", 0, []
         
         missing_dates_info = []
-        updated_count = 0
-        
-        # 对每个动销品，检查昨天是否有Traffic数据，如果有则更新status
-        for goods_id in all_sales_goods:
-            # 检查该日期是否有Traffic数据（用于计算status）
-            check_traffic_query = f"""
-            SELECT COUNT(*) 
-            FROM `{table_name}`
-            WHERE goods_id = %s AND date_label = %s
-            """
-            cursor.execute(check_traffic_query, (goods_id, yesterday))
-            has_traffic_data = cursor.fetchone()[0] > 0
-            
-            if not has_traffic_data:
-                # 如果没有Traffic数据，跳过（不记录缺失信息，因为可能是正常下架）
-                continue
-            
-            # 计算该日期的status
-            try:
-                success, msg, count = auto_update_status_for_goods(
-                    cursor, table_name, sales_table_name, yesterday, [goods_id]
-                )
-                if success:
-                    updated_count += count
-            except Exception as e:
-                # 如果单个商品更新失败，记录错误但继续处理其他商品
-                print(f"更新goods_id {goods_id} 在 {yesterday} 的status失败: {str(e)}")
         
         conn.commit()
+        if refreshed_goods:
+            refresh_snapshot_after_write(cursor, table_name, refreshed_goods, refresh_daily=True, since_date=yesterday, columns=['Status'])
         
         return True, f"成功快速刷新所有动销品在昨天({yesterday})的status数据，共更新 {updated_count} 条记录", updated_count, missing_dates_info
     except Exception as e:
@@ -1593,9 +1714,7 @@ def quick_refresh_status_data(table_name, sales_table_name):
         return False, f"快速刷新失败: {str(e)}", 0, []
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
 
 
 def auto_update_status_for_goods(cursor, table_name, sales_table_name, target_date, goods_ids):
@@ -1670,15 +1789,12 @@ def auto_update_status_for_date(table_name, sales_table_name, target_date):
     返回: (success, message, updated_count)
     """
     from config import get_db_config
-    import pymysql
     
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
+    traffic_config, _, _, _ = get_db_config()
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
         
         # 获取目标日期有动销的商品
         query_goods = f"""
@@ -1705,6 +1821,7 @@ def auto_update_status_for_date(table_name, sales_table_name, target_date):
         
         if success:
             conn.commit()
+            refresh_snapshot_after_write(cursor, table_name, goods_ids, refresh_daily=True, since_date=target_date, columns=['Status'])
         else:
             conn.rollback()
         
@@ -1717,45 +1834,53 @@ def auto_update_status_for_date(table_name, sales_table_name, target_date):
         return False, f"更新Status失败: {str(e)}", 0
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
 
 
-def get_cache_file_path(table_name, target_date):
+def get_cache_file_path(table_name, target_date, extension='cache'):
     """
     获取缓存文件路径
+    extension: 'cache' 为分段压缩格式（cache_store），'json' 为旧版JSON缓存
     返回: 缓存文件路径
     """
     cache_dir = 'Cache_Dynamic'
     if not os.path.exists(cache_dir):
         os.makedirs(cache_dir)
     
-    # 文件名格式：表名_日期.json，例如：ROA1_FR_2025-12-16.json
+    # 文件名格式：表名_日期.cache，例如：FR_2025-12-16.cache
     # 去掉表名中的ROA1_前缀（如果存在）
     table_suffix = table_name.replace('ROA1_', '')
-    filename = f"{table_suffix}_{target_date}.json"
+    filename = f"{table_suffix}_{target_date}.{extension}"
     return os.path.join(cache_dir, filename)
 
 
-def load_dynamic_management_cache(table_name, target_date):
+def load_dynamic_management_cache(table_name, target_date, sections=None):
     """
     加载动销品管理缓存
+    sections: 只读取这些部分（如 ['statistics']，不解压商品列表），None表示全部
     返回: 缓存数据字典，如果不存在则返回None
     """
     try:
-        cache_file = get_cache_file_path(table_name, target_date)
-        if os.path.exists(cache_file):
-            with open(cache_file, 'r', encoding='utf-8') as f:
+        cache_data = load_cache_file(get_cache_file_path(table_name, target_date), sections=sections)
+        if cache_data is not None:
+            return cache_data
+        
+        # 兼容旧版JSON缓存
+        legacy_file = get_cache_file_path(table_name, target_date, extension='json')
+        if os.path.exists(legacy_file):
+            with open(legacy_file, 'r', encoding='utf-8') as f:
                 cache_data = json.load(f)
-                return cache_data
+            if sections is not None:
+                cache_data = {key: value for key, value in cache_data.items() if key in sections}
+            return cache_data
         return None
     except Exception as e:
         print(f"加载缓存失败: {e}")
         return None
 
 
-def save_dynamic_management_cache(table_name, target_date, statistics, rising_info, declined_info, rising_summary, declined_summary, analysis_time, total_summary=None):
+def save_dynamic_management_cache(table_name, target_date, statistics, rising_info, declined_info, rising_summary, declined_summary, analysis_time, total_summary=None,
+                                  watermark=None):
     """
     保存动销品管理缓存
     参数:
@@ -1768,6 +1893,7 @@ def save_dynamic_management_cache(table_name, target_date, statistics, rising_in
         declined_summary: 非上升期统计摘要
         analysis_time: 分析耗时
         total_summary: 汇总统计摘要
+        watermark: 分析开始前的源数据水位（get_dynamic_cache_watermark），读取时据此判断缓存是否过期
     """
     try:
         cache_file = get_cache_file_path(table_name, target_date)
@@ -1796,16 +1922,280 @@ def save_dynamic_management_cache(table_name, target_date, statistics, rising_in
             },
             'total_summary': total_summary if total_summary else {}
         }
+        if watermark is not None:
+            cache_data['watermark'] = watermark
         
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        save_cache_file(cache_file, cache_data)
         
         print(f"缓存已保存到: {cache_file}")
     except Exception as e:
         print(f"保存缓存失败: {e}")
 
 
-def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, filter_mode=None):
+def get_dynamic_cache_watermark(table_name, sales_table_name, target_date):
+    """动销品管理缓存的源数据水位（截至 target_date 的流量/销售数据与 Status/Reason 写入），获取失败返回 None"""
+    try:
+        return get_cache_watermark(table_name, sales_table_name, target_date, columns=('Status', 'Reason'))
+    except Exception as e:
+        print(f"获取缓存水位失败: {e}")
+        return None
+
+
+def check_dynamic_management_cache(table_name, target_date, watermark):
+    """
+    根据水位判断缓存是否可用
+    返回: 'fresh' 可直接使用；'reason' 只有Reason发生变化，刷新商品信息中的reason即可；
+         'stale' 需要重新分析（包括没有水位的旧版缓存）；None 表示没有缓存
+    watermark 为 None（无法获取当前水位）时按可用处理
+    """
+    saved = load_dynamic_management_cache(table_name, target_date, sections=['watermark'])
+    if saved is None:
+        return None
+    if watermark is None:
+        return 'fresh'
+    changed = compare_cache_watermark(saved.get('watermark'), watermark)
+    if not changed:
+        return 'fresh'
+    if changed == {'Reason'}:
+        return 'reason'
+    return 'stale'
+
+
+def refresh_cached_goods_reasons(table_name, target_date, cache_data):
+    """
+    Reason 变化后只刷新缓存中上升期/非上升期商品信息的 reason 字段（每个商品截至 target_date 最新的非空Reason），
+    商品集合和加入时间不受 Reason 影响，保持不变；汇总统计（含Reason饼图）清空，由读取缓存时重新计算
+    """
+    from config import get_db_config
+
+    all_goods_info = cache_data.get('rising', {}).get('goods_info', []) + \
+        cache_data.get('declined', {}).get('goods_info', [])
+    goods_ids = sorted({str(info.get('goods_id')) for info in all_goods_info})
+    if not goods_ids:
+        return
+
+    traffic_config, _, _, _ = get_db_config()
+    with db_cursor(traffic_config) as cursor:
+        placeholders = ','.join(['%s'] * len(goods_ids))
+        cursor.execute(f"""
+        SELECT goods_id, Reason
+        FROM `Vida_Traffic`.`{table_name}`
+        WHERE goods_id IN ({placeholders})
+          AND date_label <= %s
+          AND Reason IS NOT NULL AND Reason != ''
+        ORDER BY goods_id, date_label
+        """, goods_ids + [target_date])
+        latest_reason = {str(goods_id): reason for goods_id, reason in cursor.fetchall()}
+
+    for info in all_goods_info:
+        info['reason'] = latest_reason.get(str(info.get('goods_id'))) or 'None'
+    cache_data['total_summary'] = {}
+
+
+# 按需分页生成图片时每页的商品数（配置项 image_page_size，会向上取整为3的倍数，每张图3个商品）
+IMAGE_PAGE_SIZE = 30
+
+
+def get_image_page_size():
+    from config import get_config_section
+    try:
+        page_size = int(get_config_section('image_page_size', IMAGE_PAGE_SIZE))
+    except (TypeError, ValueError):
+        page_size = IMAGE_PAGE_SIZE
+    page_size = max(page_size, 3)
+    return (page_size + 2) // 3 * 3
+
+
+# 分页令牌的签名密钥（进程内随机生成，服务重启后旧令牌失效，需重新分析）
+_IMAGE_PAGE_TOKEN_KEY = secrets.token_bytes(32)
+
+
+def _sign_image_page_token(body):
+    return hmac.new(_IMAGE_PAGE_TOKEN_KEY, body.encode('ascii'), hashlib.sha256).hexdigest()
+
+
+def _encode_image_page_token(payload):
+    """base64(JSON) + '.' + HMAC-SHA256签名，客户端无法伪造或修改其中的商品列表"""
+    raw = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    body = base64.urlsafe_b64encode(raw).decode('ascii')
+    return f"{body}.{_sign_image_page_token(body)}"
+
+
+def _decode_image_page_token(token):
+    """签名不匹配时抛出 ValueError"""
+    body, _, signature = token.partition('.')
+    if not hmac.compare_digest(signature, _sign_image_page_token(body)):
+        raise ValueError('分页令牌签名无效')
+    return json.loads(base64.urlsafe_b64decode(body.encode('ascii')).decode('utf-8'))
+
+
+def _build_image_pages(goods_ids, category, table_name, target_date, filter_mode):
+    """
+    按需分页生成图片：不渲染图片，只返回分页信息，由前端滚动到对应位置时调用
+    render_dynamic_management_image_page 渲染某一页
+    返回: {
+        'page_tokens': [str, ...],  # 每页的签名令牌（站点、日期、类别、过滤模式、页码、该页商品）
+        'page_size': int,
+        'total_goods': int,
+        'pages': [[goods_id, ...], ...]  # 每页的商品，顺序与 plot_goods_batch 相同
+    }
+    """
+    ids = sorted(goods_id.item() if hasattr(goods_id, 'item') else goods_id for goods_id in goods_ids)
+    page_size = get_image_page_size()
+    pages = [ids[start : start + page_size] for start in range(0, len(ids), page_size)]
+    page_tokens = [
+        _encode_image_page_token({
+            'table': table_name,
+            'date': target_date,
+            'category': category,
+            'filter_mode': filter_mode,
+            'page': page_index,
+            'goods_ids': page_ids
+        })
+        for page_index, page_ids in enumerate(pages)
+    ]
+    return {
+        'page_tokens': page_tokens,
+        'page_size': page_size,
+        'total_goods': len(ids),
+        'pages': pages
+    }
+
+
+def _build_category_charts(df, category, table_name, target_date, filter_mode, chart_mode, lazy_images):
+    """生成某个类别的图：lazy_images 为 True 时只返回分页信息，否则直接生成全部图片/序列数据"""
+    if lazy_images:
+        return _build_image_pages(df['goods_id'].unique(), category, table_name, target_date, filter_mode)
+    return plot_goods_charts(df, chart_mode=chart_mode, cols=3)
+
+
+# 统计信息中的变更类别（statistics 中对应 <类别>_goods 列表）
+CHANGE_CATEGORIES = ['new_rising', 'new_declined', 'updated_to_rising', 'back_to_rising', 'declined_from_rising']
+
+
+def _build_category_sections(table_name, sales_table_name, target_date, filter_mode, category_goods,
+                             image_categories, chart_mode, lazy_images):
+    """
+    一次取出所有类别商品（并集）的历史数据，并且只对变更类别的商品计算一次 goods_info，再在内存中按类别拆分
+    （过滤模式按单个商品的Buyers总和判断，先取并集再拆分与逐类别查询结果相同）
+    参数:
+        category_goods: {类别: goods_id列表}，包含 CHANGE_CATEGORIES 以及需要出图的 rising/declined
+        image_categories: 需要生成图片的类别
+    返回: (category_images, category_goods_info)，只包含 category_goods 中的类别
+    """
+    category_images = {category: [] for category in category_goods}
+    category_goods_info = {category: [] for category in category_goods}
+
+    union_goods_ids = list({
+        str(goods_id): goods_id for goods_ids in category_goods.values() for goods_id in goods_ids
+    }.values())
+    if len(union_goods_ids) == 0:
+        return category_images, category_goods_info
+
+    df_all = get_goods_data_by_ids(table_name, sales_table_name, union_goods_ids, target_date, filter_mode=filter_mode)
+    if len(df_all) == 0:
+        return category_images, category_goods_info
+
+    # 统计信息来自缓存JSON时goods_id类型可能与数据库不同，统一按字符串匹配
+    goods_id_str = df_all['goods_id'].astype(str)
+
+    info_goods_ids = {
+        str(goods_id)
+        for category in CHANGE_CATEGORIES
+        for goods_id in category_goods.get(category, [])
+    }
+    info_by_id = {}
+    if info_goods_ids:
+        df_info = df_all[goods_id_str.isin(info_goods_ids)]
+        if len(df_info) > 0:
+            info_by_id = {
+                str(info['goods_id']): info
+                for info in get_goods_info_with_status(df_info, table_name, sales_table_name)
+            }
+
+    for category, goods_ids in category_goods.items():
+        df_category = df_all[goods_id_str.isin({str(goods_id) for goods_id in goods_ids})]
+        if len(df_category) == 0:
+            continue
+        if category in CHANGE_CATEGORIES:
+            # 按goods_id排序，与plot_goods_batch的顺序一致
+            category_goods_info[category] = [
+                info_by_id[str(goods_id)]
+                for goods_id in sorted(df_category['goods_id'].unique())
+                if str(goods_id) in info_by_id
+            ]
+        if category in image_categories:
+            category_images[category] = _build_category_charts(
+                df_category, category, table_name, target_date, filter_mode, chart_mode, lazy_images
+            )
+
+    return category_images, category_goods_info
+
+
+def _move_chart_payloads(data):
+    """
+    各类别的 images 中可能是：
+        - 分页信息（lazy_images）→ 移到 image_pages
+        - 序列数据（浏览器端绘图模式）→ 移到 series
+    移动后 images 置为空列表
+    """
+    sections = [data.get('rising'), data.get('declined')] + list((data.get('categories') or {}).values())
+    for section in sections:
+        if section and isinstance(section.get('images'), dict):
+            key = 'image_pages' if 'pages' in section['images'] else 'series'
+            section[key] = section['images']
+            section['images'] = []
+    return data
+
+
+def render_dynamic_management_image_page(token, goods_ids, chart_mode='image'):
+    """
+    渲染某个类别的一页图片（配合 dynamic_management 的 lazy_images 使用）
+    参数:
+        token: image_pages['page_tokens'][N]
+        goods_ids: image_pages['pages'][N]，必须都在令牌签名的商品列表中；为空时渲染令牌中的全部商品
+        chart_mode: 同 dynamic_management
+    返回: {
+        'success': bool,
+        'data': {'images': [...], 'series': dict or None, 'goods_ids': [...]} or None,
+        'error': str or None
+    }
+    """
+    try:
+        payload = _decode_image_page_token(token)
+    except Exception:
+        return {'success': False, 'data': None, 'error': '无效的分页令牌（服务已重启或令牌被修改），请重新分析'}
+
+    table_name = get_current_table()
+    if payload.get('table') != table_name:
+        return {'success': False, 'data': None, 'error': '当前站点已切换，请重新分析'}
+
+    token_goods_ids = payload.get('goods_ids') or []
+    allowed = {str(goods_id) for goods_id in token_goods_ids}
+    goods_ids = list(goods_ids or token_goods_ids)
+    if len(goods_ids) == 0 or any(str(goods_id) not in allowed for goods_id in goods_ids):
+        return {'success': False, 'data': None, 'error': '商品不在该分页中'}
+
+    try:
+        sales_table_name = f"{table_name}_Sales"
+        df = get_goods_data_by_ids(table_name, sales_table_name, goods_ids, payload.get('date'),
+                                   filter_mode=payload.get('filter_mode'))
+        section = {'images': [], 'goods_ids': []}
+        if len(df) > 0:
+            section['images'] = plot_goods_charts(df, chart_mode=chart_mode, cols=3)
+            section['goods_ids'] = [
+                goods_id.item() if hasattr(goods_id, 'item') else goods_id
+                for goods_id in sorted(df['goods_id'].unique())
+            ]
+        return {'success': True, 'data': _move_chart_payloads({'rising': section})['rising'], 'error': None}
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return {'success': False, 'data': None, 'error': str(e)}
+
+
+def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, filter_mode=None, chart_mode='image',
+                       lazy_images=False):
     """
     动销品管理功能
     参数:
@@ -1823,6 +2213,9 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
                 - 'declined_from_rising': 由上升期到非上升期
             注意：所有模块都会返回数据，只有勾选的模块才会生成图片
         filter_mode: 过滤模式，None=不过滤, 2=总和>1, 3=总和>2
+        chart_mode: 'image' 各类别返回base64图片（images）；'series' 返回序列数据（series），由浏览器绘制
+        lazy_images: 为True时勾选的类别不生成图片，只返回分页信息（image_pages），
+            由前端通过 render_dynamic_management_image_page 按页获取
     返回: {
         'success': bool,
         'data': dict or None,
@@ -1842,9 +2235,30 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
         table_name = get_current_table()
         sales_table_name = f"{table_name}_Sales"
         
-        # 如果使用缓存，先检查缓存
+        # 如果使用缓存，先检查缓存（源数据水位变化时缓存过期）
         if use_cache:
-            cache_data = load_dynamic_management_cache(table_name, target_date)
+            cache_data = None
+            watermark = get_dynamic_cache_watermark(table_name, sales_table_name, target_date)
+            cache_state = check_dynamic_management_cache(table_name, target_date, watermark)
+            if cache_state == 'fresh':
+                cache_data = load_dynamic_management_cache(table_name, target_date)
+            elif cache_state == 'reason':
+                cache_data = load_dynamic_management_cache(table_name, target_date)
+                if cache_data:
+                    try:
+                        refresh_cached_goods_reasons(table_name, target_date, cache_data)
+                        statistics = cache_data.get('statistics', {})
+                        save_dynamic_management_cache(
+                            table_name, target_date, statistics,
+                            cache_data.get('rising', {}).get('goods_info', []),
+                            cache_data.get('declined', {}).get('goods_info', []),
+                            cache_data.get('rising', {}).get('summary', {}),
+                            cache_data.get('declined', {}).get('summary', {}),
+                            statistics.get('elapsed_time', 0), watermark=watermark
+                        )
+                    except Exception as e:
+                        print(f"刷新缓存中的Reason失败，重新分析: {e}")
+                        cache_data = None
             if cache_data:
                 # 从缓存加载数据
                 end_time = time.time()
@@ -1956,108 +2370,32 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
                 # 处理半图片模式：根据选择的类别生成图片
                 if half_image_mode is None:
                     half_image_mode = []
+                if not isinstance(half_image_mode, list):
+                    half_image_mode = []
                 
-                if isinstance(half_image_mode, list) and len(half_image_mode) > 0:
-                    stats = cache_data.get('statistics', {})
-                    
-                    # 获取各类别的goods_id
-                    new_rising_goods = stats.get('new_rising_goods', [])
-                    new_declined_goods = stats.get('new_declined_goods', [])
-                    updated_to_rising_goods = stats.get('updated_to_rising_goods', [])
-                    back_to_rising_goods = stats.get('back_to_rising_goods', [])
-                    declined_from_rising_goods = stats.get('declined_from_rising_goods', [])
-                    
-                    # 获取所有上升期和非上升期的goods_id
+                # 各类别的goods_id（即使没有勾选也要返回变更类别的商品信息）
+                stats = cache_data.get('statistics', {})
+                category_goods = {category: stats.get(f'{category}_goods', []) for category in CHANGE_CATEGORIES}
+                
+                # 上升期/非上升期只在勾选时需要（用于出图）
+                df_rising = None
+                df_declined = None
+                if 'rising' in half_image_mode:
                     df_rising = get_dynamic_goods_data(table_name, sales_table_name, 1, target_date, filter_mode=filter_mode)
-                    df_declined = get_declined_goods_data_with_discontinued(table_name, sales_table_name, target_date, filter_mode=filter_mode)
-                    
-                    rising_goods_ids = set()
-                    declined_goods_ids = set()
                     if len(df_rising) > 0:
-                        rising_goods_ids = set(df_rising['goods_id'].unique())
+                        category_goods['rising'] = list(df_rising['goods_id'].unique())
+                if 'declined' in half_image_mode:
+                    df_declined = get_declined_goods_data_with_discontinued(table_name, sales_table_name, target_date, filter_mode=filter_mode)
                     if len(df_declined) > 0:
-                        declined_goods_ids = set(df_declined['goods_id'].unique())
-                    
-                    # 为每个勾选的类别生成图片
-                    if 'rising' in half_image_mode and len(rising_goods_ids) > 0:
-                        df_rising_selected = get_goods_data_by_ids(table_name, sales_table_name, list(rising_goods_ids), target_date, filter_mode=filter_mode)
-                        if len(df_rising_selected) > 0:
-                            category_images['rising'] = plot_goods_batch(df_rising_selected, cols=3)
-                            category_goods_info['rising'] = get_goods_info_with_status(df_rising_selected, table_name, sales_table_name)
-                    
-                    if 'declined' in half_image_mode and len(declined_goods_ids) > 0:
-                        df_declined_selected = get_goods_data_by_ids(table_name, sales_table_name, list(declined_goods_ids), target_date, filter_mode=filter_mode)
-                        if len(df_declined_selected) > 0:
-                            category_images['declined'] = plot_goods_batch(df_declined_selected, cols=3)
-                            category_goods_info['declined'] = get_goods_info_with_status(df_declined_selected, table_name, sales_table_name)
-                    
-                    if 'new_rising' in half_image_mode and len(new_rising_goods) > 0:
-                        df_new_rising = get_goods_data_by_ids(table_name, sales_table_name, new_rising_goods, target_date, filter_mode=filter_mode)
-                        if len(df_new_rising) > 0:
-                            category_images['new_rising'] = plot_goods_batch(df_new_rising, cols=3)
-                            category_goods_info['new_rising'] = get_goods_info_with_status(df_new_rising, table_name, sales_table_name)
-                    
-                    if 'new_declined' in half_image_mode and len(new_declined_goods) > 0:
-                        df_new_declined = get_goods_data_by_ids(table_name, sales_table_name, new_declined_goods, target_date, filter_mode=filter_mode)
-                        if len(df_new_declined) > 0:
-                            category_images['new_declined'] = plot_goods_batch(df_new_declined, cols=3)
-                            category_goods_info['new_declined'] = get_goods_info_with_status(df_new_declined, table_name, sales_table_name)
-                    
-                    if 'updated_to_rising' in half_image_mode and len(updated_to_rising_goods) > 0:
-                        df_updated_to_rising = get_goods_data_by_ids(table_name, sales_table_name, updated_to_rising_goods, target_date, filter_mode=filter_mode)
-                        if len(df_updated_to_rising) > 0:
-                            category_images['updated_to_rising'] = plot_goods_batch(df_updated_to_rising, cols=3)
-                            category_goods_info['updated_to_rising'] = get_goods_info_with_status(df_updated_to_rising, table_name, sales_table_name)
-                    
-                    if 'back_to_rising' in half_image_mode and len(back_to_rising_goods) > 0:
-                        df_back_to_rising = get_goods_data_by_ids(table_name, sales_table_name, back_to_rising_goods, target_date, filter_mode=filter_mode)
-                        if len(df_back_to_rising) > 0:
-                            category_images['back_to_rising'] = plot_goods_batch(df_back_to_rising, cols=3)
-                            category_goods_info['back_to_rising'] = get_goods_info_with_status(df_back_to_rising, table_name, sales_table_name)
-                    
-                    if 'declined_from_rising' in half_image_mode and len(declined_from_rising_goods) > 0:
-                        df_declined_from_rising = get_goods_data_by_ids(table_name, sales_table_name, declined_from_rising_goods, target_date, filter_mode=filter_mode)
-                        if len(df_declined_from_rising) > 0:
-                            category_images['declined_from_rising'] = plot_goods_batch(df_declined_from_rising, cols=3)
-                            category_goods_info['declined_from_rising'] = get_goods_info_with_status(df_declined_from_rising, table_name, sales_table_name)
-                
-                # 获取各类别的商品信息（即使没有勾选也要返回数据）
-                stats = cache_data.get('statistics', {})
-                new_rising_goods = stats.get('new_rising_goods', [])
-                new_declined_goods = stats.get('new_declined_goods', [])
-                updated_to_rising_goods = stats.get('updated_to_rising_goods', [])
-                back_to_rising_goods = stats.get('back_to_rising_goods', [])
-                declined_from_rising_goods = stats.get('declined_from_rising_goods', [])
-                
-                if len(new_rising_goods) > 0:
-                    if 'new_rising' not in category_goods_info or len(category_goods_info['new_rising']) == 0:
-                        df_new_rising = get_goods_data_by_ids(table_name, sales_table_name, new_rising_goods, target_date, filter_mode=filter_mode)
-                        if len(df_new_rising) > 0:
-                            category_goods_info['new_rising'] = get_goods_info_with_status(df_new_rising, table_name, sales_table_name)
-                
-                if len(new_declined_goods) > 0:
-                    if 'new_declined' not in category_goods_info or len(category_goods_info['new_declined']) == 0:
-                        df_new_declined = get_goods_data_by_ids(table_name, sales_table_name, new_declined_goods, target_date, filter_mode=filter_mode)
-                        if len(df_new_declined) > 0:
-                            category_goods_info['new_declined'] = get_goods_info_with_status(df_new_declined, table_name, sales_table_name)
+                        category_goods['declined'] = list(df_declined['goods_id'].unique())
                 
-                if len(updated_to_rising_goods) > 0:
-                    if 'updated_to_rising' not in category_goods_info or len(category_goods_info['updated_to_rising']) == 0:
-                        df_updated_to_rising = get_goods_data_by_ids(table_name, sales_table_name, updated_to_rising_goods, target_date, filter_mode=filter_mode)
-                        if len(df_updated_to_rising) > 0:
-                            category_goods_info['updated_to_rising'] = get_goods_info_with_status(df_updated_to_rising, table_name, sales_table_name)
-                
-                if len(back_to_rising_goods) > 0:
-                    if 'back_to_rising' not in category_goods_info or len(category_goods_info['back_to_rising']) == 0:
-                        df_back_to_rising = get_goods_data_by_ids(table_name, sales_table_name, back_to_rising_goods, target_date, filter_mode=filter_mode)
-                        if len(df_back_to_rising) > 0:
-                            category_goods_info['back_to_rising'] = get_goods_info_with_status(df_back_to_rising, table_name, sales_table_name)
-                
-                if len(declined_from_rising_goods) > 0:
-                    if 'declined_from_rising' not in category_goods_info or len(category_goods_info['declined_from_rising']) == 0:
-                        df_declined_from_rising = get_goods_data_by_ids(table_name, sales_table_name, declined_from_rising_goods, target_date, filter_mode=filter_mode)
-                        if len(df_declined_from_rising) > 0:
-                            category_goods_info['declined_from_rising'] = get_goods_info_with_status(df_declined_from_rising, table_name, sales_table_name)
+                # 所有类别的商品历史只查询一次，再按类别拆分
+                section_images, section_goods_info = _build_category_sections(
+                    table_name, sales_table_name, target_date, filter_mode, category_goods,
+                    half_image_mode, chart_mode, lazy_images
+                )
+                category_images.update(section_images)
+                category_goods_info.update(section_goods_info)
                 
                 # 更新返回数据，包含各类别的数据
                 result_data['rising']['images'] = category_images.get('rising', [])
@@ -2088,8 +2426,9 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
                 # 过滤模式：如果启用过滤模式，需要从缓存数据中过滤掉Buyers = 1的商品信息
                 if filter_mode:
                     # 需要重新获取数据来应用过滤（因为缓存中没有Buyers信息）
-                    # 获取上升期数据（传递filter_mode参数，在SQL层面过滤）
-                    df_rising = get_dynamic_goods_data(table_name, sales_table_name, 1, target_date, filter_mode=filter_mode)
+                    # 获取上升期数据（传递filter_mode参数，在SQL层面过滤；出图时已查询过则复用）
+                    if df_rising is None:
+                        df_rising = get_dynamic_goods_data(table_name, sales_table_name, 1, target_date, filter_mode=filter_mode)
                     if len(df_rising) > 0:
                         # 获取过滤后的goods_id列表
                         filtered_rising_goods = set(df_rising['goods_id'].unique())
@@ -2099,8 +2438,9 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
                             if info['goods_id'] in filtered_rising_goods
                         ]
                     
-                    # 获取非上升期数据（传递filter_mode参数，在SQL层面过滤）
-                    df_declined = get_declined_goods_data_with_discontinued(table_name, sales_table_name, target_date, filter_mode=filter_mode)
+                    # 获取非上升期数据（传递filter_mode参数，在SQL层面过滤；出图时已查询过则复用）
+                    if df_declined is None:
+                        df_declined = get_declined_goods_data_with_discontinued(table_name, sales_table_name, target_date, filter_mode=filter_mode)
                     if len(df_declined) > 0:
                         # 获取过滤后的goods_id列表
                         filtered_declined_goods = set(df_declined['goods_id'].unique())
@@ -2110,6 +2450,7 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
                             if info['goods_id'] in filtered_declined_goods
                         ]
                 
+                _move_chart_payloads(result_data)
                 return {
                     'success': True,
                     'data': result_data,
@@ -2120,15 +2461,12 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
         
         # 检查目标日期是否有任何goods_id的数据
         from config import get_db_config
-        import pymysql
         
-        traffic_config, sales_config, pallet_config, product_config = get_db_config()
-        conn = pymysql.connect(**traffic_config)
-        conn_sales = pymysql.connect(**sales_config)
+        traffic_config, _, _, _ = get_db_config()
+        conn = get_db_connection(traffic_config)
         
         try:
             cursor = conn.cursor()
-            cursor_sales = conn_sales.cursor()
             
             # 检查目标日期是否有任何goods_id的数据
             check_date_query = f"""
@@ -2172,9 +2510,7 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
                 }
         finally:
             cursor.close()
-            cursor_sales.close()
             conn.close()
-            conn_sales.close()
         
         # 检查目标日期是否有Status数据
         has_status_data, status_count = check_target_date_has_status_data(table_name, target_date)
@@ -2209,6 +2545,9 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
                     'analysis_time': round(analysis_time, 2)
                 }
         
+        # 分析开始前记录源数据水位，分析期间发生的写入会使本次缓存在下次读取时过期
+        watermark = get_dynamic_cache_watermark(table_name, sales_table_name, target_date)
+        
         # 获取统计信息
         stats = get_status_statistics(table_name, sales_table_name, target_date)
         
@@ -2245,112 +2584,27 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
         }
         
         # 获取各类别的goods_id（从统计信息中获取）
-        new_rising_goods = stats.get('new_rising_goods', [])
-        new_declined_goods = stats.get('new_declined_goods', [])
-        updated_to_rising_goods = stats.get('updated_to_rising_goods', [])
-        back_to_rising_goods = stats.get('back_to_rising_goods', [])
-        declined_from_rising_goods = stats.get('declined_from_rising_goods', [])
-        
-        # 获取所有上升期和非上升期的goods_id
-        rising_goods_ids = set()
-        declined_goods_ids = set()
-        if len(df_rising) > 0:
-            rising_goods_ids = set(df_rising['goods_id'].unique())
-        if len(df_declined) > 0:
-            declined_goods_ids = set(df_declined['goods_id'].unique())
+        category_goods = {category: stats.get(f'{category}_goods', []) for category in CHANGE_CATEGORIES}
         
         # 处理半图片模式：根据选择的类别生成图片
         if half_image_mode is None:
             half_image_mode = []
+        if not isinstance(half_image_mode, list):
+            half_image_mode = []
         
-        if isinstance(half_image_mode, list):
-            
-            # 为每个勾选的类别生成图片
-            if 'rising' in half_image_mode and len(rising_goods_ids) > 0:
-                df_rising_selected = get_goods_data_by_ids(table_name, sales_table_name, list(rising_goods_ids), target_date, filter_mode=filter_mode)
-                if len(df_rising_selected) > 0:
-                    category_images['rising'] = plot_goods_batch(df_rising_selected, cols=3)
-                    category_goods_info['rising'] = get_goods_info_with_status(df_rising_selected, table_name, sales_table_name)
-            
-            if 'declined' in half_image_mode and len(declined_goods_ids) > 0:
-                df_declined_selected = get_goods_data_by_ids(table_name, sales_table_name, list(declined_goods_ids), target_date, filter_mode=filter_mode)
-                if len(df_declined_selected) > 0:
-                    category_images['declined'] = plot_goods_batch(df_declined_selected, cols=3)
-                    category_goods_info['declined'] = get_goods_info_with_status(df_declined_selected, table_name, sales_table_name)
-            
-            if 'new_rising' in half_image_mode and len(new_rising_goods) > 0:
-                df_new_rising = get_goods_data_by_ids(table_name, sales_table_name, new_rising_goods, target_date, filter_mode=filter_mode)
-                if len(df_new_rising) > 0:
-                    category_images['new_rising'] = plot_goods_batch(df_new_rising, cols=3)
-                    category_goods_info['new_rising'] = get_goods_info_with_status(df_new_rising, table_name, sales_table_name)
-            
-            if 'new_declined' in half_image_mode and len(new_declined_goods) > 0:
-                df_new_declined = get_goods_data_by_ids(table_name, sales_table_name, new_declined_goods, target_date, filter_mode=filter_mode)
-                if len(df_new_declined) > 0:
-                    category_images['new_declined'] = plot_goods_batch(df_new_declined, cols=3)
-                    category_goods_info['new_declined'] = get_goods_info_with_status(df_new_declined, table_name, sales_table_name)
-            
-            if 'updated_to_rising' in half_image_mode and len(updated_to_rising_goods) > 0:
-                df_updated_to_rising = get_goods_data_by_ids(table_name, sales_table_name, updated_to_rising_goods, target_date, filter_mode=filter_mode)
-                if len(df_updated_to_rising) > 0:
-                    category_images['updated_to_rising'] = plot_goods_batch(df_updated_to_rising, cols=3)
-                    category_goods_info['updated_to_rising'] = get_goods_info_with_status(df_updated_to_rising, table_name, sales_table_name)
-            
-            if 'back_to_rising' in half_image_mode and len(back_to_rising_goods) > 0:
-                df_back_to_rising = get_goods_data_by_ids(table_name, sales_table_name, back_to_rising_goods, target_date, filter_mode=filter_mode)
-                if len(df_back_to_rising) > 0:
-                    category_images['back_to_rising'] = plot_goods_batch(df_back_to_rising, cols=3)
-                    category_goods_info['back_to_rising'] = get_goods_info_with_status(df_back_to_rising, table_name, sales_table_name)
-            
-            if 'declined_from_rising' in half_image_mode and len(declined_from_rising_goods) > 0:
-                df_declined_from_rising = get_goods_data_by_ids(table_name, sales_table_name, declined_from_rising_goods, target_date, filter_mode=filter_mode)
-                if len(df_declined_from_rising) > 0:
-                    category_images['declined_from_rising'] = plot_goods_batch(df_declined_from_rising, cols=3)
-                    category_goods_info['declined_from_rising'] = get_goods_info_with_status(df_declined_from_rising, table_name, sales_table_name)
-        
-        # 获取各类别的商品信息（即使没有勾选也要返回数据）
-        if len(new_rising_goods) > 0:
-            if 'new_rising' not in category_goods_info or len(category_goods_info['new_rising']) == 0:
-                df_new_rising = get_goods_data_by_ids(table_name, sales_table_name, new_rising_goods, target_date, filter_mode=filter_mode)
-                if len(df_new_rising) > 0:
-                    category_goods_info['new_rising'] = get_goods_info_with_status(df_new_rising, table_name, sales_table_name)
-        
-        if len(new_declined_goods) > 0:
-            if 'new_declined' not in category_goods_info or len(category_goods_info['new_declined']) == 0:
-                df_new_declined = get_goods_data_by_ids(table_name, sales_table_name, new_declined_goods, target_date, filter_mode=filter_mode)
-                if len(df_new_declined) > 0:
-                    category_goods_info['new_declined'] = get_goods_info_with_status(df_new_declined, table_name, sales_table_name)
-        
-        if len(updated_to_rising_goods) > 0:
-            if 'updated_to_rising' not in category_goods_info or len(category_goods_info['updated_to_rising']) == 0:
-                df_updated_to_rising = get_goods_data_by_ids(table_name, sales_table_name, updated_to_rising_goods, target_date, filter_mode=filter_mode)
-                if len(df_updated_to_rising) > 0:
-                    category_goods_info['updated_to_rising'] = get_goods_info_with_status(df_updated_to_rising, table_name, sales_table_name)
-        
-        if len(back_to_rising_goods) > 0:
-            if 'back_to_rising' not in category_goods_info or len(category_goods_info['back_to_rising']) == 0:
-                df_back_to_rising = get_goods_data_by_ids(table_name, sales_table_name, back_to_rising_goods, target_date, filter_mode=filter_mode)
-                if len(df_back_to_rising) > 0:
-                    category_goods_info['back_to_rising'] = get_goods_info_with_status(df_back_to_rising, table_name, sales_table_name)
+        # 上升期/非上升期的商品信息已在 rising_info/declined_info 中，只在勾选时为出图取历史数据
+        if 'rising' in half_image_mode and len(df_rising) > 0:
+            category_goods['rising'] = list(df_rising['goods_id'].unique())
+        if 'declined' in half_image_mode and len(df_declined) > 0:
+            category_goods['declined'] = list(df_declined['goods_id'].unique())
         
-        if len(declined_from_rising_goods) > 0:
-            if 'declined_from_rising' not in category_goods_info or len(category_goods_info['declined_from_rising']) == 0:
-                df_declined_from_rising = get_goods_data_by_ids(table_name, sales_table_name, declined_from_rising_goods, target_date, filter_mode=filter_mode)
-                if len(df_declined_from_rising) > 0:
-                    category_goods_info['declined_from_rising'] = get_goods_info_with_status(df_declined_from_rising, table_name, sales_table_name)
-        
-        # 获取上升期和非上升期的商品信息（如果没有获取过）
-        if len(rising_goods_ids) > 0:
-            if 'rising' not in category_goods_info or len(category_goods_info['rising']) == 0:
-                df_rising_selected = get_goods_data_by_ids(table_name, sales_table_name, list(rising_goods_ids), target_date, filter_mode=filter_mode)
-                if len(df_rising_selected) > 0:
-                    category_goods_info['rising'] = get_goods_info_with_status(df_rising_selected, table_name, sales_table_name)
-        
-        if len(declined_goods_ids) > 0:
-            if 'declined' not in category_goods_info or len(category_goods_info['declined']) == 0:
-                df_declined_selected = get_goods_data_by_ids(table_name, sales_table_name, list(declined_goods_ids), target_date, filter_mode=filter_mode)
-                if len(df_declined_selected) > 0:
-                    category_goods_info['declined'] = get_goods_info_with_status(df_declined_selected, table_name, sales_table_name)
+        # 所有类别的商品历史只查询一次，再按类别拆分
+        section_images, section_goods_info = _build_category_sections(
+            table_name, sales_table_name, target_date, filter_mode, category_goods,
+            half_image_mode, chart_mode, lazy_images
+        )
+        category_images.update(section_images)
+        category_goods_info.update(section_goods_info)
         
         # 基本信息统计（参考看图专用NL.ipynb的格式）
         rising_summary = {}
@@ -2441,13 +2695,13 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
         # 保存缓存（不包含图片）
         save_dynamic_management_cache(
             table_name, target_date, stats, rising_info, declined_info,
-            rising_summary, declined_summary, analysis_time, total_summary
+            rising_summary, declined_summary, analysis_time, total_summary, watermark=watermark
         )
         
         # 构建返回数据，包含所有类别的数据
         return {
             'success': True,
-            'data': {
+            'data': _move_chart_payloads({
                 'statistics': stats,
                 'rising': {
                     'images': category_images.get('rising', []),
@@ -2482,7 +2736,7 @@ def dynamic_management(target_date=None, use_cache=True, half_image_mode=None, f
                         'goods_info': category_goods_info.get('declined_from_rising', [])
                     }
                 }
-            },
+            }),
             'error': None,
             'analysis_time': round(analysis_time, 2),
             'from_cache': False
@@ -2507,15 +2761,12 @@ def get_goods_all_history_data(table_name, sales_table_name, status, target_date
     status: 1=上升期, 2=非上升期
     """
     from config import get_db_config
-    import pymysql
     
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
+    traffic_config, _, _, _ = get_db_config()
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
         
         # 先找到目标日期有指定Status的商品
         query_goods = f"""
@@ -2548,31 +2799,17 @@ def get_goods_all_history_data(table_name, sales_table_name, status, target_date
         WHERE t.goods_id IN ({placeholders})
         ORDER BY t.goods_id, t.date_label;
         """
-        cursor.execute(query_history, goods_ids)
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
+        df = get_history_from_cache(table_name, sales_table_name, goods_ids)
+        if df is None:
+            df = fetch_dataframe_streaming(conn, query_history, goods_ids)
         
         # 数据清洗
-        if 'date_label' in df.columns:
-            df["date"] = pd.to_datetime(df["date_label"], dayfirst=True, errors="coerce")
-            df = df.dropna(subset=["date"])
-        
-        if "Product impressions" in df.columns:
-            df["Product impressions"] = pd.to_numeric(df["Product impressions"], errors="coerce").fillna(0)
-        
-        if "Product clicks" in df.columns:
-            df["Product clicks"] = pd.to_numeric(df["Product clicks"], errors="coerce").fillna(0)
-        
-        if "Buyers" in df.columns:
-            df["Buyers"] = pd.to_numeric(df["Buyers"], errors="coerce").fillna(0)
+        df = clean_history_frame(df)
         
         return df
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
 
 
 def get_goods_data_by_ids(table_name, sales_table_name, goods_ids, target_date, filter_mode=None):
@@ -2587,18 +2824,15 @@ def get_goods_data_by_ids(table_name, sales_table_name, goods_ids, target_date,
     返回: DataFrame
     """
     from config import get_db_config
-    import pymysql
     
     if len(goods_ids) == 0:
         return pd.DataFrame()
     
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
+    traffic_config, _, _, _ = get_db_config()
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
         
         # 获取这些商品的所有历史数据
         placeholders = ','.join(['%s'] * len(goods_ids))
@@ -2614,24 +2848,12 @@ def get_goods_data_by_ids(table_name, sales_table_name, goods_ids, target_date,
           AND t.date_label <= %s
         ORDER BY t.goods_id, t.date_label;
         """
-        cursor.execute(query_data, goods_ids + [target_date])
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
+        df = get_history_from_cache(table_name, sales_table_name, goods_ids, end_date=target_date)
+        if df is None:
+            df = fetch_dataframe_streaming(conn, query_data, goods_ids + [target_date])
         
         # 数据清洗
-        if 'date_label' in df.columns:
-            df["date"] = pd.to_datetime(df["date_label"], dayfirst=True, errors="coerce")
-            df = df.dropna(subset=["date"])
-        
-        if "Product impressions" in df.columns:
-            df["Product impressions"] = pd.to_numeric(df["Product impressions"], errors="coerce").fillna(0)
-        
-        if "Product clicks" in df.columns:
-            df["Product clicks"] = pd.to_numeric(df["Product clicks"], errors="coerce").fillna(0)
-        
-        if "Buyers" in df.columns:
-            df["Buyers"] = pd.to_numeric(df["Buyers"], errors="coerce").fillna(0)
+        df = clean_history_frame(df)
         
         # 应用过滤模式
         if filter_mode is not None:
@@ -2649,9 +2871,7 @@ def get_goods_data_by_ids(table_name, sales_table_name, goods_ids, target_date,
         return df
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
 
 
 def get_declined_from_rising_goods_data(table_name, sales_table_name, target_date):
@@ -2660,15 +2880,12 @@ def get_declined_from_rising_goods_data(table_name, sales_table_name, target_dat
     返回: DataFrame
     """
     from config import get_db_config
-    import pymysql
     
-    traffic_config, sales_config, pallet_config, product_config = get_db_config()
-    conn = pymysql.connect(**traffic_config)
-    conn_sales = pymysql.connect(**sales_config)
+    traffic_config, _, _, _ = get_db_config()
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
-        cursor_sales = conn_sales.cursor()
         
         # 获取前一天是Status=1，选定日期是Status=2的商品
         query = f"""
@@ -2706,31 +2923,17 @@ def get_declined_from_rising_goods_data(table_name, sales_table_name, target_dat
           AND t.date_label <= %s
         ORDER BY t.goods_id, t.date_label;
         """
-        cursor.execute(query_data, declined_goods_ids + [target_date])
-        columns = [desc[0] for desc in cursor.description]
-        data = cursor.fetchall()
-        df = pd.DataFrame(data, columns=columns)
+        df = get_history_from_cache(table_name, sales_table_name, declined_goods_ids, end_date=target_date)
+        if df is None:
+            df = fetch_dataframe_streaming(conn, query_data, declined_goods_ids + [target_date])
         
         # 数据清洗
-        if 'date_label' in df.columns:
-            df["date"] = pd.to_datetime(df["date_label"], dayfirst=True, errors="coerce")
-            df = df.dropna(subset=["date"])
-        
-        if "Product impressions" in df.columns:
-            df["Product impressions"] = pd.to_numeric(df["Product impressions"], errors="coerce").fillna(0)
-        
-        if "Product clicks" in df.columns:
-            df["Product clicks"] = pd.to_numeric(df["Product clicks"], errors="coerce").fillna(0)
-        
-        if "Buyers" in df.columns:
-            df["Buyers"] = pd.to_numeric(df["Buyers"], errors="coerce").fillna(0)
+        df = clean_history_frame(df)
         
         return df
     finally:
         cursor.close()
-        cursor_sales.close()
         conn.close()
-        conn_sales.close()
 
 
 def get_latest_reason_for_goods_ids(cursor, table_name, goods_ids):
@@ -2858,10 +3061,9 @@ def export_dynamic_management_data(target_date=None, export_format='xlsx', statu
             
             if needs_reason:
                 from config import get_db_config
-                import pymysql
                 
                 traffic_config, _, _, _ = get_db_config()
-                conn = pymysql.connect(**traffic_config)
+                conn = get_db_connection(traffic_config)
                 try:
                     cursor = conn.cursor()
                     
@@ -3,8 +3,8 @@
 功能3：优化效果数据
 """
 
-from db_utils import get_optimization_data
-from plot_utils import plot_goods_batch
+from db_utils import get_optimization_data, get_db_connection
+from plot_utils import plot_goods_charts, normalize_chart_mode, CHART_MODE_SERIES
 from config import get_current_table
 
 
@@ -14,10 +14,9 @@ def get_optimization_marked_dates(table_name, field_name):
     返回: dict {goods_id: date_label}
     """
     from config import get_db_config
-    import pymysql
     
     traffic_config, _, _, _ = get_db_config()
-    conn = pymysql.connect(**traffic_config)
+    conn = get_db_connection(traffic_config)
     
     try:
         cursor = conn.cursor()
@@ -44,10 +43,11 @@ def get_optimization_marked_dates(table_name, field_name):
         conn.close()
 
 
-def optimization_effect(field_name):
+def optimization_effect(field_name, chart_mode='image'):
     """
     优化效果数据功能
     field_name: 'Video' 或 'Price'
+    chart_mode: 'image' 返回base64图片（images）；'series' 返回序列数据（series），由浏览器绘制
     返回: {
         'success': bool,
         'data': dict or None,
@@ -91,7 +91,11 @@ def optimization_effect(field_name):
                     continue
         
         # 绘制图表，传入标记日期
-        images = plot_goods_batch(df, cols=3, marked_dates=marked_dates_for_plot)
+        charts = plot_goods_charts(df, chart_mode=chart_mode, cols=3, marked_dates=marked_dates_for_plot)
+        if normalize_chart_mode(chart_mode) == CHART_MODE_SERIES:
+            images, series = [], charts
+        else:
+            images, series = charts, None
         
         # 获取商品信息（包括标记日期）
         goods_info = []
@@ -116,6 +120,7 @@ def optimization_effect(field_name):
             'data': {
                 'field_name': field_name,
                 'images': images,
+                'series': series,
                 'goods_info': goods_info,
                 'marked_dates': marked_dates,
                 'summary': summary
@@ -6,13 +6,14 @@
 import os
 import re
 import pandas as pd
-import pymysql
 from datetime import datetime, timedelta
 from db_utils import (
     update_reason, update_video, update_price,
     check_date_exists, get_latest_date_label, get_yesterday_date,
-    get_db_connection
+    db_cursor, bulk_write_columns
 )
+from snapshot_utils import get_goods_snapshot, get_daily_snapshot, refresh_snapshot_after_write
+from xlsx_cache import read_goods_ids_from_dir
 from config import (
     get_current_table, get_db_config,
     load_auto_reason_config, save_auto_reason_config, get_auto_reason_restricted_dir
@@ -123,10 +124,8 @@ def get_available_dates(goods_id):
         table_name = get_current_table()
         
         traffic_config, _, _, _ = get_db_config()
-        conn = pymysql.connect(**traffic_config)
         
-        try:
-            cursor = conn.cursor()
+        with db_cursor(traffic_config) as cursor:
             query = f"""
             SELECT DISTINCT date_label
             FROM `{table_name}`
@@ -141,9 +140,6 @@ def get_available_dates(goods_id):
                 'success': True,
                 'dates': dates
             }
-        finally:
-            cursor.close()
-            conn.close()
     except Exception as e:
         return {
             'success': False,
@@ -270,46 +266,11 @@ def normalize_goods_id(goods_id_val):
 def read_restricted_goods_ids_from_xlsx(restricted_dir, site_name):
     """
     从限流数据xlsx文件中读取goods_id
-    从第3列（列名Goods ID）第3行开始读取
+    从第3列（列名Goods ID）第3行开始读取，解析结果按文件缓存（xlsx_cache），未变化的文件不再打开
     返回: set of goods_id
     """
-    restricted_goods_ids = set()
-    
     try:
-        restricted_site_dir = os.path.join(restricted_dir, site_name)
-        if not os.path.exists(restricted_site_dir):
-            return restricted_goods_ids
-        
-        restricted_files = [f for f in os.listdir(restricted_site_dir) if f.endswith('.xlsx')]
-        
-        for file in restricted_files:
-            file_path = os.path.join(restricted_site_dir, file)
-            try:
-                # 尝试读取Template sheet，如果不存在则读取第一个sheet
-                try:
-                    df = pd.read_excel(file_path, sheet_name='Template', header=None)
-                except:
-                    df = pd.read_excel(file_path, header=None)
-                
-                if len(df) > 2 and len(df.columns) > 2:
-                    # 从第3行（索引2）开始，读取第3列（索引2）的所有数据
-                    goods_id_column = df.iloc[2:, 2]
-                    for goods_id_val in goods_id_column:
-                        if pd.notna(goods_id_val):
-                            goods_id_str = str(goods_id_val).strip()
-                            if goods_id_str and goods_id_str.lower() not in ['nan', 'none', '']:
-                                # 处理可能的换行符、制表符等
-                                goods_id_str = goods_id_str.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
-                                ids = goods_id_str.split()
-                                for goods_id in ids:
-                                    normalized_id = normalize_goods_id(goods_id)
-                                    if normalized_id:
-                                        restricted_goods_ids.add(normalized_id)
-            except Exception as e:
-                print(f"读取限流文件 {file} 出错: {e}")
-                continue
-        
-        return restricted_goods_ids
+        return read_goods_ids_from_dir(os.path.join(restricted_dir, site_name), label='限流')
     
     except Exception as e:
         print(f"读取限流数据出错: {e}")
@@ -325,25 +286,20 @@ def get_product_status_goods(table_name, status_value):
     _, _, _, product_config = get_db_config()
     
     try:
-        conn = get_db_connection(product_config)
-        cursor = conn.cursor()
-        
-        query = f"""
-        SELECT DISTINCT goods_id
-        FROM `{table_name}`
-        WHERE detail_status = %s
-        """
-        cursor.execute(query, (status_value,))
-        results = cursor.fetchall()
-        
-        goods_ids = set()
-        for row in results:
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                goods_ids.add(normalized_id)
+        with db_cursor(product_config) as cursor:
+            query = f"""
+            SELECT DISTINCT goods_id
+            FROM `{table_name}`
+            WHERE detail_status = %s
+            """
+            cursor.execute(query, (status_value,))
+            results = cursor.fetchall()
         
-        cursor.close()
-        conn.close()
+            goods_ids = set()
+            for row in results:
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    goods_ids.add(normalized_id)
         
         return goods_ids
     
@@ -360,45 +316,36 @@ def get_dynamic_goods_with_yesterday_data(table_name, sales_table_name, target_d
     traffic_config, sales_config, _, _ = get_db_config()
     
     try:
-        conn_traffic = get_db_connection(traffic_config)
-        conn_sales = get_db_connection(sales_config)
-        cursor_traffic = conn_traffic.cursor()
-        cursor_sales = conn_sales.cursor()
-        
-        # 获取在target_date有数据的goods_id
-        query_traffic = f"""
-        SELECT DISTINCT goods_id
-        FROM `{table_name}`
-        WHERE date_label = %s
-        """
-        cursor_traffic.execute(query_traffic, (target_date,))
-        traffic_goods = set()
-        for row in cursor_traffic.fetchall():
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                traffic_goods.add(normalized_id)
-        
-        # 获取销售表中历史Buyers >= 1的动销品
-        query_sales = f"""
-        SELECT goods_id, SUM(COALESCE(Buyers, 0)) as total_buyers
-        FROM `{sales_table_name}`
-        GROUP BY goods_id
-        HAVING total_buyers >= 1
-        """
-        cursor_sales.execute(query_sales)
-        sales_goods = set()
-        for row in cursor_sales.fetchall():
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                sales_goods.add(normalized_id)
-        
-        # 取交集
-        result = traffic_goods.intersection(sales_goods)
+        with db_cursor(traffic_config) as cursor_traffic, db_cursor(sales_config) as cursor_sales:
+            # 获取在target_date有数据的goods_id
+            query_traffic = f"""
+            SELECT DISTINCT goods_id
+            FROM `{table_name}`
+            WHERE date_label = %s
+            """
+            cursor_traffic.execute(query_traffic, (target_date,))
+            traffic_goods = set()
+            for row in cursor_traffic.fetchall():
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    traffic_goods.add(normalized_id)
+        
+            # 获取销售表中历史Buyers >= 1的动销品
+            query_sales = f"""
+            SELECT goods_id, SUM(COALESCE(Buyers, 0)) as total_buyers
+            FROM `{sales_table_name}`
+            GROUP BY goods_id
+            HAVING total_buyers >= 1
+            """
+            cursor_sales.execute(query_sales)
+            sales_goods = set()
+            for row in cursor_sales.fetchall():
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    sales_goods.add(normalized_id)
         
-        cursor_traffic.close()
-        cursor_sales.close()
-        conn_traffic.close()
-        conn_sales.close()
+            # 取交集
+            result = traffic_goods.intersection(sales_goods)
         
         return result
     
@@ -412,26 +359,16 @@ def get_dynamic_goods_with_yesterday_data(table_name, sales_table_name, target_d
 def get_dynamic_goods_only(table_name, sales_table_name):
     """
     获取销售表中历史Buyers >= 1的动销品goods_id（不限定某日是否在流量表）
+    从商品快照的累计Buyers读取，不再对销售表做全表 GROUP BY
     返回: set of goods_id
     """
-    _, sales_config, _, _ = get_db_config()
     try:
-        conn = get_db_connection(sales_config)
-        cursor = conn.cursor()
-        query = f"""
-        SELECT goods_id
-        FROM `{sales_table_name}`
-        GROUP BY goods_id
-        HAVING SUM(COALESCE(Buyers, 0)) >= 1
-        """
-        cursor.execute(query)
+        snapshot = get_goods_snapshot(table_name, sales_table_name, columns=['goods_id'], where="total_buyers >= 1")
         goods_ids = set()
-        for row in cursor.fetchall():
-            normalized_id = normalize_goods_id(row[0])
+        for goods_id in snapshot['goods_id']:
+            normalized_id = normalize_goods_id(goods_id)
             if normalized_id:
                 goods_ids.add(normalized_id)
-        cursor.close()
-        conn.close()
         return goods_ids
     except Exception as e:
         print(f"获取动销品列表出错: {e}")
@@ -445,21 +382,18 @@ def get_traffic_goods_for_date(table_name, target_date):
     """
     traffic_config, _, _, _ = get_db_config()
     try:
-        conn = get_db_connection(traffic_config)
-        cursor = conn.cursor()
-        query = f"""
-        SELECT DISTINCT goods_id
-        FROM `{table_name}`
-        WHERE date_label = %s
-        """
-        cursor.execute(query, (target_date,))
-        goods_ids = set()
-        for row in cursor.fetchall():
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                goods_ids.add(normalized_id)
-        cursor.close()
-        conn.close()
+        with db_cursor(traffic_config) as cursor:
+            query = f"""
+            SELECT DISTINCT goods_id
+            FROM `{table_name}`
+            WHERE date_label = %s
+            """
+            cursor.execute(query, (target_date,))
+            goods_ids = set()
+            for row in cursor.fetchall():
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    goods_ids.add(normalized_id)
         return goods_ids
     except Exception as e:
         print(f"获取流量表当日商品出错: {e}")
@@ -473,15 +407,12 @@ def get_last_appearance_date(table_name, goods_id):
     """
     traffic_config, _, _, _ = get_db_config()
     try:
-        conn = get_db_connection(traffic_config)
-        cursor = conn.cursor()
-        query = f"""
-        SELECT MAX(date_label) FROM `{table_name}` WHERE goods_id = %s
-        """
-        cursor.execute(query, (goods_id,))
-        row = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with db_cursor(traffic_config) as cursor:
+            query = f"""
+            SELECT MAX(date_label) FROM `{table_name}` WHERE goods_id = %s
+            """
+            cursor.execute(query, (goods_id,))
+            row = cursor.fetchone()
         return row[0] if row and row[0] else None
     except Exception as e:
         print(f"获取最后出现日期出错: {e}")
@@ -490,24 +421,12 @@ def get_last_appearance_date(table_name, goods_id):
 
 def check_has_yesterday_data(table_name, target_date):
     """
-    检查流量表中是否有target_date的数据
+    检查流量表中是否有target_date的数据（读取每日汇总）
     返回: (has_data, count)
     """
-    traffic_config, _, _, _ = get_db_config()
-    
     try:
-        conn = get_db_connection(traffic_config)
-        cursor = conn.cursor()
-        
-        query = f"""
-        SELECT COUNT(*) FROM `{table_name}` WHERE date_label = %s
-        """
-        cursor.execute(query, (target_date,))
-        result = cursor.fetchone()
-        count = result[0] if result else 0
-        
-        cursor.close()
-        conn.close()
+        daily = get_daily_snapshot(table_name, f"{table_name}_Sales", target_date, target_date)
+        count = int(daily['traffic_row_count'].iloc[0]) if not daily.empty else 0
         
         return count > 0, count
     
@@ -524,20 +443,15 @@ def get_goods_reason_history(table_name, goods_id):
     traffic_config, _, _, _ = get_db_config()
     
     try:
-        conn = get_db_connection(traffic_config)
-        cursor = conn.cursor()
-        
-        query = f"""
-        SELECT date_label, Reason
-        FROM `{table_name}`
-        WHERE goods_id = %s AND Reason IS NOT NULL AND Reason != ''
-        ORDER BY date_label DESC
-        """
-        cursor.execute(query, (goods_id,))
-        results = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        with db_cursor(traffic_config) as cursor:
+            query = f"""
+            SELECT date_label, Reason
+            FROM `{table_name}`
+            WHERE goods_id = %s AND Reason IS NOT NULL AND Reason != ''
+            ORDER BY date_label DESC
+            """
+            cursor.execute(query, (goods_id,))
+            results = cursor.fetchall()
         
         return results
     
@@ -596,6 +510,153 @@ def get_previous_abnormal_status(table_name, goods_id):
     return None
 
 
+# 异常状态类型（已有这些记录的商品不再重复标记；恢复正常时写入 Normal (Xxx_MMDD)）
+ABNORMAL_REASON_TYPES = ['Out_of_stock', 'Blocked', 'Secondary_traffic_restricted']
+
+
+def load_goods_reason_context(table_name, goods_ids):
+    """
+    一次性加载候选商品的Reason摘要，代替逐个商品调用 has_previous_status_record /
+    get_previous_abnormal_status / get_goods_reason_history / get_last_appearance_date
+    返回: {goods_id: {'last_abnormal': 最近的异常状态类型或None,
+                      'latest_reason': 最近一条非空Reason或None,
+                      'last_date': 流量表最后出现日期}}
+    goods_id 为标准化后的字符串；流量表中没有记录的商品不在结果中
+    """
+    goods_ids = sorted(goods_ids)
+    context = {}
+    if not goods_ids:
+        return context
+    
+    traffic_config, _, _, _ = get_db_config()
+    placeholders = ','.join(['%s'] * len(goods_ids))
+    
+    with db_cursor(traffic_config) as cursor:
+        # 最后出现日期与最近一条非空Reason
+        query = f"""
+        SELECT
+          a.goods_id,
+          a.last_date,
+          (SELECT t2.Reason FROM `{table_name}` t2
+            WHERE t2.goods_id = a.goods_id AND t2.date_label = a.latest_reason_date
+              AND t2.Reason IS NOT NULL AND t2.Reason != '' LIMIT 1)
+        FROM (
+            SELECT
+              goods_id,
+              MAX(date_label) AS last_date,
+              MAX(CASE WHEN Reason IS NOT NULL AND Reason != '' THEN date_label END) AS latest_reason_date
+            FROM `{table_name}`
+            WHERE goods_id IN ({placeholders})
+            GROUP BY goods_id
+        ) a
+        """
+        cursor.execute(query, goods_ids)
+        for goods_id, last_date, latest_reason in cursor.fetchall():
+            normalized_id = normalize_goods_id(goods_id)
+            if normalized_id:
+                context[normalized_id] = {
+                    'last_abnormal': None,
+                    'latest_reason': latest_reason,
+                    'last_date': last_date
+                }
+        
+        # 异常状态只在首次出现时标记，记录很少：先按前缀筛选，再用 parse_reason_type 精确判断
+        like_conditions = ' OR '.join(['TRIM(Reason) LIKE %s'] * len(ABNORMAL_REASON_TYPES))
+        query = f"""
+        SELECT goods_id, Reason
+        FROM `{table_name}`
+        WHERE goods_id IN ({placeholders})
+          AND ({like_conditions})
+        ORDER BY goods_id, date_label
+        """
+        cursor.execute(query, goods_ids + [reason_type.replace('_', '\\_') + '%' for reason_type in ABNORMAL_REASON_TYPES])
+        for goods_id, reason in cursor.fetchall():
+            reason_type = parse_reason_type(reason)
+            entry = context.get(normalize_goods_id(goods_id))
+            if entry is not None and reason_type in ABNORMAL_REASON_TYPES:
+                entry['last_abnormal'] = reason_type
+    
+    return context
+
+
+def decide_auto_reasons(date_suffix, out_of_stock_set, blocked_set, restricted_set, normal_set, normal_at_risk_set,
+                        missing_yesterday, out_of_stock_goods, reason_context):
+    """
+    根据 load_goods_reason_context 的结果在内存中一次性决定各商品的Reason，规则与逐个查询时相同：
+        缺货/封禁/二次限流：已有异常状态记录的跳过
+        正常品：有风险的标 Normal (Blocking_MMDD)，曾有异常状态的标 Normal (Xxx_MMDD)，其余标 Normal (MMDD)
+        回填：昨日无数据的缺货/封禁动销品，最近一条Reason不是缺货/封禁时在最后出现日期上标记
+    返回: (goods_reason_dict, backfill_list, stats)
+        goods_reason_dict: {goods_id: reason}，写入昨日记录
+        backfill_list: [(goods_id, 最后出现日期, reason), ...]
+    """
+    def last_abnormal(goods_id):
+        return reason_context.get(goods_id, {}).get('last_abnormal')
+    
+    goods_reason_dict = {}
+    stats = {
+        'out_of_stock': 0,
+        'blocked': 0,
+        'secondary_traffic_restricted': 0,
+        'normal': 0,
+        'normal_recovered': 0,
+        'normal_blocking': 0,
+        'skipped': 0,
+        'out_of_stock_backfill': 0,
+        'blocked_backfill': 0
+    }
+    
+    # 1. 缺货  2. 封禁（统一为 Blocked (MMDD)）  3. 二次限流（去除封禁的）
+    for goods_set, reason_type, stats_key in (
+        (out_of_stock_set, 'Out_of_stock', 'out_of_stock'),
+        (blocked_set, 'Blocked', 'blocked'),
+        (restricted_set - blocked_set, 'Secondary_traffic_restricted', 'secondary_traffic_restricted')
+    ):
+        for goods_id in goods_set:
+            if last_abnormal(goods_id):
+                stats['skipped'] += 1
+                continue
+            goods_reason_dict[goods_id] = f"{reason_type} ({date_suffix})"
+            stats[stats_key] += 1
+    
+    # 4. 正常品
+    for goods_id in normal_set:
+        # 有风险的正常品（优先级最高）
+        if goods_id in normal_at_risk_set:
+            goods_reason_dict[goods_id] = f"Normal (Blocking_{date_suffix})"
+            stats['normal_blocking'] += 1
+            continue
+        
+        # 之前有异常状态记录（恢复正常）
+        prev_status = last_abnormal(goods_id)
+        if prev_status:
+            goods_reason_dict[goods_id] = f"Normal ({prev_status}_{date_suffix})"
+            stats['normal_recovered'] += 1
+            continue
+        
+        # 普通正常
+        goods_reason_dict[goods_id] = f"Normal ({date_suffix})"
+        stats['normal'] += 1
+    
+    # 5. 回填：有历史且最近一条已是缺货/封禁则跳过；历史为空（从未标过Reason）仍回填
+    backfill_list = []
+    for goods_id in missing_yesterday:
+        entry = reason_context.get(goods_id)
+        if entry is None or not entry['last_date']:
+            continue
+        if parse_reason_type(entry['latest_reason']) in ('Out_of_stock', 'Blocked'):
+            continue
+        if goods_id in out_of_stock_goods:
+            reason_str = f"Out_of_stock ({date_suffix})"
+            stats['out_of_stock_backfill'] += 1
+        else:
+            reason_str = f"Blocked ({date_suffix})"
+            stats['blocked_backfill'] += 1
+        backfill_list.append((goods_id, entry['last_date'], reason_str))
+    
+    return goods_reason_dict, backfill_list, stats
+
+
 def batch_update_reason(table_name, goods_reason_dict, target_date):
     """
     批量更新Reason字段
@@ -609,29 +670,19 @@ def batch_update_reason(table_name, goods_reason_dict, target_date):
     errors = []
     
     try:
-        conn = get_db_connection(traffic_config)
-        cursor = conn.cursor()
-        
-        for goods_id, reason in goods_reason_dict.items():
-            try:
-                query = f"""
-                UPDATE `{table_name}` 
-                SET Reason = %s 
-                WHERE goods_id = %s AND date_label = %s
-                """
-                cursor.execute(query, (reason, goods_id, target_date))
-                if cursor.rowcount > 0:
+        with db_cursor(traffic_config) as cursor:
+            rows = [(goods_id, target_date, 'Reason', reason) for goods_id, reason in goods_reason_dict.items()]
+            matched, _ = bulk_write_columns(cursor, table_name, rows)
+            for (goods_id, _, _, _), found in zip(rows, matched):
+                if found:
                     success_count += 1
                 else:
                     fail_count += 1
                     errors.append(f"[昨日更新] goods_id={goods_id} date={target_date}: 未找到记录（可能流量表与商品表/销售表 goods_id 格式不一致，如前导零）")
-            except Exception as e:
-                fail_count += 1
-                errors.append(f"goods_id {goods_id}: {str(e)}")
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            cursor.connection.commit()
+            refresh_snapshot_after_write(cursor, table_name, list(goods_reason_dict.keys()), dates=[target_date],
+                                         columns=['Reason'])
         
         return success_count, fail_count, errors
     
@@ -651,41 +702,36 @@ def batch_update_reason_multi_date(table_name, goods_date_reason_list):
     fail_count = 0
     errors = []
     try:
-        conn = get_db_connection(traffic_config)
-        cursor = conn.cursor()
-        for goods_id, date_label, reason in goods_date_reason_list:
-            try:
-                query = f"""
-                UPDATE `{table_name}`
-                SET Reason = %s
-                WHERE goods_id = %s AND date_label = %s
-                """
-                cursor.execute(query, (reason, goods_id, date_label))
-                if cursor.rowcount > 0:
+        with db_cursor(traffic_config) as cursor:
+            rows = [(goods_id, date_label, 'Reason', reason) for goods_id, date_label, reason in goods_date_reason_list]
+            matched, _ = bulk_write_columns(cursor, table_name, rows)
+            for (goods_id, date_label, _, _), found in zip(rows, matched):
+                if found:
                     success_count += 1
                 else:
                     fail_count += 1
                     errors.append(f"[回填] goods_id={goods_id} date={date_label}: 未找到记录")
-            except Exception as e:
-                fail_count += 1
-                errors.append(f"[回填] goods_id={goods_id} date={date_label}: {str(e)}")
-        conn.commit()
-        cursor.close()
-        conn.close()
+            cursor.connection.commit()
+            refresh_snapshot_after_write(
+                cursor, table_name, [item[0] for item in goods_date_reason_list],
+                dates=[item[1] for item in goods_date_reason_list], columns=['Reason']
+            )
         return success_count, fail_count, errors
     except Exception as e:
         print(f"批量更新Reason(多日期)出错: {e}")
         return 0, len(goods_date_reason_list), [str(e)]
 
 
-def auto_update_reason():
+def auto_update_reason(table_name=None):
     """
     自动更新Reason主函数
     只能更新昨天的数据
+    参数:
+        table_name: 要更新的表名，为None时使用当前表（后台任务在提交时确定表名）
     """
     try:
         # 获取当前表名和昨天日期
-        table_name = get_current_table()
+        table_name = table_name or get_current_table()
         sales_table_name = f"{table_name}_Sales"
         yesterday = get_yesterday_date()
         
@@ -743,97 +789,24 @@ def auto_update_reason():
         # 有风险的正常品
         normal_at_risk_set = normal_set.intersection(at_risk_goods)
         
-        # 准备更新字典
-        goods_reason_dict = {}
-        stats = {
-            'out_of_stock': 0,
-            'blocked': 0,
-            'secondary_traffic_restricted': 0,
-            'normal': 0,
-            'normal_recovered': 0,
-            'normal_blocking': 0,
-            'skipped': 0
-        }
-        
-        # 异常状态类型列表（用于检查是否已有记录）
-        abnormal_status_types = ['Out_of_stock', 'Blocked', 'Secondary_traffic_restricted']
-        
-        # 1. 处理缺货
-        for goods_id in out_of_stock_set:
-            has_record, _ = has_previous_status_record(table_name, goods_id, abnormal_status_types)
-            if has_record:
-                stats['skipped'] += 1
-                continue
-            goods_reason_dict[goods_id] = f"Out_of_stock ({date_suffix})"
-            stats['out_of_stock'] += 1
-        
-        # 2. 处理封禁（统一为 Blocked (MMDD)）
-        for goods_id in blocked_set:
-            has_record, _ = has_previous_status_record(table_name, goods_id, abnormal_status_types)
-            if has_record:
-                stats['skipped'] += 1
-                continue
-            goods_reason_dict[goods_id] = f"Blocked ({date_suffix})"
-            stats['blocked'] += 1
-        
-        # 3. 处理二次限流（去除封禁的）
-        pure_restricted_set = restricted_set - blocked_set
-        for goods_id in pure_restricted_set:
-            has_record, _ = has_previous_status_record(table_name, goods_id, abnormal_status_types)
-            if has_record:
-                stats['skipped'] += 1
-                continue
-            goods_reason_dict[goods_id] = f"Secondary_traffic_restricted ({date_suffix})"
-            stats['secondary_traffic_restricted'] += 1
-        
-        # 4. 处理正常品
-        for goods_id in normal_set:
-            # 检查是否是有风险的正常品（优先级最高）
-            if goods_id in normal_at_risk_set:
-                goods_reason_dict[goods_id] = f"Normal (Blocking_{date_suffix})"
-                stats['normal_blocking'] += 1
-                continue
-            
-            # 检查是否有之前的异常状态记录（恢复正常）
-            prev_status = get_previous_abnormal_status(table_name, goods_id)
-            if prev_status:
-                goods_reason_dict[goods_id] = f"Normal ({prev_status}_{date_suffix})"
-                stats['normal_recovered'] += 1
-                continue
-            
-            # 普通正常
-            goods_reason_dict[goods_id] = f"Normal ({date_suffix})"
-            stats['normal'] += 1
-        
-        # 执行批量更新（昨日有数据的记录）
-        success_count, fail_count, errors = batch_update_reason(table_name, goods_reason_dict, yesterday)
-        
-        # 回填：昨天流量表无数据、但商品表为缺货/封禁、且为动销品、且历史最近Reason未标缺货/封禁 -> 在最后出现日期上标缺货或封禁+昨日日期
+        # 回填候选：昨天流量表无数据、但商品表为缺货/封禁的动销品
         dynamic_goods = get_dynamic_goods_only(table_name, sales_table_name)
         traffic_goods_yesterday = get_traffic_goods_for_date(table_name, yesterday)
         out_of_stock_dynamic = out_of_stock_goods.intersection(dynamic_goods)
         blocked_dynamic = blocked_goods.intersection(dynamic_goods)
         missing_yesterday = (out_of_stock_dynamic.union(blocked_dynamic)) - traffic_goods_yesterday
-        backfill_list = []
-        stats['out_of_stock_backfill'] = 0
-        stats['blocked_backfill'] = 0
-        for goods_id in missing_yesterday:
-            history = get_goods_reason_history(table_name, goods_id)
-            # 有历史且最近一条已是缺货/封禁则跳过；历史为空（从未标过Reason）仍回填
-            if history:
-                last_reason_type = parse_reason_type(history[0][1])
-                if last_reason_type in ('Out_of_stock', 'Blocked'):
-                    continue
-            last_date = get_last_appearance_date(table_name, goods_id)
-            if not last_date:
-                continue
-            if goods_id in out_of_stock_goods:
-                reason_str = f"Out_of_stock ({date_suffix})"
-                stats['out_of_stock_backfill'] += 1
-            else:
-                reason_str = f"Blocked ({date_suffix})"
-                stats['blocked_backfill'] += 1
-            backfill_list.append((goods_id, last_date, reason_str))
+        
+        # 一次性加载所有候选商品的Reason摘要，再在内存中决定各商品的Reason
+        reason_context = load_goods_reason_context(table_name, base_goods_ids | missing_yesterday)
+        goods_reason_dict, backfill_list, stats = decide_auto_reasons(
+            date_suffix, out_of_stock_set, blocked_set, restricted_set, normal_set, normal_at_risk_set,
+            missing_yesterday, out_of_stock_goods, reason_context
+        )
+        
+        # 执行批量更新（昨日有数据的记录）
+        success_count, fail_count, errors = batch_update_reason(table_name, goods_reason_dict, yesterday)
+        
+        # 回填：在最后出现日期上标缺货或封禁+昨日日期
         if backfill_list:
             backfill_success, backfill_fail, backfill_errors = batch_update_reason_multi_date(table_name, backfill_list)
             success_count += backfill_success
@@ -956,97 +929,24 @@ def auto_update_reason_for_table(table_name):
         # 有风险的正常品
         normal_at_risk_set = normal_set.intersection(at_risk_goods)
         
-        # 准备更新字典
-        goods_reason_dict = {}
-        stats = {
-            'out_of_stock': 0,
-            'blocked': 0,
-            'secondary_traffic_restricted': 0,
-            'normal': 0,
-            'normal_recovered': 0,
-            'normal_blocking': 0,
-            'skipped': 0
-        }
-        
-        # 异常状态类型列表（用于检查是否已有记录）
-        abnormal_status_types = ['Out_of_stock', 'Blocked', 'Secondary_traffic_restricted']
-        
-        # 1. 处理缺货
-        for goods_id in out_of_stock_set:
-            has_record, _ = has_previous_status_record(table_name, goods_id, abnormal_status_types)
-            if has_record:
-                stats['skipped'] += 1
-                continue
-            goods_reason_dict[goods_id] = f"Out_of_stock ({date_suffix})"
-            stats['out_of_stock'] += 1
-        
-        # 2. 处理封禁（统一为 Blocked (MMDD)）
-        for goods_id in blocked_set:
-            has_record, _ = has_previous_status_record(table_name, goods_id, abnormal_status_types)
-            if has_record:
-                stats['skipped'] += 1
-                continue
-            goods_reason_dict[goods_id] = f"Blocked ({date_suffix})"
-            stats['blocked'] += 1
-        
-        # 3. 处理二次限流（去除封禁的）
-        pure_restricted_set = restricted_set - blocked_set
-        for goods_id in pure_restricted_set:
-            has_record, _ = has_previous_status_record(table_name, goods_id, abnormal_status_types)
-            if has_record:
-                stats['skipped'] += 1
-                continue
-            goods_reason_dict[goods_id] = f"Secondary_traffic_restricted ({date_suffix})"
-            stats['secondary_traffic_restricted'] += 1
-        
-        # 4. 处理正常品
-        for goods_id in normal_set:
-            # 检查是否是有风险的正常品（优先级最高）
-            if goods_id in normal_at_risk_set:
-                goods_reason_dict[goods_id] = f"Normal (Blocking_{date_suffix})"
-                stats['normal_blocking'] += 1
-                continue
-            
-            # 检查是否有之前的异常状态记录（恢复正常）
-            prev_status = get_previous_abnormal_status(table_name, goods_id)
-            if prev_status:
-                goods_reason_dict[goods_id] = f"Normal ({prev_status}_{date_suffix})"
-                stats['normal_recovered'] += 1
-                continue
-            
-            # 普通正常
-            goods_reason_dict[goods_id] = f"Normal ({date_suffix})"
-            stats['normal'] += 1
-        
-        # 执行批量更新（昨日有数据的记录）
-        success_count, fail_count, errors = batch_update_reason(table_name, goods_reason_dict, yesterday)
-        
-        # 回填：昨天流量表无数据、但商品表为缺货/封禁、且为动销品、且历史最近Reason未标缺货/封禁 -> 在最后出现日期上标缺货或封禁+昨日日期
+        # 回填候选：昨天流量表无数据、但商品表为缺货/封禁的动销品
         dynamic_goods = get_dynamic_goods_only(table_name, sales_table_name)
         traffic_goods_yesterday = get_traffic_goods_for_date(table_name, yesterday)
         out_of_stock_dynamic = out_of_stock_goods.intersection(dynamic_goods)
         blocked_dynamic = blocked_goods.intersection(dynamic_goods)
         missing_yesterday = (out_of_stock_dynamic.union(blocked_dynamic)) - traffic_goods_yesterday
-        backfill_list = []
-        stats['out_of_stock_backfill'] = 0
-        stats['blocked_backfill'] = 0
-        for goods_id in missing_yesterday:
-            history = get_goods_reason_history(table_name, goods_id)
-            # 有历史且最近一条已是缺货/封禁则跳过；历史为空（从未标过Reason）仍回填
-            if history:
-                last_reason_type = parse_reason_type(history[0][1])
-                if last_reason_type in ('Out_of_stock', 'Blocked'):
-                    continue
-            last_date = get_last_appearance_date(table_name, goods_id)
-            if not last_date:
-                continue
-            if goods_id in out_of_stock_goods:
-                reason_str = f"Out_of_stock ({date_suffix})"
-                stats['out_of_stock_backfill'] += 1
-            else:
-                reason_str = f"Blocked ({date_suffix})"
-                stats['blocked_backfill'] += 1
-            backfill_list.append((goods_id, last_date, reason_str))
+        
+        # 一次性加载所有候选商品的Reason摘要，再在内存中决定各商品的Reason
+        reason_context = load_goods_reason_context(table_name, base_goods_ids | missing_yesterday)
+        goods_reason_dict, backfill_list, stats = decide_auto_reasons(
+            date_suffix, out_of_stock_set, blocked_set, restricted_set, normal_set, normal_at_risk_set,
+            missing_yesterday, out_of_stock_goods, reason_context
+        )
+        
+        # 执行批量更新（昨日有数据的记录）
+        success_count, fail_count, errors = batch_update_reason(table_name, goods_reason_dict, yesterday)
+        
+        # 回填：在最后出现日期上标缺货或封禁+昨日日期
         if backfill_list:
             backfill_success, backfill_fail, backfill_errors = batch_update_reason_multi_date(table_name, backfill_list)
             success_count += backfill_success
@@ -13,13 +13,17 @@ import os
 import json
 from datetime import datetime, timedelta
 from flask import jsonify, request
-from db_utils import get_db_connection
+from db_utils import db_cursor
 from config import (
-    load_config, save_config, get_current_table, get_db_config,
+    load_config, save_config, get_config_section, get_current_table, get_db_config,
     DEFAULT_DB_CONFIG, DEFAULT_SALES_DB_CONFIG,
     DEFAULT_PALLET_DB_CONFIG, DEFAULT_PRODUCT_DB_CONFIG
 )
 from plot_utils import plot_to_base64
+from chart_cache import chart_cache_key, get_or_render_chart
+from cache_store import load_cache_file, save_cache_file
+from xlsx_cache import read_goods_ids_from_dirs
+from snapshot_utils import get_cache_watermark, compare_cache_watermark
 
 
 def get_eastern_europe_time():
@@ -57,8 +61,7 @@ def normalize_goods_id(goods_id_val):
 
 def load_indicator_config():
     """加载指标计算配置文件"""
-    config = load_config()
-    return config.get('indicator_config', {
+    return get_config_section('indicator_config', {
         'unpriced_data_dir': '',
         'traffic_restricted_data_dir': ''
     })
@@ -66,39 +69,92 @@ def load_indicator_config():
 
 # ===== 缓存功能 =====
 
-def get_indicator_cache_file_path(table_name, target_date):
+def get_indicator_cache_file_path(table_name, target_date, extension='cache'):
     """
     获取缓存文件路径
+    extension: 'cache' 为分段压缩格式（cache_store），'json' 为旧版JSON缓存
     返回: 缓存文件路径
     """
     cache_dir = 'Cache_Indicator'
     if not os.path.exists(cache_dir):
         os.makedirs(cache_dir)
     
-    # 文件名格式：表名_日期.json，例如：FR_2025-12-16.json
+    # 文件名格式：表名_日期.cache，例如：FR_2025-12-16.cache
     # 去掉表名中的ROA1_前缀（如果存在）
     table_suffix = table_name.replace('ROA1_', '')
-    filename = f"{table_suffix}_{target_date}.json"
+    filename = f"{table_suffix}_{target_date}.{extension}"
     return os.path.join(cache_dir, filename)
 
 
-def load_indicator_cache(table_name, target_date):
+def load_indicator_cache(table_name, target_date, sections=None):
     """
     加载指标计算缓存
+    sections: 只读取这些部分（如 ['analysis_time']），None表示全部
     返回: 缓存数据字典，如果不存在则返回None
     """
     try:
-        cache_file = get_indicator_cache_file_path(table_name, target_date)
-        if os.path.exists(cache_file):
-            with open(cache_file, 'r', encoding='utf-8') as f:
+        cache_data = load_cache_file(get_indicator_cache_file_path(table_name, target_date), sections=sections)
+        if cache_data is not None:
+            return cache_data
+        
+        # 兼容旧版JSON缓存
+        legacy_file = get_indicator_cache_file_path(table_name, target_date, extension='json')
+        if os.path.exists(legacy_file):
+            with open(legacy_file, 'r', encoding='utf-8') as f:
                 cache_data = json.load(f)
-                return cache_data
+            if sections is not None:
+                cache_data = {key: value for key, value in cache_data.items() if key in sections}
+            return cache_data
         return None
     except Exception as e:
         print(f"加载指标缓存失败: {e}")
         return None
 
 
+def get_indicator_cache_watermark(table_name, sales_table_name, target_date):
+    """
+    指标缓存的源数据水位：截至 target_date 的流量/销售数据、该站点未核价/限流xlsx目录、
+    商品表中 Active/At Risk 每种状态的 [商品数, goods_id的CRC32异或指纹]；获取失败返回 None
+    只看商品数时，同一状态下一个商品换成另一个商品（数量不变）检测不到，指纹可以区分
+    """
+    config = load_indicator_config()
+    xlsx_dirs = [os.path.join(data_dir, table_name)
+                 for data_dir in (config.get('unpriced_data_dir', ''), config.get('traffic_restricted_data_dir', ''))
+                 if data_dir]
+    try:
+        watermark = get_cache_watermark(table_name, sales_table_name, target_date, columns=(), xlsx_dirs=xlsx_dirs)
+        _, _, _, product_config = get_db_config()
+        with db_cursor(product_config) as cursor:
+            cursor.execute(f"""
+            SELECT detail_status, COUNT(*), BIT_XOR(CRC32(goods_id))
+            FROM (
+                SELECT DISTINCT detail_status, goods_id
+                FROM `{table_name}`
+                WHERE detail_status IN ('Active', 'At Risk')
+            ) p
+            GROUP BY detail_status
+            """)
+            # 列表形式与缓存文件中JSON读回的值一致
+            watermark['products'] = {status: [count, int(fingerprint)] for status, count, fingerprint in cursor.fetchall()}
+        return watermark
+    except Exception as e:
+        print(f"获取指标缓存水位失败: {e}")
+        return None
+
+
+def is_indicator_cache_fresh(table_name, target_date, watermark):
+    """缓存存在且水位未变化时返回True（没有水位的旧版缓存视为过期；无法获取当前水位时按未过期处理）"""
+    saved = load_indicator_cache(table_name, target_date, sections=['watermark'])
+    if saved is None:
+        return False
+    if watermark is None:
+        return True
+    changed = compare_cache_watermark(saved.get('watermark'), watermark)
+    if changed:
+        print(f"[缓存过期] 源数据已变化: {', '.join(sorted(changed))}")
+    return not changed
+
+
 def convert_to_json_serializable(obj):
     """
     递归转换对象为JSON可序列化的类型
@@ -119,7 +175,7 @@ def convert_to_json_serializable(obj):
         return str(obj)
 
 
-def save_indicator_cache(table_name, target_date, results, analysis_time):
+def save_indicator_cache(table_name, target_date, results, analysis_time, watermark=None):
     """
     保存指标计算缓存
     参数:
@@ -127,6 +183,7 @@ def save_indicator_cache(table_name, target_date, results, analysis_time):
         target_date: 目标日期
         results: 计算结果字典
         analysis_time: 分析耗时
+        watermark: 计算开始前的源数据水位（get_indicator_cache_watermark），读取时据此判断缓存是否过期
     """
     try:
         cache_file = get_indicator_cache_file_path(table_name, target_date)
@@ -151,9 +208,10 @@ def save_indicator_cache(table_name, target_date, results, analysis_time):
             else:
                 # 转换所有数据为JSON可序列化格式
                 cache_data['results'][key] = convert_to_json_serializable(value)
+        if watermark is not None:
+            cache_data['watermark'] = watermark
         
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        save_cache_file(cache_file, cache_data)
         
         print(f"指标缓存已保存到: {cache_file}")
     except Exception as e:
@@ -171,81 +229,15 @@ def save_indicator_config(config_data):
 
 def read_excel_files_to_goods_ids(unpriced_dir, restricted_dir, site_name):
     """
-    从Excel文件读取goods_id数据（实际读取文件）
-    返回: (unpriced_goods_ids, restricted_goods_ids, unpriced_file_paths_mtimes, restricted_file_paths_mtimes)
+    从Excel文件读取goods_id数据（第3列第3行开始），解析结果按文件缓存（xlsx_cache），未变化的文件不再打开，
+    两个目录中需要解析的文件一起并行解析；出错的文件打印后跳过
+    返回: (unpriced_goods_ids, restricted_goods_ids)
     """
-    unpriced_goods_ids = set()
-    restricted_goods_ids = set()
-
     try:
-        # 处理未核价数据
-        unpriced_site_dir = os.path.join(unpriced_dir, site_name)
-        if os.path.exists(unpriced_site_dir):
-            unpriced_files = [f for f in os.listdir(unpriced_site_dir) if f.endswith('.xlsx')]
-
-            for file in unpriced_files:
-                file_path = os.path.join(unpriced_site_dir, file)
-                try:
-                    # 尝试读取Template sheet，如果不存在则读取第一个sheet
-                    try:
-                        df = pd.read_excel(file_path, sheet_name='Template', header=None)
-                    except:
-                        df = pd.read_excel(file_path, header=None)
-                    
-                    if len(df) > 2 and len(df.columns) > 2:  # 确保有至少3行3列
-                        # 从第3行（索引2）开始，读取第3列（索引2）的所有数据
-                        goods_id_column = df.iloc[2:, 2]  # 从第3行开始的所有行的第3列
-                        for goods_id_val in goods_id_column:
-                            if pd.notna(goods_id_val):
-                                goods_id_str = str(goods_id_val).strip()
-                                if goods_id_str and goods_id_str.lower() not in ['nan', 'none', '']:
-                                    # goods_id可能是单个ID，也可能是多个用空格分隔的ID
-                                    # 处理可能的换行符、制表符等
-                                    goods_id_str = goods_id_str.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
-                                    ids = goods_id_str.split()
-                                    for goods_id in ids:
-                                        # 使用标准化函数处理goods_id
-                                        normalized_id = normalize_goods_id(goods_id)
-                                        if normalized_id:
-                                            unpriced_goods_ids.add(normalized_id)
-                except Exception as e:
-                    print(f"读取未核价文件 {file} 出错: {e}")
-                    continue
-
-        # 处理限流数据
-        restricted_site_dir = os.path.join(restricted_dir, site_name)
-        if os.path.exists(restricted_site_dir):
-            restricted_files = [f for f in os.listdir(restricted_site_dir) if f.endswith('.xlsx')]
-
-            for file in restricted_files:
-                file_path = os.path.join(restricted_site_dir, file)
-                try:
-                    # 尝试读取Template sheet，如果不存在则读取第一个sheet
-                    try:
-                        df = pd.read_excel(file_path, sheet_name='Template', header=None)
-                    except:
-                        df = pd.read_excel(file_path, header=None)
-                    
-                    if len(df) > 2 and len(df.columns) > 2:  # 确保有至少3行3列
-                        # 从第3行（索引2）开始，读取第3列（索引2）的所有数据
-                        goods_id_column = df.iloc[2:, 2]  # 从第3行开始的所有行的第3列
-                        for goods_id_val in goods_id_column:
-                            if pd.notna(goods_id_val):
-                                goods_id_str = str(goods_id_val).strip()
-                                if goods_id_str and goods_id_str.lower() not in ['nan', 'none', '']:
-                                    # goods_id可能是单个ID，也可能是多个用空格分隔的ID
-                                    # 处理可能的换行符、制表符等
-                                    goods_id_str = goods_id_str.replace('\n', ' ').replace('\r', ' ').replace('\t', ' ')
-                                    ids = goods_id_str.split()
-                                    for goods_id in ids:
-                                        # 使用标准化函数处理goods_id
-                                        normalized_id = normalize_goods_id(goods_id)
-                                        if normalized_id:
-                                            restricted_goods_ids.add(normalized_id)
-                except Exception as e:
-                    print(f"读取限流文件 {file} 出错: {e}")
-                    continue
-
+        (unpriced_goods_ids, restricted_goods_ids), _ = read_goods_ids_from_dirs([
+            (os.path.join(unpriced_dir, site_name), '未核价'),
+            (os.path.join(restricted_dir, site_name), '限流')
+        ])
         return unpriced_goods_ids, restricted_goods_ids
 
     except Exception as e:
@@ -320,41 +312,36 @@ def get_active_products_data(current_table):
     _, _, _, product_config = get_db_config()
 
     try:
-        conn = get_db_connection(product_config)
-        cursor = conn.cursor()
-
-        # 获取Active状态的商品
-        active_query = f"""
-        SELECT DISTINCT goods_id
-        FROM `{current_table}`
-        WHERE detail_status = 'Active'
-        """
-        cursor.execute(active_query)
-        active_results = cursor.fetchall()
-        # 使用标准化函数处理goods_id
-        active_goods_ids = set()
-        for row in active_results:
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                active_goods_ids.add(normalized_id)
-
-        # 获取At Risk状态的商品
-        at_risk_query = f"""
-        SELECT DISTINCT goods_id
-        FROM `{current_table}`
-        WHERE detail_status = 'At Risk'
-        """
-        cursor.execute(at_risk_query)
-        at_risk_results = cursor.fetchall()
-        # 使用标准化函数处理goods_id
-        at_risk_goods_ids = set()
-        for row in at_risk_results:
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                at_risk_goods_ids.add(normalized_id)
-
-        cursor.close()
-        conn.close()
+        with db_cursor(product_config) as cursor:
+            # 获取Active状态的商品
+            active_query = f"""
+            SELECT DISTINCT goods_id
+            FROM `{current_table}`
+            WHERE detail_status = 'Active'
+            """
+            cursor.execute(active_query)
+            active_results = cursor.fetchall()
+            # 使用标准化函数处理goods_id
+            active_goods_ids = set()
+            for row in active_results:
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    active_goods_ids.add(normalized_id)
+
+            # 获取At Risk状态的商品
+            at_risk_query = f"""
+            SELECT DISTINCT goods_id
+            FROM `{current_table}`
+            WHERE detail_status = 'At Risk'
+            """
+            cursor.execute(at_risk_query)
+            at_risk_results = cursor.fetchall()
+            # 使用标准化函数处理goods_id
+            at_risk_goods_ids = set()
+            for row in at_risk_results:
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    at_risk_goods_ids.add(normalized_id)
 
         return active_goods_ids, at_risk_goods_ids
 
@@ -375,42 +362,37 @@ def get_sales_data(current_table, sales_table_name, end_date=None):
     _, sales_config, _, _ = get_db_config()
 
     try:
-        conn = get_db_connection(sales_config)
-        cursor = conn.cursor()
-
-        # 获取有动销记录的商品ID
-        if end_date is None:
-            # 如果没有指定日期，获取所有历史动销品
-            sales_query = f"""
-            SELECT DISTINCT goods_id
-            FROM `{sales_table_name}`
-            """
-            cursor.execute(sales_query)
-        else:
-            # 如果指定了日期，只获取该日期及之前的动销品
-            if isinstance(end_date, datetime):
-                end_date = end_date.date()
-            elif isinstance(end_date, str):
-                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        with db_cursor(sales_config) as cursor:
+            # 获取有动销记录的商品ID
+            if end_date is None:
+                # 如果没有指定日期，获取所有历史动销品
+                sales_query = f"""
+                SELECT DISTINCT goods_id
+                FROM `{sales_table_name}`
+                """
+                cursor.execute(sales_query)
+            else:
+                # 如果指定了日期，只获取该日期及之前的动销品
+                if isinstance(end_date, datetime):
+                    end_date = end_date.date()
+                elif isinstance(end_date, str):
+                    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
             
-            end_date_str = end_date.strftime('%Y-%m-%d')
-            sales_query = f"""
-            SELECT DISTINCT goods_id
-            FROM `{sales_table_name}`
-            WHERE date_label <= %s
-            """
-            cursor.execute(sales_query, (end_date_str,))
-        
-        sales_results = cursor.fetchall()
-        # 使用标准化函数处理goods_id
-        sales_goods_ids = set()
-        for row in sales_results:
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                sales_goods_ids.add(normalized_id)
-
-        cursor.close()
-        conn.close()
+                end_date_str = end_date.strftime('%Y-%m-%d')
+                sales_query = f"""
+                SELECT DISTINCT goods_id
+                FROM `{sales_table_name}`
+                WHERE date_label <= %s
+                """
+                cursor.execute(sales_query, (end_date_str,))
+        
+            sales_results = cursor.fetchall()
+            # 使用标准化函数处理goods_id
+            sales_goods_ids = set()
+            for row in sales_results:
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    sales_goods_ids.add(normalized_id)
 
         return sales_goods_ids
 
@@ -431,37 +413,32 @@ def get_recent_sales_volume(sales_table_name, days=7, end_date=None):
     _, sales_config, _, _ = get_db_config()
 
     try:
-        conn = get_db_connection(sales_config)
-        cursor = conn.cursor()
-
-        # 计算N天前的日期
-        if end_date is None:
-            end_date = (get_eastern_europe_time() - timedelta(days=1)).date()  # 昨天
-        elif isinstance(end_date, datetime):
-            end_date = end_date.date()
-        elif isinstance(end_date, str):
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-        
-        start_date = end_date - timedelta(days=days-1)  # N天前
-
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        end_date_str = end_date.strftime('%Y-%m-%d')
-
-        # 获取指定日期范围内的总单量
-        volume_query = f"""
-        SELECT SUM(`Units ordered`) as total_volume
-        FROM `{sales_table_name}`
-        WHERE date_label >= %s AND date_label <= %s
-        """
-        cursor.execute(volume_query, (start_date_str, end_date_str))
-        result = cursor.fetchone()
-        total_volume = result[0] if result[0] else 0
-
-        # 计算日均单量
-        avg_daily_volume = round(total_volume / days, 2)
-
-        cursor.close()
-        conn.close()
+        with db_cursor(sales_config) as cursor:
+            # 计算N天前的日期
+            if end_date is None:
+                end_date = (get_eastern_europe_time() - timedelta(days=1)).date()  # 昨天
+            elif isinstance(end_date, datetime):
+                end_date = end_date.date()
+            elif isinstance(end_date, str):
+                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        
+            start_date = end_date - timedelta(days=days-1)  # N天前
+
+            start_date_str = start_date.strftime('%Y-%m-%d')
+            end_date_str = end_date.strftime('%Y-%m-%d')
+
+            # 获取指定日期范围内的总单量
+            volume_query = f"""
+            SELECT SUM(`Units ordered`) as total_volume
+            FROM `{sales_table_name}`
+            WHERE date_label >= %s AND date_label <= %s
+            """
+            cursor.execute(volume_query, (start_date_str, end_date_str))
+            result = cursor.fetchone()
+            total_volume = result[0] if result[0] else 0
+
+            # 计算日均单量
+            avg_daily_volume = round(total_volume / days, 2)
 
         return avg_daily_volume
 
@@ -483,68 +460,63 @@ def get_gmv_data(sales_table_name, days=30, end_date=None):
     _, sales_config, _, _ = get_db_config()
 
     try:
-        conn = get_db_connection(sales_config)
-        cursor = conn.cursor()
-
-        # 计算日期范围
-        if end_date is None:
-            end_date = (get_eastern_europe_time() - timedelta(days=1)).date()  # 昨天
-        elif isinstance(end_date, datetime):
-            end_date = end_date.date()
-        elif isinstance(end_date, str):
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-        
-        start_date = end_date - timedelta(days=days-1)  # N天前
-
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        end_date_str = end_date.strftime('%Y-%m-%d')
-
-        # 获取每日GMV和销量数据
-        gmv_query = f"""
-        SELECT
-            date_label,
-            COALESCE(SUM(`Base price sales`), 0) as daily_gmv,
-            COALESCE(SUM(`Units ordered`), 0) as daily_volume
-        FROM `{sales_table_name}`
-        WHERE date_label >= %s AND date_label <= %s
-        GROUP BY date_label
-        ORDER BY date_label
-        """
-        cursor.execute(gmv_query, (start_date_str, end_date_str))
-        results = cursor.fetchall()
-
-        # 转换为DataFrame
-        if results:
-            df = pd.DataFrame(results, columns=['date_label', 'daily_gmv', 'daily_volume'])
-            # 将date_label转换为日期（去掉时间部分）
-            df['date_label'] = pd.to_datetime(df['date_label']).dt.date
-            # 然后再转换为datetime以便后续合并
-            df['date_label'] = pd.to_datetime(df['date_label'])
-        else:
-            # 如果没有数据，创建空DataFrame
-            df = pd.DataFrame(columns=['date_label', 'daily_gmv', 'daily_volume'])
+        with db_cursor(sales_config) as cursor:
+            # 计算日期范围
+            if end_date is None:
+                end_date = (get_eastern_europe_time() - timedelta(days=1)).date()  # 昨天
+            elif isinstance(end_date, datetime):
+                end_date = end_date.date()
+            elif isinstance(end_date, str):
+                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        
+            start_date = end_date - timedelta(days=days-1)  # N天前
 
-        # 生成完整的日期序列（确保所有日期都有数据，只保留日期部分）
-        date_range = pd.date_range(start=start_date, end=end_date, freq='D')
-        date_df = pd.DataFrame({'date_label': date_range})
+            start_date_str = start_date.strftime('%Y-%m-%d')
+            end_date_str = end_date.strftime('%Y-%m-%d')
 
-        # 合并数据，缺失的日期填充为0
-        if len(df) > 0:
-            df = date_df.merge(df, on='date_label', how='left')
-        else:
-            df = date_df.copy()
-            df['daily_gmv'] = 0
-            df['daily_volume'] = 0
+            # 获取每日GMV和销量数据
+            gmv_query = f"""
+            SELECT
+                date_label,
+                COALESCE(SUM(`Base price sales`), 0) as daily_gmv,
+                COALESCE(SUM(`Units ordered`), 0) as daily_volume
+            FROM `{sales_table_name}`
+            WHERE date_label >= %s AND date_label <= %s
+            GROUP BY date_label
+            ORDER BY date_label
+            """
+            cursor.execute(gmv_query, (start_date_str, end_date_str))
+            results = cursor.fetchall()
+
+            # 转换为DataFrame
+            if results:
+                df = pd.DataFrame(results, columns=['date_label', 'daily_gmv', 'daily_volume'])
+                # 将date_label转换为日期（去掉时间部分）
+                df['date_label'] = pd.to_datetime(df['date_label']).dt.date
+                # 然后再转换为datetime以便后续合并
+                df['date_label'] = pd.to_datetime(df['date_label'])
+            else:
+                # 如果没有数据，创建空DataFrame
+                df = pd.DataFrame(columns=['date_label', 'daily_gmv', 'daily_volume'])
 
-        df['daily_gmv'] = df['daily_gmv'].fillna(0)
-        df['daily_volume'] = df['daily_volume'].fillna(0)
+            # 生成完整的日期序列（确保所有日期都有数据，只保留日期部分）
+            date_range = pd.date_range(start=start_date, end=end_date, freq='D')
+            date_df = pd.DataFrame({'date_label': date_range})
+
+            # 合并数据，缺失的日期填充为0
+            if len(df) > 0:
+                df = date_df.merge(df, on='date_label', how='left')
+            else:
+                df = date_df.copy()
+                df['daily_gmv'] = 0
+                df['daily_volume'] = 0
 
-        # 确保数据类型正确
-        df['daily_gmv'] = pd.to_numeric(df['daily_gmv'], errors='coerce').fillna(0)
-        df['daily_volume'] = pd.to_numeric(df['daily_volume'], errors='coerce').fillna(0)
+            df['daily_gmv'] = df['daily_gmv'].fillna(0)
+            df['daily_volume'] = df['daily_volume'].fillna(0)
 
-        cursor.close()
-        conn.close()
+            # 确保数据类型正确
+            df['daily_gmv'] = pd.to_numeric(df['daily_gmv'], errors='coerce').fillna(0)
+            df['daily_volume'] = pd.to_numeric(df['daily_volume'], errors='coerce').fillna(0)
 
         return df
 
@@ -799,12 +771,24 @@ def generate_gmv_chart(df, title, bar_color, line_color):
         title: 图表标题
         bar_color: 柱状图颜色
         line_color: 折线图颜色
-    返回: base64编码的图表字符串
+    返回: base64编码的图表字符串（数据未变化时直接取渲染图表缓存）
     """
     try:
         if len(df) == 0:
             return None
 
+        key = chart_cache_key(('gmv_chart', title, bar_color, line_color),
+                              df[['date_label', 'daily_gmv', 'daily_volume']])
+    except Exception as e:
+        print(f"生成GMV图表出错: {e}")
+        return None
+
+    return get_or_render_chart(key, lambda: _render_gmv_chart(df, title, bar_color, line_color))
+
+
+def _render_gmv_chart(df, title, bar_color, line_color):
+    """渲染GMV图表，参数同 generate_gmv_chart"""
+    try:
         # 创建双轴图表（进一步增大尺寸以提高可读性）
         if '近30天' in title or '近7日' in title:
             fig, ax1 = plt.subplots(figsize=(20, 12))
@@ -918,6 +902,9 @@ def indicator_calculation(target_date=None, use_cache=True):
         current_table = get_current_table()
         sales_table_name = f"{current_table}_Sales"
         
+        # 计算开始前记录源数据水位，用于判断缓存是否过期以及随新缓存保存
+        watermark = get_indicator_cache_watermark(current_table, sales_table_name, target_date_str)
+        
         # 如果使用缓存，先检查缓存
         if use_cache:
             cache_file_path = get_indicator_cache_file_path(current_table, target_date_str)
@@ -925,7 +912,9 @@ def indicator_calculation(target_date=None, use_cache=True):
             print(f"[缓存检查] 缓存文件路径: {cache_file_path}")
             print(f"[缓存检查] 缓存文件是否存在: {os.path.exists(cache_file_path)}")
             
-            cache_data = load_indicator_cache(current_table, target_date_str)
+            cache_data = None
+            if is_indicator_cache_fresh(current_table, target_date_str, watermark):
+                cache_data = load_indicator_cache(current_table, target_date_str)
             if cache_data:
                 # 从缓存加载数据，不生成图表（加快速度）
                 print(f"[缓存命中] 直接从缓存返回数据，不生成图表")
@@ -954,7 +943,7 @@ def indicator_calculation(target_date=None, use_cache=True):
                     'from_cache': True
                 })
             else:
-                print(f"[缓存未命中] 缓存文件不存在或加载失败，将重新计算")
+                print(f"[缓存未命中] 缓存文件不存在、已过期或加载失败，将重新计算")
         
         results = {}
 
@@ -1102,7 +1091,7 @@ def indicator_calculation(target_date=None, use_cache=True):
         analysis_time = round(end_time - start_time, 2)
         
         # 保存缓存（无论use_cache是True还是False都保存，以便下次使用）
-        save_indicator_cache(current_table, target_date_str, results, analysis_time)
+        save_indicator_cache(current_table, target_date_str, results, analysis_time, watermark=watermark)
 
         return jsonify({
             'success': True,
@@ -1443,39 +1432,34 @@ def get_active_products_data_for_table(table_name):
     _, _, _, product_config = get_db_config()
 
     try:
-        conn = get_db_connection(product_config)
-        cursor = conn.cursor()
-
-        # 获取Active状态的商品
-        active_query = f"""
-        SELECT DISTINCT goods_id
-        FROM `{table_name}`
-        WHERE detail_status = 'Active'
-        """
-        cursor.execute(active_query)
-        active_results = cursor.fetchall()
-        active_goods_ids = set()
-        for row in active_results:
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                active_goods_ids.add(normalized_id)
-
-        # 获取At Risk状态的商品
-        at_risk_query = f"""
-        SELECT DISTINCT goods_id
-        FROM `{table_name}`
-        WHERE detail_status = 'At Risk'
-        """
-        cursor.execute(at_risk_query)
-        at_risk_results = cursor.fetchall()
-        at_risk_goods_ids = set()
-        for row in at_risk_results:
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                at_risk_goods_ids.add(normalized_id)
-
-        cursor.close()
-        conn.close()
+        with db_cursor(product_config) as cursor:
+            # 获取Active状态的商品
+            active_query = f"""
+            SELECT DISTINCT goods_id
+            FROM `{table_name}`
+            WHERE detail_status = 'Active'
+            """
+            cursor.execute(active_query)
+            active_results = cursor.fetchall()
+            active_goods_ids = set()
+            for row in active_results:
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    active_goods_ids.add(normalized_id)
+
+            # 获取At Risk状态的商品
+            at_risk_query = f"""
+            SELECT DISTINCT goods_id
+            FROM `{table_name}`
+            WHERE detail_status = 'At Risk'
+            """
+            cursor.execute(at_risk_query)
+            at_risk_results = cursor.fetchall()
+            at_risk_goods_ids = set()
+            for row in at_risk_results:
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    at_risk_goods_ids.add(normalized_id)
 
         return active_goods_ids, at_risk_goods_ids
 
@@ -1496,38 +1480,33 @@ def get_sales_data_for_table(table_name, sales_table_name, end_date=None):
     _, sales_config, _, _ = get_db_config()
 
     try:
-        conn = get_db_connection(sales_config)
-        cursor = conn.cursor()
-
-        if end_date is None:
-            sales_query = f"""
-            SELECT DISTINCT goods_id
-            FROM `{sales_table_name}`
-            """
-            cursor.execute(sales_query)
-        else:
-            if isinstance(end_date, datetime):
-                end_date = end_date.date()
-            elif isinstance(end_date, str):
-                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        with db_cursor(sales_config) as cursor:
+            if end_date is None:
+                sales_query = f"""
+                SELECT DISTINCT goods_id
+                FROM `{sales_table_name}`
+                """
+                cursor.execute(sales_query)
+            else:
+                if isinstance(end_date, datetime):
+                    end_date = end_date.date()
+                elif isinstance(end_date, str):
+                    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
             
-            end_date_str = end_date.strftime('%Y-%m-%d')
-            sales_query = f"""
-            SELECT DISTINCT goods_id
-            FROM `{sales_table_name}`
-            WHERE date_label <= %s
-            """
-            cursor.execute(sales_query, (end_date_str,))
-        
-        sales_results = cursor.fetchall()
-        sales_goods_ids = set()
-        for row in sales_results:
-            normalized_id = normalize_goods_id(row[0])
-            if normalized_id:
-                sales_goods_ids.add(normalized_id)
-
-        cursor.close()
-        conn.close()
+                end_date_str = end_date.strftime('%Y-%m-%d')
+                sales_query = f"""
+                SELECT DISTINCT goods_id
+                FROM `{sales_table_name}`
+                WHERE date_label <= %s
+                """
+                cursor.execute(sales_query, (end_date_str,))
+        
+            sales_results = cursor.fetchall()
+            sales_goods_ids = set()
+            for row in sales_results:
+                normalized_id = normalize_goods_id(row[0])
+                if normalized_id:
+                    sales_goods_ids.add(normalized_id)
 
         return sales_goods_ids
 
@@ -1543,34 +1522,29 @@ def get_recent_sales_volume_for_table(sales_table_name, days=7, end_date=None):
     _, sales_config, _, _ = get_db_config()
 
     try:
-        conn = get_db_connection(sales_config)
-        cursor = conn.cursor()
-
-        if end_date is None:
-            end_date = (get_eastern_europe_time() - timedelta(days=1)).date()
-        elif isinstance(end_date, datetime):
-            end_date = end_date.date()
-        elif isinstance(end_date, str):
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        with db_cursor(sales_config) as cursor:
+            if end_date is None:
+                end_date = (get_eastern_europe_time() - timedelta(days=1)).date()
+            elif isinstance(end_date, datetime):
+                end_date = end_date.date()
+            elif isinstance(end_date, str):
+                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         
-        start_date = end_date - timedelta(days=days-1)
-
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        end_date_str = end_date.strftime('%Y-%m-%d')
+            start_date = end_date - timedelta(days=days-1)
 
-        volume_query = f"""
-        SELECT SUM(`Units ordered`) as total_volume
-        FROM `{sales_table_name}`
-        WHERE date_label >= %s AND date_label <= %s
-        """
-        cursor.execute(volume_query, (start_date_str, end_date_str))
-        result = cursor.fetchone()
-        total_volume = result[0] if result[0] else 0
+            start_date_str = start_date.strftime('%Y-%m-%d')
+            end_date_str = end_date.strftime('%Y-%m-%d')
 
-        avg_daily_volume = round(total_volume / days, 2)
+            volume_query = f"""
+            SELECT SUM(`Units ordered`) as total_volume
+            FROM `{sales_table_name}`
+            WHERE date_label >= %s AND date_label <= %s
+            """
+            cursor.execute(volume_query, (start_date_str, end_date_str))
+            result = cursor.fetchone()
+            total_volume = result[0] if result[0] else 0
 
-        cursor.close()
-        conn.close()
+            avg_daily_volume = round(total_volume / days, 2)
 
         return avg_daily_volume
 
@@ -1606,9 +1580,14 @@ def indicator_calculation_for_table(table_name, target_date=None, use_cache=True
         target_date_str = end_date.strftime('%Y-%m-%d')
         sales_table_name = f"{table_name}_Sales"
         
+        # 计算开始前记录源数据水位，用于判断缓存是否过期以及随新缓存保存
+        watermark = get_indicator_cache_watermark(table_name, sales_table_name, target_date_str)
+        
         # 如果使用缓存，先检查缓存
         if use_cache:
-            cache_data = load_indicator_cache(table_name, target_date_str)
+            cache_data = None
+            if is_indicator_cache_fresh(table_name, target_date_str, watermark):
+                cache_data = load_indicator_cache(table_name, target_date_str)
             if cache_data:
                 end_time = time.time()
                 return {
@@ -1724,7 +1703,7 @@ def indicator_calculation_for_table(table_name, target_date=None, use_cache=True
         analysis_time = round(end_time - start_time, 2)
         
         # 保存缓存
-        save_indicator_cache(table_name, target_date_str, results, analysis_time)
+        save_indicator_cache(table_name, target_date_str, results, analysis_time, watermark=watermark)
 
         return {
             'success': True,
@@ -6,10 +6,16 @@
 
 import os
 import json
+import time
+import threading
+import traceback
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
-from db_utils import get_db_connection
+from db_utils import db_cursor
+from xlsx_cache import read_goods_ids_from_dirs
 from config import (
-    load_config, save_config, get_db_config,
+    load_config, save_config, get_config_section, get_db_config,
     load_auto_reason_config
 )
 
@@ -24,8 +30,7 @@ def load_batch_countries_config():
         'selected_tables': ['ROA1_CZ', 'ROA1_DE', ...]    # 已选中的国家表列表
     }
     """
-    config = load_config()
-    return config.get('batch_countries_config', {
+    return get_config_section('batch_countries_config', {
         'available_tables': [],
         'selected_tables': []
     })
@@ -131,14 +136,9 @@ def check_table_exists(db_config, table_name):
     返回: (exists, error_message)
     """
     try:
-        conn = get_db_connection(db_config)
-        cursor = conn.cursor()
-        
-        cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-        result = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        with db_cursor(db_config) as cursor:
+            cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
+            result = cursor.fetchone()
         
         return result is not None, None
     except Exception as e:
@@ -256,13 +256,178 @@ def validate_all_selected_tables():
     }
 
 
+# ===== 并行执行 =====
+
+DEFAULT_BATCH_PARALLEL_CONFIG = {
+    'max_workers': 3,         # 同时处理的国家数
+    'country_timeout': 1800,  # 单个国家最长等待时间（秒），0表示不限制
+    'fail_fast': False        # True: 任一国家失败后不再启动剩余国家；False: 继续处理其他国家
+}
+
+# 所有国家的指标数据写入同一个xlsx（读-改-写），保存步骤必须串行
+_indicator_excel_lock = threading.Lock()
+
+# 超时后仍在后台运行的国家 {表名: future}，线程结束时移除；
+# 在此期间再次提交的批量任务不会对该表启动新的处理，避免两个线程同时写同一张表
+_timed_out_running = {}
+_timed_out_running_lock = threading.Lock()
+
+
+def _mark_timed_out_running(table_name, future):
+    with _timed_out_running_lock:
+        _timed_out_running[table_name] = future
+
+    def release(finished_future):
+        with _timed_out_running_lock:
+            if _timed_out_running.get(table_name) is finished_future:
+                del _timed_out_running[table_name]
+
+    # 已结束的 future 会立即调用回调
+    future.add_done_callback(release)
+
+
+def get_timed_out_running_tables():
+    """超时后仍在后台运行的国家表"""
+    with _timed_out_running_lock:
+        return sorted(_timed_out_running)
+
+
+def load_batch_parallel_config():
+    """加载批量操作的并行配置（配置项 batch_parallel_config，缺省项使用默认值）"""
+    parallel_config = dict(DEFAULT_BATCH_PARALLEL_CONFIG)
+    parallel_config.update(get_config_section('batch_parallel_config', {}) or {})
+    try:
+        parallel_config['max_workers'] = max(int(parallel_config['max_workers']), 1)
+    except (TypeError, ValueError):
+        parallel_config['max_workers'] = DEFAULT_BATCH_PARALLEL_CONFIG['max_workers']
+    try:
+        parallel_config['country_timeout'] = max(float(parallel_config['country_timeout']), 0)
+    except (TypeError, ValueError):
+        parallel_config['country_timeout'] = DEFAULT_BATCH_PARALLEL_CONFIG['country_timeout']
+    parallel_config['fail_fast'] = bool(parallel_config['fail_fast'])
+    return parallel_config
+
+
+def run_countries_in_parallel(selected_tables, process_table, error_result,
+                              progress_callback=None, cancel_check=None, parallel_config=None):
+    """
+    在有界线程池中并行处理多个国家（各国家的表互不相关，主要耗时在数据库与文件IO）
+    参数:
+        selected_tables: 要处理的表列表
+        process_table: process_table(table_name) 返回该国家的结果字典（含 success，跳过时含 skipped=True）
+        error_result: error_result(table_name, message) 返回异常/超时时该国家的结果字典
+        progress_callback: 每完成一个国家调用 progress_callback(已完成数, 总数, 表名)
+        cancel_check: 无参函数，返回True时不再启动剩余国家，已在运行的国家会等待其完成
+        parallel_config: 并行配置，为None时读取 load_batch_parallel_config()
+    返回: {
+        'results': {表名: 结果字典}（按 selected_tables 的顺序，未启动的国家不在其中）,
+        'processed': int, 'failed': int, 'skipped': int,
+        'cancelled': bool,   # 因取消请求提前结束
+        'aborted': bool      # fail_fast 模式下因失败提前结束
+    }
+    超时的国家按失败计入；线程无法被强制终止，超时国家的任务会在后台继续运行直至结束，
+    在它结束之前，之后提交的批量操作遇到该表时直接按失败返回，不会再启动一个处理同一张表的线程
+    """
+    if parallel_config is None:
+        parallel_config = load_batch_parallel_config()
+    max_workers = min(parallel_config['max_workers'], max(len(selected_tables), 1))
+    country_timeout = parallel_config['country_timeout']
+    fail_fast = parallel_config['fail_fast']
+
+    collected = {}
+    started_at = {}
+    counts = {'processed': 0, 'failed': 0, 'skipped': 0}
+    cancelled = False
+    aborted = False
+
+    def run_one(table_name):
+        if table_name in get_timed_out_running_tables():
+            return error_result(table_name, '上次超时的处理仍在后台运行，等待其结束后再重试')
+        started_at[table_name] = time.monotonic()
+        return process_table(table_name)
+
+    def record(table_name, result):
+        collected[table_name] = result
+        if result.get('success'):
+            counts['processed'] += 1
+        elif result.get('skipped'):
+            counts['skipped'] += 1
+        else:
+            counts['failed'] += 1
+        if progress_callback:
+            progress_callback(len(collected), len(selected_tables), table_name)
+        return result.get('success') or result.get('skipped')
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch')
+    try:
+        # 复制上下文提交，使国家线程中的输出仍记入当前后台任务的日志
+        pending = {
+            executor.submit(contextvars.copy_context().run, run_one, table_name): table_name
+            for table_name in selected_tables
+        }
+        stopping = False
+
+        while pending:
+            done, _ = wait(list(pending), timeout=1, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                table_name = pending.pop(future)
+                if future.cancelled():
+                    continue
+                try:
+                    ok = record(table_name, future.result())
+                except Exception as e:
+                    traceback.print_exc()
+                    ok = record(table_name, error_result(table_name, str(e)))
+                if not ok and fail_fast and not stopping:
+                    aborted = True
+                    stopping = True
+
+            if country_timeout:
+                now = time.monotonic()
+                for future, table_name in list(pending.items()):
+                    started = started_at.get(table_name)
+                    if started is not None and now - started > country_timeout:
+                        del pending[future]
+                        _mark_timed_out_running(table_name, future)
+                        print(f"{table_name} 处理超时（{country_timeout:g} 秒），不再等待")
+                        ok = record(table_name, error_result(table_name, f'处理超时（超过 {country_timeout:g} 秒），仍在后台运行'))
+                        if not ok and fail_fast and not stopping:
+                            aborted = True
+                            stopping = True
+
+            if not stopping and cancel_check and cancel_check():
+                cancelled = True
+                stopping = True
+
+            if stopping:
+                # 取消尚未启动的国家，只等待已在运行的国家
+                for future in list(pending):
+                    if future.cancel():
+                        del pending[future]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return {
+        'results': {table_name: collected[table_name] for table_name in selected_tables if table_name in collected},
+        'processed': counts['processed'],
+        'failed': counts['failed'],
+        'skipped': counts['skipped'],
+        'cancelled': cancelled,
+        'aborted': aborted
+    }
+
+
 # ===== 批量操作：功能2 =====
 
-def batch_refresh_status(selected_tables=None):
+def batch_refresh_status(selected_tables=None, progress_callback=None, cancel_check=None):
     """
     批量刷新Status数据（功能2的刷新功能）
+    各国家并行执行，并发数/超时/失败策略见 load_batch_parallel_config
     参数:
         selected_tables: 要处理的表列表，如果为None则使用配置中的已选表
+        progress_callback: 每完成一个国家调用 progress_callback(已完成数, 总数, 表名)，用于后台任务进度
+        cancel_check: 无参函数，返回True时不再启动剩余国家（结果中 cancelled 为 True）
     返回: {
         'success': bool,
         'total': int,
@@ -290,49 +455,47 @@ def batch_refresh_status(selected_tables=None):
             'results': {}
         }
     
-    results = {}
-    processed_count = 0
-    failed_count = 0
+    def process_table(table_name):
+        sales_table_name = f"{table_name}_Sales"
+        success, message, updated_count, missing_dates_info = refresh_status_data(table_name, sales_table_name)
+        return {
+            'success': success,
+            'message': message,
+            'updated_count': updated_count,
+            'missing_dates_info': missing_dates_info
+        }
     
-    for table_name in selected_tables:
-        try:
-            sales_table_name = f"{table_name}_Sales"
-            success, message, updated_count, missing_dates_info = refresh_status_data(table_name, sales_table_name)
-            
-            results[table_name] = {
-                'success': success,
-                'message': message,
-                'updated_count': updated_count,
-                'missing_dates_info': missing_dates_info
-            }
-            
-            if success:
-                processed_count += 1
-            else:
-                failed_count += 1
-        except Exception as e:
-            results[table_name] = {
-                'success': False,
-                'message': f'刷新失败: {str(e)}',
-                'updated_count': 0,
-                'missing_dates_info': []
-            }
-            failed_count += 1
+    def error_result(table_name, error):
+        return {
+            'success': False,
+            'message': f'刷新失败: {error}',
+            'updated_count': 0,
+            'missing_dates_info': []
+        }
+    
+    outcome = run_countries_in_parallel(selected_tables, process_table, error_result,
+                                        progress_callback=progress_callback, cancel_check=cancel_check)
+    stopped = outcome['cancelled'] or outcome['aborted']
     
     return {
-        'success': failed_count == 0,
+        'success': not stopped and outcome['failed'] == 0,
         'total': len(selected_tables),
-        'processed': processed_count,
-        'failed': failed_count,
-        'results': results
+        'processed': outcome['processed'],
+        'failed': outcome['failed'],
+        'results': outcome['results'],
+        'cancelled': outcome['cancelled'],
+        'aborted': outcome['aborted']
     }
 
 
-def batch_quick_refresh_status(selected_tables=None):
+def batch_quick_refresh_status(selected_tables=None, progress_callback=None, cancel_check=None):
     """
     批量快速刷新Status数据（功能2的快速刷新功能）
+    各国家并行执行，并发数/超时/失败策略见 load_batch_parallel_config
     参数:
         selected_tables: 要处理的表列表，如果为None则使用配置中的已选表
+        progress_callback: 每完成一个国家调用 progress_callback(已完成数, 总数, 表名)，用于后台任务进度
+        cancel_check: 无参函数，返回True时不再启动剩余国家（结果中 cancelled 为 True）
     返回: {
         'success': bool,
         'total': int,
@@ -360,49 +523,83 @@ def batch_quick_refresh_status(selected_tables=None):
             'results': {}
         }
     
-    results = {}
-    processed_count = 0
-    failed_count = 0
+    def process_table(table_name):
+        sales_table_name = f"{table_name}_Sales"
+        success, message, updated_count, missing_dates_info = quick_refresh_status_data(table_name, sales_table_name)
+        return {
+            'success': success,
+            'message': message,
+            'updated_count': updated_count,
+            'missing_dates_info': missing_dates_info
+        }
     
-    for table_name in selected_tables:
-        try:
-            sales_table_name = f"{table_name}_Sales"
-            success, message, updated_count, missing_dates_info = quick_refresh_status_data(table_name, sales_table_name)
-            
-            results[table_name] = {
-                'success': success,
-                'message': message,
-                'updated_count': updated_count,
-                'missing_dates_info': missing_dates_info
-            }
-            
-            if success:
-                processed_count += 1
-            else:
-                failed_count += 1
-        except Exception as e:
-            results[table_name] = {
-                'success': False,
-                'message': f'快速刷新失败: {str(e)}',
-                'updated_count': 0,
-                'missing_dates_info': []
-            }
-            failed_count += 1
+    def error_result(table_name, error):
+        return {
+            'success': False,
+            'message': f'快速刷新失败: {error}',
+            'updated_count': 0,
+            'missing_dates_info': []
+        }
+    
+    outcome = run_countries_in_parallel(selected_tables, process_table, error_result,
+                                        progress_callback=progress_callback, cancel_check=cancel_check)
+    stopped = outcome['cancelled'] or outcome['aborted']
     
     return {
-        'success': failed_count == 0,
+        'success': not stopped and outcome['failed'] == 0,
         'total': len(selected_tables),
-        'processed': processed_count,
-        'failed': failed_count,
-        'results': results
+        'processed': outcome['processed'],
+        'failed': outcome['failed'],
+        'results': outcome['results'],
+        'cancelled': outcome['cancelled'],
+        'aborted': outcome['aborted']
     }
 
 
 # ===== 批量操作：功能4 =====
 
-def check_restricted_data_dir_for_country(restricted_dir, table_name):
+def prefetch_country_xlsx(selected_tables, data_dirs):
+    """
+    各国家开始处理前，把所有选中国家目录下未缓存的xlsx一起并行解析并写入缓存（xlsx_cache），
+    之后各国家读取goods_id时直接命中缓存
+    data_dirs: [(数据目录, 类别), ...]，如 [(限流数据目录, '限流')]
+    返回: {国家目录: [出错文件的描述, ...]}，用于校验与结果中的逐文件错误报告
+    """
+    directories = [(os.path.join(data_dir, table_name), label)
+                   for table_name in selected_tables for data_dir, label in data_dirs if data_dir]
+    try:
+        _, file_errors = read_goods_ids_from_dirs(directories)
+    except Exception as e:
+        print(f"预解析xlsx文件出错: {e}")
+        return {}
+
+    errors_by_dir = {}
+    for error in file_errors:
+        errors_by_dir.setdefault(error['directory'], []).append(
+            f"{error['label']}文件 {error['file']} 读取失败: {error['error']}"
+        )
+    return errors_by_dir
+
+
+def _count_readable_xlsx(country_dir, file_errors):
+    """目录中可读取的xlsx文件数（file_errors 为 prefetch_country_xlsx 的结果）"""
+    xlsx_files = [f for f in os.listdir(country_dir) if f.endswith('.xlsx') and not f.startswith('~$')]
+    return len(xlsx_files) - len((file_errors or {}).get(country_dir, []))
+
+
+def _attach_file_errors(result, file_errors, country_dirs):
+    """把国家目录中出错文件的描述附加到结果的 file_errors 中"""
+    errors = [message for country_dir in country_dirs for message in (file_errors or {}).get(country_dir, [])]
+    if errors:
+        result = dict(result)
+        result['file_errors'] = errors
+    return result
+
+
+def check_restricted_data_dir_for_country(restricted_dir, table_name, file_errors=None):
     """
     检查限流数据目录中是否存在指定国家的数据
+    file_errors: prefetch_country_xlsx 的结果，提供时所有xlsx文件都无法读取也视为没有数据
     返回: (exists, error_message)
     """
     if not restricted_dir:
@@ -416,14 +613,20 @@ def check_restricted_data_dir_for_country(restricted_dir, table_name):
     if not xlsx_files:
         return False, f'{table_name} 目录中没有xlsx文件'
     
+    if _count_readable_xlsx(country_dir, file_errors) <= 0:
+        return False, f'{table_name} 目录中的xlsx文件都无法读取'
+    
     return True, None
 
 
-def batch_auto_update_reason(selected_tables=None):
+def batch_auto_update_reason(selected_tables=None, progress_callback=None, cancel_check=None):
     """
     批量自动更新Reason（功能4的自动更新Reason功能）
+    各国家并行执行，并发数/超时/失败策略见 load_batch_parallel_config
     参数:
         selected_tables: 要处理的表列表，如果为None则使用配置中的已选表
+        progress_callback: 每完成一个国家调用 progress_callback(已完成数, 总数, 表名)，用于后台任务进度
+        cancel_check: 无参函数，返回True时不再启动剩余国家（结果中 cancelled 为 True）
     返回: {
         'success': bool,
         'total': int,
@@ -468,54 +671,49 @@ def batch_auto_update_reason(selected_tables=None):
             'results': {}
         }
     
-    results = {}
-    processed_count = 0
-    failed_count = 0
-    skipped_count = 0
+    # 所有国家的限流xlsx先一起并行解析到缓存
+    file_errors = prefetch_country_xlsx(selected_tables, [(restricted_dir, '限流')])
     
-    for table_name in selected_tables:
+    def process_table(table_name):
+        country_dirs = [os.path.join(restricted_dir, table_name)]
         # 先检查限流数据目录中是否存在该国家的数据
-        exists, error = check_restricted_data_dir_for_country(restricted_dir, table_name)
+        exists, error = check_restricted_data_dir_for_country(restricted_dir, table_name, file_errors)
         if not exists:
-            results[table_name] = {
+            return _attach_file_errors({
                 'success': False,
                 'message': error,
                 'skipped': True
-            }
-            skipped_count += 1
-            continue
-        
-        try:
-            result = auto_update_reason_for_table(table_name)
-            
-            results[table_name] = result
-            
-            if result.get('success'):
-                processed_count += 1
-            else:
-                failed_count += 1
-        except Exception as e:
-            results[table_name] = {
-                'success': False,
-                'message': f'自动更新Reason失败: {str(e)}'
-            }
-            failed_count += 1
+            }, file_errors, country_dirs)
+        return _attach_file_errors(auto_update_reason_for_table(table_name), file_errors, country_dirs)
+    
+    def error_result(table_name, error):
+        return {
+            'success': False,
+            'message': f'自动更新Reason失败: {error}'
+        }
+    
+    outcome = run_countries_in_parallel(selected_tables, process_table, error_result,
+                                        progress_callback=progress_callback, cancel_check=cancel_check)
+    stopped = outcome['cancelled'] or outcome['aborted']
     
     return {
-        'success': failed_count == 0 and skipped_count == 0,
+        'success': not stopped and outcome['failed'] == 0 and outcome['skipped'] == 0,
         'total': len(selected_tables),
-        'processed': processed_count,
-        'failed': failed_count,
-        'skipped': skipped_count,
-        'results': results
+        'processed': outcome['processed'],
+        'failed': outcome['failed'],
+        'skipped': outcome['skipped'],
+        'results': outcome['results'],
+        'cancelled': outcome['cancelled'],
+        'aborted': outcome['aborted']
     }
 
 
 # ===== 批量操作：功能6 =====
 
-def check_indicator_data_dir_for_country(unpriced_dir, restricted_dir, table_name):
+def check_indicator_data_dir_for_country(unpriced_dir, restricted_dir, table_name, file_errors=None):
     """
     检查指标计算数据目录中是否存在指定国家的数据
+    file_errors: prefetch_country_xlsx 的结果，提供时所有xlsx文件都无法读取也视为没有数据
     返回: (exists, error_message)
     """
     errors = []
@@ -529,6 +727,8 @@ def check_indicator_data_dir_for_country(unpriced_dir, restricted_dir, table_nam
             xlsx_files = [f for f in os.listdir(unpriced_country_dir) if f.endswith('.xlsx')]
             if not xlsx_files:
                 errors.append(f'未核价数据 {table_name} 目录中没有xlsx文件')
+            elif _count_readable_xlsx(unpriced_country_dir, file_errors) <= 0:
+                errors.append(f'未核价数据 {table_name} 目录中的xlsx文件都无法读取')
     else:
         errors.append('未核价数据目录未配置')
     
@@ -541,6 +741,8 @@ def check_indicator_data_dir_for_country(unpriced_dir, restricted_dir, table_nam
             xlsx_files = [f for f in os.listdir(restricted_country_dir) if f.endswith('.xlsx')]
             if not xlsx_files:
                 errors.append(f'限流数据 {table_name} 目录中没有xlsx文件')
+            elif _count_readable_xlsx(restricted_country_dir, file_errors) <= 0:
+                errors.append(f'限流数据 {table_name} 目录中的xlsx文件都无法读取')
     else:
         errors.append('限流数据目录未配置')
     
@@ -550,13 +752,16 @@ def check_indicator_data_dir_for_country(unpriced_dir, restricted_dir, table_nam
     return True, None
 
 
-def batch_save_indicator_data(selected_tables=None, target_date=None):
+def batch_save_indicator_data(selected_tables=None, target_date=None, progress_callback=None, cancel_check=None):
     """
     批量保存指标数据（功能6的保存指标数据功能）
     会先计算指标到缓存，再保存到对应xlsx文件
+    各国家的指标计算并行执行；所有国家写入同一个xlsx，保存步骤串行
     参数:
         selected_tables: 要处理的表列表，如果为None则使用配置中的已选表
         target_date: 目标日期，如果为None则使用昨天
+        progress_callback: 每完成一个国家调用 progress_callback(已完成数, 总数, 表名)，用于后台任务进度
+        cancel_check: 无参函数，返回True时不再启动剩余国家（结果中 cancelled 为 True）
     返回: {
         'success': bool,
         'total': int,
@@ -606,68 +811,66 @@ def batch_save_indicator_data(selected_tables=None, target_date=None):
             'results': {}
         }
     
-    results = {}
-    processed_count = 0
-    failed_count = 0
-    skipped_count = 0
+    # 所有国家的未核价/限流xlsx先一起并行解析到缓存
+    file_errors = prefetch_country_xlsx(selected_tables, [(unpriced_dir, '未核价'), (restricted_dir, '限流')])
     
-    for table_name in selected_tables:
+    def process_table(table_name):
+        country_dirs = [os.path.join(unpriced_dir, table_name), os.path.join(restricted_dir, table_name)]
+        return _attach_file_errors(process_country(table_name), file_errors, country_dirs)
+    
+    def process_country(table_name):
         # 先检查数据目录中是否存在该国家的数据
-        exists, error = check_indicator_data_dir_for_country(unpriced_dir, restricted_dir, table_name)
+        exists, error = check_indicator_data_dir_for_country(unpriced_dir, restricted_dir, table_name, file_errors)
         if not exists:
-            results[table_name] = {
+            return {
                 'success': False,
                 'message': error,
                 'skipped': True
             }
-            skipped_count += 1
-            continue
         
-        try:
-            # 1. 先计算指标（不使用缓存，确保数据是最新的）
-            calc_result = indicator_calculation_for_table(table_name, target_date=target_date, use_cache=False)
-            
-            if not calc_result.get('success'):
-                results[table_name] = {
-                    'success': False,
-                    'message': f'计算指标失败: {calc_result.get("error", "未知错误")}'
-                }
-                failed_count += 1
-                continue
-            
-            # 2. 保存指标数据到Excel
-            save_result = save_indicator_data_to_excel_for_table(table_name, target_date=target_date)
-            
-            if save_result.get('success'):
-                results[table_name] = {
-                    'success': True,
-                    'message': '计算并保存指标数据成功',
-                    'calc_time': calc_result.get('analysis_time', 0)
-                }
-                processed_count += 1
-            else:
-                results[table_name] = {
-                    'success': False,
-                    'message': f'保存指标数据失败: {save_result.get("error", "未知错误")}'
-                }
-                failed_count += 1
-                
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            results[table_name] = {
+        # 1. 先计算指标（不使用缓存，确保数据是最新的）
+        calc_result = indicator_calculation_for_table(table_name, target_date=target_date, use_cache=False)
+        
+        if not calc_result.get('success'):
+            return {
                 'success': False,
-                'message': f'处理失败: {str(e)}'
+                'message': f'计算指标失败: {calc_result.get("error", "未知错误")}'
+            }
+        
+        # 2. 保存指标数据到Excel
+        with _indicator_excel_lock:
+            save_result = save_indicator_data_to_excel_for_table(table_name, target_date=target_date)
+        
+        if save_result.get('success'):
+            return {
+                'success': True,
+                'message': '计算并保存指标数据成功',
+                'calc_time': calc_result.get('analysis_time', 0)
             }
-            failed_count += 1
+        return {
+            'success': False,
+            'message': f'保存指标数据失败: {save_result.get("error", "未知错误")}'
+        }
+    
+    def error_result(table_name, error):
+        return {
+            'success': False,
+            'message': f'处理失败: {error}'
+        }
+    
+    outcome = run_countries_in_parallel(selected_tables, process_table, error_result,
+                                        progress_callback=progress_callback, cancel_check=cancel_check)
+    stopped = outcome['cancelled'] or outcome['aborted']
     
     return {
-        'success': failed_count == 0 and skipped_count == 0,
+        'success': not stopped and outcome['failed'] == 0 and outcome['skipped'] == 0,
         'total': len(selected_tables),
-        'processed': processed_count,
-        'failed': failed_count,
-        'skipped': skipped_count,
-        'results': results
+        'processed': outcome['processed'],
+        'failed': outcome['failed'],
+        'skipped': outcome['skipped'],
+        'results': outcome['results'],
+        'cancelled': outcome['cancelled'],
+        'aborted': outcome['aborted']
     }
 
 
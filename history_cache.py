@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+历史数据本地镜像模块
+按国家在 Cache_History/<表名>/ 下保存 流量表 LEFT JOIN 销售表（t.*, s.Buyers）的完整历史，
+每个月一个 Arrow IPC 文件（YYYY-MM.arrow），读取时内存映射，不再经过 pymysql 元组转换
+新鲜度判断：
+    - 源表水位（最大日期 + 行数）与镜像记录一致 → 直接读取
+    - 只在最大日期之后追加了数据 → 只重新拉取受影响的月份
+    - 其他变化 → 全量重建
+    - Status/Reason/Video/Price 写入后由写入方调用 mark_history_cache_dirty 标记受影响的月份；
+      其他进程（如 Batch_marking 脚本）的写入通过 Snapshot_Writes 中的写入记录发现
+    - 最近 HISTORY_CHECKSUM_MONTHS 个月另外比较数值校验和（曝光/点击/Buyers 之和），
+      发现行数不变的数值修正时重新拉取该月
+    更早月份中未经过上述写入路径的数值修正检测不到，需调用 refresh_history_cache 强制刷新
+需要 pyarrow；未安装时 HISTORY_CACHE_AVAILABLE 为 False，读取函数返回 None，调用方回退到直接查询MySQL
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+import pandas as pd
+from db_utils import db_cursor, format_date_label, fetch_dataframe_streaming
+from config import get_db_config
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as pa_ipc
+    HISTORY_CACHE_AVAILABLE = True
+except ImportError:
+    pa = None
+    pc = None
+    pa_ipc = None
+    HISTORY_CACHE_AVAILABLE = False
+
+
+HISTORY_CACHE_DIR = 'Cache_History'
+HISTORY_CACHE_VERSION = 2
+MANIFEST_FILENAME = 'manifest.json'
+
+# 同一进程内两次新鲜度检查之间的最短间隔（秒）；被标记为脏的镜像不受此限制
+HISTORY_CHECK_INTERVAL = 60
+
+# 比较数值校验和的最近月份数（按源表最大日期所在月份往前数）
+HISTORY_CHECKSUM_MONTHS = 2
+
+_table_locks = {}
+_table_locks_guard = threading.Lock()
+_last_checked = {}
+
+
+def _get_table_lock(table_name):
+    with _table_locks_guard:
+        if table_name not in _table_locks:
+            _table_locks[table_name] = threading.RLock()
+        return _table_locks[table_name]
+
+
+def get_history_cache_dir(table_name):
+    return os.path.join(HISTORY_CACHE_DIR, table_name)
+
+
+def _partition_path(table_name, month):
+    return os.path.join(get_history_cache_dir(table_name), f"{month}.arrow")
+
+
+def _month_of(date_str):
+    """'YYYY-MM-DD' → 'YYYY-MM'"""
+    return date_str[:7]
+
+
+def _month_range(month):
+    """返回该月的 [起始日期, 下月起始日期)"""
+    start = datetime.strptime(f"{month}-01", '%Y-%m-%d')
+    next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start.strftime('%Y-%m-%d'), next_month.strftime('%Y-%m-%d')
+
+
+def _load_manifest(table_name):
+    path = os.path.join(get_history_cache_dir(table_name), MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != HISTORY_CACHE_VERSION:
+            return None
+        return manifest
+    except Exception as e:
+        print(f"读取历史镜像清单失败: {e}")
+        return None
+
+
+def _save_manifest(table_name, manifest):
+    cache_dir = get_history_cache_dir(table_name)
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, MANIFEST_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _fetch_month(cursor, table_name, sales_table_name, month):
+    """从MySQL拉取某个月的 t.* + Buyers"""
+    start_date, end_date = _month_range(month)
+    query = f"""
+    SELECT
+      t.*,
+      s.Buyers
+    FROM `Vida_Traffic`.`{table_name}` t
+    LEFT JOIN `Vida_Sales`.`{sales_table_name}` s
+      ON t.goods_id = s.goods_id
+      AND t.date_label = s.date_label
+    WHERE t.date_label >= %s AND t.date_label < %s
+    ORDER BY t.goods_id, t.date_label
+    """
+    return fetch_dataframe_streaming(cursor.connection, query, (start_date, end_date))
+
+
+def _write_partition(table_name, month, df):
+    """原子写入一个月的分区（先写临时文件再替换）"""
+    path = _partition_path(table_name, month)
+    tmp_path = f"{path}.tmp"
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa_ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _rebuild_months(cursor, table_name, sales_table_name, manifest, months):
+    """重新拉取并写入指定月份，更新 manifest['months'] 与 manifest['columns']"""
+    os.makedirs(get_history_cache_dir(table_name), exist_ok=True)
+    existing = set(manifest.get('months', []))
+    for month in sorted(months):
+        df = _fetch_month(cursor, table_name, sales_table_name, month)
+        manifest['columns'] = list(df.columns)
+        if df.empty:
+            existing.discard(month)
+            path = _partition_path(table_name, month)
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        _write_partition(table_name, month, df)
+        existing.add(month)
+    manifest['months'] = sorted(existing)
+
+
+def _recent_months(latest_date, count):
+    """latest_date 所在月份及之前共 count 个月（'YYYY-MM'）"""
+    if not latest_date or count <= 0:
+        return []
+    month_start = datetime.strptime(f"{_month_of(latest_date)}-01", '%Y-%m-%d')
+    months = []
+    for _ in range(count):
+        months.append(month_start.strftime('%Y-%m'))
+        month_start = (month_start - timedelta(days=1)).replace(day=1)
+    return months
+
+
+def _month_checksums(cursor, table_name, sales_table_name, months):
+    """
+    每个月的数值校验和 [曝光之和, 点击之和, Buyers之和]，按日期范围走索引
+    行数不变的数值修正（如重新导入某天的数据）会改变校验和
+    """
+    checksums = {}
+    for month in months:
+        start_date, end_date = _month_range(month)
+        cursor.execute(f"""
+        SELECT COALESCE(SUM(`Product impressions`), 0), COALESCE(SUM(`Product clicks`), 0)
+        FROM `Vida_Traffic`.`{table_name}`
+        WHERE date_label >= %s AND date_label < %s
+        """, (start_date, end_date))
+        impressions, clicks = cursor.fetchone()
+        cursor.execute(f"""
+        SELECT COALESCE(SUM(Buyers), 0)
+        FROM `Vida_Sales`.`{sales_table_name}`
+        WHERE date_label >= %s AND date_label < %s
+        """, (start_date, end_date))
+        buyers = cursor.fetchone()[0]
+        # 转为字符串，与 manifest 中JSON读回的值可直接比较（DECIMAL 不可JSON序列化）
+        checksums[month] = [str(impressions), str(clicks), str(buyers)]
+    return checksums
+
+
+def _list_source_months(cursor, table_name):
+    cursor.execute(f"SELECT DISTINCT DATE_FORMAT(date_label, '%Y-%m') FROM `Vida_Traffic`.`{table_name}`")
+    return sorted(row[0] for row in cursor.fetchall() if row[0])
+
+
+def _full_rebuild(cursor, table_name, sales_table_name):
+    manifest = {'version': HISTORY_CACHE_VERSION, 'months': [], 'columns': [], 'dirty_months': [], 'all_dirty': False}
+    cache_dir = get_history_cache_dir(table_name)
+    if os.path.isdir(cache_dir):
+        for filename in os.listdir(cache_dir):
+            if filename.endswith('.arrow'):
+                os.remove(os.path.join(cache_dir, filename))
+    _rebuild_months(cursor, table_name, sales_table_name, manifest, _list_source_months(cursor, table_name))
+    return manifest
+
+
+def _sync_recorded_writes(cursor, table_name, manifest):
+    """
+    把 Snapshot_Writes 中镜像上次同步之后记录的写入合并到 manifest 的脏月份
+    （Batch_marking 脚本等其他进程写入时无法调用本进程的 mark_history_cache_dirty）
+    每条记录只标记其日期所在月份，全部日期的记录标记为 all_dirty
+    返回: 当前最新的写入时间，保存到 manifest['writes_seen']
+    """
+    from snapshot_utils import SNAPSHOT_WRITES_TABLE, ALL_DATES_MARK, ensure_writes_table
+
+    ensure_writes_table(cursor)
+    cursor.execute(f"SELECT MAX(last_write_at) FROM `{SNAPSHOT_WRITES_TABLE}` WHERE table_name = %s", (table_name,))
+    latest = cursor.fetchone()[0]
+    latest = str(latest) if latest else None
+    writes_seen = manifest.get('writes_seen') if manifest else None
+    if manifest is None or latest is None or writes_seen is None or latest <= writes_seen:
+        return latest or writes_seen
+
+    cursor.execute(f"""
+    SELECT DISTINCT date_label
+    FROM `{SNAPSHOT_WRITES_TABLE}`
+    WHERE table_name = %s AND last_write_at > %s
+    """, (table_name, writes_seen))
+    dirty_months = set(manifest.get('dirty_months', []))
+    for (date_label,) in cursor.fetchall():
+        date_str = format_date_label(date_label)
+        if date_str == ALL_DATES_MARK:
+            manifest['all_dirty'] = True
+        elif date_str:
+            dirty_months.add(_month_of(date_str))
+    manifest['dirty_months'] = sorted(dirty_months)
+    return latest
+
+
+def ensure_history_cache_fresh(table_name, sales_table_name, force=False):
+    """
+    确保本地镜像与MySQL一致
+    返回: True 表示镜像可用，False 表示不可用（调用方应直接查询MySQL）
+    """
+    from snapshot_utils import get_source_watermark, is_append_only_change
+
+    if not HISTORY_CACHE_AVAILABLE:
+        return False
+
+    with _get_table_lock(table_name):
+        manifest = _load_manifest(table_name)
+        needs_sync = manifest is None or manifest.get('all_dirty') or manifest.get('dirty_months')
+        last_checked = _last_checked.get(table_name)
+        if not force and not needs_sync and last_checked is not None \
+                and time.monotonic() - last_checked < HISTORY_CHECK_INTERVAL:
+            return True
+
+        traffic_config, _, _, _ = get_db_config()
+        try:
+            with db_cursor(traffic_config) as cursor:
+                watermark = list(get_source_watermark(cursor, table_name, sales_table_name))
+                writes_seen = _sync_recorded_writes(cursor, table_name, manifest)
+                saved = tuple(manifest['watermark']) if manifest and manifest.get('watermark') else None
+                # 在拉取数据之前计算，拉取期间发生的修正会在下次检查时发现
+                checksums = _month_checksums(cursor, table_name, sales_table_name,
+                                             _recent_months(watermark[0], HISTORY_CHECKSUM_MONTHS))
+                if manifest is not None:
+                    saved_checksums = manifest.get('checksums') or {}
+                    changed_months = [month for month, checksum in checksums.items()
+                                      if saved_checksums.get(month) != checksum]
+                    if changed_months:
+                        manifest['dirty_months'] = sorted(set(manifest.get('dirty_months', [])) | set(changed_months))
+
+                if manifest is None or manifest.get('all_dirty'):
+                    manifest = _full_rebuild(cursor, table_name, sales_table_name)
+                elif saved != tuple(watermark):
+                    if is_append_only_change(cursor, table_name, sales_table_name, saved, tuple(watermark)):
+                        # 只重新拉取最早受影响日期所在月份及之后的月份
+                        since_month = _month_of(min(saved[0], saved[2]))
+                        months = [m for m in _list_source_months(cursor, table_name) if m >= since_month]
+                        months += [m for m in manifest.get('months', []) if m >= since_month]
+                        _rebuild_months(cursor, table_name, sales_table_name, manifest, set(months))
+                    else:
+                        manifest = _full_rebuild(cursor, table_name, sales_table_name)
+
+                dirty_months = set(manifest.get('dirty_months', []))
+                if dirty_months:
+                    _rebuild_months(cursor, table_name, sales_table_name, manifest, dirty_months)
+
+                manifest['watermark'] = watermark
+                manifest['checksums'] = checksums
+                manifest['writes_seen'] = writes_seen
+                manifest['dirty_months'] = []
+                manifest['all_dirty'] = False
+                manifest['refreshed_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                _save_manifest(table_name, manifest)
+        except Exception as e:
+            print(f"刷新历史镜像失败: {e}")
+            return False
+
+        _last_checked[table_name] = time.monotonic()
+        return True
+
+
+def mark_history_cache_dirty(table_name, dates=None, since_date=None):
+    """
+    标记镜像中受写入影响的月份，下次读取时重新拉取
+    dates: 受影响的日期（字符串或date）
+    since_date: 该日期所在月份及之后的月份都受影响
+    两者都为 None 时标记全部月份
+    """
+    if not HISTORY_CACHE_AVAILABLE:
+        return
+
+    with _get_table_lock(table_name):
+        manifest = _load_manifest(table_name)
+        if manifest is None:
+            return
+        try:
+            if dates is None and since_date is None:
+                manifest['all_dirty'] = True
+            else:
+                dirty_months = set(manifest.get('dirty_months', []))
+                for date_value in dates or []:
+                    date_str = format_date_label(date_value)
+                    if date_str:
+                        dirty_months.add(_month_of(date_str))
+                since_str = format_date_label(since_date)
+                if since_str:
+                    dirty_months.update(m for m in manifest.get('months', []) if m >= _month_of(since_str))
+                manifest['dirty_months'] = sorted(dirty_months)
+            _save_manifest(table_name, manifest)
+        except Exception as e:
+            print(f"标记历史镜像失败: {e}")
+
+
+def refresh_history_cache(table_name, sales_table_name, months=None):
+    """
+    强制刷新镜像：months 为 None 时全量重建，否则重新拉取指定月份（'YYYY-MM'）
+    用于校验和覆盖不到的早期月份被直接修正之后
+    返回: True 表示刷新成功
+    """
+    if not HISTORY_CACHE_AVAILABLE:
+        return False
+
+    with _get_table_lock(table_name):
+        manifest = _load_manifest(table_name)
+        if manifest is not None:
+            try:
+                if months is None:
+                    manifest['all_dirty'] = True
+                else:
+                    manifest['dirty_months'] = sorted(set(manifest.get('dirty_months', [])) | set(months))
+                _save_manifest(table_name, manifest)
+            except Exception as e:
+                print(f"标记历史镜像失败: {e}")
+                return False
+        return ensure_history_cache_fresh(table_name, sales_table_name, force=True)
+
+
+def _read_partition(path, goods_ids):
+    """内存映射读取一个分区，goods_ids 过滤在 Arrow 层完成，只把命中的行转换为 DataFrame"""
+    with pa.memory_map(path, 'r') as source:
+        table = pa_ipc.open_file(source).read_all()
+        if goods_ids is not None:
+            goods_column = table.column('goods_id')
+            value_set = pa.array([str(goods_id) for goods_id in goods_ids]).cast(goods_column.type)
+            table = table.filter(pc.is_in(goods_column, value_set=value_set))
+        df = table.to_pandas()
+        del table
+    return df
+
+
+def read_history_cache(table_name, sales_table_name, goods_ids=None, start_date=None, end_date=None):
+    """
+    从镜像读取 t.* + Buyers，结果与 LEFT JOIN 查询相同，按 goods_id, date_label 排序
+    goods_ids: 只读取这些商品，None表示全部
+    start_date/end_date: 'YYYY-MM-DD'，包含边界
+    返回: DataFrame；镜像不可用或读取失败时返回 None
+    """
+    if not ensure_history_cache_fresh(table_name, sales_table_name):
+        return None
+
+    if goods_ids is not None:
+        goods_ids = list(goods_ids)
+
+    with _get_table_lock(table_name):
+        manifest = _load_manifest(table_name)
+        if manifest is None:
+            return None
+
+        months = manifest.get('months', [])
+        if start_date:
+            months = [m for m in months if m >= _month_of(start_date)]
+        if end_date:
+            months = [m for m in months if m <= _month_of(end_date)]
+
+        try:
+            frames = []
+            for month in months:
+                if goods_ids is not None and len(goods_ids) == 0:
+                    break
+                frames.append(_read_partition(_partition_path(table_name, month), goods_ids))
+        except Exception as e:
+            # 如goods_id类型无法转换为镜像中的类型，交由MySQL查询处理
+            print(f"读取历史镜像失败: {e}")
+            return None
+
+    if not frames:
+        return pd.DataFrame(columns=manifest.get('columns', []))
+
+    df = pd.concat(frames, ignore_index=True)
+    if start_date or end_date:
+        dates = pd.to_datetime(df['date_label'], errors='coerce')
+        mask = pd.Series(True, index=df.index)
+        if start_date:
+            mask &= dates >= pd.Timestamp(start_date)
+        if end_date:
+            mask &= dates <= pd.Timestamp(end_date)
+        df = df[mask]
+
+    return df.sort_values(['goods_id', 'date_label'], kind='stable').reset_index(drop=True)
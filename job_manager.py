@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+后台任务模块
+耗时较长的操作（刷新Status、自动更新Reason、功能7批量操作）不再在Flask请求线程中同步执行：
+接口提交任务后立即返回任务ID，任务在进程内线程池中运行，前端轮询状态/进度/结果
+任务记录与日志保存在本地SQLite（jobs.db）中，服务重启后仍可查询历史任务
+    - 任务状态: queued → running → finished / failed / cancelled
+    - 取消: 排队中的任务直接取消；运行中的任务记录取消请求，由任务在检查点（如每个国家之间）停止
+    - 日志: 任务线程中的 print 输出和异常堆栈（stdout/stderr）会同时写入该任务的日志
+      （任务内再开线程时用 contextvars.copy_context().run 提交，子线程的输出也会记入该任务）
+      日志行先进入内存缓冲，由后台线程每 LOG_FLUSH_INTERVAL 秒或每积累 LOG_FLUSH_LINES 行
+      用一个长连接批量写入；任务结束前会写完该任务的全部日志，再更新任务状态
+"""
+
+import sys
+import json
+import uuid
+import atexit
+import sqlite3
+import threading
+import contextvars
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+JOB_DB_FILE = 'jobs.db'
+
+# 默认后台线程数（可通过配置项 job_workers 修改）
+JOB_WORKERS = 2
+
+# 日志批量写入：最长间隔（秒）与触发立即写入的缓冲行数
+LOG_FLUSH_INTERVAL = 1.0
+LOG_FLUSH_LINES = 200
+
+JOB_STATUS_QUEUED = 'queued'
+JOB_STATUS_RUNNING = 'running'
+JOB_STATUS_FINISHED = 'finished'
+JOB_STATUS_FAILED = 'failed'
+JOB_STATUS_CANCELLED = 'cancelled'
+
+ACTIVE_JOB_STATUSES = (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING)
+
+_job_handlers = {}
+_executor = None
+_init_lock = threading.Lock()
+_submit_lock = threading.Lock()
+_db_lock = threading.Lock()
+_current_job_id = contextvars.ContextVar('current_job_id', default=None)
+
+# 待写入的日志 [(job_id, created_at, message)]；_log_flush_lock 保证各批按顺序写入
+_log_buffer = []
+_log_buffer_lock = threading.Lock()
+_log_flush_lock = threading.Lock()
+_log_flush_event = threading.Event()
+_log_conn = None
+_log_flusher = None
+
+
+class JobCancelled(Exception):
+    """任务在检查点发现取消请求时抛出"""
+    pass
+
+
+class JobContext:
+    """传给任务处理函数的上下文：写日志、更新进度、检查取消"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def log(self, message):
+        _append_log(self.job_id, message)
+
+    def set_progress(self, progress, message=None):
+        """progress: 0~100"""
+        progress = max(0.0, min(100.0, float(progress)))
+        _execute(
+            "UPDATE jobs SET progress = ?, progress_message = COALESCE(?, progress_message) WHERE id = ?",
+            (progress, message, self.job_id)
+        )
+
+    def is_cancelled(self):
+        row = _query_one("SELECT cancel_requested FROM jobs WHERE id = ?", (self.job_id,))
+        return bool(row and row['cancel_requested'])
+
+    def check_cancelled(self):
+        if self.is_cancelled():
+            raise JobCancelled()
+
+
+class _JobOutputStream:
+    """
+    替换 sys.stdout / sys.stderr：原样输出到控制台，同时在任务线程中把每一行写入对应任务的日志
+    现有代码大量使用 print 和 traceback.print_exc 输出进度和错误，这样无需逐处修改即可得到按任务划分的日志
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()  # 每个线程未满一行的输出
+
+    def write(self, text):
+        written = self._stream.write(text)
+        job_id = _current_job_id.get()
+        if job_id and text:
+            buffer = getattr(self._local, 'buffer', '') + text
+            *lines, buffer = buffer.split('\n')
+            self._local.buffer = buffer
+            for line in lines:
+                if line.strip():
+                    _append_log(job_id, line)
+        return written
+
+    def flush_pending(self, job_id):
+        """任务结束时写入本线程剩余的不完整行"""
+        buffer = getattr(self._local, 'buffer', '')
+        self._local.buffer = ''
+        if buffer.strip():
+            _append_log(job_id, buffer)
+
+    def flush(self):
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _connect():
+    conn = sqlite3.connect(JOB_DB_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _execute(sql, params=()):
+    with _db_lock:
+        conn = _connect()
+        try:
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+
+def _query_one(sql, params=()):
+    conn = _connect()
+    try:
+        return conn.execute(sql, params).fetchone()
+    finally:
+        conn.close()
+
+
+def _query_all(sql, params=()):
+    conn = _connect()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _append_log(job_id, message):
+    """加入日志缓冲，不在调用线程中写数据库"""
+    with _log_buffer_lock:
+        _log_buffer.append((job_id, _now(), str(message)))
+        buffered = len(_log_buffer)
+    if buffered >= LOG_FLUSH_LINES:
+        _log_flush_event.set()
+
+
+def _flush_logs():
+    """把缓冲中的日志用一个事务批量写入"""
+    global _log_conn
+    with _log_flush_lock:
+        with _log_buffer_lock:
+            if not _log_buffer:
+                return
+            rows = _log_buffer[:]
+            del _log_buffer[:]
+        try:
+            with _db_lock:
+                if _log_conn is None:
+                    _log_conn = sqlite3.connect(JOB_DB_FILE, timeout=30, check_same_thread=False)
+                _log_conn.executemany("INSERT INTO job_logs (job_id, created_at, message) VALUES (?, ?, ?)", rows)
+                _log_conn.commit()
+        except Exception as e:
+            # 日志写入失败不能影响任务本身；丢弃这一批并重建连接，直接写原始stdout避免递归
+            sys.__stdout__.write(f"写入任务日志失败（{len(rows)} 行）: {e}\n")
+            if _log_conn is not None:
+                try:
+                    _log_conn.close()
+                except Exception:
+                    pass
+                _log_conn = None
+
+
+def _log_flush_loop():
+    while True:
+        _log_flush_event.wait(LOG_FLUSH_INTERVAL)
+        _log_flush_event.clear()
+        _flush_logs()
+
+
+def get_job_workers():
+    from config import get_config_section
+    try:
+        workers = int(get_config_section('job_workers', JOB_WORKERS))
+    except (TypeError, ValueError):
+        workers = JOB_WORKERS
+    return max(workers, 1)
+
+
+def init_job_manager():
+    """创建任务表、安装日志输出、启动线程池（可重复调用）"""
+    global _executor, _log_flusher
+    with _init_lock:
+        if _executor is not None:
+            return
+
+        with _db_lock:
+            conn = _connect()
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        job_type TEXT NOT NULL,
+                        params TEXT,
+                        status TEXT NOT NULL,
+                        progress REAL DEFAULT 0,
+                        progress_message TEXT,
+                        result TEXT,
+                        error TEXT,
+                        cancel_requested INTEGER DEFAULT 0,
+                        created_at TEXT,
+                        started_at TEXT,
+                        finished_at TEXT
+                    )
+                """)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS job_logs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        job_id TEXT NOT NULL,
+                        created_at TEXT,
+                        message TEXT
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_job_logs_job_id ON job_logs (job_id, id)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at)")
+                # 上次进程退出时未完成的任务不会再被执行，标记为失败
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?)",
+                    (JOB_STATUS_FAILED, '服务重启，任务已中断', _now(), *ACTIVE_JOB_STATUSES)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+        if not isinstance(sys.stdout, _JobOutputStream):
+            sys.stdout = _JobOutputStream(sys.stdout)
+        if not isinstance(sys.stderr, _JobOutputStream):
+            sys.stderr = _JobOutputStream(sys.stderr)
+
+        _log_flusher = threading.Thread(target=_log_flush_loop, name='job-log-flusher', daemon=True)
+        _log_flusher.start()
+        # 退出时写入尚在缓冲中的日志
+        atexit.register(_flush_logs)
+
+        _executor = ThreadPoolExecutor(max_workers=get_job_workers(), thread_name_prefix='job')
+
+
+def register_job_type(job_type, handler):
+    """
+    注册任务类型
+    handler(ctx, **params) 返回可JSON序列化的结果（一般为原接口返回的字典）
+    """
+    _job_handlers[job_type] = handler
+
+
+def submit_job(job_type, params=None, dedupe=True):
+    """
+    提交任务
+    dedupe: 已有相同类型、相同参数且未结束的任务时直接返回该任务，避免重复刷新同一批表
+    返回: 任务字典（见 get_job）
+    """
+    if job_type not in _job_handlers:
+        raise ValueError(f'未知的任务类型: {job_type}')
+
+    init_job_manager()
+    params = params or {}
+    params_json = json.dumps(params, ensure_ascii=False, sort_keys=True)
+
+    with _submit_lock:
+        if dedupe:
+            row = _query_one(
+                "SELECT id FROM jobs WHERE job_type = ? AND params = ? AND status IN (?, ?) AND cancel_requested = 0 "
+                "ORDER BY created_at LIMIT 1",
+                (job_type, params_json, *ACTIVE_JOB_STATUSES)
+            )
+            if row:
+                return get_job(row['id'])
+
+        job_id = uuid.uuid4().hex
+        _execute(
+            "INSERT INTO jobs (id, job_type, params, status, progress, created_at) VALUES (?, ?, ?, ?, 0, ?)",
+            (job_id, job_type, params_json, JOB_STATUS_QUEUED, _now())
+        )
+        _executor.submit(_run_job, job_id)
+
+    return get_job(job_id)
+
+
+def _run_job(job_id):
+    row = _query_one("SELECT job_type, params, status, cancel_requested FROM jobs WHERE id = ?", (job_id,))
+    if row is None or row['status'] != JOB_STATUS_QUEUED:
+        return
+    if row['cancel_requested']:
+        _finish_job(job_id, JOB_STATUS_CANCELLED)
+        return
+
+    _execute(
+        "UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?",
+        (JOB_STATUS_RUNNING, _now(), job_id, JOB_STATUS_QUEUED)
+    )
+    ctx = JobContext(job_id)
+    token = _current_job_id.set(job_id)
+    status, result, error, progress = JOB_STATUS_FAILED, None, None, None
+    try:
+        handler = _job_handlers[row['job_type']]
+        result = handler(ctx, **json.loads(row['params'] or '{}'))
+        if ctx.is_cancelled():
+            status = JOB_STATUS_CANCELLED
+        else:
+            status, progress = JOB_STATUS_FINISHED, 100
+    except JobCancelled:
+        status = JOB_STATUS_CANCELLED
+    except Exception as e:
+        traceback.print_exc()
+        error = str(e)
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            if isinstance(stream, _JobOutputStream):
+                stream.flush_pending(job_id)
+        _current_job_id.reset(token)
+        # 先写完日志再更新状态，前端看到任务结束时日志已完整
+        _flush_logs()
+    _finish_job(job_id, status, result=result, error=error, progress=progress)
+
+
+def _finish_job(job_id, status, result=None, error=None, progress=None):
+    result_json = json.dumps(result, ensure_ascii=False, default=str) if result is not None else None
+    _execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, progress = COALESCE(?, progress) "
+        "WHERE id = ?",
+        (status, result_json, error, _now(), progress, job_id)
+    )
+
+
+def _row_to_job(row, include_result=True):
+    job = {
+        'job_id': row['id'],
+        'job_type': row['job_type'],
+        'params': json.loads(row['params'] or '{}'),
+        'status': row['status'],
+        'progress': row['progress'] or 0,
+        'progress_message': row['progress_message'],
+        'error': row['error'],
+        'cancel_requested': bool(row['cancel_requested']),
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at']
+    }
+    if include_result:
+        job['result'] = json.loads(row['result']) if row['result'] else None
+    return job
+
+
+def get_job(job_id):
+    """返回任务字典，不存在时返回 None"""
+    init_job_manager()
+    row = _query_one("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    return _row_to_job(row) if row else None
+
+
+def list_jobs(limit=50, status=None):
+    """按创建时间倒序列出任务（不含结果）"""
+    init_job_manager()
+    if status:
+        rows = _query_all(
+            "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, int(limit))
+        )
+    else:
+        rows = _query_all("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (int(limit),))
+    return [_row_to_job(row, include_result=False) for row in rows]
+
+
+def get_job_logs(job_id, after_id=0, limit=1000):
+    """返回 id 大于 after_id 的日志，前端可用最后一条的 id 增量拉取"""
+    init_job_manager()
+    rows = _query_all(
+        "SELECT id, created_at, message FROM job_logs WHERE job_id = ? AND id > ? ORDER BY id LIMIT ?",
+        (job_id, int(after_id), int(limit))
+    )
+    return [{'id': row['id'], 'created_at': row['created_at'], 'message': row['message']} for row in rows]
+
+
+def cancel_job(job_id):
+    """
+    取消任务
+    返回: (success, message)
+    """
+    job = get_job(job_id)
+    if job is None:
+        return False, '任务不存在'
+    if job['status'] not in ACTIVE_JOB_STATUSES:
+        return False, f"任务已结束（{job['status']}）"
+
+    _execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+    if job['status'] == JOB_STATUS_QUEUED:
+        # 排队中的任务直接标记为已取消，线程池取到时会跳过
+        _execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (JOB_STATUS_CANCELLED, _now(), job_id, JOB_STATUS_QUEUED)
+        )
+        return True, '任务已取消'
+    return True, '已请求取消，任务将在当前步骤完成后停止'
@@ -3,13 +3,24 @@
 图表工具模块
 """
 
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import matplotlib
 matplotlib.use('Agg')  # 使用非交互式后端
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
+import pandas as pd
 from scipy.stats import pearsonr
 import base64
 from io import BytesIO
+from PIL import Image
+from chart_cache import chart_cache_key, goods_fingerprint, get_cached_chart, put_cached_chart, get_or_render_chart
 
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'Arial Unicode MS']
@@ -29,11 +40,21 @@ def plot_to_base64(fig):
 def plot_goods_trend_double_axis(goods_id, df):
     """
     绘制商品曝光趋势图和动销条形图（同一张图，双Y轴）
-    返回base64编码的图片
+    返回base64编码的图片（数据未变化时直接取渲染图表缓存）
     """
     if len(df) == 0:
         return None
-    
+
+    key = chart_cache_key('goods_trend_double_axis', goods_fingerprint(
+        goods_id,
+        df['date_label'].to_numpy(),
+        df['impressions'].to_numpy(dtype=float),
+        df['buyers'].to_numpy(dtype=float)
+    ))
+    return get_or_render_chart(key, lambda: _render_goods_trend_double_axis(goods_id, df))
+
+
+def _render_goods_trend_double_axis(goods_id, df):
     fig, ax = plt.subplots(figsize=(14, 8))
     
     # 计算日期数量
@@ -131,123 +152,363 @@ def plot_impressions_clicks_scatter(goods_id, df):
     return img_base64, correlation
 
 
+# ===== 批量商品图渲染 =====
+# 每3个商品一张图。每个商品单独渲染为一个小图（panel），再按顺序横向拼接为一张图：
+#   - 小图先按商品的数据指纹查渲染图表缓存（chart_cache），同一商品出现在不同分类或分页位置变化时仍能命中
+#   - 未命中的小图较多时分发到进程池（每个进程启动时初始化字体与matplotlib状态），按原顺序取回
+#   - 每个进程/线程复用同一个 Figure 与 Axes，每个小图只清空重画，不再逐张创建和关闭图
+# 渲染器只使用面向对象的 Figure API（不经过 pyplot 全局状态），Flask 多线程下也可安全使用
+
+# 渲染进程数（可通过配置项 plot_workers 修改，0 表示不使用进程池）
+PLOT_WORKERS = min(4, os.cpu_count() or 1)
+
+# 需要渲染的小图少于该值时直接在当前进程渲染（进程间传输与调度开销大于收益）
+PLOT_POOL_MIN_PANELS = 12
+
+PLOT_SALES_TICKS = np.arange(0, 13, 1)
+
+_plot_pool = None
+_plot_pool_workers = None
+_plot_pool_lock = threading.Lock()
+_thread_renderers = threading.local()
+_process_renderer = None
+
+
+class GoodsBatchRenderer:
+    """复用同一个 Figure/Axes 渲染批量商品图中单个商品的小图"""
+
+    def __init__(self):
+        self.fig = Figure(figsize=(4, 3), constrained_layout=True)
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots()
+        self.ax_sales = self.ax.twinx()
+
+    def _reset_axes(self):
+        ax, ax_sales = self.ax, self.ax_sales
+        ax.cla()
+        ax_sales.cla()
+        # 清空后恢复 twinx 的右侧Y轴设置
+        ax_sales.yaxis.tick_right()
+        ax_sales.yaxis.set_label_position('right')
+        ax_sales.yaxis.set_offset_position('right')
+        ax_sales.xaxis.set_visible(False)
+        ax_sales.patch.set_visible(False)
+
+    def render(self, item):
+        """
+        item: (goods_id, dates, impressions, buyers, marked_dates, marked_impressions)
+        返回base64编码的图片
+        """
+        goods_id, dates, impressions, buyers, marked_dates, marked_impressions = item
+        self._reset_axes()
+        ax, ax_sales = self.ax, self.ax_sales
+
+        ax.plot(
+            dates,
+            impressions,
+            color="tab:blue",
+            marker="o",
+            linewidth=1,
+            label="曝光",
+        )
+
+        # 如果有标记日期，在折线图上用红点标记
+        if len(marked_dates) > 0:
+            ax.scatter(
+                marked_dates,
+                marked_impressions,
+                color="red",
+                s=100,
+                marker="o",
+                zorder=5,
+                edgecolors="darkred",
+                linewidths=1.5
+            )
+
+        ax_sales.bar(
+            dates,
+            buyers,
+            color="tab:orange",
+            alpha=0.4,
+            width=0.6,
+            label="动销",
+        )
+
+        date_count = len(np.unique(dates))
+        ax.set_title(f"{goods_id}\n（{date_count}个日期）", fontsize=9)
+        ax.set_ylabel("曝光", fontsize=8)
+        ax_sales.set_ylabel("动销", fontsize=8)
+
+        ax_sales.set_ylim(0, 12)
+        ax_sales.set_yticks(PLOT_SALES_TICKS)
+
+        max_ticks = 16
+        tick_indices = np.linspace(
+            0, len(dates) - 1, num=min(max_ticks, len(dates))
+        ).round().astype(int)
+        tick_dates = dates[tick_indices]
+        ax.set_xticks(tick_dates)
+        ax.set_xticklabels(
+            pd.DatetimeIndex(tick_dates).strftime("%m-%d"), rotation=45, ha="right", fontsize=7
+        )
+
+        # 每个小图都带图例，小图内容只取决于商品数据，与在图中的位置无关
+        handles1, labels1 = ax.get_legend_handles_labels()
+        handles2, labels2 = ax_sales.get_legend_handles_labels()
+        ax.legend(
+            handles1 + handles2, labels1 + labels2, fontsize=8, loc="upper left"
+        )
+
+        img_buffer = BytesIO()
+        self.fig.savefig(img_buffer, format='png', bbox_inches='tight', dpi=100)
+        return base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+
+
+def _compose_panels(panel_images):
+    """把同一张图中各商品的小图（base64）从左到右拼接为一张图，高度不同时顶部对齐、白色补齐"""
+    if len(panel_images) == 1:
+        return panel_images[0]
+    images = [Image.open(BytesIO(base64.b64decode(img_base64))).convert('RGB') for img_base64 in panel_images]
+    canvas = Image.new('RGB', (sum(image.width for image in images), max(image.height for image in images)), 'white')
+    offset = 0
+    for image in images:
+        canvas.paste(image, (offset, 0))
+        offset += image.width
+    img_buffer = BytesIO()
+    canvas.save(img_buffer, format='PNG')
+    return base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+
+
+def _to_datetime64(value):
+    try:
+        return pd.Timestamp(value).to_datetime64()
+    except (TypeError, ValueError):
+        return None
+
+
+def _build_goods_items(df, marked_dates, date_column="date", impressions_column="Product impressions",
+                       buyers_column="Buyers"):
+    """把 DataFrame 按 goods_id 分组，每个商品只保留绘图需要的数组"""
+    goods_items = []
+    for goods_id, sub_df in df.groupby("goods_id"):
+        sub = sub_df.sort_values(date_column)
+        dates = pd.to_datetime(sub[date_column]).to_numpy(dtype='datetime64[ns]')
+        impressions = sub[impressions_column].to_numpy(dtype=float)
+        buyers = sub[buyers_column].to_numpy(dtype=float)
+
+        points_dates = []
+        points_impressions = []
+        for md in marked_dates.get(goods_id) or []:
+            md_dt = _to_datetime64(md)
+            if md_dt is None:
+                continue
+            matching = np.flatnonzero(dates == md_dt)
+            if len(matching) > 0:
+                points_dates.append(md_dt)
+                points_impressions.append(impressions[matching[0]])
+
+        goods_items.append((
+            goods_id, dates, impressions, buyers,
+            np.array(points_dates, dtype='datetime64[ns]'), np.array(points_impressions, dtype=float)
+        ))
+    return goods_items
+
+
+def _get_thread_renderer():
+    renderer = getattr(_thread_renderers, 'renderer', None)
+    if renderer is None:
+        renderer = _thread_renderers.renderer = GoodsBatchRenderer()
+    return renderer
+
+
+def _init_plot_worker():
+    """渲染进程初始化：固定Agg后端与中文字体，预先创建渲染器并绘制一次以加载字体缓存"""
+    global _process_renderer
+    matplotlib.use('Agg')
+    matplotlib.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'Arial Unicode MS']
+    matplotlib.rcParams['axes.unicode_minus'] = False
+    renderer = GoodsBatchRenderer()
+    renderer.ax.set_title("预热 0123456789")
+    renderer.fig.canvas.draw()
+    _process_renderer = renderer
+
+
+def _render_panel_in_worker(item):
+    """在渲染进程中执行，进程内复用同一个渲染器"""
+    global _process_renderer
+    if _process_renderer is None:
+        _process_renderer = GoodsBatchRenderer()
+    return _process_renderer.render(item)
+
+
+def get_plot_workers():
+    from config import get_config_section
+    try:
+        workers = int(get_config_section('plot_workers', PLOT_WORKERS))
+    except (TypeError, ValueError):
+        workers = PLOT_WORKERS
+    return max(workers, 0)
+
+
+def _get_plot_pool():
+    """获取（必要时创建）渲染进程池；配置为0时返回 None"""
+    global _plot_pool, _plot_pool_workers
+    workers = get_plot_workers()
+    with _plot_pool_lock:
+        if _plot_pool is not None and _plot_pool_workers != workers:
+            _plot_pool.shutdown(wait=False, cancel_futures=True)
+            _plot_pool = None
+        if _plot_pool is None and workers > 0:
+            # Flask 服务是多线程的，fork 会把其他线程持有的锁（连接池、matplotlib、logging）复制到子进程中导致死锁，
+            # 因此用 spawn 启动全新的渲染进程
+            _plot_pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_plot_worker,
+                                             mp_context=multiprocessing.get_context('spawn'))
+            _plot_pool_workers = workers
+        return _plot_pool
+
+
+def _discard_plot_pool():
+    global _plot_pool
+    with _plot_pool_lock:
+        if _plot_pool is not None:
+            _plot_pool.shutdown(wait=False, cancel_futures=True)
+            _plot_pool = None
+
+
+def shutdown_plot_pool():
+    """关闭渲染进程池（进程退出时调用）"""
+    _discard_plot_pool()
+
+
+atexit.register(shutdown_plot_pool)
+
+
+def _panel_cache_key(item):
+    """按单个商品的数据指纹计算小图的缓存键，与所在分类、分页和图中位置无关"""
+    goods_id, dates, impressions, buyers, marked_dates, _ = item
+    return chart_cache_key('goods_panel', goods_fingerprint(goods_id, dates, impressions, buyers, marked_dates))
+
+
+def _render_panels(items):
+    """按顺序渲染小图；数量达到 PLOT_POOL_MIN_PANELS 时使用进程池"""
+    pool = _get_plot_pool() if len(items) >= PLOT_POOL_MIN_PANELS else None
+    if pool is not None:
+        rendered = 0
+        try:
+            batch_size = max(1, len(items) // (_plot_pool_workers * 4))
+            for img_base64 in pool.map(_render_panel_in_worker, items, chunksize=batch_size):
+                rendered += 1
+                yield img_base64
+            return
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            # 进程池不可用（如进程被杀死、系统限制）时丢弃进程池，剩余小图在当前进程渲染
+            print(f"渲染进程池不可用，改为在当前进程渲染: {e}")
+            _discard_plot_pool()
+            items = items[rendered:]
+
+    renderer = _get_thread_renderer()
+    for item in items:
+        yield renderer.render(item)
+
+
+def iter_goods_batch_images(df, cols=3, marked_dates=None):
+    """
+    按顺序逐张生成批量商品图（base64），参数同 plot_goods_batch
+    每个商品的小图按数据指纹缓存，已缓存的直接读取，其余渲染后写入缓存，再按每张图 cols 个商品拼接
+    """
+    if len(df) == 0:
+        return
+
+    goods_items = _build_goods_items(df, marked_dates or {})
+    keys = [_panel_cache_key(item) for item in goods_items]
+    cached = [get_cached_chart(key) for key in keys]
+
+    misses = [item for item, img_base64 in zip(goods_items, cached) if img_base64 is None]
+    rendered = _render_panels(misses)
+    for start in range(0, len(goods_items), cols):
+        panel_images = []
+        for key, img_base64 in zip(keys[start:start + cols], cached[start:start + cols]):
+            if img_base64 is None:
+                img_base64 = next(rendered)
+                put_cached_chart(key, img_base64)
+            panel_images.append(img_base64)
+        yield _compose_panels(panel_images)
+
+
 def plot_goods_batch(df, cols=3, marked_dates=None):
     """
     批量展示商品图，每行固定3个小图
     marked_dates: dict {goods_id: [date1, date2, ...]} 标记日期列表，会在折线图上用红点标记
     返回base64编码的图片列表
     """
+    return list(iter_goods_batch_images(df, cols=cols, marked_dates=marked_dates))
+
+
+# ===== 浏览器端绘图模式 =====
+# 不在服务器渲染PNG，只返回紧凑的序列数据，由 static/js/main.js 在浏览器中绘制相同样式的双轴图
+# 日期以相对 base_date 的天数表示，曝光/动销为整数数组（缺失值为 null）
+
+CHART_MODE_IMAGE = 'image'
+CHART_MODE_SERIES = 'series'
+
+
+def normalize_chart_mode(chart_mode):
+    """未知的模式按 image 处理"""
+    return CHART_MODE_SERIES if chart_mode == CHART_MODE_SERIES else CHART_MODE_IMAGE
+
+
+def _to_int_list(values):
+    return [None if np.isnan(value) else int(round(value)) for value in values]
+
+
+def _build_series_payload(goods_items):
+    if not goods_items:
+        return {'base_date': None, 'goods': []}
+
+    base_date = min(item[1][0] for item in goods_items if len(item[1]) > 0).astype('datetime64[D]')
+    goods = []
+    for goods_id, dates, impressions, buyers, marked_dates, _ in goods_items:
+        goods.append({
+            'goods_id': str(goods_id),
+            'd': (dates.astype('datetime64[D]') - base_date).astype(int).tolist(),
+            'i': _to_int_list(impressions),
+            'b': _to_int_list(buyers),
+            'm': (marked_dates.astype('datetime64[D]') - base_date).astype(int).tolist()
+        })
+    return {'base_date': str(base_date), 'goods': goods}
+
+
+def build_goods_batch_series(df, marked_dates=None):
+    """
+    批量商品图的序列数据（浏览器端绘图），商品顺序与 plot_goods_batch 相同
+    返回: {
+        'base_date': 'YYYY-MM-DD',
+        'goods': [{'goods_id': str, 'd': [日期偏移], 'i': [曝光], 'b': [动销], 'm': [标记日期偏移]}, ...]
+    }
+    """
     if len(df) == 0:
-        return []
-    
-    if marked_dates is None:
-        marked_dates = {}
-    
-    sales_ticks = np.arange(0, 13, 1)
-    goods_groups = list(df.groupby("goods_id"))
-    chunk_size = cols
-    images = []
-    
-    for start in range(0, len(goods_groups), chunk_size):
-        chunk = goods_groups[start : start + chunk_size]
-        fig, axes = plt.subplots(
-            1, cols, figsize=(cols * 4, 3), constrained_layout=True
-        )
-        axes = np.atleast_1d(axes)
-        
-        for ax in axes[len(chunk) :]:
-            ax.axis("off")
-        
-        for idx_ax, (goods_id, sub_df) in enumerate(chunk):
-            ax = axes[idx_ax]
-            sub = sub_df.sort_values("date")
-            ax_sales = ax.twinx()
-            
-            ax.plot(
-                sub["date"],
-                sub["Product impressions"],
-                color="tab:blue",
-                marker="o",
-                linewidth=1,
-                label="曝光",
-            )
-            
-            # 如果有标记日期，在折线图上用红点标记
-            if goods_id in marked_dates and marked_dates[goods_id]:
-                marked_dates_list = marked_dates[goods_id]
-                # 将标记日期转换为与sub["date"]相同的格式（datetime）
-                import pandas as pd
-                from datetime import datetime
-                
-                # 确保标记日期是datetime格式
-                marked_dates_dt = []
-                for md in marked_dates_list:
-                    if isinstance(md, str):
-                        try:
-                            md_dt = pd.to_datetime(md)
-                            marked_dates_dt.append(md_dt)
-                        except:
-                            continue
-                    elif hasattr(md, 'to_pydatetime'):
-                        marked_dates_dt.append(md)
-                    elif isinstance(md, datetime):
-                        marked_dates_dt.append(pd.to_datetime(md))
-                
-                # 在折线图上标记这些日期
-                for md_dt in marked_dates_dt:
-                    # 找到sub中对应的日期行
-                    matching_rows = sub[sub["date"] == md_dt]
-                    if len(matching_rows) > 0:
-                        # 在对应的日期位置画红点
-                        ax.scatter(
-                            md_dt,
-                            matching_rows.iloc[0]["Product impressions"],
-                            color="red",
-                            s=100,
-                            marker="o",
-                            zorder=5,
-                            edgecolors="darkred",
-                            linewidths=1.5
-                        )
-            
-            ax_sales.bar(
-                sub["date"],
-                sub["Buyers"],
-                color="tab:orange",
-                alpha=0.4,
-                width=0.6,
-                label="动销",
-            )
-            
-            date_count = sub["date"].nunique()
-            ax.set_title(f"{goods_id}\n（{date_count}个日期）", fontsize=9)
-            ax.set_ylabel("曝光", fontsize=8)
-            ax_sales.set_ylabel("动销", fontsize=8)
-            
-            ax_sales.set_ylim(0, 12)
-            ax_sales.set_yticks(sales_ticks)
-            
-            max_ticks = 16
-            tick_indices = np.linspace(
-                0, len(sub) - 1, num=min(max_ticks, len(sub))
-            ).round().astype(int)
-            tick_dates = sub.iloc[tick_indices]["date"]
-            ax.set_xticks(tick_dates)
-            ax.set_xticklabels(
-                tick_dates.dt.strftime("%m-%d"), rotation=45, ha="right", fontsize=7
-            )
-            
-            if idx_ax == 0:
-                handles1, labels1 = ax.get_legend_handles_labels()
-                handles2, labels2 = ax_sales.get_legend_handles_labels()
-                ax.legend(
-                    handles1 + handles2, labels1 + labels2, fontsize=8, loc="upper left"
-                )
-        
-        img_base64 = plot_to_base64(fig)
-        images.append(img_base64)
-    
-    return images
+        return {'base_date': None, 'goods': []}
+    return _build_series_payload(_build_goods_items(df, marked_dates or {}))
+
+
+def build_goods_trend_series(goods_id, df):
+    """单个商品趋势图的序列数据（对应 plot_goods_trend_double_axis，列为 date_label/impressions/buyers）"""
+    if len(df) == 0:
+        return None
+    df = df.assign(goods_id=goods_id)
+    return _build_series_payload(_build_goods_items(
+        df, {}, date_column='date_label', impressions_column='impressions', buyers_column='buyers'
+    ))
+
+
+def plot_goods_charts(df, chart_mode=CHART_MODE_IMAGE, cols=3, marked_dates=None):
+    """
+    按模式生成批量商品图
+    返回: image 模式为base64图片列表；series 模式为 build_goods_batch_series 的结果
+    """
+    if normalize_chart_mode(chart_mode) == CHART_MODE_SERIES:
+        return build_goods_batch_series(df, marked_dates=marked_dates)
+    return plot_goods_batch(df, cols=cols, marked_dates=marked_dates)
 
 
 def plot_reason_category_pie(reason_counts):
@@ -0,0 +1,789 @@
+# -*- coding: utf-8 -*-
+"""
+商品快照模块
+按国家维护两张汇总表（位于流量库），避免各功能反复扫描完整历史：
+    Snapshot_ROA1_xx        每个goods_id一行：首次/最后出现日期、首次动销日期、累计Buyers、
+                            最近一次Status/Reason/Video/Price
+    Snapshot_Daily_ROA1_xx  每个date_label一行：当天商品数、Status覆盖数、上升期/非上升期数量、动销商品数
+快照在读取时按源表的最大日期（走索引）发现新导入的日期并增量刷新；
+源表总行数的校验（发现补录/删除历史数据）在后台线程中进行，只刷新行数变化的日期涉及的商品，
+有数据被删除时在后台全量重建，期间读取仍使用旧快照
+Status/Reason/Video/Price 写入后由写入方调用 refresh_snapshot_after_write 同步刷新，
+同时记录到 Snapshot_Writes，结果缓存（Cache_Dynamic/Cache_Indicator）据此与源表水位判断是否过期
+"""
+
+import os
+import time
+import threading
+import pandas as pd
+from db_utils import db_cursor, format_date_label
+from config import get_db_config
+
+
+SNAPSHOT_TABLE_PREFIX = 'Snapshot_'
+DAILY_SNAPSHOT_TABLE_PREFIX = 'Snapshot_Daily_'
+SNAPSHOT_META_TABLE = 'Snapshot_Meta'
+SNAPSHOT_WRITES_TABLE = 'Snapshot_Writes'
+
+# Snapshot_Writes 中表示"全部日期"的日期（主键列不能为NULL）
+ALL_DATES_MARK = '1000-01-01'
+
+# 同一进程内两次新鲜度检查之间的最短间隔（秒）
+SNAPSHOT_CHECK_INTERVAL = 60
+
+# 同一进程内两次后台全量校验（源表总行数、逐日行数）之间的最短间隔（秒）
+SNAPSHOT_VERIFY_INTERVAL = 600
+
+# 结果缓存水位中源表行数（COUNT(*)）的复用时间（秒）；最大日期每次都查询（走 date_label 索引）
+CACHE_WATERMARK_COUNT_TTL = 60
+
+_last_checked = {}
+_last_verified = {}
+_check_lock = threading.Lock()
+_refresh_locks = {}
+_row_counts = {}
+_row_counts_lock = threading.Lock()
+
+
+def get_snapshot_table_names(table_name):
+    """返回 (商品快照表名, 每日汇总表名)，表名不以 ROA1_ 开头，不会出现在国家表列表中"""
+    return f"{SNAPSHOT_TABLE_PREFIX}{table_name}", f"{DAILY_SNAPSHOT_TABLE_PREFIX}{table_name}"
+
+
+def _get_column_type(cursor, table, column):
+    """返回列的类型定义（如 'bigint'、'varchar(64)'），表或列不存在时返回 None"""
+    try:
+        cursor.execute(f"SHOW COLUMNS FROM {table} LIKE %s", (column,))
+    except Exception:
+        return None
+    row = cursor.fetchone()
+    return row[1] if row else None
+
+
+def _snapshot_goods_id_type(cursor, table_name):
+    """快照表 goods_id 的列类型：与源流量表一致，JOIN 回源表时不发生隐式类型转换、可以使用索引"""
+    goods_id_type = _get_column_type(cursor, f"`Vida_Traffic`.`{table_name}`", 'goods_id')
+    if not goods_id_type or goods_id_type.lower().split('(')[0] in ('text', 'tinytext', 'mediumtext', 'longtext', 'blob'):
+        # 主键不能直接使用 TEXT/BLOB
+        return 'VARCHAR(64)'
+    return goods_id_type
+
+
+def _get_refresh_lock(table_name):
+    """同一进程内对同一国家快照的刷新互斥（请求线程的增量刷新与后台校验）"""
+    with _check_lock:
+        if table_name not in _refresh_locks:
+            _refresh_locks[table_name] = threading.Lock()
+        return _refresh_locks[table_name]
+
+
+def _clear_watermark(cursor, table_name):
+    """删除水位记录，下次 ensure_snapshot_fresh 全量构建"""
+    cursor.execute("SHOW TABLES LIKE %s", (SNAPSHOT_META_TABLE,))
+    if cursor.fetchone() is not None:
+        cursor.execute(f"DELETE FROM `{SNAPSHOT_META_TABLE}` WHERE table_name = %s", (table_name,))
+
+
+def ensure_snapshot_tables(cursor, table_name):
+    """
+    创建快照表（如不存在）
+    已有的商品快照表 goods_id 类型与源表不一致时（旧版本统一为 VARCHAR(64)）删除重建，
+    旧版本的每日汇总表缺少 sales_row_count 时补上该列；两种情况都清除水位记录，使 ensure_snapshot_fresh 全量重新构建
+    """
+    goods_table, daily_table = get_snapshot_table_names(table_name)
+    goods_id_type = _snapshot_goods_id_type(cursor, table_name)
+
+    existing_type = _get_column_type(cursor, f"`{goods_table}`", 'goods_id')
+    if existing_type is not None and existing_type.lower() != goods_id_type.lower():
+        print(f"快照表 {goods_table} 的 goods_id 类型 {existing_type} 与源表 {goods_id_type} 不一致，重新构建")
+        cursor.execute(f"DROP TABLE `{goods_table}`")
+        _clear_watermark(cursor, table_name)
+
+    if _get_column_type(cursor, f"`{daily_table}`", 'date_label') is not None \
+            and _get_column_type(cursor, f"`{daily_table}`", 'sales_row_count') is None:
+        cursor.execute(f"""
+        ALTER TABLE `{daily_table}`
+        ADD COLUMN `sales_row_count` INT NOT NULL DEFAULT 0 COMMENT '销售表当天行数' AFTER `traffic_row_count`
+        """)
+        _clear_watermark(cursor, table_name)
+
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS `{goods_table}` (
+        `goods_id` {goods_id_type} NOT NULL,
+        `first_traffic_date` DATE DEFAULT NULL COMMENT '流量表首次出现日期',
+        `last_traffic_date` DATE DEFAULT NULL COMMENT '流量表最后出现日期',
+        `first_sales_date` DATE DEFAULT NULL COMMENT '首次动销日期（Buyers > 0）',
+        `first_sales_record_date` DATE DEFAULT NULL COMMENT '销售表首次出现日期',
+        `last_sales_date` DATE DEFAULT NULL COMMENT '销售表最后出现日期',
+        `total_buyers` DECIMAL(20, 2) NOT NULL DEFAULT 0 COMMENT '累计Buyers',
+        `latest_status` INT DEFAULT NULL,
+        `latest_status_date` DATE DEFAULT NULL,
+        `latest_reason` VARCHAR(255) DEFAULT NULL COMMENT '最近一次非空Reason',
+        `latest_reason_date` DATE DEFAULT NULL,
+        `latest_video` VARCHAR(500) DEFAULT NULL,
+        `latest_price` DECIMAL(10, 2) DEFAULT NULL,
+        `updated_at` DATETIME DEFAULT NULL,
+        PRIMARY KEY (`goods_id`),
+        KEY `idx_first_sales_date` (`first_sales_date`),
+        KEY `idx_first_traffic_date` (`first_traffic_date`)
+    ) DEFAULT CHARSET=utf8mb4
+    """)
+
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS `{daily_table}` (
+        `date_label` DATE NOT NULL,
+        `traffic_row_count` INT NOT NULL DEFAULT 0 COMMENT '流量表当天行数',
+        `sales_row_count` INT NOT NULL DEFAULT 0 COMMENT '销售表当天行数',
+        `traffic_goods_count` INT NOT NULL DEFAULT 0,
+        `status_goods_count` INT NOT NULL DEFAULT 0,
+        `rising_goods_count` INT NOT NULL DEFAULT 0,
+        `declined_goods_count` INT NOT NULL DEFAULT 0,
+        `sales_linked_goods_count` INT NOT NULL DEFAULT 0 COMMENT '当天流量表与销售表都有记录的商品数',
+        `sales_linked_status_count` INT NOT NULL DEFAULT 0 COMMENT '其中有Status的商品数',
+        `buyers_goods_count` INT NOT NULL DEFAULT 0 COMMENT '当天Buyers > 0的商品数',
+        `updated_at` DATETIME DEFAULT NULL,
+        PRIMARY KEY (`date_label`)
+    ) DEFAULT CHARSET=utf8mb4
+    """)
+
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS `{SNAPSHOT_META_TABLE}` (
+        `table_name` VARCHAR(64) NOT NULL,
+        `traffic_max_date` DATE DEFAULT NULL,
+        `traffic_row_count` BIGINT NOT NULL DEFAULT 0,
+        `sales_max_date` DATE DEFAULT NULL,
+        `sales_row_count` BIGINT NOT NULL DEFAULT 0,
+        `refreshed_at` DATETIME DEFAULT NULL,
+        PRIMARY KEY (`table_name`)
+    ) DEFAULT CHARSET=utf8mb4
+    """)
+
+
+def _goods_filter(alias, goods_ids):
+    """构建按goods_id过滤的WHERE子句"""
+    if goods_ids is None:
+        return "", []
+    placeholders = ','.join(['%s'] * len(goods_ids))
+    return f"WHERE {alias}.goods_id IN ({placeholders})", [str(goods_id) for goods_id in goods_ids]
+
+
+def refresh_goods_snapshot(cursor, table_name, sales_table_name, goods_ids=None):
+    """
+    重新计算商品快照
+    goods_ids: 只刷新这些商品（先删除这些商品的快照行），None表示全量重建
+    不提交事务，由调用方 commit
+    """
+    goods_table, _ = get_snapshot_table_names(table_name)
+    if goods_ids is not None:
+        goods_ids = list(goods_ids)
+        if len(goods_ids) == 0:
+            return
+
+    # 先删除再重新写入：源表中已不存在的商品不会残留，销售数据被删除的商品也不会保留旧的销售字段
+    where_delete, params_delete = _goods_filter(f"`{goods_table}`", goods_ids)
+    cursor.execute(f"DELETE FROM `{goods_table}` {where_delete}", params_delete)
+
+    # 流量表部分：首次/最后出现日期、最近一次非空的Status/Reason/Video/Price
+    where_traffic, params_traffic = _goods_filter('t', goods_ids)
+    cursor.execute(f"""
+    INSERT INTO `{goods_table}` (
+        goods_id, first_traffic_date, last_traffic_date,
+        latest_status, latest_status_date, latest_reason, latest_reason_date,
+        latest_video, latest_price, updated_at
+    )
+    SELECT
+      a.goods_id,
+      a.first_traffic_date,
+      a.last_traffic_date,
+      (SELECT t2.`Status` FROM `{table_name}` t2
+        WHERE t2.goods_id = a.goods_id AND t2.date_label = a.latest_status_date AND t2.`Status` IS NOT NULL LIMIT 1),
+      a.latest_status_date,
+      (SELECT t2.`Reason` FROM `{table_name}` t2
+        WHERE t2.goods_id = a.goods_id AND t2.date_label = a.latest_reason_date
+          AND t2.`Reason` IS NOT NULL AND t2.`Reason` != '' LIMIT 1),
+      a.latest_reason_date,
+      (SELECT t2.`Video` FROM `{table_name}` t2
+        WHERE t2.goods_id = a.goods_id AND t2.date_label = a.latest_video_date AND t2.`Video` IS NOT NULL LIMIT 1),
+      (SELECT t2.`Price` FROM `{table_name}` t2
+        WHERE t2.goods_id = a.goods_id AND t2.date_label = a.latest_price_date AND t2.`Price` IS NOT NULL LIMIT 1),
+      NOW()
+    FROM (
+        SELECT
+          t.goods_id,
+          MIN(t.date_label) AS first_traffic_date,
+          MAX(t.date_label) AS last_traffic_date,
+          MAX(CASE WHEN t.`Status` IS NOT NULL THEN t.date_label END) AS latest_status_date,
+          MAX(CASE WHEN t.`Reason` IS NOT NULL AND t.`Reason` != '' THEN t.date_label END) AS latest_reason_date,
+          MAX(CASE WHEN t.`Video` IS NOT NULL THEN t.date_label END) AS latest_video_date,
+          MAX(CASE WHEN t.`Price` IS NOT NULL THEN t.date_label END) AS latest_price_date
+        FROM `{table_name}` t
+        {where_traffic}
+        GROUP BY t.goods_id
+    ) a
+    ON DUPLICATE KEY UPDATE
+      first_traffic_date = VALUES(first_traffic_date),
+      last_traffic_date = VALUES(last_traffic_date),
+      latest_status = VALUES(latest_status),
+      latest_status_date = VALUES(latest_status_date),
+      latest_reason = VALUES(latest_reason),
+      latest_reason_date = VALUES(latest_reason_date),
+      latest_video = VALUES(latest_video),
+      latest_price = VALUES(latest_price),
+      updated_at = VALUES(updated_at)
+    """, params_traffic)
+
+    # 销售表部分：首次动销日期、首次/最后出现日期、累计Buyers
+    where_sales, params_sales = _goods_filter('s', goods_ids)
+    cursor.execute(f"""
+    INSERT INTO `{goods_table}` (
+        goods_id, first_sales_date, first_sales_record_date, last_sales_date, total_buyers, updated_at
+    )
+    SELECT
+      s.goods_id,
+      MIN(CASE WHEN s.Buyers > 0 THEN s.date_label END),
+      MIN(s.date_label),
+      MAX(s.date_label),
+      COALESCE(SUM(s.Buyers), 0),
+      NOW()
+    FROM `Vida_Sales`.`{sales_table_name}` s
+    {where_sales}
+    GROUP BY s.goods_id
+    ON DUPLICATE KEY UPDATE
+      first_sales_date = VALUES(first_sales_date),
+      first_sales_record_date = VALUES(first_sales_record_date),
+      last_sales_date = VALUES(last_sales_date),
+      total_buyers = VALUES(total_buyers),
+      updated_at = VALUES(updated_at)
+    """, params_sales)
+
+
+def refresh_daily_snapshot(cursor, table_name, sales_table_name, since_date=None):
+    """
+    重新计算每日汇总
+    since_date: 只刷新该日期及之后的汇总，None表示全量重建
+    不提交事务，由调用方 commit
+    """
+    _, daily_table = get_snapshot_table_names(table_name)
+
+    if since_date is None:
+        cursor.execute(f"DELETE FROM `{daily_table}`")
+        date_condition, params = "1 = 1", []
+    else:
+        cursor.execute(f"DELETE FROM `{daily_table}` WHERE date_label >= %s", (since_date,))
+        date_condition, params = "date_label >= %s", [since_date]
+
+    cursor.execute(f"""
+    INSERT INTO `{daily_table}` (
+        date_label, traffic_row_count, traffic_goods_count, status_goods_count,
+        rising_goods_count, declined_goods_count, sales_linked_goods_count, sales_linked_status_count, updated_at
+    )
+    SELECT
+      t.date_label,
+      COUNT(*),
+      COUNT(DISTINCT t.goods_id),
+      COUNT(DISTINCT CASE WHEN t.`Status` IS NOT NULL THEN t.goods_id END),
+      COUNT(DISTINCT CASE WHEN t.`Status` = 1 THEN t.goods_id END),
+      COUNT(DISTINCT CASE WHEN t.`Status` = 2 THEN t.goods_id END),
+      COUNT(DISTINCT CASE WHEN s.goods_id IS NOT NULL THEN t.goods_id END),
+      COUNT(DISTINCT CASE WHEN s.goods_id IS NOT NULL AND t.`Status` IS NOT NULL THEN t.goods_id END),
+      NOW()
+    FROM (
+        SELECT goods_id, date_label, `Status`
+        FROM `Vida_Traffic`.`{table_name}`
+        WHERE {date_condition}
+    ) t
+    LEFT JOIN (
+        SELECT DISTINCT goods_id, date_label
+        FROM `Vida_Sales`.`{sales_table_name}`
+        WHERE {date_condition}
+    ) s ON s.goods_id = t.goods_id AND s.date_label = t.date_label
+    GROUP BY t.date_label
+    """, params + params)
+
+    cursor.execute(f"""
+    INSERT INTO `{daily_table}` (date_label, sales_row_count, buyers_goods_count, updated_at)
+    SELECT date_label, COUNT(*), COUNT(DISTINCT CASE WHEN Buyers > 0 THEN goods_id END), NOW()
+    FROM `Vida_Sales`.`{sales_table_name}`
+    WHERE {date_condition}
+    GROUP BY date_label
+    ON DUPLICATE KEY UPDATE
+      sales_row_count = VALUES(sales_row_count),
+      buyers_goods_count = VALUES(buyers_goods_count),
+      updated_at = VALUES(updated_at)
+    """, params)
+
+
+def get_source_watermark(cursor, table_name, sales_table_name):
+    """源表的 (流量表最大日期, 流量表行数, 销售表最大日期, 销售表行数)"""
+    cursor.execute(f"SELECT MAX(date_label), COUNT(*) FROM `Vida_Traffic`.`{table_name}`")
+    traffic_max_date, traffic_row_count = cursor.fetchone()
+    cursor.execute(f"SELECT MAX(date_label), COUNT(*) FROM `Vida_Sales`.`{sales_table_name}`")
+    sales_max_date, sales_row_count = cursor.fetchone()
+    return (format_date_label(traffic_max_date), traffic_row_count,
+            format_date_label(sales_max_date), sales_row_count)
+
+
+def _save_watermark(cursor, table_name, watermark):
+    cursor.execute(f"""
+    REPLACE INTO `{SNAPSHOT_META_TABLE}` (
+        table_name, traffic_max_date, traffic_row_count, sales_max_date, sales_row_count, refreshed_at
+    ) VALUES (%s, %s, %s, %s, %s, NOW())
+    """, [table_name] + list(watermark))
+
+
+def _count_rows_after(cursor, source_table, date_label):
+    if date_label is None:
+        return None
+    cursor.execute(f"SELECT COUNT(*) FROM {source_table} WHERE date_label > %s", (date_label,))
+    return cursor.fetchone()[0]
+
+
+def is_append_only_change(cursor, table_name, sales_table_name, saved, watermark):
+    """
+    判断源表从 saved 水位到 watermark 水位的变化是否只是在最大日期之后追加了数据
+    saved/watermark: get_source_watermark 的返回值
+    """
+    if saved is None or saved[0] is None or saved[2] is None:
+        return False
+    traffic_source = f"`Vida_Traffic`.`{table_name}`"
+    sales_source = f"`Vida_Sales`.`{sales_table_name}`"
+    return (
+        _count_rows_after(cursor, traffic_source, saved[0]) == watermark[1] - saved[1]
+        and _count_rows_after(cursor, sales_source, saved[2]) == watermark[3] - saved[3]
+    )
+
+
+def _load_watermark(cursor, table_name):
+    """Snapshot_Meta 中保存的水位，没有记录时返回 None"""
+    cursor.execute(f"""
+    SELECT traffic_max_date, traffic_row_count, sales_max_date, sales_row_count
+    FROM `{SNAPSHOT_META_TABLE}`
+    WHERE table_name = %s
+    """, (table_name,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return (format_date_label(row[0]), row[1], format_date_label(row[2]), row[3])
+
+
+def _full_refresh(cursor, table_name, sales_table_name):
+    """全量重建商品快照与每日汇总，并保存重建前读取的水位（不提交事务）"""
+    from function2_dynamic_management import create_columns_if_not_exist
+    watermark = get_source_watermark(cursor, table_name, sales_table_name)
+    create_columns_if_not_exist(cursor, table_name)
+    refresh_goods_snapshot(cursor, table_name, sales_table_name)
+    refresh_daily_snapshot(cursor, table_name, sales_table_name)
+    _save_watermark(cursor, table_name, watermark)
+
+
+def _refresh_appended(cursor, table_name, sales_table_name, saved):
+    """
+    增量刷新 saved 水位的最大日期之后新导入的数据（只查询最大日期和新日期的行数，都走 date_label 索引）
+    新水位的行数按"原行数 + 新增行数"累加，其他变化由后台校验发现
+    返回: 是否有新数据
+    """
+    traffic_source = f"`Vida_Traffic`.`{table_name}`"
+    sales_source = f"`Vida_Sales`.`{sales_table_name}`"
+    cursor.execute(f"SELECT MAX(date_label) FROM {traffic_source}")
+    traffic_max_date = format_date_label(cursor.fetchone()[0])
+    cursor.execute(f"SELECT MAX(date_label) FROM {sales_source}")
+    sales_max_date = format_date_label(cursor.fetchone()[0])
+    if traffic_max_date == saved[0] and sales_max_date == saved[2]:
+        return False
+
+    traffic_added = _count_rows_after(cursor, traffic_source, saved[0])
+    sales_added = _count_rows_after(cursor, sales_source, saved[2])
+    cursor.execute(f"""
+    SELECT goods_id FROM {traffic_source} WHERE date_label > %s
+    UNION
+    SELECT goods_id FROM {sales_source} WHERE date_label > %s
+    """, (saved[0], saved[2]))
+    goods_ids = [row[0] for row in cursor.fetchall()]
+    refresh_goods_snapshot(cursor, table_name, sales_table_name, goods_ids)
+    refresh_daily_snapshot(cursor, table_name, sales_table_name, min(saved[0], saved[2]))
+    _save_watermark(cursor, table_name, (traffic_max_date, saved[1] + traffic_added,
+                                         sales_max_date, saved[3] + sales_added))
+    return True
+
+
+def _count_rows_by_date(cursor, source_table):
+    cursor.execute(f"SELECT date_label, COUNT(*) FROM {source_table} GROUP BY date_label")
+    return {format_date_label(date_label): row_count for date_label, row_count in cursor.fetchall()}
+
+
+def _verify_snapshot(cursor, table_name, sales_table_name):
+    """
+    校验源表总行数；与水位不一致时（补录/删除了历史数据）按日期比较源表与每日汇总中的行数：
+    - 只有行数增加的日期 → 只刷新这些日期涉及的商品，以及最早变化日期之后的每日汇总
+    - 有日期的行数减少（删除了数据，无法从源表找到受影响的商品）→ 全量重建
+    不提交事务
+    """
+    watermark = get_source_watermark(cursor, table_name, sales_table_name)
+    saved = _load_watermark(cursor, table_name)
+    if saved is None:
+        _full_refresh(cursor, table_name, sales_table_name)
+        return
+    if saved == watermark:
+        return
+
+    _, daily_table = get_snapshot_table_names(table_name)
+    traffic_source = f"`Vida_Traffic`.`{table_name}`"
+    sales_source = f"`Vida_Sales`.`{sales_table_name}`"
+    traffic_counts = _count_rows_by_date(cursor, traffic_source)
+    sales_counts = _count_rows_by_date(cursor, sales_source)
+    cursor.execute(f"SELECT date_label, traffic_row_count, sales_row_count FROM `{daily_table}`")
+    snapshot_counts = {format_date_label(date_label): (traffic_count, sales_count)
+                       for date_label, traffic_count, sales_count in cursor.fetchall()}
+
+    changed_dates = []
+    for date_label in set(traffic_counts) | set(sales_counts) | set(snapshot_counts):
+        snapshot_traffic, snapshot_sales = snapshot_counts.get(date_label, (0, 0))
+        current_traffic = traffic_counts.get(date_label, 0)
+        current_sales = sales_counts.get(date_label, 0)
+        if current_traffic < snapshot_traffic or current_sales < snapshot_sales:
+            print(f"{table_name} 的 {date_label} 有数据被删除，后台全量重建快照")
+            _full_refresh(cursor, table_name, sales_table_name)
+            return
+        if (current_traffic, current_sales) != (snapshot_traffic, snapshot_sales):
+            changed_dates.append(date_label)
+
+    if changed_dates:
+        changed_dates.sort()
+        placeholders = ','.join(['%s'] * len(changed_dates))
+        cursor.execute(f"""
+        SELECT goods_id FROM {traffic_source} WHERE date_label IN ({placeholders})
+        UNION
+        SELECT goods_id FROM {sales_source} WHERE date_label IN ({placeholders})
+        """, changed_dates + changed_dates)
+        goods_ids = [row[0] for row in cursor.fetchall()]
+        print(f"{table_name} 有 {len(changed_dates)} 个日期的数据变化（最早 {changed_dates[0]}），"
+              f"刷新 {len(goods_ids)} 个商品的快照")
+        refresh_goods_snapshot(cursor, table_name, sales_table_name, goods_ids)
+        refresh_daily_snapshot(cursor, table_name, sales_table_name, changed_dates[0])
+    _save_watermark(cursor, table_name, watermark)
+
+
+def _run_snapshot_verify(table_name, sales_table_name):
+    """后台线程：用独立连接校验并刷新快照，期间读取方继续使用旧快照（事务提交前不可见）"""
+    traffic_config, _, _, _ = get_db_config()
+    refresh_lock = _get_refresh_lock(table_name)
+    with refresh_lock:
+        try:
+            with db_cursor(traffic_config) as cursor:
+                try:
+                    _verify_snapshot(cursor, table_name, sales_table_name)
+                    cursor.connection.commit()
+                except Exception:
+                    cursor.connection.rollback()
+                    raise
+        except Exception as e:
+            print(f"后台校验商品快照失败: {e}")
+            return
+    with _check_lock:
+        _last_verified[table_name] = time.monotonic()
+
+
+def _schedule_snapshot_verify(table_name, sales_table_name, force=False):
+    """距上次校验超过 SNAPSHOT_VERIFY_INTERVAL 秒（或 force）且没有正在进行的校验时启动后台校验"""
+    now = time.monotonic()
+    with _check_lock:
+        last_verified = _last_verified.get(table_name)
+        if not force and last_verified is not None and now - last_verified < SNAPSHOT_VERIFY_INTERVAL:
+            return
+        # 校验失败时也要等一个间隔再重试
+        _last_verified[table_name] = now
+    if _get_refresh_lock(table_name).locked():
+        return
+    threading.Thread(target=_run_snapshot_verify, args=(table_name, sales_table_name),
+                     name=f"snapshot-verify-{table_name}", daemon=True).start()
+
+
+def ensure_snapshot_fresh(cursor, table_name, sales_table_name, force=False):
+    """
+    确保快照可用并及时反映新导入的日期：
+    - 快照不存在时同步全量构建
+    - 源表最大日期之后有新数据时，同步增量刷新新日期涉及的商品和日期（只走 date_label 索引，不统计全表行数）
+    - 源表总行数的校验（补录历史日期、删除数据等其他变化）交给后台线程，
+      每 SNAPSHOT_VERIFY_INTERVAL 秒最多一次，见 _verify_snapshot；校验完成前读取旧快照
+    同一进程内 SNAPSHOT_CHECK_INTERVAL 秒内只检查一次（force=True 时强制检查并立即启动后台校验）
+    会提交事务
+    """
+    now = time.monotonic()
+    with _check_lock:
+        last_checked = _last_checked.get(table_name)
+        if not force and last_checked is not None and now - last_checked < SNAPSHOT_CHECK_INTERVAL:
+            return
+
+    ensure_snapshot_tables(cursor, table_name)
+    saved = _load_watermark(cursor, table_name)
+    refresh_lock = _get_refresh_lock(table_name)
+
+    if saved is None:
+        with refresh_lock:
+            _full_refresh(cursor, table_name, sales_table_name)
+            cursor.connection.commit()
+        with _check_lock:
+            _last_verified[table_name] = time.monotonic()
+    elif saved[0] is None or saved[2] is None:
+        # 构建时源表为空，没有可用于增量判断的最大日期，交给后台校验
+        cursor.connection.commit()
+        _schedule_snapshot_verify(table_name, sales_table_name, force=True)
+    else:
+        # 后台校验正在写同一张快照时不等待，本次读取旧快照
+        if refresh_lock.acquire(blocking=False):
+            try:
+                _refresh_appended(cursor, table_name, sales_table_name, saved)
+                cursor.connection.commit()
+            finally:
+                refresh_lock.release()
+        _schedule_snapshot_verify(table_name, sales_table_name, force=force)
+
+    with _check_lock:
+        _last_checked[table_name] = time.monotonic()
+
+
+def ensure_writes_table(cursor):
+    """创建写入记录表（如不存在）：每个 (表, 列, 受影响的起始日期) 一行，记录写入次数与最后写入时间"""
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS `{SNAPSHOT_WRITES_TABLE}` (
+        `table_name` VARCHAR(64) NOT NULL,
+        `column_name` VARCHAR(32) NOT NULL,
+        `date_label` DATE NOT NULL COMMENT '写入影响该日期及之后的结果（1000-01-01 表示全部日期）',
+        `write_count` BIGINT NOT NULL DEFAULT 0,
+        `last_write_at` DATETIME(6) DEFAULT NULL,
+        PRIMARY KEY (`table_name`, `column_name`, `date_label`)
+    ) DEFAULT CHARSET=utf8mb4
+    """)
+
+
+def _invalidate_row_counts(table_name):
+    """丢弃该国家流量表/销售表缓存的行数（本进程写入后下次读取水位时重新统计）"""
+    with _row_counts_lock:
+        for key in [key for key in _row_counts if key[0] in (table_name, f"{table_name}_Sales")]:
+            del _row_counts[key]
+
+
+def _get_row_count(cursor, database, source_table, target_date):
+    """源表 target_date 及之前的行数，CACHE_WATERMARK_COUNT_TTL 秒内复用上次的统计结果"""
+    key = (source_table, target_date)
+    now = time.monotonic()
+    with _row_counts_lock:
+        cached = _row_counts.get(key)
+    if cached is not None and now - cached[0] < CACHE_WATERMARK_COUNT_TTL:
+        return cached[1]
+    cursor.execute(f"SELECT COUNT(*) FROM `{database}`.`{source_table}` WHERE date_label <= %s", (target_date,))
+    row_count = cursor.fetchone()[0]
+    with _row_counts_lock:
+        _row_counts[key] = (now, row_count)
+    return row_count
+
+
+def record_source_writes(cursor, table_name, columns, dates=None, since_date=None):
+    """
+    记录 Status/Reason/Video/Price 的写入，供结果缓存判断是否过期（get_cache_watermark）
+    columns: 写入的列
+    dates/since_date: 含义同 refresh_snapshot_after_write；都为 None 时视为全部日期
+    会提交事务
+    """
+    date_marks = set()
+    for date_value in dates or []:
+        date_str = format_date_label(date_value)
+        if date_str:
+            date_marks.add(date_str)
+    since_str = format_date_label(since_date)
+    if since_str:
+        date_marks.add(since_str)
+    if not date_marks:
+        date_marks.add(ALL_DATES_MARK)
+
+    ensure_writes_table(cursor)
+    cursor.executemany(f"""
+    INSERT INTO `{SNAPSHOT_WRITES_TABLE}` (table_name, column_name, date_label, write_count, last_write_at)
+    VALUES (%s, %s, %s, 1, NOW(6))
+    ON DUPLICATE KEY UPDATE
+      write_count = write_count + 1,
+      last_write_at = VALUES(last_write_at)
+    """, [(table_name, column, date_mark) for column in columns for date_mark in sorted(date_marks)])
+    cursor.connection.commit()
+    _invalidate_row_counts(table_name)
+
+
+def _directory_fingerprint(directory):
+    """目录下所有 .xlsx 文件的 (数量, 最大mtime, 总大小)；目录不存在时为 None"""
+    if not directory or not os.path.isdir(directory):
+        return None
+    count = 0
+    max_mtime = 0
+    total_size = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith('.xlsx'):
+            stat = entry.stat()
+            count += 1
+            max_mtime = max(max_mtime, stat.st_mtime_ns)
+            total_size += stat.st_size
+    return [count, max_mtime, total_size]
+
+
+def get_cache_watermark(table_name, sales_table_name, target_date, columns=('Status', 'Reason'), xlsx_dirs=None):
+    """
+    结果缓存的源数据水位（只统计 target_date 及之前的数据）：
+        traffic/sales: [最大日期, 行数]
+        writes: {列: [写入次数, 最后写入时间]}，只统计影响 target_date 的写入
+        xlsx: {目录: [文件数, 最大mtime, 总大小]}
+    水位与缓存中保存的不一致时缓存过期，见 compare_cache_watermark
+    每次读取只查询最大日期（date_label 索引）和 Snapshot_Writes；行数需要扫描，
+    CACHE_WATERMARK_COUNT_TTL 秒内复用（本进程记录写入时立即失效），用于发现补录历史日期等不改变最大日期的变化
+    """
+    traffic_config, _, _, _ = get_db_config()
+    with db_cursor(traffic_config) as cursor:
+        cursor.execute(f"SELECT MAX(date_label) FROM `Vida_Traffic`.`{table_name}` WHERE date_label <= %s",
+                       (target_date,))
+        traffic_max_date = cursor.fetchone()[0]
+        cursor.execute(f"SELECT MAX(date_label) FROM `Vida_Sales`.`{sales_table_name}` WHERE date_label <= %s",
+                       (target_date,))
+        sales_max_date = cursor.fetchone()[0]
+        traffic_row_count = _get_row_count(cursor, 'Vida_Traffic', table_name, target_date)
+        sales_row_count = _get_row_count(cursor, 'Vida_Sales', sales_table_name, target_date)
+
+        ensure_writes_table(cursor)
+        writes = {}
+        tracked_columns = list(columns) + ['*']
+        cursor.execute(f"""
+        SELECT column_name, SUM(write_count), MAX(last_write_at)
+        FROM `{SNAPSHOT_WRITES_TABLE}`
+        WHERE table_name = %s
+          AND column_name IN ({','.join(['%s'] * len(tracked_columns))})
+          AND date_label <= %s
+        GROUP BY column_name
+        """, [table_name] + tracked_columns + [target_date])
+        for column, write_count, last_write_at in cursor.fetchall():
+            writes[column] = [int(write_count or 0), str(last_write_at) if last_write_at else None]
+
+    return {
+        'traffic': [format_date_label(traffic_max_date), traffic_row_count],
+        'sales': [format_date_label(sales_max_date), sales_row_count],
+        'writes': writes,
+        'xlsx': {directory: _directory_fingerprint(directory) for directory in (xlsx_dirs or [])}
+    }
+
+
+def compare_cache_watermark(saved, current):
+    """
+    返回发生变化的部分：'traffic'、'sales'、'xlsx' 等水位项（调用方可附加自己的项）以及写入过的列名
+    （未知列 '*' 的写入按 Status 和 Reason 都变化处理）；saved 为空时返回 {'all'}
+    """
+    if not saved:
+        return {'all'}
+    changed = set()
+    for key in (set(saved) | set(current)) - {'writes'}:
+        if saved.get(key) != current.get(key):
+            changed.add(key)
+    saved_writes = saved.get('writes') or {}
+    current_writes = current.get('writes') or {}
+    for column in set(saved_writes) | set(current_writes):
+        if saved_writes.get(column) != current_writes.get(column):
+            changed.update(['Status', 'Reason'] if column == '*' else [column])
+    return changed
+
+
+def refresh_snapshot_after_write(cursor, table_name, goods_ids=None, refresh_daily=False, since_date=None, dates=None,
+                                 columns=None):
+    """
+    Status/Reason/Video/Price 写入并提交后，刷新受影响的快照并提交，同时标记本地历史镜像中受影响的月份
+    goods_ids: 受影响的商品，None表示全部商品
+    refresh_daily: Status发生变化时为True，同时刷新 since_date（为None时取 dates 中最早的日期，都为None表示全部日期）之后的每日汇总
+    dates: 写入涉及的日期（用于历史镜像）；dates 和 since_date 都为 None 时视为全部日期
+    columns: 写入的列（记录到 Snapshot_Writes，使相关结果缓存失效），None 表示未知
+    快照尚未构建时跳过（首次读取时会全量构建）；刷新失败不影响写入本身，只打印错误
+    """
+    from history_cache import mark_history_cache_dirty
+    mark_history_cache_dirty(table_name, dates=dates, since_date=since_date)
+
+    try:
+        record_source_writes(cursor, table_name, columns or ['*'], dates=dates, since_date=since_date)
+    except Exception as e:
+        cursor.connection.rollback()
+        print(f"记录写入失败: {e}")
+
+    sales_table_name = f"{table_name}_Sales"
+    try:
+        cursor.execute("SHOW TABLES LIKE %s", (SNAPSHOT_META_TABLE,))
+        if cursor.fetchone() is None:
+            return
+        cursor.execute(f"SELECT 1 FROM `{SNAPSHOT_META_TABLE}` WHERE table_name = %s", (table_name,))
+        if cursor.fetchone() is None:
+            return
+
+        refresh_goods_snapshot(cursor, table_name, sales_table_name, goods_ids)
+        if refresh_daily:
+            if since_date is None and dates:
+                since_date = min(format_date_label(date_value) for date_value in dates)
+            refresh_daily_snapshot(cursor, table_name, sales_table_name, since_date)
+        cursor.connection.commit()
+    except Exception as e:
+        cursor.connection.rollback()
+        print(f"刷新商品快照失败: {e}")
+
+
+def get_goods_snapshot(table_name, sales_table_name, goods_ids=None, columns=None, where=None, params=None):
+    """
+    读取商品快照
+    goods_ids: 只读取这些商品，None表示全部
+    columns: 需要的列，None表示全部
+    where/params: 额外的过滤条件（SQL片段及参数）
+    返回: DataFrame（goods_id 为字符串）
+    """
+    traffic_config, _, _, _ = get_db_config()
+    goods_table, _ = get_snapshot_table_names(table_name)
+
+    with db_cursor(traffic_config) as cursor:
+        ensure_snapshot_fresh(cursor, table_name, sales_table_name)
+
+        conditions = []
+        query_params = []
+        if goods_ids is not None:
+            goods_ids = [str(goods_id) for goods_id in goods_ids]
+            if len(goods_ids) == 0:
+                conditions.append("1 = 0")
+            else:
+                conditions.append(f"goods_id IN ({','.join(['%s'] * len(goods_ids))})")
+                query_params += goods_ids
+        if where:
+            conditions.append(f"({where})")
+            query_params += list(params or [])
+
+        select_columns = ', '.join(['goods_id'] + [f"`{col}`" for col in (columns or []) if col != 'goods_id']) if columns else '*'
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor.execute(f"SELECT {select_columns} FROM `{goods_table}` {where_clause}", query_params)
+
+        result_columns = [desc[0] for desc in cursor.description]
+        df = pd.DataFrame(cursor.fetchall(), columns=result_columns)
+        # goods_id 列类型与源表一致（可能为整数），返回时统一为字符串
+        df['goods_id'] = df['goods_id'].astype(str)
+        return df
+
+
+def get_daily_snapshot(table_name, sales_table_name, start_date=None, end_date=None):
+    """
+    读取每日汇总
+    返回: DataFrame，按 date_label 升序
+    """
+    traffic_config, _, _, _ = get_db_config()
+    _, daily_table = get_snapshot_table_names(table_name)
+
+    with db_cursor(traffic_config) as cursor:
+        ensure_snapshot_fresh(cursor, table_name, sales_table_name)
+
+        conditions = []
+        params = []
+        if start_date:
+            conditions.append("date_label >= %s")
+            params.append(start_date)
+        if end_date:
+            conditions.append("date_label <= %s")
+            params.append(end_date)
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        cursor.execute(f"SELECT * FROM `{daily_table}` {where_clause} ORDER BY date_label", params)
+        result_columns = [desc[0] for desc in cursor.description]
+        return pd.DataFrame(cursor.fetchall(), columns=result_columns)
@@ -39,6 +39,309 @@ function clearNotifications() {
     }
 }
 
+// 提交后台任务并轮询直到结束，返回任务结果（与原同步接口返回内容相同）
+// onProgress(job): 每次轮询时回调，可用于显示进度
+async function runJob(url, body = null, onProgress = null, interval = 2000) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: body ? JSON.stringify(body) : null
+    });
+    const submitted = await response.json();
+    if (!submitted.job_id) {
+        // 提交失败时直接返回错误内容
+        return submitted;
+    }
+    if (onProgress) {
+        onProgress({ job_id: submitted.job_id, status: submitted.status, progress: 0, progress_message: null });
+    }
+
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, interval));
+        const statusResponse = await fetch(`/api/jobs/${submitted.job_id}`);
+        const statusResult = await statusResponse.json();
+        if (!statusResult.success) {
+            return { success: false, message: statusResult.error, error: statusResult.error };
+        }
+
+        const job = statusResult.data;
+        if (onProgress) {
+            onProgress(job);
+        }
+        if (job.status === 'finished' || (job.status === 'cancelled' && job.result)) {
+            return job.result;
+        }
+        if (job.status === 'failed' || job.status === 'cancelled') {
+            const error = job.error || (job.status === 'cancelled' ? '任务已取消' : '任务失败');
+            return { success: false, message: error, error: error };
+        }
+    }
+}
+
+// ----- 浏览器端绘图（chart_mode = 'series'） -----
+// 服务器只返回紧凑的序列数据（日期为相对 base_date 的天数，曝光/动销为整数数组），
+// 在浏览器中按 plot_utils 的样式绘制双轴图，并转换为与服务器PNG相同格式的base64，原有显示代码无需修改
+// 'image' 模式仍使用服务器渲染的PNG（导出等场景始终使用PNG）
+const CHART_MODE = 'series';
+
+const CHART_STYLE = {
+    impressions: '#1f77b4',
+    buyers: 'rgba(255, 127, 14, 0.4)',
+    marked: 'red',
+    markedEdge: 'darkred',
+    axis: '#000',
+    font: '"SimHei", "Microsoft YaHei", "Arial Unicode MS", sans-serif'
+};
+
+function seriesOffsetToDate(baseDate, offset) {
+    const date = new Date(baseDate + 'T00:00:00Z');
+    date.setUTCDate(date.getUTCDate() + offset);
+    return date;
+}
+
+function formatMonthDay(date) {
+    const month = String(date.getUTCMonth() + 1).padStart(2, '0');
+    const day = String(date.getUTCDate()).padStart(2, '0');
+    return `${month}-${day}`;
+}
+
+// 与matplotlib默认刻度相近的"整齐"刻度
+function niceAxisTicks(minValue, maxValue, targetCount = 6) {
+    if (minValue === maxValue) {
+        minValue -= 1;
+        maxValue += 1;
+    }
+    const rawStep = (maxValue - minValue) / targetCount;
+    const magnitude = Math.pow(10, Math.floor(Math.log10(rawStep)));
+    const step = [1, 2, 2.5, 5, 10].map(m => m * magnitude).find(s => s >= rawStep) || 10 * magnitude;
+    const ticks = [];
+    for (let v = Math.ceil(minValue / step) * step; v <= maxValue + step * 1e-9; v += step) {
+        ticks.push(Math.round(v / step) * step);
+    }
+    return ticks;
+}
+
+// 在 (x, y, width, height) 区域内绘制单个商品的曝光折线 + 动销条形双轴图
+function drawGoodsPanel(ctx, x, y, width, height, goods, baseDate, fonts, showLegend) {
+    const days = goods.d;
+    if (!days || days.length === 0) return;
+
+    const margin = { left: fonts.tick * 5, right: fonts.tick * 3.5, top: fonts.title * 3, bottom: fonts.tick * 4.5 };
+    const plotX = x + margin.left;
+    const plotY = y + margin.top;
+    const plotW = width - margin.left - margin.right;
+    const plotH = height - margin.top - margin.bottom;
+
+    // 坐标范围（与matplotlib一样两端留5%边距）
+    const minDay = days[0];
+    const maxDay = days[days.length - 1];
+    const xPad = Math.max((maxDay - minDay) * 0.05, 0.6);
+    const xMin = minDay - xPad;
+    const xMax = maxDay + xPad;
+    const values = goods.i.filter(v => v !== null);
+    let yMin = values.length ? Math.min(...values) : 0;
+    let yMax = values.length ? Math.max(...values) : 1;
+    const yPad = (yMax - yMin) * 0.05 || 1;
+    yMin -= yPad;
+    yMax += yPad;
+    const yTicks = niceAxisTicks(yMin, yMax).filter(t => t >= yMin && t <= yMax);
+
+    const sx = d => plotX + (d - xMin) / (xMax - xMin) * plotW;
+    const sy = v => plotY + plotH - (v - yMin) / (yMax - yMin) * plotH;
+    const sb = v => plotY + plotH - v / 12 * plotH;
+
+    // 标题
+    ctx.fillStyle = CHART_STYLE.axis;
+    ctx.textAlign = 'center';
+    ctx.textBaseline = 'top';
+    ctx.font = `${fonts.title}px ${CHART_STYLE.font}`;
+    ctx.fillText(String(goods.goods_id), plotX + plotW / 2, y + fonts.title * 0.2);
+    ctx.fillText(`（${new Set(days).size}个日期）`, plotX + plotW / 2, y + fonts.title * 1.4);
+
+    // 曝光折线（左轴）
+    ctx.save();
+    ctx.beginPath();
+    ctx.rect(plotX, plotY, plotW, plotH);
+    ctx.clip();
+    ctx.strokeStyle = CHART_STYLE.impressions;
+    ctx.fillStyle = CHART_STYLE.impressions;
+    ctx.lineWidth = 1;
+    ctx.beginPath();
+    let penDown = false;
+    days.forEach((d, idx) => {
+        const v = goods.i[idx];
+        if (v === null) {
+            penDown = false;
+            return;
+        }
+        if (penDown) ctx.lineTo(sx(d), sy(v)); else ctx.moveTo(sx(d), sy(v));
+        penDown = true;
+    });
+    ctx.stroke();
+    days.forEach((d, idx) => {
+        const v = goods.i[idx];
+        if (v === null) return;
+        ctx.beginPath();
+        ctx.arc(sx(d), sy(v), fonts.marker, 0, Math.PI * 2);
+        ctx.fill();
+    });
+
+    // 标记日期（红点）
+    (goods.m || []).forEach(md => {
+        const idx = days.indexOf(md);
+        if (idx < 0 || goods.i[idx] === null) return;
+        ctx.beginPath();
+        ctx.arc(sx(md), sy(goods.i[idx]), fonts.marker * 1.8, 0, Math.PI * 2);
+        ctx.fillStyle = CHART_STYLE.marked;
+        ctx.fill();
+        ctx.lineWidth = 1.5;
+        ctx.strokeStyle = CHART_STYLE.markedEdge;
+        ctx.stroke();
+    });
+
+    // 动销条形（右轴，固定0-12）
+    const barWidth = 0.6 / (xMax - xMin) * plotW;
+    ctx.fillStyle = CHART_STYLE.buyers;
+    days.forEach((d, idx) => {
+        const b = goods.b[idx];
+        if (!b) return;
+        const top = sb(Math.min(b, 12));
+        ctx.fillRect(sx(d) - barWidth / 2, top, barWidth, plotY + plotH - top);
+    });
+    ctx.restore();
+
+    // 坐标轴与刻度
+    ctx.strokeStyle = CHART_STYLE.axis;
+    ctx.lineWidth = 1;
+    ctx.strokeRect(plotX, plotY, plotW, plotH);
+    ctx.fillStyle = CHART_STYLE.axis;
+    ctx.font = `${fonts.tick}px ${CHART_STYLE.font}`;
+
+    ctx.textAlign = 'right';
+    ctx.textBaseline = 'middle';
+    yTicks.forEach(t => {
+        ctx.beginPath();
+        ctx.moveTo(plotX - 4, sy(t));
+        ctx.lineTo(plotX, sy(t));
+        ctx.stroke();
+        ctx.fillText(String(t), plotX - 6, sy(t));
+    });
+
+    ctx.textAlign = 'left';
+    for (let t = 0; t <= 12; t++) {
+        ctx.beginPath();
+        ctx.moveTo(plotX + plotW, sb(t));
+        ctx.lineTo(plotX + plotW + 4, sb(t));
+        ctx.stroke();
+        ctx.fillText(String(t), plotX + plotW + 6, sb(t));
+    }
+
+    // X轴日期刻度（最多16个，与服务器端取点方式相同）
+    const tickCount = Math.min(16, days.length);
+    const tickIndices = [];
+    for (let k = 0; k < tickCount; k++) {
+        const idx = tickCount === 1 ? 0 : Math.round(k * (days.length - 1) / (tickCount - 1));
+        if (tickIndices[tickIndices.length - 1] !== idx) tickIndices.push(idx);
+    }
+    tickIndices.forEach(idx => {
+        const tx = sx(days[idx]);
+        ctx.beginPath();
+        ctx.moveTo(tx, plotY + plotH);
+        ctx.lineTo(tx, plotY + plotH + 4);
+        ctx.stroke();
+        ctx.save();
+        ctx.translate(tx, plotY + plotH + 6);
+        ctx.rotate(-Math.PI / 4);
+        ctx.textAlign = 'right';
+        ctx.textBaseline = 'top';
+        ctx.fillText(formatMonthDay(seriesOffsetToDate(baseDate, days[idx])), 0, 0);
+        ctx.restore();
+    });
+
+    // 轴标签
+    ctx.font = `${fonts.label}px ${CHART_STYLE.font}`;
+    ctx.textAlign = 'center';
+    ctx.save();
+    ctx.translate(x + fonts.label * 0.8, plotY + plotH / 2);
+    ctx.rotate(-Math.PI / 2);
+    ctx.fillText('曝光', 0, 0);
+    ctx.restore();
+    ctx.save();
+    ctx.translate(x + width - fonts.label * 0.6, plotY + plotH / 2);
+    ctx.rotate(Math.PI / 2);
+    ctx.fillText('动销', 0, 0);
+    ctx.restore();
+
+    // 图例
+    if (showLegend) {
+        const lx = plotX + 8;
+        const ly = plotY + 8;
+        ctx.fillStyle = 'rgba(255, 255, 255, 0.8)';
+        ctx.fillRect(lx, ly, fonts.label * 5, fonts.label * 3);
+        ctx.strokeStyle = '#ccc';
+        ctx.strokeRect(lx, ly, fonts.label * 5, fonts.label * 3);
+        ctx.strokeStyle = CHART_STYLE.impressions;
+        ctx.beginPath();
+        ctx.moveTo(lx + 4, ly + fonts.label);
+        ctx.lineTo(lx + fonts.label * 2, ly + fonts.label);
+        ctx.stroke();
+        ctx.fillStyle = CHART_STYLE.buyers;
+        ctx.fillRect(lx + 4, ly + fonts.label * 1.8, fonts.label * 2 - 4, fonts.label * 0.8);
+        ctx.fillStyle = CHART_STYLE.axis;
+        ctx.textAlign = 'left';
+        ctx.textBaseline = 'middle';
+        ctx.fillText('曝光', lx + fonts.label * 2.4, ly + fonts.label);
+        ctx.fillText('动销', lx + fonts.label * 2.4, ly + fonts.label * 2.2);
+    }
+}
+
+// 序列数据 → 每张3个商品的base64图片列表（与 plot_goods_batch 的分组一致）
+function renderSeriesImages(series, cols = 3) {
+    if (!series || !series.goods || series.goods.length === 0) return [];
+    const panelWidth = 400;
+    const panelHeight = 300;
+    const fonts = { title: 12, label: 11, tick: 10, marker: 2.5 };
+    const images = [];
+    for (let start = 0; start < series.goods.length; start += cols) {
+        const canvas = document.createElement('canvas');
+        canvas.width = panelWidth * cols;
+        canvas.height = panelHeight;
+        const ctx = canvas.getContext('2d');
+        ctx.fillStyle = '#fff';
+        ctx.fillRect(0, 0, canvas.width, canvas.height);
+        series.goods.slice(start, start + cols).forEach((goods, idx) => {
+            drawGoodsPanel(ctx, idx * panelWidth, 0, panelWidth, panelHeight, goods, series.base_date, fonts, idx === 0);
+        });
+        images.push(canvas.toDataURL('image/png').split(',')[1]);
+    }
+    return images;
+}
+
+// 序列数据 → 单个商品的大尺寸趋势图（对应 plot_goods_trend_double_axis）
+function renderSeriesTrendImage(series) {
+    if (!series || !series.goods || series.goods.length === 0) return null;
+    const canvas = document.createElement('canvas');
+    canvas.width = 1400;
+    canvas.height = 800;
+    const ctx = canvas.getContext('2d');
+    ctx.fillStyle = '#fff';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    const fonts = { title: 18, label: 15, tick: 13, marker: 3.5 };
+    drawGoodsPanel(ctx, 0, 0, canvas.width, canvas.height, series.goods[0], series.base_date, fonts, true);
+    return canvas.toDataURL('image/png').split(',')[1];
+}
+
+// 把响应中各部分的 series 转换为 images（供原有的显示代码使用）
+function applySeriesImages(sections) {
+    sections.forEach(section => {
+        if (section && section.series && (!section.images || section.images.length === 0)) {
+            section.images = renderSeriesImages(section.series);
+        }
+    });
+}
+
 // 页面加载时初始化
 document.addEventListener('DOMContentLoaded', function() {
     currentTable = document.getElementById('current-table').textContent;
@@ -251,13 +554,16 @@ async function doQuickSearch() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ goods_id: goodsId })
+            body: JSON.stringify({ goods_id: goodsId, chart_mode: CHART_MODE })
         });
         
         const result = await response.json();
         
         if (result.success) {
             const data = result.data;
+            if (data.trend_series && !data.trend_image) {
+                data.trend_image = renderSeriesTrendImage(data.trend_series);
+            }
             let html = '<h5>查询结果</h5>';
             
             // 将两幅图放在同一行
@@ -570,7 +876,7 @@ function showFunction2() {
                     
                     <p><strong>3. 缓存机制</strong></p>
                     <ul style="margin-left: 40px; margin-bottom: 15px;">
-                        <li>缓存保存在 Cache_Dynamic 目录，格式为 JSON</li>
+                        <li>缓存保存在 Cache_Dynamic 目录，格式为分段压缩的 .cache 文件（仍可读取旧版 JSON 缓存）</li>
                         <li>缓存不包含图片数据（base64 图片太大）</li>
                         <li>非缓存模式会重新分析并覆盖原有缓存</li>
                     </ul>
@@ -751,15 +1057,12 @@ async function refreshStatusData() {
     resultDiv.innerHTML = '<div class="alert alert-info">正在刷新数据，请稍候...</div>';
     
     try {
-        const response = await fetch('/api/function2/refresh_status', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
+        const result = await runJob('/api/function2/refresh_status', null, job => {
+            if (job.progress_message) {
+                resultDiv.innerHTML = `<div class="alert alert-info">${job.progress_message}，请稍候...</div>`;
             }
         });
         
-        const result = await response.json();
-        
         if (result.success) {
             let message = `<div class="alert alert-success">${result.message}</div>`;
             if (result.missing_dates_info && result.missing_dates_info.length > 0) {
@@ -859,13 +1162,20 @@ async function doDynamicManagement() {
                 target_date: targetDate,
                 use_cache: useCache,
                 half_image_mode: halfImageMode,
-                filter_mode: filterMode
+                filter_mode: filterMode,
+                chart_mode: CHART_MODE,
+                lazy_images: true  // 勾选类别的图片按页懒加载
             })
         });
         
         const result = await response.json();
         
         if (result.success) {
+            applySeriesImages([
+                result.data.rising,
+                result.data.declined,
+                ...Object.values(result.data.categories || {})
+            ]);
             // 保存到缓存（不包含图片数据，因为图片太大）
             const cacheData = {
                 statistics: result.data.statistics,
@@ -911,6 +1221,93 @@ async function doDynamicManagement() {
     }
 }
 
+// ----- 功能2：按需分页加载图片（lazy_images） -----
+// 勾选的类别只返回分页信息（image_pages），每页先显示商品信息，滚动到该页时才请求服务器渲染图片
+const lazyImagePageRegistry = {};
+let lazyImagePageSeq = 0;
+
+function formatGoodsInfoLine(info, goodsId) {
+    if (!info) {
+        return `<div style="margin: 5px 0; font-family: monospace; font-size: 14px;">${goodsId}</div>`;
+    }
+    return `<div style="margin: 5px 0; font-family: monospace; font-size: 14px;">${info.goods_id} - 加入时间: ${info.join_date}, Reason: ${info.reason}</div>`;
+}
+
+function renderLazyImagePages(imagePages, goodsInfo, categoryName) {
+    const infoById = new Map((goodsInfo || []).map(info => [String(info.goods_id), info]));
+    let html = '';
+    imagePages.pages.forEach((goodsIds, pageIdx) => {
+        const pageId = `lazy-image-page-${++lazyImagePageSeq}`;
+        lazyImagePageRegistry[pageId] = { token: imagePages.page_tokens[pageIdx], pageSize: imagePages.page_size, goodsIds, infoById, categoryName, pageIdx };
+        html += `<div class="lazy-image-page" id="${pageId}">`;
+        html += '<div class="goods-info-text-container" style="margin-bottom: 10px; padding: 10px; background: #f8f9fa; border-radius: 5px;">';
+        goodsIds.forEach(goodsId => {
+            html += formatGoodsInfoLine(infoById.get(String(goodsId)), goodsId);
+        });
+        html += '</div>';
+        html += `<p class="text-muted">${categoryName} 第${pageIdx + 1}/${imagePages.pages.length}页图片加载中...</p>`;
+        html += '</div>';
+    });
+    return html;
+}
+
+async function loadLazyImagePage(pageDiv) {
+    const page = lazyImagePageRegistry[pageDiv.id];
+    if (!page) return;
+    delete lazyImagePageRegistry[pageDiv.id];
+
+    try {
+        const response = await fetch('/api/function2/dynamic_management/image_page', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ token: page.token, goods_ids: page.goodsIds, chart_mode: CHART_MODE })
+        });
+        const result = await response.json();
+        if (!result.success) {
+            pageDiv.insertAdjacentHTML('beforeend', `<div class="error-message">第${page.pageIdx + 1}页图片加载失败: ${result.error}</div>`);
+            return;
+        }
+
+        const data = result.data;
+        applySeriesImages([data]);
+        const cols = 3;
+        let html = '';
+        (data.images || []).forEach((img, imgIdx) => {
+            html += '<div class="goods-info-text-container" style="margin-bottom: 10px; padding: 10px; background: #f8f9fa; border-radius: 5px;">';
+            data.goods_ids.slice(imgIdx * cols, (imgIdx + 1) * cols).forEach(goodsId => {
+                html += formatGoodsInfoLine(page.infoById.get(String(goodsId)), goodsId);
+            });
+            html += '</div>';
+            const imgNo = page.pageIdx * page.pageSize / cols + imgIdx + 1;
+            html += `<div class="image-container"><img src="data:image/png;base64,${img}" alt="${page.categoryName}图${imgNo}"></div>`;
+        });
+        if (html) {
+            pageDiv.innerHTML = html;
+        } else {
+            const loading = pageDiv.querySelector('p.text-muted');
+            if (loading) loading.remove();
+        }
+    } catch (error) {
+        pageDiv.insertAdjacentHTML('beforeend', `<div class="error-message">第${page.pageIdx + 1}页图片加载失败: ${error.message}</div>`);
+    }
+}
+
+function observeLazyImagePages(container) {
+    const pageDivs = container.querySelectorAll('.lazy-image-page');
+    if (pageDivs.length === 0) return;
+    const observer = new IntersectionObserver((entries) => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                observer.unobserve(entry.target);
+                loadLazyImagePage(entry.target);
+            }
+        });
+    }, { rootMargin: '600px 0px' });
+    pageDivs.forEach(div => observer.observe(div));
+}
+
 // 显示功能2的结果
 function displayFunction2Result(data, analysisTime, fromCache) {
     const resultDiv = document.getElementById('function2-result');
@@ -964,12 +1361,14 @@ function displayFunction2Result(data, analysisTime, fromCache) {
     }
     
     // 辅助函数：显示商品信息
-    function displayGoodsSection(title, goodsInfo, images, categoryName) {
+    function displayGoodsSection(title, goodsInfo, images, categoryName, imagePages) {
         if (!goodsInfo || goodsInfo.length === 0) return '';
         
         let sectionHtml = `<h6><strong>▶ ${title}</strong></h6>`;
         
-        if (images && images.length > 0) {
+        if (imagePages && imagePages.pages && imagePages.pages.length > 0) {
+            sectionHtml += renderLazyImagePages(imagePages, goodsInfo, categoryName);
+        } else if (images && images.length > 0) {
             const cols = 3;
             let goodsIndex = 0;
             
@@ -1012,7 +1411,7 @@ function displayFunction2Result(data, analysisTime, fromCache) {
         const categoryData = categories.new_rising || {};
         const categoryGoodsInfo = categoryData.goods_info || [];
         const categoryImages = categoryData.images || [];
-        html += displayGoodsSection(`新增上升期（上升期）：${stats.new_rising}个`, categoryGoodsInfo, categoryImages, '新增上升期');
+        html += displayGoodsSection(`新增上升期（上升期）：${stats.new_rising}个`, categoryGoodsInfo, categoryImages, '新增上升期', categoryData.image_pages);
     }
     
     // 2. 新增非上升期（所有模块都显示数据）
@@ -1020,7 +1419,7 @@ function displayFunction2Result(data, analysisTime, fromCache) {
         const categoryData = categories.new_declined || {};
         const categoryGoodsInfo = categoryData.goods_info || [];
         const categoryImages = categoryData.images || [];
-        html += displayGoodsSection(`新增非上升期（非上升期）：${stats.new_declined}个`, categoryGoodsInfo, categoryImages, '新增非上升期');
+        html += displayGoodsSection(`新增非上升期（非上升期）：${stats.new_declined}个`, categoryGoodsInfo, categoryImages, '新增非上升期', categoryData.image_pages);
     }
     
     // 3. 更新为上升期（所有模块都显示数据）
@@ -1028,7 +1427,7 @@ function displayFunction2Result(data, analysisTime, fromCache) {
         const categoryData = categories.updated_to_rising || {};
         const categoryGoodsInfo = categoryData.goods_info || [];
         const categoryImages = categoryData.images || [];
-        html += displayGoodsSection(`更新为上升期（上升期）：${stats.updated_to_rising}个`, categoryGoodsInfo, categoryImages, '更新为上升期');
+        html += displayGoodsSection(`更新为上升期（上升期）：${stats.updated_to_rising}个`, categoryGoodsInfo, categoryImages, '更新为上升期', categoryData.image_pages);
     }
     
     // 4. 由非上升期重回上升期（所有模块都显示数据）
@@ -1036,7 +1435,7 @@ function displayFunction2Result(data, analysisTime, fromCache) {
         const categoryData = categories.back_to_rising || {};
         const categoryGoodsInfo = categoryData.goods_info || [];
         const categoryImages = categoryData.images || [];
-        html += displayGoodsSection(`由非上升期重回上升期（上升期）：${stats.back_to_rising}个`, categoryGoodsInfo, categoryImages, '由非上升期重回上升期');
+        html += displayGoodsSection(`由非上升期重回上升期（上升期）：${stats.back_to_rising}个`, categoryGoodsInfo, categoryImages, '由非上升期重回上升期', categoryData.image_pages);
     }
     
     // 5. 由上升期到非上升期（所有模块都显示数据）
@@ -1044,7 +1443,7 @@ function displayFunction2Result(data, analysisTime, fromCache) {
         const categoryData = categories.declined_from_rising || {};
         const categoryGoodsInfo = categoryData.goods_info || [];
         const categoryImages = categoryData.images || [];
-        html += displayGoodsSection(`由上升期到非上升期（非上升期）：${stats.declined_from_rising}个`, categoryGoodsInfo, categoryImages, '由上升期到非上升期');
+        html += displayGoodsSection(`由上升期到非上升期（非上升期）：${stats.declined_from_rising}个`, categoryGoodsInfo, categoryImages, '由上升期到非上升期', categoryData.image_pages);
     }
     
     // 6. 上升期商品（剩余商品，排除已显示的类别商品）
@@ -1053,7 +1452,9 @@ function displayFunction2Result(data, analysisTime, fromCache) {
         if (remainingGoodsInfo.length > 0) {
             html += `<h6><strong>▶ 历史上升期商品：${remainingGoodsInfo.length}个</strong></h6>`;
             
-            if (data.rising.images && data.rising.images.length > 0) {
+            if (data.rising.image_pages && data.rising.image_pages.pages.length > 0) {
+                html += renderLazyImagePages(data.rising.image_pages, data.rising.goods_info, '上升期');
+            } else if (data.rising.images && data.rising.images.length > 0) {
                 const cols = 3;
                 let goodsIndex = 0;
                 
@@ -1085,7 +1486,9 @@ function displayFunction2Result(data, analysisTime, fromCache) {
         if (remainingGoodsInfo.length > 0) {
             html += `<h6><strong>▶ 历史非上升期商品：${remainingGoodsInfo.length}个</strong></h6>`;
             
-            if (data.declined.images && data.declined.images.length > 0) {
+            if (data.declined.image_pages && data.declined.image_pages.pages.length > 0) {
+                html += renderLazyImagePages(data.declined.image_pages, data.declined.goods_info, '非上升期');
+            } else if (data.declined.images && data.declined.images.length > 0) {
                 const cols = 3;
                 let goodsIndex = 0;
                 
@@ -1198,6 +1601,7 @@ function displayFunction2Result(data, analysisTime, fromCache) {
     html += '</div>'; // 结束基本信息统计容器
     
     resultDiv.innerHTML = html;
+    observeLazyImagePages(resultDiv);
 }
 
 // 从缓存显示功能2的结果（不包含图片）
@@ -1535,10 +1939,13 @@ async function doOptimization(fieldName) {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ field_name: fieldName })
+            body: JSON.stringify({ field_name: fieldName, chart_mode: CHART_MODE })
         });
         
         const result = await response.json();
+        if (result.success && result.data) {
+            applySeriesImages([result.data]);
+        }
         
         if (result.success) {
             const data = result.data;
@@ -2034,14 +2441,7 @@ async function doAutoUpdateReason() {
     resultDiv.innerHTML = '<p><strong>正在自动更新Reason，请稍候...</strong></p>';
     
     try {
-        const response = await fetch('/api/function4/auto_update_reason', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            }
-        });
-        
-        const result = await response.json();
+        const result = await runJob('/api/function4/auto_update_reason');
         
         if (result.success) {
             // 构建详细的结果显示
@@ -3120,77 +3520,72 @@ function hideBatchProgressModal(cancelled) {
     }
 }
 
-function runBatchWithProgress(options) {
-    const { title, tables, apiUrl, getBody, mapResult } = options;
+// 提交批量后台任务（后端按国家并行执行），轮询任务进度，取消按钮会请求取消任务
+async function runBatchJob(options) {
+    const { title, tables, apiUrl, body } = options;
     if (!tables || tables.length === 0) {
         showNotification('没有选中的国家表', 'warning');
-        return Promise.resolve(null);
+        return null;
     }
     resetBatchCancelled();
-    const abortController = new AbortController();
     showBatchProgressModal(title);
+    updateBatchProgress(0, tables.length, null);
     const cancelBtn = document.getElementById('batchCancelBtn');
+    let jobId = null;
+    let cancelSent = false;
+    const sendCancel = () => {
+        if (jobId && !cancelSent) {
+            cancelSent = true;
+            fetch(`/api/jobs/${jobId}/cancel`, { method: 'POST' });
+        }
+    };
     const onceCancel = () => {
         setBatchCancelled(true);
-        abortController.abort();
         if (cancelBtn) {
             cancelBtn.onclick = null;
             cancelBtn.disabled = true;
         }
+        sendCancel();
     };
     if (cancelBtn) {
         cancelBtn.disabled = false;
         cancelBtn.onclick = onceCancel;
     }
-    const results = {};
-    let processed = 0;
-    let failed = 0;
-    const total = tables.length;
-    let promise = Promise.resolve();
-    tables.forEach((tableName, index) => {
-        promise = promise.then(async () => {
-            if (batchCancelled) return;
-            updateBatchProgress(index, total, tableName);
-            const body = getBody ? getBody(tableName) : { table_name: tableName };
-            try {
-                const response = await fetch(apiUrl, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(body),
-                    signal: abortController.signal
-                });
-                const data = await response.json();
-                const r = mapResult ? mapResult(data) : { success: data.success, message: data.message || data.error };
-                results[tableName] = r;
-                if (r.success) processed++; else failed++;
-            } catch (e) {
-                if (e.name === 'AbortError' || batchCancelled) {
-                    setBatchCancelled(true);
-                    return;
-                }
-                results[tableName] = { success: false, message: e.message || '请求失败' };
-                failed++;
-            }
-        });
-    });
-    return promise.then(() => {
-        if (cancelBtn) cancelBtn.onclick = null;
-        hideBatchProgressModal(batchCancelled);
-        return { success: failed === 0 && !batchCancelled, total, processed, failed, results, cancelled: batchCancelled };
-    });
+
+    let result;
+    try {
+        result = await runJob(apiUrl, { ...(body || {}), selected_tables: tables }, job => {
+            jobId = job.job_id;
+            if (batchCancelled) sendCancel();
+            updateBatchProgress(Math.round((job.progress || 0) * tables.length / 100), tables.length, null);
+        }, 1000);
+    } catch (e) {
+        result = { success: false, error: e.message || '请求失败' };
+    }
+
+    if (cancelBtn) cancelBtn.onclick = null;
+    hideBatchProgressModal(batchCancelled);
+    if (!result || !result.results) {
+        showNotification((result && (result.error || result.message)) || '批量任务失败', 'error');
+        return null;
+    }
+    // 单表自动更新Reason失败时返回的是 error 字段
+    for (const tableResult of Object.values(result.results)) {
+        if (!tableResult.message && tableResult.error) tableResult.message = tableResult.error;
+    }
+    if (result.cancelled) setBatchCancelled(true);
+    return result;
 }
 
-// 批量刷新Status（串行 + 进度条 + 取消）
+// 批量刷新Status（后台并行 + 进度条 + 取消）
 async function batchRefreshStatus() {
     if (!confirmBatchOperation('批量刷新')) return;
     clearNotifications();
     const tables = getBatchSelectedTables();
-    const result = await runBatchWithProgress({
+    const result = await runBatchJob({
         title: '批量刷新Status',
         tables,
-        apiUrl: '/api/function7/single_refresh',
-        getBody: t => ({ table_name: t }),
-        mapResult: d => ({ success: d.success, message: d.message || d.error, updated_count: d.updated_count, missing_dates_info: d.missing_dates_info || [] })
+        apiUrl: '/api/function7/batch_refresh'
     });
     if (result) displayBatchOperationResult('批量刷新Status', result);
     if (batchCancelled) showNotification('已取消批量刷新', 'warning');
@@ -3201,12 +3596,10 @@ async function batchQuickRefreshStatus() {
     if (!confirmBatchOperation('批量快速刷新')) return;
     clearNotifications();
     const tables = getBatchSelectedTables();
-    const result = await runBatchWithProgress({
+    const result = await runBatchJob({
         title: '批量快速刷新Status',
         tables,
-        apiUrl: '/api/function7/single_quick_refresh',
-        getBody: t => ({ table_name: t }),
-        mapResult: d => ({ success: d.success, message: d.message || d.error, updated_count: d.updated_count, missing_dates_info: d.missing_dates_info || [] })
+        apiUrl: '/api/function7/batch_quick_refresh'
     });
     if (result) displayBatchOperationResult('批量快速刷新Status', result);
     if (batchCancelled) showNotification('已取消批量快速刷新', 'warning');
@@ -3217,12 +3610,10 @@ async function batchAutoUpdateReason() {
     if (!confirmBatchOperation('批量更新Reason')) return;
     clearNotifications();
     const tables = getBatchSelectedTables();
-    const result = await runBatchWithProgress({
+    const result = await runBatchJob({
         title: '批量更新Reason',
         tables,
-        apiUrl: '/api/function7/single_auto_reason',
-        getBody: t => ({ table_name: t }),
-        mapResult: d => ({ success: d.success, message: d.message || d.error, stats: d.stats, skipped: d.skipped })
+        apiUrl: '/api/function7/batch_auto_reason'
     });
     if (result) displayBatchOperationResult('批量自动更新Reason', result);
     if (batchCancelled) showNotification('已取消批量更新Reason', 'warning');
@@ -3235,12 +3626,11 @@ async function batchSaveIndicatorData() {
     const dateInput = document.getElementById('batch-date-input');
     const targetDate = dateInput ? dateInput.value : null;
     const tables = getBatchSelectedTables();
-    const result = await runBatchWithProgress({
+    const result = await runBatchJob({
         title: '批量保存指标数据',
         tables,
-        apiUrl: '/api/function7/single_save_indicator',
-        getBody: t => ({ table_name: t, target_date: targetDate }),
-        mapResult: d => ({ success: d.success, message: d.message || d.error, calc_time: d.analysis_time })
+        apiUrl: '/api/function7/batch_save_indicator',
+        body: { target_date: targetDate || null }
     });
     if (result) displayBatchOperationResult('批量保存指标数据', result);
     if (batchCancelled) showNotification('已取消批量保存指标', 'warning');
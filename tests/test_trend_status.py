@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+向量化趋势判断（_trend_status_kernel / analyze_trend_prefixes / analyze_trend_grouped）
+与逐条调用 analyze_trend 的结果一致性检查
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from function2_dynamic_management import analyze_trend, analyze_trend_prefixes, analyze_trend_grouped
+
+
+STATUS_CODES = {'rising': 1, 'declined': 2}
+
+
+def expected_prefix_statuses(values):
+    """逐个前缀调用 analyze_trend 的结果（1=上升期, 2=过了上升期）"""
+    return [STATUS_CODES[analyze_trend(values[:i + 1])] for i in range(len(values))]
+
+
+def random_series(rng):
+    length = int(rng.integers(0, 40))
+    kind = rng.integers(0, 4)
+    if kind == 0:
+        return rng.integers(0, 1000, size=length).astype(float)
+    if kind == 1:
+        # 先升后降，容易触发 0.2~0.3 的下降比例与负斜率分支
+        peak = int(rng.integers(0, length + 1))
+        rise = np.linspace(10, 500, peak)
+        fall = 500 * (1 - rng.uniform(0, 0.05, size=length - peak).cumsum())
+        return np.concatenate([rise, fall]).round()
+    if kind == 2:
+        return rng.choice([0.0, 1.0, 2.0], size=length)
+    return rng.normal(100, 30, size=length).clip(0)
+
+
+EDGE_CASES = [
+    [],
+    [5],
+    [5, 3],
+    [0, 0, 0],
+    [10, 5, 1],
+    [1, 2, 3, 4, 5, 4],
+    [7, 7, 7, 7, 7, 7, 7, 7, 7],
+    [0] * 12,
+    [100, 80, 80, 80, 80, 80, 80, 80],
+    [100, 75, 75, 75, 75, 75, 75, 75, 75, 75],
+    # 最近7天斜率接近0（polyfit 回退分支）
+    [100, 78, 79, 78, 79, 78, 79, 78, 78.5],
+    [1e6, 7.9e5, 7.9e5 + 1e-7, 7.9e5, 7.9e5 - 1e-7, 7.9e5, 7.9e5 + 1e-7, 7.9e5],
+    [100, 90, 85, 80, 79, 79, 79, 79, 79, 79, 79],
+    # NaN：analyze_trend 对含NaN的前缀一律判为上升期
+    [np.nan, 5, 3, 1],
+    [100, 60, np.nan, 50, 40],
+    [100, 90, 80, 70, 60, 50, 40, np.nan],
+    [np.nan, np.nan, np.nan],
+]
+
+
+@pytest.mark.parametrize('values', EDGE_CASES)
+def test_prefixes_match_scalar_edge_cases(values):
+    values = np.asarray(values, dtype=float)
+    assert analyze_trend_prefixes(values).tolist() == expected_prefix_statuses(values)
+
+
+def test_prefixes_match_scalar_random():
+    rng = np.random.default_rng(20240601)
+    for _ in range(500):
+        values = random_series(rng)
+        assert analyze_trend_prefixes(values).tolist() == expected_prefix_statuses(values)
+
+
+def test_grouped_matches_scalar():
+    rng = np.random.default_rng(7)
+    series = {f"g{i}": random_series(rng) for i in range(200)}
+    series.update({f"edge{i}": np.asarray(values, dtype=float) for i, values in enumerate(EDGE_CASES)})
+
+    frames = [pd.DataFrame({'goods_id': goods_id, 'day': np.arange(len(values)), 'Product impressions': values})
+              for goods_id, values in series.items() if len(values)]
+    df_history = pd.concat(frames, ignore_index=True)
+    # 不同商品的行交错排列（同一商品内仍按日期升序），索引打乱，检查分组与索引对齐
+    df_history = df_history.sample(frac=1, random_state=1).sort_values('day', kind='stable')
+    df_history.index = rng.permutation(len(df_history))
+
+    result = analyze_trend_grouped(df_history)
+    assert result.index.equals(df_history.index)
+    for goods_id, group in df_history.groupby('goods_id', sort=False):
+        values = group['Product impressions'].to_numpy()
+        assert result.loc[group.index].tolist() == expected_prefix_statuses(values), goods_id
+
+
+def test_grouped_empty():
+    df_history = pd.DataFrame({'goods_id': [], 'Product impressions': []})
+    assert analyze_trend_grouped(df_history).empty
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+xlsx goods_id 解析缓存模块（未核价/限流数据，所有国家共用）
+每个xlsx文件解析出的goods_id按 (绝对路径, 文件大小, 修改时间) 缓存在 Cache_Xlsx/goods_ids.cache（cache_store 格式），
+文件未变化时不再打开xlsx；文件被修改或替换后大小/修改时间变化，自动重新解析
+解析只读取 Template 工作表（不存在时为第一个工作表）第3列从第3行开始的单元格（openpyxl 只读流式读取），
+单元格中可包含多个用空白分隔的ID，每个ID只保留数字字符
+未命中缓存的文件（可跨多个目录/国家）达到 XLSX_POOL_MIN_FILES 个时在进程池中并行解析，单个文件出错不影响其他文件
+"""
+
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import openpyxl
+from cache_store import load_cache_file, save_cache_file
+
+
+XLSX_CACHE_DIR = 'Cache_Xlsx'
+XLSX_CACHE_FILE = os.path.join(XLSX_CACHE_DIR, 'goods_ids.cache')
+
+# goods_id 所在列与起始行（均从1开始）
+GOODS_ID_COLUMN = 3
+GOODS_ID_FIRST_ROW = 3
+
+# 解析进程数（可通过配置项 xlsx_parse_workers 修改，0 表示不使用进程池）
+XLSX_PARSE_WORKERS = min(4, os.cpu_count() or 1)
+
+# 需要解析的文件少于该值时直接在当前进程解析（进程启动与调度开销大于收益）
+XLSX_POOL_MIN_FILES = 4
+
+_cache_lock = threading.Lock()
+_cache_entries = None
+
+_parse_pool = None
+_parse_pool_workers = None
+_parse_pool_lock = threading.Lock()
+
+
+def _cell_goods_ids(value):
+    """单元格值 → 标准化后的goods_id列表（只保留数字字符）"""
+    if value is None:
+        return []
+    if isinstance(value, float):
+        if value != value:
+            return []
+        if value.is_integer():
+            value = int(value)
+    goods_ids = []
+    for part in str(value).split():
+        if part.lower() in ('nan', 'none'):
+            continue
+        digits_only = ''.join(c for c in part if c.isdigit())
+        if digits_only:
+            goods_ids.append(digits_only)
+    return goods_ids
+
+
+def parse_xlsx_goods_ids(file_path):
+    """
+    直接解析xlsx文件（不经过缓存）
+    返回: 去重并排序的goods_id列表；文件无法读取时抛出异常
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook['Template'] if 'Template' in workbook.sheetnames else workbook.worksheets[0]
+        # 部分导出工具写入的 dimension 不准确，只读模式下会截断行，需要重新计算
+        sheet.reset_dimensions()
+        goods_ids = set()
+        for (value,) in sheet.iter_rows(min_row=GOODS_ID_FIRST_ROW, min_col=GOODS_ID_COLUMN,
+                                         max_col=GOODS_ID_COLUMN, values_only=True):
+            goods_ids.update(_cell_goods_ids(value))
+        return sorted(goods_ids)
+    finally:
+        workbook.close()
+
+
+def _file_key(file_path):
+    """返回 (绝对路径, 大小, 修改时间ns)"""
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+
+def _load_entries():
+    global _cache_entries
+    if _cache_entries is None:
+        data = load_cache_file(XLSX_CACHE_FILE) or {}
+        _cache_entries = data.get('files') or {}
+    return _cache_entries
+
+
+def _save_entries():
+    """保存缓存，同时丢弃已删除文件的记录"""
+    entries = _load_entries()
+    for path in [path for path in entries if not os.path.exists(path)]:
+        del entries[path]
+    try:
+        save_cache_file(XLSX_CACHE_FILE, {'files': entries})
+    except Exception as e:
+        print(f"保存xlsx解析缓存失败: {e}")
+
+
+def lookup_cached_goods_ids(file_key):
+    """file_key 为 _file_key 的结果；命中返回goods_id列表，否则返回 None"""
+    path, size, mtime_ns = file_key
+    with _cache_lock:
+        entry = _load_entries().get(path)
+    if entry and entry.get('size') == size and entry.get('mtime_ns') == mtime_ns:
+        return entry.get('goods_ids', [])
+    return None
+
+
+def store_cached_goods_ids(results):
+    """
+    批量写入解析结果并保存到磁盘
+    results: [(file_key, goods_ids), ...]
+    """
+    if not results:
+        return
+    with _cache_lock:
+        entries = _load_entries()
+        for (path, size, mtime_ns), goods_ids in results:
+            entries[path] = {'size': size, 'mtime_ns': mtime_ns, 'goods_ids': list(goods_ids)}
+        _save_entries()
+
+
+def list_xlsx_files(directory):
+    """目录下的 .xlsx 文件路径（跳过 Excel 打开时生成的 ~$ 临时文件），目录不存在时返回空列表"""
+    if not directory or not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.endswith('.xlsx') and not name.startswith('~$')]
+
+
+def get_xlsx_parse_workers():
+    from config import get_config_section
+    try:
+        workers = int(get_config_section('xlsx_parse_workers', XLSX_PARSE_WORKERS))
+    except (TypeError, ValueError):
+        workers = XLSX_PARSE_WORKERS
+    return max(workers, 0)
+
+
+def _get_parse_pool():
+    """获取（必要时创建）解析进程池；配置为0时返回 None"""
+    global _parse_pool, _parse_pool_workers
+    workers = get_xlsx_parse_workers()
+    with _parse_pool_lock:
+        if _parse_pool is not None and _parse_pool_workers != workers:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+        if _parse_pool is None and workers > 0:
+            # 与 plot_utils 的渲染进程池相同：在多线程的 Flask 服务中 fork 可能继承其他线程持有的锁而死锁，使用 spawn
+            _parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _parse_pool_workers = workers
+        return _parse_pool
+
+
+def _discard_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+def shutdown_parse_pool():
+    """关闭解析进程池（进程退出时调用）"""
+    _discard_parse_pool()
+
+
+atexit.register(shutdown_parse_pool)
+
+
+def _parse_file_safely(file_path):
+    """返回 (goods_ids, None) 或 (None, 错误信息)，在解析进程中执行时异常不会中断其他文件"""
+    try:
+        return parse_xlsx_goods_ids(file_path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _parse_files(file_paths):
+    """按顺序返回每个文件的 (goods_ids, error)；文件数达到 XLSX_POOL_MIN_FILES 时使用进程池"""
+    pool = _get_parse_pool() if len(file_paths) >= XLSX_POOL_MIN_FILES else None
+    if pool is not None:
+        try:
+            return list(pool.map(_parse_file_safely, file_paths))
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            # 进程池不可用（如进程被杀死、系统限制）时丢弃进程池，改为在当前进程解析
+            print(f"xlsx解析进程池不可用，改为在当前进程解析: {e}")
+            _discard_parse_pool()
+    return [_parse_file_safely(file_path) for file_path in file_paths]
+
+
+def read_goods_ids_from_dirs(directories):
+    """
+    读取多个目录（如多个国家、未核价+限流）下所有xlsx文件的goods_id
+    已缓存且未变化的文件直接使用缓存，其余文件一起并行解析后写入缓存
+    directories: [(目录, 类别), ...]，类别用于出错提示，如 '未核价'、'限流'
+    返回: (goods_id_sets, file_errors)
+        goods_id_sets: 与 directories 一一对应的 set of goods_id
+        file_errors: [{'directory', 'label', 'file', 'error'}, ...]，出错的文件不计入结果
+    """
+    goods_id_sets = [set() for _ in directories]
+    file_errors = []
+    pending = []
+
+    def record_error(index, file_path, error):
+        directory, label = directories[index]
+        file_name = os.path.basename(file_path)
+        print(f"读取{label}文件 {file_name} 出错: {error}")
+        file_errors.append({'directory': directory, 'label': label, 'file': file_name, 'error': error})
+
+    for index, (directory, _) in enumerate(directories):
+        for file_path in list_xlsx_files(directory):
+            try:
+                file_key = _file_key(file_path)
+            except OSError as e:
+                record_error(index, file_path, str(e))
+                continue
+            cached = lookup_cached_goods_ids(file_key)
+            if cached is None:
+                pending.append((index, file_path, file_key))
+            else:
+                goods_id_sets[index].update(cached)
+
+    parsed = []
+    results = _parse_files([file_path for _, file_path, _ in pending])
+    for (index, file_path, file_key), (goods_ids, error) in zip(pending, results):
+        if error is not None:
+            record_error(index, file_path, error)
+            continue
+        goods_id_sets[index].update(goods_ids)
+        parsed.append((file_key, goods_ids))
+    store_cached_goods_ids(parsed)
+
+    return goods_id_sets, file_errors
+
+
+def read_goods_ids_from_dir(directory, label='xlsx'):
+    """
+    读取单个目录下所有xlsx文件的goods_id，见 read_goods_ids_from_dirs
+    返回: set of goods_id
+    """
+    goods_id_sets, _ = read_goods_ids_from_dirs([(directory, label)])
+    return goods_id_sets[0]
+
+
+def clear_xlsx_cache():
+    """删除全部解析缓存"""
+    global _cache_entries
+    with _cache_lock:
+        _cache_entries = {}
+        if os.path.exists(XLSX_CACHE_FILE):
+            os.remove(XLSX_CACHE_FILE)